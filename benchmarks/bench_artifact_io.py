@@ -0,0 +1,70 @@
+"""
+Write time, read time (all columns and a three-column projection) and size on disk
+of every artifact format supported by `src.artifact_io`.
+
+Run from the root of the repo:
+    python -m benchmarks.bench_artifact_io --rows 1000000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from src import artifact_io
+
+PROJECTION = ["log_entropy", "IR_norm_range", "entropy_x_contrast"]
+
+
+def make_features(n_rows: int, seed: int = 42) -> pd.DataFrame:
+    """ Random float features shaped like data/interim/features.csv """
+    rng = np.random.default_rng(seed)
+    columns = ["visible_mean", "visible_max", "visible_min", "visible_mean_distribution",
+               "visible_contrast", "visible_entropy", "visible_second_angular_momentum",
+               "IR_mean", "IR_max", "IR_min"] + PROJECTION
+    return pd.DataFrame(rng.normal(size=(n_rows, len(columns))), columns=columns)
+
+
+def disk_size(path: str) -> int:
+    """ Size in bytes of a file or of all files in a directory """
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    return os.path.getsize(path)
+
+
+def main() -> None:
+    """ Run the benchmark and print one line per format """
+    parser = argparse.ArgumentParser(description="Benchmark artifact storage formats")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    features = make_features(args.rows)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for extension in artifact_io.FORMATS:
+            path = os.path.join(tmp_dir, "features" + extension)
+            try:
+                start = time.perf_counter()
+                artifact_io.write_table(features, path)
+                write_time = time.perf_counter() - start
+            except ImportError:
+                print(f"{extension:>9}: skipped, pyarrow is not installed")
+                continue
+
+            start = time.perf_counter()
+            # materialize the values so memory-mapped columns are actually read
+            artifact_io.read_table(path).to_numpy().sum()
+            read_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            artifact_io.read_table(path, columns=PROJECTION).to_numpy().sum()
+            projection_time = time.perf_counter() - start
+
+            print(f"{extension:>9}: write {write_time:7.3f} s  read {read_time:7.3f} s  "
+                  f"read {len(PROJECTION)} columns {projection_time:7.3f} s  "
+                  f"size {disk_size(path) / 1e6:8.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
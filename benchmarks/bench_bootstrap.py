@@ -0,0 +1,67 @@
+"""
+Time of bootstrap confidence intervals of the test metrics with `bootstrap.bootstrap_intervals`
+and with a Python loop calling scikit-learn on every resampled test set. The loop is only run
+for --loop_replicates replicates and its time is extrapolated to --replicates.
+
+Run from the root of the repo:
+    python -m benchmarks.bench_bootstrap --rows 1000000 --replicates 10000
+"""
+import argparse
+import logging
+import time
+
+import numpy as np
+import sklearn.metrics
+
+from src import bootstrap
+
+
+def loop_bootstrap(y_test: np.ndarray, proba: np.ndarray, predicted: np.ndarray,
+                   n_replicates: int, random_state: int = 42) -> np.ndarray:
+    """ Metrics of bootstrap replicates computed one at a time with scikit-learn """
+    rng = np.random.default_rng(random_state)
+    replicates = []
+    for _ in range(n_replicates):
+        rows = rng.integers(0, len(y_test), len(y_test))
+        replicates.append([sklearn.metrics.roc_auc_score(y_test[rows], proba[rows]),
+                           sklearn.metrics.accuracy_score(y_test[rows], predicted[rows]),
+                           sklearn.metrics.precision_score(y_test[rows], predicted[rows]),
+                           sklearn.metrics.recall_score(y_test[rows], predicted[rows])])
+    return np.array(replicates)
+
+
+def main() -> None:
+    """ Run the benchmark and print one line per implementation """
+    parser = argparse.ArgumentParser(description="Benchmark bootstrap confidence intervals")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--replicates", type=int, default=10_000)
+    parser.add_argument("--loop_replicates", type=int, default=5)
+    parser.add_argument("--n_workers", type=int, default=None)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    rng = np.random.default_rng(0)
+    y_test = rng.integers(0, 2, args.rows).astype(np.float64)
+    proba = np.clip(0.3 * y_test + rng.normal(0.35, 0.2, args.rows), 0, 1)
+    predicted = (proba > 0.5).astype(np.float64)
+    print(f"{args.rows} rows, {args.replicates} replicates")
+
+    start = time.perf_counter()
+    loop_bootstrap(y_test, proba, predicted, args.loop_replicates)
+    elapsed = (time.perf_counter() - start) * args.replicates / args.loop_replicates
+    print(f"{'sklearn loop':>24}: {elapsed:8.1f}s (extrapolated)")
+
+    for method in bootstrap.METHODS:
+        for scores, name in [(proba.round(2), "rounded"), (proba, "continuous")]:
+            start = time.perf_counter()
+            intervals = bootstrap.bootstrap_intervals(y_test, scores, predicted,
+                                                      n_replicates=args.replicates,
+                                                      method=method, n_workers=args.n_workers)
+            elapsed = time.perf_counter() - start
+            auc, lower, upper = intervals["auc"]
+            print(f"{method + ', ' + name:>24}: {elapsed:8.1f}s, "
+                  f"AUC {auc:.4f} [{lower:.4f}, {upper:.4f}]")
+
+
+if __name__ == "__main__":
+    main()
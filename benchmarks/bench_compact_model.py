@@ -0,0 +1,62 @@
+"""
+Size, scoring latency and test ROC AUC of a deep random forest before and after
+`compact_model.compact_forest`, for several tolerances of the pruning and dtypes of the leaf
+probabilities. The fitted forest is scored by scikit-learn and the flattened forests by the
+flat engine of `src.forest_inference`.
+
+Run from the root of the repo:
+    python -m benchmarks.bench_compact_model --rows 200000 --n_estimators 50 --max_depth 20
+"""
+import argparse
+import logging
+import pickle
+import time
+
+import numpy as np
+
+from benchmarks.bench_update_model import make_rows
+from src import compact_model, model_format, train_model
+
+FEATURES = ["a", "b", "c"]
+
+
+def main() -> None:
+    """ Run the benchmark and print the size, latency and AUC of every compacted model """
+    parser = argparse.ArgumentParser(description="Benchmark forest compaction")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--n_estimators", type=int, default=50)
+    parser.add_argument("--max_depth", type=int, default=20)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    rng = np.random.default_rng(0)
+    x_train, y_train = make_rows(rng, args.rows)
+    x_validation, _ = make_rows(rng, 50_000)
+    x_test, y_test = make_rows(rng, 100_000)
+    model = train_model.train_classifier(x_train, y_train, FEATURES, args.n_estimators,
+                                         args.max_depth, 42)
+    print(f"{args.rows} training rows, {args.n_estimators} trees of depth {args.max_depth}, "
+          f"{len(x_test)} test rows")
+
+    models, sizes = {"fitted": model}, {"fitted": len(pickle.dumps(model))}
+    models["flat"] = model_format.to_compact(model)
+    for tolerance, value_dtype in [(0.0, "float32"), (0.0, "float16"), (0.01, "float16"),
+                                   (0.02, "float16"), (0.05, "float16")]:
+        start = time.perf_counter()
+        compacted = compact_model.compact_forest(model, x_validation, tolerance, value_dtype)
+        name = f"{tolerance} {value_dtype}"
+        print(f"compacting {name}: {time.perf_counter() - start:.1f} s")
+        models[name] = compacted
+    for name, flat in models.items():
+        if name != "fitted":
+            sizes[name] = sum(getattr(flat, array).nbytes for array in model_format.ARRAYS)
+
+    rows = compact_model.compaction_report(models, sizes, x_test, y_test.to_numpy().ravel())
+    print(f"{'model':>14} {'size (MB)':>10} {'latency (s)':>12} {'AUC':>7} {'max change':>11}")
+    for row in rows:
+        print(f"{row['model']:>14} {row['size'] / 2 ** 20:10.2f} {row['latency']:12.2f} "
+              f"{row['auc']:7.4f} {row['max_change']:11.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Wall time of training a random forest in one process (`train_model.train_classifier`) and in
+shards with `distributed_training.train_distributed`, over the local process pool and over the
+socket transport with local worker processes, and check that the merged forests are the same
+whatever the transport and the number of workers.
+
+Run from the root of the repo:
+    python -m benchmarks.bench_distributed_training --rows 500000 --n_estimators 40
+"""
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+
+from benchmarks.bench_update_model import FEATURES, make_rows
+from src import distributed_training, train_model
+
+
+def main() -> None:
+    """ Run the benchmark and print the training time of every mode """
+    parser = argparse.ArgumentParser(description="Benchmark distributed forest training")
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--n_estimators", type=int, default=40)
+    parser.add_argument("--max_depth", type=int, default=10)
+    parser.add_argument("--n_shards", type=int, default=8)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    x, y = make_rows(np.random.default_rng(0), args.rows)
+    n_cpus = os.cpu_count() or 1
+    print(f"{args.rows} rows, {args.n_estimators} trees, {args.n_shards} shards, {n_cpus} CPUs")
+
+    start = time.perf_counter()
+    train_model.train_classifier(x, y, FEATURES, args.n_estimators, args.max_depth, 42)
+    print(f"{'single process':>24}: {time.perf_counter() - start:8.2f} s")
+
+    modes = [(f"local, {n_workers} workers", {"n_workers": n_workers})
+             for n_workers in sorted({1, max(n_cpus // 2, 1), n_cpus})]
+    modes.append((f"socket, {n_cpus} workers", {"transport": "socket",
+                                                "address": "127.0.0.1:0",
+                                                "n_local_workers": n_cpus}))
+    probabilities = []
+    for name, kwargs in modes:
+        start = time.perf_counter()
+        model = distributed_training.train_distributed(x, y, FEATURES, args.n_estimators,
+                                                       args.max_depth, 42,
+                                                       n_shards=args.n_shards, **kwargs)
+        print(f"{name:>24}: {time.perf_counter() - start:8.2f} s")
+        probabilities.append(model.predict_proba(x[:10000]))
+
+    print("same merged forest:", all(np.array_equal(probabilities[0], proba)
+                                     for proba in probabilities))
+
+
+if __name__ == "__main__":
+    main()
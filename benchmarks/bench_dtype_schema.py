@@ -0,0 +1,141 @@
+"""
+Memory and time of the pipeline with pandas' default float64 data and with the dtype schema
+of config/model_config.yaml (float32 features, uint8 target), on a raw file built by
+repeating the clouds of data/raw/clouds.data.
+
+Every mode runs `pipeline.run_pipeline` from get_clouds to evaluate in a fresh Python
+process, whose peak resident memory is read from its rusage. The wall time of every stage
+comes from the runtime metrics, and the test metrics of the two modes are compared to check
+that the schema does not change the model.
+
+Run from the root of the repo:
+    python -m benchmarks.bench_dtype_schema --rows 10000000
+"""
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+from benchmarks.bench_get_clouds import build_raw_file
+from src import pipeline
+
+CONFIG_PATH = "config/model_config.yaml"
+
+# stages configured with the dtype schema
+SCHEMA_STAGES = [("create_datasets", "get_clouds"), ("process_data", "load_data"),
+                 ("process_data", "get_features"), ("train_model", "split_data"),
+                 ("train_model", "fit_model"), ("score_model", "predict")]
+
+RUN = """
+import json, logging
+logging.disable(logging.INFO)
+from src import instrumentation, pipeline
+with open({config_path!r}, "r", encoding="utf-8") as config_file:
+    config = json.load(config_file)
+instrumentation.start({metrics_path!r}, None)
+state = pipeline.run_pipeline(config)
+instrumentation.stop()
+sizes = {{name: int(state[name].memory_usage(index=False).sum())
+          for name in ["clouds", "features", "x_train", "x_test"]}}
+with open({sizes_path!r}, "w", encoding="utf-8") as sizes_file:
+    json.dump(sizes, sizes_file)
+"""
+
+
+def make_config(tmp_dir: str, raw_path: str, first_cloud: list, second_cloud: list,
+                schema: bool) -> dict:
+    """ Configuration running the pipeline on the enlarged raw file, with or without schema """
+    with open(CONFIG_PATH, "r", encoding="ASCII") as config_file:
+        config = yaml.load(config_file, Loader=yaml.FullLoader)
+
+    # the anchored schema is one dictionary shared by the stages, so copy before editing
+    config = json.loads(json.dumps(config))
+    config["create_datasets"]["get_clouds"].update(
+        input_path=raw_path, first_cloud=first_cloud, second_cloud=second_cloud)
+    evaluate_config = config["evaluate_performance"]["evaluate"]
+    evaluate_config.update(bootstrap_config=None,
+                           output_path=os.path.join(tmp_dir, f"metrics_{schema}.txt"))
+    if not schema:
+        for section, stage in SCHEMA_STAGES:
+            config[section][stage]["dtypes"] = None
+    return config
+
+
+def run(config: dict, tmp_dir: str, name: str) -> tuple:
+    """ Run the pipeline in a fresh process, return its stage times, frame sizes and peak RSS """
+    paths = {key: os.path.join(tmp_dir, f"{name}_{key}.json")
+             for key in ["config", "metrics", "sizes"]}
+    with open(paths["config"], "w", encoding="utf-8") as config_file:
+        json.dump(config, config_file)
+
+    code = RUN.format(config_path=paths["config"], metrics_path=paths["metrics"],
+                      sizes_path=paths["sizes"])
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", code])
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    if status != 0:
+        raise RuntimeError(f"{name} pipeline failed with status {status}")
+
+    with open(paths["metrics"], "r", encoding="utf-8") as metrics_file:
+        times = {record["name"]: record["wall_s"]
+                 for record in map(json.loads, metrics_file) if record["name"] in pipeline.STAGES}
+    with open(paths["sizes"], "r", encoding="utf-8") as sizes_file:
+        sizes = json.load(sizes_file)
+    # ru_maxrss is in kilobytes on Linux
+    return elapsed, times, sizes, usage.ru_maxrss * 1024
+
+
+def main() -> None:
+    """ Run the benchmark and print the stage times, frame sizes and peak memory of each mode """
+    parser = argparse.ArgumentParser(description="Benchmark the dtype schema")
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    args = parser.parse_args()
+
+    with open(CONFIG_PATH, "r", encoding="ASCII") as config_file:
+        config = yaml.load(config_file, Loader=yaml.FullLoader)
+    clouds_config = config["create_datasets"]["get_clouds"]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        raw_path = os.path.join(tmp_dir, "clouds.data")
+        first_cloud, second_cloud = clouds_config["first_cloud"], clouds_config["second_cloud"]
+        cloud_rows = (first_cloud[1] - first_cloud[0]) + (second_cloud[1] - second_cloud[0])
+        first_cloud, second_cloud = build_raw_file(clouds_config["input_path"], raw_path,
+                                                   max(math.ceil(args.rows / cloud_rows), 1),
+                                                   first_cloud, second_cloud)
+        n_rows = (first_cloud[1] - first_cloud[0]) + (second_cloud[1] - second_cloud[0])
+        print(f"{n_rows} rows, {os.cpu_count()} CPUs")
+
+        results = {}
+        for name, schema in [("float64", False), ("schema", True)]:
+            results[name] = run(make_config(tmp_dir, raw_path, first_cloud, second_cloud, schema),
+                                tmp_dir, name)
+
+        print(f"{'':>18}{'float64':>12}{'schema':>12}")
+        for stage in pipeline.STAGES:
+            print(f"{stage:>18}" + "".join(f"{results[name][1][stage]:11.2f}s"
+                                           for name in results))
+        print(f"{'total':>18}" + "".join(f"{results[name][0]:11.2f}s" for name in results))
+        for frame in results["float64"][2]:
+            print(f"{frame:>18}" + "".join(f"{results[name][2][frame] / 2**20:10.1f}MB"
+                                           for name in results))
+        print(f"{'peak RSS':>18}" + "".join(f"{results[name][3] / 2**20:10.1f}MB"
+                                            for name in results))
+
+        metrics = []
+        for schema in (False, True):
+            with open(os.path.join(tmp_dir, f"metrics_{schema}.txt"), "r",
+                      encoding="ASCII") as metrics_file:
+                metrics.append(metrics_file.read())
+        print(metrics[1].splitlines()[0], "|", metrics[1].splitlines()[1])
+        print("test metrics identical:", metrics[0] == metrics[1])
+
+
+if __name__ == "__main__":
+    main()
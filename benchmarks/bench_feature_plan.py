@@ -0,0 +1,87 @@
+"""
+Speed of the compiled feature plan of `generate_additional_features` against the
+original column-at-a-time transforms.
+
+Run from the root of the repo:
+    python -m benchmarks.bench_feature_plan --rows 10000000
+"""
+import argparse
+import time
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from src import generate_additional_features
+
+
+def legacy_features(features: pd.DataFrame, config: dict) -> pd.DataFrame:
+    """ Original transforms: per-element log and one column insert per feature """
+    log, mult, norm = config["log_transform"], config["multiply"], config["norm_range"]
+    features[log["additional_feature"]] = features[log["log_col"]].apply(np.log)
+    features[mult["additional_feature"]] = features[mult["col2"]].multiply(features[mult["col1"]])
+    if "col_range" in config:
+        rng = config["col_range"]
+        features[rng["additional_feature"]] = features[rng["max_col"]] - features[rng["min_col"]]
+    features[norm["additional_feature"]] = (features[norm["max_col"]] - features[norm["min_col"]])\
+        .divide(features[norm["mean_col"]])
+    return features
+
+
+def wrapper_features(features: pd.DataFrame, config: dict) -> pd.DataFrame:
+    """ Current column-at-a-time wrappers """
+    for operation, arguments in config.items():
+        features = getattr(generate_additional_features, operation)(features, **arguments)
+    return features
+
+
+def make_features(n_rows: int, columns: list, seed: int = 42) -> pd.DataFrame:
+    """ Positive random features with the configured column names """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(rng.uniform(1.0, 250.0, size=(n_rows, len(columns))), columns=columns)
+
+
+def timed(func: Callable, features: pd.DataFrame, *args, **kwargs) -> float:
+    """ Wall time in seconds of one call on a fresh copy of the features """
+    features = features.copy()
+    start = time.perf_counter()
+    func(features, *args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    """ Run the benchmark and print one line per implementation """
+    parser = argparse.ArgumentParser(description="Benchmark the feature plan")
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--config_file", default="config/model_config.yaml")
+    parser.add_argument("--chunk_size", type=int, default=65536)
+    args = parser.parse_args()
+
+    with open(args.config_file, "r", encoding="ASCII") as config_file:
+        config = yaml.load(config_file, Loader=yaml.FullLoader)
+    feature_config = config["generate_additional_features"]
+    features = make_features(args.rows, config["process_data"]["get_features"]["columns"])
+    plan = generate_additional_features.compile_feature_plan(feature_config,
+                                                             list(features.columns))
+
+    results = {
+        "legacy": timed(legacy_features, features, feature_config),
+        "wrappers": timed(wrapper_features, features, feature_config),
+        "plan": timed(generate_additional_features.apply_feature_plan, features, plan),
+        "plan chunked": timed(generate_additional_features.apply_feature_plan, features, plan,
+                              chunk_size=args.chunk_size),
+    }
+    try:
+        results["plan numexpr"] = timed(generate_additional_features.apply_feature_plan,
+                                        features, plan, engine="numexpr")
+    except ImportError:
+        pass
+
+    for name, elapsed in results.items():
+        print(f"{name:>13}: {elapsed:7.3f} s  {args.rows / elapsed:14,.0f} rows/s  "
+              f"{results['legacy'] / elapsed:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
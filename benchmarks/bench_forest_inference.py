@@ -0,0 +1,71 @@
+"""
+Scoring time of a random forest across batch sizes, comparing:
+
+    sklearn-2pass   predict_proba then predict, as score_model.predict used to do
+    sklearn         one predict_proba pass, the class being its argmax
+    flat            the vectorized level-by-level engine of `src.forest_inference`
+
+Run from the root of the repo (the default forest is the one of config/model_config.yaml):
+    python -m benchmarks.bench_forest_inference --trees 10 --max_depth 10
+"""
+import argparse
+import time
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+
+from src import model_format, score_model
+
+FEATURES = ["log_entropy", "IR_norm_range", "entropy_x_contrast"]
+BATCH_SIZES = [1, 10, 100, 1000, 10_000, 100_000, 1_000_000]
+
+
+def time_per_batch(func: Callable[[], object], min_time: float = 0.5) -> float:
+    """ Mean time of `func`, repeated until at least `min_time` seconds have passed """
+    runs, start = 0, time.perf_counter()
+    while True:
+        func()
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return elapsed / runs
+
+
+def two_pass(model: RandomForestClassifier, x_test: pd.DataFrame) -> None:
+    """ Probabilities and classes from two traversals of the forest """
+    model.predict_proba(x_test)
+    model.predict(x_test)
+
+
+def main() -> None:
+    """ Run the benchmark and print one line per batch size """
+    parser = argparse.ArgumentParser(description="Benchmark forest inference engines")
+    parser.add_argument("--trees", type=int, default=10)
+    parser.add_argument("--max_depth", type=int, default=10)
+    parser.add_argument("--max_rows", type=int, default=1_000_000, help="largest batch size")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    x_train = pd.DataFrame(rng.normal(size=(100_000, len(FEATURES))), columns=FEATURES)
+    y_train = (x_train.sum(axis=1) + rng.normal(size=len(x_train)) > 0).astype(float)
+    model = RandomForestClassifier(n_estimators=args.trees, max_depth=args.max_depth,
+                                   random_state=42).fit(x_train, y_train)
+    forest = model_format.to_compact(model)
+
+    print(f"{args.trees} trees, max_depth {args.max_depth}, times per batch")
+    print(f"{'rows':>9} {'sklearn-2pass':>14} {'sklearn':>11} {'flat':>11} {'speedup':>8}")
+    for n_rows in [size for size in BATCH_SIZES if size <= args.max_rows]:
+        x_test = pd.DataFrame(rng.normal(size=(n_rows, len(FEATURES))), columns=FEATURES)
+        assert np.array_equal(forest.predict_proba(x_test), model.predict_proba(x_test))
+
+        times = [time_per_batch(lambda: two_pass(model, x_test)),
+                 time_per_batch(lambda: score_model.predict_frame(model, x_test, FEATURES)),
+                 time_per_batch(lambda: score_model.predict_frame(forest, x_test, FEATURES))]
+        print(f"{n_rows:>9} " + " ".join(f"{seconds * 1000:>9.2f}ms" for seconds in times)
+              + f" {times[0] / times[2]:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Throughput and peak memory benchmark of the streaming `create_datasets.get_clouds`
+against the original readlines-based implementation.
+
+Run from the root of the repo:
+    python -m benchmarks.bench_get_clouds --repeat 50
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src import create_datasets, parse_raw_data
+
+COLUMNS = ["visible_mean", "visible_max", "visible_min", "visible_mean_distribution",
+           "visible_contrast", "visible_entropy", "visible_second_angular_momentum",
+           "IR_mean", "IR_max", "IR_min"]
+
+
+def legacy_get_clouds(input_path: str, columns: List[str], first_cloud: List[int],
+                      second_cloud: List[int], output_path: str) -> None:
+    """ Original implementation of `get_clouds`, kept as the benchmark baseline """
+    with open(input_path, mode="r", encoding="ASCII") as input_file:
+        data = [[s for s in line.split(" ") if s != ""] for line in input_file.readlines()]
+
+    first = data[first_cloud[0]:first_cloud[1]]
+    first = [[float(s.replace("/n", "")) for s in cloud] for cloud in first]
+    first = pd.DataFrame(first, columns=columns)
+    first["class"] = np.zeros(len(first))
+
+    second = data[second_cloud[0]:second_cloud[1]]
+    second = [[float(s.replace("/n", "")) for s in cloud] for cloud in second]
+    second = pd.DataFrame(second, columns=columns)
+    second["class"] = np.ones(len(second))
+
+    pd.concat([first, second]).to_csv(output_path, index=False)
+
+
+def build_raw_file(source_path: str, output_path: str, repeat: int,
+                   first_cloud: List[int], second_cloud: List[int]) -> Tuple[List[int], List[int]]:
+    """ Write a raw file with the layout of `source_path` and each cloud repeated `repeat` times
+
+    Returns:
+        (first_cloud, second_cloud) line ranges of the enlarged file
+    """
+    with open(source_path, mode="rb") as source_file:
+        lines = source_file.readlines()
+
+    header = lines[:first_cloud[0]]
+    first = lines[first_cloud[0]:first_cloud[1]]
+    separator = lines[first_cloud[1]:second_cloud[0]]
+    second = lines[second_cloud[0]:second_cloud[1]]
+
+    with open(output_path, mode="wb") as output_file:
+        output_file.writelines(header)
+        for _ in range(repeat):
+            output_file.writelines(first)
+        output_file.writelines(separator)
+        for _ in range(repeat):
+            output_file.writelines(second)
+
+    first_start = len(header)
+    second_start = first_start + repeat * len(first) + len(separator)
+    return ([first_start, first_start + repeat * len(first)],
+            [second_start, second_start + repeat * len(second)])
+
+
+def parse_only(input_path: str, columns: List[str], first_cloud: List[int],
+               second_cloud: List[int], chunk_size: int, **_) -> None:
+    """ Stream the clouds through the parsing engine without writing them """
+    with open(input_path, mode="rb") as input_file:
+        for _ in parse_raw_data.iter_segment_blocks(input_file, [first_cloud, second_cloud],
+                                                    len(columns), chunk_size):
+            pass
+
+
+def measure(func: Callable, **kwargs) -> Tuple[float, int]:
+    """ Return wall time in seconds and peak traced memory in bytes of one call """
+    start = time.perf_counter()
+    func(**kwargs)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    func(**kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed, peak
+
+
+def main() -> None:
+    """ Run the benchmark and print one line per implementation """
+    parser = argparse.ArgumentParser(description="Benchmark get_clouds parsing engines")
+    parser.add_argument("--input_path", default="data/raw/clouds.data")
+    parser.add_argument("--repeat", type=int, default=50,
+                        help="number of times each cloud is repeated in the benchmark file")
+    parser.add_argument("--chunk_size", type=int, default=1 << 22)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        raw_path = os.path.join(tmp_dir, "clouds.data")
+        first_cloud, second_cloud = build_raw_file(args.input_path, raw_path, args.repeat,
+                                                   [53, 1077], [1082, 2105])
+        n_rows = (first_cloud[1] - first_cloud[0]) + (second_cloud[1] - second_cloud[0])
+        size_mb = os.path.getsize(raw_path) / 1e6
+        print(f"raw file: {size_mb:.1f} MB, {n_rows} rows")
+
+        kwargs = dict(input_path=raw_path, columns=COLUMNS, first_cloud=first_cloud,
+                      second_cloud=second_cloud, output_path=os.path.join(tmp_dir, "clouds.csv"))
+        results = {
+            "legacy": measure(legacy_get_clouds, **kwargs),
+            "streaming": measure(create_datasets.get_clouds, chunk_size=args.chunk_size, **kwargs),
+            "parse only": measure(parse_only, chunk_size=args.chunk_size, **kwargs),
+        }
+
+    for name, (elapsed, peak) in results.items():
+        print(f"{name:>10}: {elapsed:7.3f} s  {n_rows / elapsed:12,.0f} rows/s  "
+              f"{size_mb / elapsed:7.1f} MB/s  peak {peak / 1e6:8.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
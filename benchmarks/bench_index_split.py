@@ -0,0 +1,83 @@
+"""
+Disk use and wall time of splitting features and target into train and test sets, saving
+the four sets (`train_model.split_data`) against saving only their row numbers
+(`train_model.index_split_data`), and of reading the training rows back like `fit_model`,
+with csv and npcols artifacts. Five folds of an index split are also saved, to show the size
+of several splits sharing one copy of the data.
+
+Run from the root of the repo:
+    python -m benchmarks.bench_index_split --rows 2000000
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.bench_update_model import FEATURES, make_rows
+from src import artifact_io, index_split, train_model
+
+
+def disk_size(paths: list) -> int:
+    """ Total size in bytes of files and directories """
+    total = 0
+    for path in paths:
+        if os.path.isdir(path):
+            total += sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+        else:
+            total += os.path.getsize(path)
+    return total
+
+
+def main() -> None:
+    """ Run the benchmark and print the disk use and time of every way to split """
+    parser = argparse.ArgumentParser(description="Benchmark index-based train/test splits")
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    x, y = make_rows(np.random.default_rng(0), args.rows)
+    print(f"{args.rows} rows, {len(FEATURES)} features")
+    with tempfile.TemporaryDirectory() as directory:
+        for fmt in ["csv", "npcols"]:
+            paths = {name: os.path.join(directory, f"{name}.{fmt}")
+                     for name in ["features", "target", "x_train", "x_test", "y_train",
+                                  "y_test"]}
+            artifact_io.write_table(x, paths["features"])
+            artifact_io.write_table(y, paths["target"])
+            split_path = os.path.join(directory, f"split_{fmt}.npz")
+
+            start = time.perf_counter()
+            train_model.split_data(paths["features"], paths["target"], 0.4, 42,
+                                   paths["x_train"], paths["x_test"], paths["y_train"],
+                                   paths["y_test"])
+            copy_time = time.perf_counter() - start
+            copy_size = disk_size([paths[name] for name in ["x_train", "x_test", "y_train",
+                                                             "y_test"]])
+            start = time.perf_counter()
+            artifact_io.read_table(paths["x_train"], columns=FEATURES)
+            copy_read = time.perf_counter() - start
+
+            start = time.perf_counter()
+            train_model.index_split_data(paths["features"], paths["target"], 0.4, 42,
+                                         split_path)
+            index_time = time.perf_counter() - start
+            start = time.perf_counter()
+            index_split.read_rows(split_path, "train", columns=FEATURES)
+            index_read = time.perf_counter() - start
+
+            print(f"{fmt:>7} four sets: {copy_size / 2 ** 20:9.2f} MB, split {copy_time:6.2f} s, "
+                  f"read train {copy_read:6.2f} s")
+            print(f"{fmt:>7} row index: {os.path.getsize(split_path) / 2 ** 20:9.2f} MB, "
+                  f"split {index_time:6.2f} s, read train {index_read:6.2f} s")
+
+        folds_path = os.path.join(directory, "folds.npz")
+        train_model.index_split_data(paths["features"], paths["target"], 0.4, 42, folds_path,
+                                     method="stratified", n_folds=5)
+        print(f"5 stratified folds: {os.path.getsize(folds_path) / 2 ** 20:.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
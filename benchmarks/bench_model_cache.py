@@ -0,0 +1,62 @@
+"""
+Time of scoring a small batch with a model version picked in turn among several registered
+versions, loading the model with `score_model.load_model` every time against keeping the
+loaded models in a `model_registry.ModelCache`.
+
+Run from the root of the repo:
+    python -m benchmarks.bench_model_cache --versions 4 --n_estimators 100 --switches 40
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+import joblib
+import numpy as np
+
+from benchmarks.bench_update_model import FEATURES, make_rows
+from src import model_registry, score_model, train_model
+
+
+def main() -> None:
+    """ Run the benchmark and print the time of every switch between versions """
+    parser = argparse.ArgumentParser(description="Benchmark the cache of registered models")
+    parser.add_argument("--versions", type=int, default=4)
+    parser.add_argument("--n_estimators", type=int, default=100)
+    parser.add_argument("--switches", type=int, default=40)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    rng = np.random.default_rng(0)
+    x_train, y_train = make_rows(rng, 100_000)
+    x_batch, _ = make_rows(rng, 100)
+    with tempfile.TemporaryDirectory() as directory:
+        registry_dir = os.path.join(directory, "registry")
+        model_path, data_path = (os.path.join(directory, "model.joblib"),
+                                 os.path.join(directory, "x_train.csv"))
+        x_train.to_csv(data_path, index=False)
+        for version in range(args.versions):
+            model = train_model.train_classifier(x_train, y_train, FEATURES, args.n_estimators,
+                                                 20, version + 1)
+            joblib.dump(model, model_path)
+            model_registry.register_model(registry_dir, version, model_path, [data_path])
+        paths = [model_registry.resolve_model(registry_dir, version, compact=False)
+                 for version in range(args.versions)]
+        print(f"{args.versions} versions of {args.n_estimators} trees, "
+              f"{os.path.getsize(paths[0]) / 2 ** 20:.1f} MB each, {args.switches} switches")
+
+        cache = model_registry.ModelCache()
+        for name, kwargs in [("load every time", {"cache": None}), ("cached", {"cache": cache})]:
+            start = time.perf_counter()
+            for switch in range(args.switches):
+                score_model.load_model(paths[switch % args.versions], **kwargs).predict_proba(
+                    x_batch)
+            elapsed = time.perf_counter() - start
+            print(f"{name:>16}: {elapsed / args.switches * 1000:8.1f} ms per switch")
+        print(f"cache: {cache.hits} hits, {cache.misses} misses, "
+              f"{cache.size_bytes / 2 ** 20:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
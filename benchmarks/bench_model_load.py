@@ -0,0 +1,103 @@
+"""
+Load time and resident memory of a random forest saved with joblib and in the compact
+memory-mapped format of `src.model_format`.
+
+Every measurement loads the model in a fresh Python process, so the time to import the
+modules is excluded and the memory of earlier loads does not count. The time of a first
+prediction is reported too, since the compact model only reads its pages when they are used.
+
+Run from the root of the repo:
+    python -m benchmarks.bench_model_load --trees 500 --rows 100000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+FEATURES = ["log_entropy", "IR_norm_range", "entropy_x_contrast"]
+
+
+def rss_bytes() -> int:
+    """ Resident set size of this process, from /proc on Linux """
+    with open("/proc/self/status", "r", encoding="ascii") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def measure_load(path: str) -> None:
+    """ Load a model, predict 1000 rows and print the measurements as JSON """
+    # imports done before the measurement, as in a long-lived process
+    from src import score_model  # pylint: disable=import-outside-toplevel
+
+    x_test = pd.DataFrame(np.random.default_rng(1).normal(size=(1000, len(FEATURES))),
+                          columns=FEATURES)
+    rss_before = rss_bytes()
+    start = time.perf_counter()
+    model = score_model.load_model(path)
+    load_time = time.perf_counter() - start
+    rss_loaded = rss_bytes()
+
+    start = time.perf_counter()
+    model.predict_proba(x_test)
+    predict_time = time.perf_counter() - start
+
+    print(json.dumps({"load_s": load_time, "first_predict_s": predict_time,
+                      "rss_load_bytes": rss_loaded - rss_before,
+                      "rss_after_predict_bytes": rss_bytes() - rss_before}))
+
+
+def disk_size(path: str) -> int:
+    """ Size in bytes of a file or of all files in a directory """
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    return os.path.getsize(path)
+
+
+def main() -> None:
+    """ Fit a forest, save it in both formats and compare their loads """
+    parser = argparse.ArgumentParser(description="Benchmark model load time and memory")
+    parser.add_argument("--trees", type=int, default=500)
+    parser.add_argument("--rows", type=int, default=100_000, help="training rows")
+    parser.add_argument("--load", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.load:
+        measure_load(args.load)
+        return
+
+    from sklearn.ensemble import RandomForestClassifier  # pylint: disable=import-outside-toplevel
+    from src import model_format, train_model  # pylint: disable=import-outside-toplevel
+
+    rng = np.random.default_rng(0)
+    x_train = pd.DataFrame(rng.normal(size=(args.rows, len(FEATURES))), columns=FEATURES)
+    y_train = (x_train.sum(axis=1) + rng.normal(size=args.rows) > 0).astype(float)
+    model = RandomForestClassifier(n_estimators=args.trees, random_state=42)
+    model.fit(x_train, y_train)
+    print(f"{args.trees} trees, {sum(tree.tree_.node_count for tree in model.estimators_)} nodes")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        joblib_path = os.path.join(tmp_dir, "model.joblib")
+        forest_path = os.path.join(tmp_dir, "model" + model_format.EXTENSION)
+        train_model.save_model(model, joblib_path, forest_path)
+
+        for path in [joblib_path, forest_path]:
+            output = subprocess.run([sys.executable, "-m", "benchmarks.bench_model_load",
+                                     "--load", path], check=True, capture_output=True, text=True)
+            result = json.loads(output.stdout.strip().splitlines()[-1])
+            print(f"{os.path.basename(path):>13}: {disk_size(path) / 2**20:7.1f}MB on disk, "
+                  f"load {result['load_s'] * 1000:8.2f}ms, "
+                  f"first predict {result['first_predict_s'] * 1000:8.2f}ms, "
+                  f"RSS +{result['rss_load_bytes'] / 2**20:6.1f}MB after load, "
+                  f"+{result['rss_after_predict_bytes'] / 2**20:6.1f}MB after predict")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Time to pull a few labeled segments out of a large raw file, streaming the file from its
+start against reading the segments at their byte offsets with a sidecar line index.
+
+The raw file repeats the clouds of data/raw/clouds.data, and the segments are spread over
+it, the last one near its end. The one-time cost of building the index is reported
+separately from the extraction with an up-to-date index.
+
+Run from the root of the repo:
+    python -m benchmarks.bench_segment_index --repeat 500 --segments 4 --rows 5000
+"""
+import argparse
+import os
+import tempfile
+import time
+from typing import Callable, Tuple
+
+import pandas as pd
+
+from benchmarks.bench_get_clouds import COLUMNS, build_raw_file
+from src import create_datasets, parse_raw_data
+
+
+def timed(func: Callable, **kwargs) -> Tuple[float, pd.DataFrame]:
+    """ Return wall time in seconds and result of one call """
+    start = time.perf_counter()
+    result = func(**kwargs)
+    return time.perf_counter() - start, result
+
+
+def main() -> None:
+    """ Run the benchmark and print the time of each way to extract the segments """
+    parser = argparse.ArgumentParser(description="Benchmark the line index of raw files")
+    parser.add_argument("--input_path", default="data/raw/clouds.data")
+    parser.add_argument("--repeat", type=int, default=500,
+                        help="number of times each cloud is repeated in the benchmark file")
+    parser.add_argument("--segments", type=int, default=4, help="number of segments to extract")
+    parser.add_argument("--rows", type=int, default=5000, help="number of rows per segment")
+    parser.add_argument("--stride", type=int, default=parse_raw_data.DEFAULT_INDEX_STRIDE)
+    parser.add_argument("--n_workers", type=int, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        raw_path = os.path.join(tmp_dir, "clouds.data")
+        first_cloud, second_cloud = build_raw_file(args.input_path, raw_path, args.repeat,
+                                                   [53, 1077], [1082, 2105])
+        # spread the segments over both clouds, the last one ending with the second cloud
+        starts = [first_cloud[0] + (second_cloud[1] - args.rows - first_cloud[0])
+                  * position // max(args.segments - 1, 1) for position in range(args.segments)]
+        starts = [start if not first_cloud[1] - args.rows < start < second_cloud[0]
+                  else second_cloud[0] for start in starts]
+        segments = [{"lines": [start, start + args.rows], "label": position % 2}
+                    for position, start in enumerate(starts)]
+        print(f"raw file: {os.path.getsize(raw_path) / 1e6:.1f} MB, "
+              f"{second_cloud[1]} lines, {args.segments} segments of {args.rows} rows, "
+              f"{os.cpu_count()} CPUs")
+
+        kwargs = dict(input_path=raw_path, columns=COLUMNS, first_cloud=None, second_cloud=None,
+                      segments=segments)
+        streamed_s, streamed = timed(create_datasets.load_clouds, **kwargs)
+        build_s, _ = timed(parse_raw_data.load_index, input_path=raw_path, stride=args.stride)
+        index_size = os.path.getsize(raw_path + parse_raw_data.INDEX_SUFFIX)
+        indexed_s, indexed = timed(create_datasets.load_clouds, index={"stride": args.stride},
+                                   n_workers=args.n_workers, **kwargs)
+
+    print(f"{'streamed':>16}: {streamed_s:8.3f} s")
+    print(f"{'index build':>16}: {build_s:8.3f} s  ({index_size / 1e3:.1f} kB sidecar)")
+    print(f"{'indexed':>16}: {indexed_s:8.3f} s  ({streamed_s / indexed_s:.0f}x faster)")
+    print("same clouds:", streamed.equals(indexed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Time of scoring the same test data with several models by running `score_model.predict` once
+per model, which reads the test data and writes its outputs every time, against one pass of
+`shadow_scoring.shadow_score` in threads and in processes.
+
+Run from the root of the repo:
+    python -m benchmarks.bench_shadow_scoring --rows 200000 --models 4 --n_estimators 50
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+import joblib
+import numpy as np
+
+from benchmarks.bench_update_model import FEATURES, make_rows
+from src import score_model, shadow_scoring, train_model
+
+
+def main() -> None:
+    """ Run the benchmark and print the time of scoring every model """
+    parser = argparse.ArgumentParser(description="Benchmark shadow scoring")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--models", type=int, default=4)
+    parser.add_argument("--n_estimators", type=int, default=50)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    rng = np.random.default_rng(0)
+    x_train, y_train = make_rows(rng, 100_000)
+    x_test, _ = make_rows(rng, args.rows)
+    with tempfile.TemporaryDirectory() as directory:
+        x_test_path = os.path.join(directory, "x_test.csv")
+        x_test.to_csv(x_test_path, index=False)
+        paths = {}
+        for index in range(args.models):
+            model = train_model.train_classifier(x_train, y_train, FEATURES, args.n_estimators,
+                                                 10, index + 1)
+            paths[f"model_{index}"] = os.path.join(directory, f"model_{index}.joblib")
+            joblib.dump(model, paths[f"model_{index}"])
+        print(f"{args.rows} test rows, {args.models} models of {args.n_estimators} trees")
+
+        output_path = os.path.join(directory, "proba.csv")
+        start = time.perf_counter()
+        for path in paths.values():
+            score_model.predict(path, x_test_path, FEATURES, output_path,
+                                os.path.join(directory, "class.csv"))
+        print(f"{'predict per model':>18}: {time.perf_counter() - start:6.2f} s")
+        for executor in shadow_scoring.EXECUTORS:
+            start = time.perf_counter()
+            shadow_scoring.shadow_score(x_test_path, FEATURES, output_path,
+                                        os.path.join(directory, "stats.csv"), models=paths,
+                                        executor=executor)
+            print(f"{'shadow ' + executor:>18}: {time.perf_counter() - start:6.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Startup time of run.py actions, importing every module of `src` like run.py used to before
+running any action, against importing only the modules of the action.
+
+Every mode is timed as the wall time of a fresh interpreter that imports the modules and
+parses the logging configuration, the median of `--repeat` runs. An action skipped by the
+stage cache only imports the modules run.py always imports.
+
+Run from the root of the repo:
+    python -m benchmarks.bench_startup --repeat 5
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from typing import List
+
+import run
+
+LOGGING_CONFIG = "import logging.config; logging.config.fileConfig('config/logging/local.conf')"
+
+
+def startup_time(modules: List[str], repeat: int) -> float:
+    """ Median wall time in seconds of a fresh interpreter importing `modules` """
+    code = "; ".join([LOGGING_CONFIG] + [f"import {name}" for name in modules])
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main() -> None:
+    """ Run the benchmark and print the startup time of every action """
+    parser = argparse.ArgumentParser(description="Benchmark the startup time of run.py")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    every_module = sorted({"src." + name for modules in run.ACTION_MODULES.values()
+                           for name in modules})
+    eager = startup_time(run.BASE_MODULES + every_module, args.repeat)
+    print(f"{'python -c pass':>20}: {startup_time([], args.repeat):6.3f} s")
+    print(f"{'every module':>20}: {eager:6.3f} s")
+    print(f"{'cache hit':>20}: {startup_time(run.BASE_MODULES, args.repeat):6.3f} s")
+    for action, modules in run.ACTION_MODULES.items():
+        lazy = startup_time(run.BASE_MODULES + ["src." + name for name in modules], args.repeat)
+        print(f"{action:>20}: {lazy:6.3f} s  ({lazy / eager:4.0%} of every module)")
+
+
+if __name__ == "__main__":
+    main()
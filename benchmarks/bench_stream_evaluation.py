@@ -0,0 +1,89 @@
+"""
+Time and peak memory of evaluating saved predictions with `evaluate_performance.evaluate`,
+which loads all rows and sorts them for the exact AUC, and with
+`evaluate_performance.evaluate_stream`, on one file and on shards evaluated in parallel.
+
+Every run is a fresh Python process whose peak resident memory is read from its rusage.
+
+Run from the root of the repo:
+    python -m benchmarks.bench_stream_evaluation --rows 5000000 --shards 4
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+RUNS = {
+    "evaluate": "evaluate_performance.evaluate(proba[0], bins[0], y_test[0], output)",
+    "evaluate_stream": "evaluate_performance.evaluate_stream(proba[0], bins[0], y_test[0], "
+                       "output, chunk_size={chunk_size})",
+    "evaluate_stream-shards": "evaluate_performance.evaluate_stream(proba[1:], bins[1:], "
+                              "y_test[1:], output, chunk_size={chunk_size})",
+}
+
+
+def write_predictions(directory: str, n_rows: int, n_shards: int) -> dict:
+    """ Write random predictions and target, whole and split in shards, return their paths """
+    rng = np.random.default_rng(0)
+    y_test = rng.integers(0, 2, n_rows).astype(np.float64)
+    proba = np.clip(0.3 * y_test + rng.normal(0.35, 0.2, n_rows), 0, 1)
+    columns = {"proba": proba, "bins": (proba > 0.5).astype(np.float64), "y_test": y_test}
+
+    paths = {name: [] for name in columns}
+    bounds = np.linspace(0, n_rows, n_shards + 1).astype(int)
+    for shard, (start, stop) in enumerate([(0, n_rows)] + list(zip(bounds[:-1], bounds[1:]))):
+        for name, values in columns.items():
+            path = os.path.join(directory, f"{name}_{shard}.csv")
+            with open(path, "w", encoding="ASCII") as output_file:
+                if name == "y_test":
+                    output_file.write("class\n")
+                for block in range(start, stop, 1_000_000):
+                    chunk = values[block:min(block + 1_000_000, stop)]
+                    output_file.write(("%.18e\n" * len(chunk)) % tuple(chunk.tolist()))
+            paths[name].append(path)
+    return paths
+
+
+def run(statement: str, paths: dict, output: str) -> tuple:
+    """ Run an evaluation statement in a fresh process, return its wall time and peak RSS """
+    code = ("import logging; logging.disable(logging.INFO)\n"
+            "from src import evaluate_performance\n"
+            f"proba, bins, y_test = {paths['proba']!r}, {paths['bins']!r}, {paths['y_test']!r}\n"
+            f"output = {output!r}\n"
+            + statement)
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", code])
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    if status != 0:
+        raise RuntimeError(f"{statement} failed with status {status}")
+    # ru_maxrss is in kilobytes on Linux
+    return elapsed, usage.ru_maxrss * 1024
+
+
+def main() -> None:
+    """ Run the benchmark and print one line per evaluation mode """
+    parser = argparse.ArgumentParser(description="Benchmark streamed evaluation")
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--chunk_size", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = write_predictions(tmp_dir, args.rows, args.shards)
+        print(f"{args.rows} rows, {args.shards} shards, chunks of {args.chunk_size} rows, "
+              f"{os.cpu_count()} CPUs")
+        for name, statement in RUNS.items():
+            output = os.path.join(tmp_dir, f"{name}.txt")
+            elapsed, peak = run(statement.format(chunk_size=args.chunk_size), paths, output)
+            with open(output, "r", encoding="ASCII") as metrics_file:
+                auc = metrics_file.readline().strip()
+            print(f"{name:>22}: {elapsed:7.2f}s, peak RSS {peak / 2**20:7.1f}MB, {auc}")
+
+
+if __name__ == "__main__":
+    main()
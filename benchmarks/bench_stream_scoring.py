@@ -0,0 +1,89 @@
+"""
+Time and peak memory of scoring a test set with `score_model.predict`, which loads all rows,
+and with `score_model.predict_stream`, sequentially and with reader/predictor/writer threads.
+
+Every run is a fresh Python process whose peak resident memory is read from its rusage.
+Peak memory of the streamed runs should stay flat as --rows grows.
+
+Run from the root of the repo:
+    python -m benchmarks.bench_stream_scoring --rows 2000000 --chunk_size 100000
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+
+FEATURES = ["log_entropy", "IR_norm_range", "entropy_x_contrast"]
+
+RUNS = {
+    "predict": "score_model.predict(model, x_test, FEATURES, proba, bins)",
+    "stream": "score_model.predict_stream(model, x_test, FEATURES, proba, bins, "
+              "chunk_size={chunk_size}, threaded=False)",
+    "stream-threaded": "score_model.predict_stream(model, x_test, FEATURES, proba, bins, "
+                       "chunk_size={chunk_size}, threaded=True)",
+}
+
+
+def write_test_set(path: str, n_rows: int, chunk_size: int = 1_000_000) -> None:
+    """ Write a random test set of `n_rows` rows in chunks """
+    rng = np.random.default_rng(1)
+    for start in range(0, n_rows, chunk_size):
+        chunk = pd.DataFrame(rng.normal(size=(min(chunk_size, n_rows - start), len(FEATURES))),
+                             columns=FEATURES)
+        chunk.to_csv(path, index=False, header=start == 0, mode="w" if start == 0 else "a")
+
+
+def run(statement: str, paths: dict) -> tuple:
+    """ Run a scoring statement in a fresh process, return its wall time and peak RSS """
+    code = ("import logging; logging.disable(logging.INFO)\n"
+            "from src import score_model\n"
+            f"FEATURES = {FEATURES!r}\n"
+            f"model, x_test = {paths['model']!r}, {paths['x_test']!r}\n"
+            f"proba, bins = {paths['proba']!r}, {paths['bins']!r}\n"
+            + statement)
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", code])
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    if status != 0:
+        raise RuntimeError(f"{statement} failed with status {status}")
+    # ru_maxrss is in kilobytes on Linux
+    return elapsed, usage.ru_maxrss * 1024
+
+
+def main() -> None:
+    """ Run the benchmark and print one line per scoring mode """
+    parser = argparse.ArgumentParser(description="Benchmark streamed scoring")
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--chunk_size", type=int, default=100_000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    x_train = pd.DataFrame(rng.normal(size=(10_000, len(FEATURES))), columns=FEATURES)
+    y_train = (x_train.sum(axis=1) > 0).astype(float)
+    model = RandomForestClassifier(n_estimators=10, max_depth=10, random_state=42)
+    model.fit(x_train, y_train)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = {name: os.path.join(tmp_dir, file_name) for name, file_name in
+                 [("model", "model.joblib"), ("x_test", "x_test.csv"),
+                  ("proba", "proba.csv"), ("bins", "class.csv")]}
+        joblib.dump(model, paths["model"])
+        write_test_set(paths["x_test"], args.rows)
+        print(f"{args.rows} rows, {os.path.getsize(paths['x_test']) / 2**20:.0f}MB test set, "
+              f"chunks of {args.chunk_size} rows")
+
+        for name, statement in RUNS.items():
+            elapsed, peak = run(statement.format(chunk_size=args.chunk_size), paths)
+            print(f"{name:>16}: {elapsed:7.2f}s, peak RSS {peak / 2**20:7.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Time and test ROC AUC of updating a fitted random forest with a batch of new labeled rows,
+retraining it from scratch on the whole history against `train_model.grow_forest`, which only
+fits new trees on the batch and retires as many of the oldest trees.
+
+The rows are drawn from a fixed logistic model of three features, so the history, the
+batches and the test set come from the same distribution.
+
+Run from the root of the repo:
+    python -m benchmarks.bench_update_model --history 1000000 --batch 10000
+"""
+import argparse
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import roc_auc_score
+
+from src import train_model
+
+FEATURES = ["a", "b", "c"]
+
+
+def make_rows(rng: np.random.Generator, n_rows: int) -> tuple:
+    """ Features and binary target of `n_rows` rows """
+    x = pd.DataFrame(rng.normal(size=(n_rows, len(FEATURES))).astype(np.float32),
+                     columns=FEATURES)
+    logits = 2.0 * x["a"] - x["b"] * x["c"]
+    y = pd.DataFrame({"class": (rng.uniform(size=n_rows) < 1 / (1 + np.exp(-logits)))
+                      .astype(np.uint8)})
+    return x, y
+
+
+def main() -> None:
+    """ Run the benchmark and print the time and test AUC of each way to update the model """
+    parser = argparse.ArgumentParser(description="Benchmark incremental model updates")
+    parser.add_argument("--history", type=int, default=1_000_000)
+    parser.add_argument("--batch", type=int, default=10_000)
+    parser.add_argument("--n_estimators", type=int, default=50)
+    parser.add_argument("--n_new_estimators", type=int, default=5)
+    parser.add_argument("--max_depth", type=int, default=10)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    rng = np.random.default_rng(0)
+    x_history, y_history = make_rows(rng, args.history)
+    x_batch, y_batch = make_rows(rng, args.batch)
+    x_test, y_test = make_rows(rng, 200_000)
+    print(f"{args.history} history rows, {args.batch} new rows, {args.n_estimators} trees")
+
+    model = train_model.train_classifier(x_history, y_history, FEATURES, args.n_estimators,
+                                         args.max_depth, 42)
+    results = {"before": (0.0, model.predict_proba(x_test)[:, 1])}
+
+    start = time.perf_counter()
+    retrained = train_model.train_classifier(pd.concat([x_history, x_batch]),
+                                             pd.concat([y_history, y_batch]), FEATURES,
+                                             args.n_estimators, args.max_depth, 42)
+    results["retrain"] = (time.perf_counter() - start, retrained.predict_proba(x_test)[:, 1])
+
+    start = time.perf_counter()
+    grown = train_model.grow_forest(model, x_batch, y_batch, FEATURES, args.n_new_estimators,
+                                    max_estimators=args.n_estimators)
+    results["grow"] = (time.perf_counter() - start, grown.predict_proba(x_test)[:, 1])
+
+    for name, (elapsed, proba) in results.items():
+        print(f"{name:>8}: {elapsed:8.2f} s  test AUC {roc_auc_score(y_test, proba):.4f}")
+
+
+if __name__ == "__main__":
+    main()
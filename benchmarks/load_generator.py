@@ -0,0 +1,103 @@
+"""
+Load generator for the scoring server (`python run.py serve`).
+
+Concurrent clients send /predict requests of random cloud instances for a fixed duration,
+then the client-side latency percentiles and throughput are printed next to the /metrics
+counters of the server. Without --url, a server is started in this process on a free port
+with the model and configuration of the repo.
+
+Run from the root of the repo:
+    python -m benchmarks.load_generator --clients 16 --rows 1 --duration 10
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.request
+from typing import Any, Dict, List
+
+import numpy as np
+import yaml
+
+from src import scoring_server, score_model
+
+
+def make_instances(columns: List[str], n_rows: int, rng: np.random.Generator) -> List[Dict]:
+    """ Random positive instances with a value for every raw feature column """
+    return [dict(zip(columns, row)) for row in rng.uniform(1.0, 100.0, (n_rows, len(columns)))]
+
+
+def post(url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """ POST a JSON payload and decode the JSON response """
+    request = urllib.request.Request(url, data=json.dumps(payload).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def client(url: str, columns: List[str], n_rows: int, deadline: float, seed: int,
+           latencies: List[float]) -> None:
+    """ Send requests until `deadline`, appending every request latency to `latencies` """
+    rng = np.random.default_rng(seed)
+    while time.monotonic() < deadline:
+        payload = {"instances": make_instances(columns, n_rows, rng)}
+        start = time.perf_counter()
+        post(url + "/predict", payload)
+        latencies.append(time.perf_counter() - start)
+
+
+def main() -> None:
+    """ Run the load generator and print client and server statistics """
+    parser = argparse.ArgumentParser(description="Load generator for the scoring server")
+    parser.add_argument("--url", help="URL of a running server, e.g. http://127.0.0.1:8080")
+    parser.add_argument("--config_file", default="config/model_config.yaml")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--rows", type=int, default=1, help="instances per request")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    args = parser.parse_args()
+
+    with open(args.config_file, "r", encoding="ASCII") as config_file:
+        config = yaml.load(config_file, Loader=yaml.FullLoader)
+    columns = config["process_data"]["get_features"]["columns"]
+
+    server = None
+    url = args.url
+    if url is None:
+        server_config = dict(config["scoring_server"])
+        service = scoring_server.ScoringService(
+            score_model.load_model(server_config["model_path"]), columns,
+            server_config["initial_features"], config["generate_additional_features"],
+            server_config["max_batch_size"], server_config["max_latency_ms"],
+            server_config.get("engine", "sklearn"), server_config.get("dtypes"))
+        server = scoring_server.create_server(service, "127.0.0.1", 0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://127.0.0.1:%d" % server.server_address[1]
+
+    latencies: List[float] = []
+    deadline = time.monotonic() + args.duration
+    threads = [threading.Thread(target=client,
+                                args=(url, columns, args.rows, deadline, seed, latencies))
+               for seed in range(args.clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    p50, p99 = np.percentile(np.array(latencies) * 1000.0, [50, 99])
+    print(f"clients={args.clients} rows/request={args.rows} requests={len(latencies)}")
+    print(f"client latency p50={p50:.2f}ms p99={p99:.2f}ms, "
+          f"{len(latencies) / elapsed:.0f} requests/s, "
+          f"{len(latencies) * args.rows / elapsed:.0f} rows/s")
+    with urllib.request.urlopen(url + "/metrics") as response:
+        print("server metrics:", json.dumps(json.loads(response.read()), indent=2))
+
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+        server.service.batcher.close()
+
+
+if __name__ == "__main__":
+    main()
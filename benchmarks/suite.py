@@ -0,0 +1,257 @@
+"""
+Benchmark suite of the pipeline stages at several input sizes, with regression tracking.
+
+The `run` command times every stage on synthetic clouds data of each size and writes the wall
+time (best of --repeat runs), the throughput in rows processed by the stage per second and
+the peak traced memory of one run to a JSON results file. The `compare` command flags the
+stages that became slower (or, with --memory, used more memory) than in a baseline results
+file by more than --threshold, and exits with status 1 if there is any.
+
+Stages run on in-memory data like the `pipeline` action, except `get_clouds` which parses a
+raw file built by repeating the clouds of data/raw/clouds.data.
+
+Run from the root of the repo:
+    python -m benchmarks.suite run --sizes 1000 100000 1000000 --output results.json
+    python -m benchmarks.suite compare baseline.json results.json --threshold 0.1
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import sklearn
+import yaml
+
+from benchmarks.bench_get_clouds import build_raw_file
+from src import create_datasets, evaluate_performance, generate_additional_features
+from src import model_format, process_data, score_model, train_model
+
+CONFIG_PATH = "config/model_config.yaml"
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+TRANSFORMS = ["log_transform", "multiply", "col_range", "norm_range"]
+
+# largest input size of the stages too slow to run on 1e7 rows by default
+MAX_ROWS = {"fit_model": 1_000_000}
+
+# largest number of training rows of the model scored by the predict and evaluate stages
+MAX_MODEL_ROWS = 100_000
+
+
+def make_clouds(n_rows: int, columns: List[str], seed: int = 42) -> pd.DataFrame:
+    """ Positive random clouds data with the configured columns and a class column """
+    rng = np.random.default_rng(seed)
+    clouds = pd.DataFrame(rng.uniform(1.0, 300.0, size=(n_rows, len(columns))), columns=columns)
+    clouds["class"] = (rng.uniform(size=n_rows) < 0.5).astype(np.float64)
+    return clouds
+
+
+def make_cases(config: Dict[str, Any], n_rows: int,
+               tmp_dir: str) -> Dict[str, Tuple[int, Callable[[], Any]]]:
+    """ Number of rows processed by every stage on `n_rows` rows of clouds, and a
+    zero-argument function running the stage
+
+    The inputs of every stage are prepared beforehand with the previous stages, so that
+    calling a function only runs its stage. The model scored by the predict and evaluate
+    stages is trained on at most `MAX_MODEL_ROWS` rows, so preparing them stays cheap on
+    large inputs.
+    """
+    columns = config["process_data"]["get_features"]["columns"]
+    feature_config = config["generate_additional_features"]
+    fit_config = config["train_model"]["fit_model"]
+    split_config = config["train_model"]["split_data"]
+    initial_features = fit_config["initial_features"]
+    plan_config = config.get("feature_plan", {})
+
+    clouds = make_clouds(n_rows, columns)
+    features = process_data.get_features(clouds, columns)
+    target = clouds[["class"]]
+    plan = generate_additional_features.compile_feature_plan(feature_config, columns)
+    all_features = generate_additional_features.apply_feature_plan(features, plan)
+    x_train, x_test, y_train, y_test = train_model.split_frames(
+        all_features, target, split_config["test_size"], split_config["random_state"])
+    model = train_model.train_classifier(x_train.iloc[:MAX_MODEL_ROWS],
+                                         y_train.iloc[:MAX_MODEL_ROWS], initial_features,
+                                         fit_config["n_estimators"], fit_config["max_depth"],
+                                         fit_config["random_state"])
+    compact_model = model_format.to_compact(model)
+    proba, classes = score_model.predict_frame(model, x_test, initial_features)
+
+    cases = {
+        "get_clouds": (n_rows, _get_clouds_case(config, n_rows, tmp_dir)),
+        "get_features": (n_rows, lambda: process_data.get_features(clouds, columns)),
+    }
+    for operation in [operation for operation in TRANSFORMS if operation in feature_config]:
+        cases[operation] = (n_rows, lambda operation=operation: getattr(
+            generate_additional_features, operation)(features.copy(), **feature_config[operation]))
+    cases.update({
+        "feature_plan": (n_rows, lambda: generate_additional_features.apply_feature_plan(
+            features, plan, **plan_config)),
+        "split_data": (n_rows, lambda: train_model.split_frames(all_features, target,
+                                                                split_config["test_size"],
+                                                                split_config["random_state"])),
+        "fit_model": (len(x_train), lambda: train_model.train_classifier(
+            x_train, y_train, initial_features, fit_config["n_estimators"],
+            fit_config["max_depth"], fit_config["random_state"])),
+        "predict": (len(x_test), lambda: score_model.predict_frame(model, x_test,
+                                                                   initial_features)),
+        "predict_flat": (len(x_test), lambda: score_model.predict_frame(
+            compact_model, x_test, initial_features, engine="flat")),
+        "evaluate": (len(x_test), lambda: evaluate_performance.compute_metrics(
+            y_test, proba, classes)),
+    })
+    return cases
+
+
+def _get_clouds_case(config: Dict[str, Any], n_rows: int,
+                     tmp_dir: str) -> Callable[[], None]:
+    """ get_clouds on a raw file holding `n_rows` rows of clouds """
+    stage_config = dict(config["create_datasets"]["get_clouds"])
+    first_cloud, second_cloud = stage_config["first_cloud"], stage_config["second_cloud"]
+    cloud_rows = (first_cloud[1] - first_cloud[0]) + (second_cloud[1] - second_cloud[0])
+    raw_path = os.path.join(tmp_dir, "clouds.data")
+    first, second = build_raw_file(stage_config["input_path"], raw_path,
+                                   max(math.ceil(n_rows / cloud_rows), 1),
+                                   first_cloud, second_cloud)
+
+    # keep half of the rows from each cloud
+    stage_config.update(input_path=raw_path, output_path=os.path.join(tmp_dir, "clouds.csv"),
+                        first_cloud=[first[0], first[0] + n_rows // 2],
+                        second_cloud=[second[0], second[0] + n_rows - n_rows // 2])
+    return lambda: create_datasets.get_clouds(**stage_config)
+
+
+def measure(func: Callable[[], Any], repeat: int) -> Tuple[float, int]:
+    """ Best wall time in seconds over `repeat` runs and peak traced memory of one more run """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak
+
+
+def environment() -> Dict[str, Any]:
+    """ Versions and machine the results were measured with """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], check=True,
+                                capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "commit": commit, "python": platform.python_version(),
+            "numpy": np.__version__, "pandas": pd.__version__, "sklearn": sklearn.__version__,
+            "machine": platform.machine(), "cpu_count": os.cpu_count()}
+
+
+def run(sizes: List[int], stages: Optional[List[str]], repeat: int, output: str,
+        all_sizes: bool) -> None:
+    """ Run the suite and write the results file """
+    with open(CONFIG_PATH, "r", encoding="ASCII") as config_file:
+        config = yaml.load(config_file, Loader=yaml.FullLoader)
+
+    results = []
+    for n_rows in sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cases = make_cases(config, n_rows, tmp_dir)
+            for stage, (stage_rows, func) in cases.items():
+                if stages and stage not in stages:
+                    continue
+                if not all_sizes and n_rows > MAX_ROWS.get(stage, n_rows):
+                    continue
+                wall, peak = measure(func, repeat)
+                # "rows" is the input size the stage is compared at, "stage_rows" the rows
+                # it processed, like the test rows of predict
+                results.append({"stage": stage, "rows": n_rows, "stage_rows": stage_rows,
+                                "wall_s": wall,
+                                "rows_per_s": stage_rows / wall if wall else None,
+                                "peak_bytes": peak})
+                print(f"{stage:>14} {n_rows:>9} rows: {wall * 1000:10.2f}ms "
+                      f"{stage_rows / wall:14.0f} rows/s, peak {peak / 2**20:8.1f}MB",
+                      flush=True)
+
+    with open(output, "w", encoding="utf-8") as output_file:
+        json.dump({"environment": environment(), "repeat": repeat, "results": results},
+                  output_file, indent=2)
+    print(f"Results saved to {output}")
+
+
+def compare(baseline_path: str, results_path: str, threshold: float, min_time: float,
+            memory: bool) -> int:
+    """ Print the change of every stage against the baseline, return the number of
+    regressions """
+    with open(baseline_path, "r", encoding="utf-8") as baseline_file:
+        baseline = {(result["stage"], result["rows"]): result
+                    for result in json.load(baseline_file)["results"]}
+    with open(results_path, "r", encoding="utf-8") as results_file:
+        results = json.load(results_file)["results"]
+
+    regressions = 0
+    for result in results:
+        before = baseline.get((result["stage"], result["rows"]))
+        if before is None:
+            continue
+        checks = [("time", result["wall_s"], before["wall_s"])]
+        if memory:
+            checks.append(("memory", result["peak_bytes"], before["peak_bytes"]))
+        for metric, value, reference in checks:
+            ratio = value / reference if reference else float("inf")
+            # timings shorter than min_time are too noisy to compare
+            noisy = metric == "time" and max(value, reference) < min_time
+            regressed = ratio > 1.0 + threshold and not noisy
+            regressions += regressed
+            print(f"{result['stage']:>14} {result['rows']:>9} rows {metric:>6}: "
+                  f"{ratio:6.2f}x{'  REGRESSION' if regressed else ''}")
+
+    print(f"{regressions} regressions beyond {threshold:.0%}")
+    return regressions
+
+
+def main() -> None:
+    """ Parse the command line and run a command """
+    parser = argparse.ArgumentParser(description="Benchmark suite of the pipeline stages")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the suite and save the results")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                            help="numbers of rows, e.g. 1000 10000000")
+    run_parser.add_argument("--stages", nargs="+", help="stages to run, all by default")
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--output", default="benchmark_results.json")
+    run_parser.add_argument("--all_sizes", action="store_true",
+                            help=f"also run the stages of {sorted(MAX_ROWS)} on larger inputs")
+
+    compare_parser = commands.add_parser("compare", help="compare results with a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("results")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="relative slowdown flagged as a regression")
+    compare_parser.add_argument("--min_time", type=float, default=0.001,
+                                help="seconds under which timings are not compared")
+    compare_parser.add_argument("--memory", action="store_true",
+                                help="also flag increases of peak memory")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args.sizes, args.stages, args.repeat, args.output, args.all_sizes)
+    else:
+        sys.exit(1 if compare(args.baseline, args.results, args.threshold, args.min_time,
+                              args.memory) else 0)
+
+
+if __name__ == "__main__":
+    main()
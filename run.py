@@ -1,22 +1,132 @@
 """
 Receives command-line arguments from the user
 and delegates instructions to the appropriate module in `src/`.
+
+Only the modules of the action are imported, when it runs, so actions that are skipped by
+the stage cache or only need a few modules start without importing pandas or scikit-learn.
 """
 import argparse
+import importlib
 import logging.config
 import sys
+from types import SimpleNamespace
 
 import yaml
 
-from src import create_datasets, process_data, generate_additional_features
-from src import train_model, score_model, evaluate_performance
+from src import import_profile, instrumentation, stage_cache
 
-logging.config.fileConfig('config/logging/local.conf')
 logger = logging.getLogger('assignment3')
 
+# actions whose outputs are skipped or restored by the stage cache when their inputs are unchanged,
+# get_raw_data is left to the conditional requests of `src.download`
+CACHED_ACTIONS = ["get_clouds", "generate_features", "train_model", "score_model", "evaluate"]
+
+# modules of `src` imported by every action when it runs
+ACTION_MODULES = {
+    "get_raw_data": ["create_datasets"],
+    "get_clouds": ["create_datasets"],
+    "generate_features": ["process_data", "generate_additional_features"],
+    "train_model": ["train_model"],
+    "score_model": ["score_model"],
+    "shadow_score": ["shadow_scoring"],
+    "evaluate": ["evaluate_performance"],
+    "generate_synthetic": ["synthetic_data"],
+    "score_stream": ["score_model"],
+    "evaluate_stream": ["evaluate_performance"],
+    "update_model": ["train_model"],
+    "compact_model": ["compact_model"],
+    "register_model": ["model_registry"],
+    "train_worker": ["distributed_training"],
+    "tune_model": ["tune_model"],
+    "pipeline": ["pipeline"],
+    "serve": ["scoring_server"],
+    "clean_cache": [],
+}
+
+# modules imported by run.py before any action
+BASE_MODULES = ["argparse", "importlib", "logging.config", "yaml", "src.import_profile",
+                "src.instrumentation", "src.stage_cache"]
+
+
+def import_action(action: str) -> SimpleNamespace:
+    """ Import the modules of `src` used by an action
+
+    Args:
+        action (`str`): action to take
+
+    Returns:
+        modules (:obj:`types.SimpleNamespace`): imported modules as attributes named like
+            in `src`
+    """
+    return SimpleNamespace(**{name: importlib.import_module("src." + name)
+                              for name in ACTION_MODULES[action]})
+
+
+def execute(action: str, config: dict, args: argparse.Namespace) -> None:
+    """ Execute one action of the model pipeline
+
+    Args:
+        action (`str`): action to take
+        config (`dict`): model pipeline configuration
+        args (:obj:`argparse.Namespace`): parsed command-line arguments
+
+    Returns:
+        None
+    """
+    src = import_action(action)
+    if action == "get_raw_data":
+        src.create_datasets.acquire_raw_data(**config["create_datasets"]["acquire_raw_data"])
+    if action == "generate_synthetic":
+        src.synthetic_data.generate(columns=config["create_datasets"]["get_clouds"]["columns"],
+                                    **config["synthetic_data"]["generate"])
+    if action == "get_clouds":
+        src.create_datasets.get_clouds(**config["create_datasets"]["get_clouds"])
+    if action == "generate_features":
+        data = src.process_data.load_data(**config["process_data"]["load_data"])
+        features = src.process_data.get_features(data, **config["process_data"]["get_features"])
+        src.process_data.get_target(data, **config["process_data"]["get_target"])
+        plan = src.generate_additional_features.compile_feature_plan(
+            config["generate_additional_features"], list(features.columns))
+        features = src.generate_additional_features.apply_feature_plan(
+            features, plan, **config.get("feature_plan", {}))
+        src.process_data.save_features(features, **config["process_data"]["save_features"])
+    if action == "train_model":
+        src.train_model.split_data(**config["train_model"]["split_data"])
+        src.train_model.fit_model(**config["train_model"]["fit_model"])
+    if action == "update_model":
+        src.train_model.update_model(**config["train_model"]["update_model"])
+    if action == "compact_model":
+        src.compact_model.compact(**config["compact_model"]["compact"])
+    if action == "register_model":
+        src.model_registry.register(**config["model_registry"]["register"])
+    if action == "train_worker":
+        src.distributed_training.serve_worker(config["distributed_training"]["address"])
+    if action == "tune_model":
+        src.tune_model.tune(**config["tune_model"]["tune"])
+    if action == "score_model":
+        src.score_model.predict(**config["score_model"]["predict"])
+    if action == "shadow_score":
+        src.shadow_scoring.shadow_score(**config["shadow_scoring"]["shadow_score"])
+    if action == "score_stream":
+        src.score_model.predict_stream(feature_config=config["generate_additional_features"],
+                                       **config["score_model"]["predict_stream"])
+    if action == "evaluate":
+        src.evaluate_performance.evaluate(**config["evaluate_performance"]["evaluate"])
+    if action == "evaluate_stream":
+        src.evaluate_performance.evaluate_stream(
+            **config["evaluate_performance"]["evaluate_stream"])
+    if action == "pipeline":
+        stages = src.pipeline.STAGES
+        src.pipeline.run_pipeline(config, start=args.start or stages[0],
+                                  stop=args.stop or stages[-1], persist=args.persist)
+    if action == "serve":
+        src.scoring_server.serve(columns=config["process_data"]["get_features"]["columns"],
+                                 feature_config=config["generate_additional_features"],
+                                 **config["scoring_server"])
+
+
 if __name__ == "__main__":
-    actions = ["get_raw_data", "get_clouds", "generate_features",
-               "train_model", "score_model", "evaluate"]
+    actions = list(ACTION_MODULES)
 
     parser = argparse.ArgumentParser(description="Model Pipeline for Classifying Clouds")
     parser.add_argument("action",
@@ -25,8 +135,43 @@ if __name__ == "__main__":
     parser.add_argument("--config_file",
                         help="path to configuration file",
                         default="config/model_config.yaml")
+    parser.add_argument("--from", dest="start",
+                        help="first stage run by the pipeline action, get_clouds by default")
+    parser.add_argument("--to", dest="stop",
+                        help="last stage run by the pipeline action, evaluate by default")
+    parser.add_argument("--persist",
+                        help="save the intermediate artifacts of every pipeline stage",
+                        action="store_true")
+    parser.add_argument("--force",
+                        help="run the action even if its outputs are up to date",
+                        action="store_true")
+    parser.add_argument("--no_cache",
+                        help="run the action without reading or writing the stage cache",
+                        action="store_true")
+    parser.add_argument("--no_metrics",
+                        help="do not record the runtime metrics of the action",
+                        action="store_true")
+    parser.add_argument("--max_cache_size", type=int,
+                        help="size cap in bytes of the stage cache kept by clean_cache")
+    parser.add_argument("--profile_imports",
+                        help="report the import time of the modules of the action "
+                             "instead of running it",
+                        action="store_true")
 
     args = parser.parse_args()
+    if args.action == "pipeline":
+        # the stages are only known once the pipeline is imported
+        stages = import_action("pipeline").pipeline.STAGES
+        for stage in [args.start, args.stop]:
+            if stage is not None and stage not in stages:
+                parser.error(f"invalid stage {stage!r} (choose from {', '.join(stages)})")
+    logging.config.fileConfig('config/logging/local.conf')
+
+    if args.profile_imports:
+        base_times, action_times = import_profile.profile_imports(
+            BASE_MODULES, ["src." + name for name in ACTION_MODULES[args.action]])
+        print(import_profile.format_report(args.action, base_times, action_times))
+        sys.exit(0)
 
     # process configuration file
     try:
@@ -36,31 +181,29 @@ if __name__ == "__main__":
         logger.error("Cannot find input configure file")
         sys.exit(1)
 
+    cache_config = config.get("stage_cache", {})
+    cache_dir = cache_config.get("cache_dir", stage_cache.DEFAULT_CACHE_DIR)
+
+    metrics_config = config.get("instrumentation", {})
+    if metrics_config.get("enabled", False) and not args.no_metrics:
+        instrumentation.start(metrics_config.get("metrics_path"),
+                              metrics_config.get("prometheus_path"), labels={"action": args.action})
+
     # execute actions
-    if args.action == "get_raw_data":
-        create_datasets.acquire_raw_data(**config["create_datasets"]["acquire_raw_data"])
-    if args.action == "get_clouds":
-        create_datasets.get_clouds(**config["create_datasets"]["get_clouds"])
-    if args.action == "generate_features":
-        data = process_data.load_data(**config["process_data"]["load_data"])
-        features = process_data.get_features(data, **config["process_data"]["get_features"])
-        process_data.get_target(data, **config["process_data"]["get_target"])
-        features = generate_additional_features.log_transform(
-            features,
-            **config["generate_additional_features"]["log_transform"])
-        features = generate_additional_features.multiply(
-            features,
-            **config["generate_additional_features"]["multiply"])
-        features = generate_additional_features.norm_range(
-            features,
-            **config["generate_additional_features"]["norm_range"])
-        process_data.save_features(features, **config["process_data"]["save_features"])
-    if args.action == "train_model":
-        train_model.split_data(**config["train_model"]["split_data"])
-        train_model.fit_model(**config["train_model"]["fit_model"])
-    if args.action == "score_model":
-        score_model.predict(**config["score_model"]["predict"])
-    if args.action == "evaluate":
-        evaluate_performance.evaluate(**config["evaluate_performance"]["evaluate"])
-    if args.action not in actions:
-        parser.print_help()
+    try:
+        with instrumentation.span(args.action):
+            if args.action == "clean_cache":
+                max_cache_size = args.max_cache_size
+                if max_cache_size is None:
+                    max_cache_size = cache_config.get("max_size", 1 << 30)
+                stage_cache.collect_garbage(cache_dir, max_cache_size)
+            elif args.action in CACHED_ACTIONS and not args.no_cache:
+                stage_cache.run_cached(args.action, config,
+                                       lambda: execute(args.action, config, args),
+                                       cache_dir=cache_dir, force=args.force)
+            elif args.action in actions:
+                execute(args.action, config, args)
+            else:
+                parser.print_help()
+    finally:
+        instrumentation.stop()
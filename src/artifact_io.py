@@ -0,0 +1,245 @@
+"""
+This module is to read and write the tabular artifacts exchanged between pipeline stages.
+The storage format is selected from the file extension:
+
+    .csv       comma separated text (default)
+    .parquet   columnar Parquet file (requires pyarrow or fastparquet)
+    .feather   columnar Feather file (requires pyarrow)
+    .npcols    directory holding one uncompressed .npy file per column,
+               memory-mapped on read so only the requested columns are paged in
+"""
+import collections
+import json
+import logging.config
+import os
+from typing import Any, Iterator, List, Mapping, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from src import instrumentation
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {".csv": "csv", ".parquet": "parquet", ".feather": "feather", ".npcols": "npcols"}
+
+# file listing the column names of a .npcols directory, in order
+NPCOLS_INDEX = "columns.json"
+
+
+def get_format(path: str) -> str:
+    """ Get the storage format of an artifact from its file extension
+
+    Args:
+        path (`str`): path to the artifact
+
+    Returns:
+        fmt (`str`): one of "csv", "parquet", "feather" or "npcols"
+
+    Raises:
+        ValueError: if the extension is not a supported format
+    """
+    extension = os.path.splitext(path.rstrip("/\\"))[1].lower()
+    if extension not in FORMATS:
+        logger.error("Unsupported artifact extension %s", extension)
+        raise ValueError(f"Unsupported artifact extension {extension!r}, "
+                         f"expected one of {sorted(FORMATS)}")
+
+    return FORMATS[extension]
+
+
+def read_table(path: str, columns: Optional[List[str]] = None,
+               dtype: Optional[Mapping[str, Any]] = None) -> pd.DataFrame:
+    """ Read a tabular artifact, loading only the given columns
+
+    Args:
+        path (`str`): path to the artifact
+        columns (:obj:`list` of `str`, optional): columns to load, all columns if None
+        dtype (`dict`, optional): dtype of the columns it lists, CSV columns are parsed
+            straight to it; a `collections.defaultdict` gives the dtype of every column
+
+    Returns:
+        data (:obj:`pandas.DataFrame`): dataframe with the requested columns in the given order
+
+    Raises:
+        FileNotFoundError: if the artifact does not exist
+        KeyError: if one of `columns` is not in the artifact
+        ValueError: if the extension of `path` is not a supported format
+    """
+    fmt = get_format(path)
+    columns = list(columns) if columns is not None else None
+
+    with instrumentation.span("read_table") as timing:
+        if fmt == "csv":
+            try:
+                data = pd.read_csv(path, index_col=False, usecols=columns, dtype=dtype)
+            except ValueError as error:
+                if columns is None:
+                    raise
+                raise KeyError(f"Columns {columns} are not all in {path}") from error
+        elif fmt == "npcols":
+            data = _read_npcols(path, columns)
+        else:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"No such file: {path!r}")
+            reader = pd.read_parquet if fmt == "parquet" else pd.read_feather
+            try:
+                data = reader(path, columns=columns)
+            except ImportError:
+                logger.error("Reading %s artifacts requires pyarrow to be installed", fmt)
+                raise
+            except (ValueError, IndexError) as error:
+                if columns is None:
+                    raise
+                raise KeyError(f"Columns {columns} are not all in {path}") from error
+        if dtype is not None and fmt != "csv":
+            data = data.astype({name: dtype[name] for name in data.columns
+                                if name in dtype or isinstance(dtype, collections.defaultdict)})
+        timing.rows = len(data)
+
+    # usecols keeps the file order, so restore the requested order
+    return data[columns] if columns is not None else data
+
+
+def iter_table(path: str, columns: Optional[List[str]] = None,
+               chunk_size: int = 100000) -> Iterator[pd.DataFrame]:
+    """ Read a tabular artifact `chunk_size` rows at a time, loading only the given columns
+
+    CSV and Parquet files are parsed chunk by chunk and .npcols columns are memory-mapped,
+    so memory use does not depend on the size of the artifact. Feather files cannot be read
+    in chunks and are loaded whole.
+
+    Args:
+        path (`str`): path to the artifact
+        columns (:obj:`list` of `str`, optional): columns to load, all columns if None
+        chunk_size (`int`): number of rows per chunk
+
+    Yields:
+        chunk (:obj:`pandas.DataFrame`): consecutive rows with the requested columns in the
+            given order, indexed from 0 within the artifact
+
+    Raises:
+        FileNotFoundError: if the artifact does not exist
+        KeyError: if one of `columns` is not in the artifact
+        ValueError: if the extension of `path` is not a supported format
+    """
+    fmt = get_format(path)
+    columns = list(columns) if columns is not None else None
+
+    if fmt == "csv":
+        try:
+            reader = pd.read_csv(path, index_col=False, usecols=columns, chunksize=chunk_size)
+        except ValueError as error:
+            if columns is None:
+                raise
+            raise KeyError(f"Columns {columns} are not all in {path}") from error
+        with reader:
+            for chunk in reader:
+                yield chunk[columns] if columns is not None else chunk
+    elif fmt == "npcols":
+        data = _read_npcols(path, columns)
+        for start in range(0, len(data), chunk_size):
+            # copy the rows so only the pages of the current chunk are touched
+            yield data.iloc[start:start + chunk_size].copy()
+    elif fmt == "parquet":
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No such file: {path!r}")
+        try:
+            import pyarrow.parquet  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            logger.error("Reading parquet artifacts requires pyarrow to be installed")
+            raise
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        missing = [name for name in (columns or []) if name not in parquet_file.schema.names]
+        if missing:
+            raise KeyError(f"Columns {missing} are not in {path}")
+        start = 0
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+            chunk = batch.to_pandas()
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            start += len(chunk)
+            yield chunk[columns] if columns is not None else chunk
+    else:
+        data = read_table(path, columns)
+        for start in range(0, len(data), chunk_size):
+            yield data.iloc[start:start + chunk_size]
+
+
+def write_table(data: Union[pd.DataFrame, pd.Series], path: str) -> None:
+    """ Write a dataframe (or a named series) as a tabular artifact without its index
+
+    Args:
+        data (:obj:`pandas.DataFrame` or :obj:`pandas.Series`): data to save
+        path (`str`): path to save the artifact
+
+    Returns:
+        None
+
+    Raises:
+        FileNotFoundError: if the directory to save the artifact does not exist
+        ValueError: if the extension of `path` is not a supported format
+    """
+    fmt = get_format(path)
+    if isinstance(data, pd.Series):
+        data = data.to_frame()
+
+    with instrumentation.span("write_table", rows=len(data)):
+        if fmt == "csv":
+            data.to_csv(path, index=False)
+            return
+
+        data = data.reset_index(drop=True)
+        if fmt == "npcols":
+            _write_npcols(data, path)
+            return
+
+        parent = os.path.dirname(path)
+        if parent and not os.path.isdir(parent):
+            raise FileNotFoundError(f"No such directory: {parent!r}")
+        try:
+            if fmt == "parquet":
+                data.to_parquet(path, index=False)
+            else:
+                data.to_feather(path)
+        except ImportError:
+            logger.error("Writing %s artifacts requires pyarrow to be installed", fmt)
+            raise
+
+
+def _read_npcols(path: str, columns: Optional[List[str]]) -> pd.DataFrame:
+    """ Memory-map the requested columns of a .npcols directory """
+    with open(os.path.join(path, NPCOLS_INDEX), "r", encoding="utf-8") as index_file:
+        stored = json.load(index_file)["columns"]
+
+    positions = {name: position for position, name in enumerate(stored)}
+    missing = [name for name in (columns or []) if name not in positions]
+    if missing:
+        raise KeyError(f"Columns {missing} are not in {path}")
+
+    return pd.DataFrame({
+        name: np.load(os.path.join(path, f"{positions[name]}.npy"), mmap_mode="r")
+        for name in (columns if columns is not None else stored)}, copy=False)
+
+
+def _write_npcols(data: pd.DataFrame, path: str) -> None:
+    """ Write every column of `data` to its own .npy file in the directory `path` """
+    if os.path.isdir(path):
+        # only replace directories that were written by this module
+        existing = os.listdir(path)
+        if not all(name == NPCOLS_INDEX or name.endswith(".npy") for name in existing):
+            raise FileExistsError(f"{path!r} exists and is not a .npcols artifact")
+        if NPCOLS_INDEX in existing:
+            os.remove(os.path.join(path, NPCOLS_INDEX))
+        for name in existing:
+            if name != NPCOLS_INDEX:
+                os.remove(os.path.join(path, name))
+    else:
+        os.mkdir(path)
+
+    for position, name in enumerate(data.columns):
+        np.save(os.path.join(path, f"{position}.npy"), data[name].to_numpy())
+
+    # write the index last so a partially written directory is never read back
+    with open(os.path.join(path, NPCOLS_INDEX), "w", encoding="utf-8") as index_file:
+        json.dump({"columns": [str(name) for name in data.columns], "rows": len(data)},
+                  index_file)
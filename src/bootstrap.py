@@ -0,0 +1,183 @@
+"""
+This module is to compute bootstrap confidence intervals of the test metrics.
+
+Rows with the same predicted probability, actual class and predicted class are
+interchangeable, so the test set is reduced to the counts of its distinct rows and a
+bootstrap replicate is one multinomial draw of these counts. Replicates are drawn in batches
+as matrices of counts and the metrics of a whole batch are computed with array operations,
+so the cost depends on the number of distinct rows instead of the number of rows. Batches
+are drawn by a pool of processes, each from its own seed spawned from `random_state`, so the
+intervals do not depend on the number of processes.
+"""
+import concurrent.futures
+import logging.config
+import os
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from src import streaming_metrics
+
+logger = logging.getLogger(__name__)
+
+METRICS = ["auc", "accuracy", "precision", "recall"]
+
+METHODS = ["multinomial", "poisson"]
+
+# largest number of distinct rows resampled, beyond it the probabilities are rounded to as many
+# bins as the streamed metrics, fine enough for the rounding not to bias the AUC
+DEFAULT_MAX_GROUPS = 4 * streaming_metrics.DEFAULT_N_BINS
+
+# largest number of counts drawn at a time by a worker, as a (replicates, groups) matrix
+MAX_BATCH_CELLS = 1 << 24
+
+
+def group_rows(y_test: Any, ypred_proba_test: Any, ypred_bin_test: Any,
+               n_bins: Optional[int] = None) -> Dict[str, np.ndarray]:
+    """ Counts of the distinct (predicted probability, actual class, predicted class) rows
+
+    Args:
+        y_test (array-like): actual test target, 0 or 1
+        ypred_proba_test (array-like): predicted probability of the positive class
+        ypred_bin_test (array-like): predicted class, 0 or 1
+        n_bins (`int`, optional): number of equal-width bins the probabilities are rounded
+            down to, which only changes the AUC of pairs of rows in the same bin; exact
+            probabilities if None
+
+    Returns:
+        groups (`dict`): arrays "score" (index of the probability among the distinct ones),
+            "actual", "predicted" and "count", one value per group, sorted by score
+    """
+    actual = np.asarray(y_test, dtype=np.float64).ravel()
+    predicted = np.asarray(ypred_bin_test, dtype=np.float64).ravel()
+    proba = np.asarray(ypred_proba_test, dtype=np.float64).ravel()
+    if not len(actual) == len(predicted) == len(proba):
+        logger.error("Target and predictions should have the same length")
+        raise ValueError("Target and predictions should have the same length")
+    if not np.all(np.isin(actual, [0, 1]) & np.isin(predicted, [0, 1])):
+        logger.error("Actual and predicted classes should be 0 or 1")
+        raise ValueError("Actual and predicted classes should be 0 or 1")
+
+    if n_bins is not None:
+        proba = np.floor(np.clip(proba, 0, 1) * n_bins)
+    _, score = np.unique(proba, return_inverse=True)
+    keys, count = np.unique(4 * score.ravel() + 2 * actual.astype(np.int64)
+                            + predicted.astype(np.int64), return_counts=True)
+    return {"score": keys // 4, "actual": (keys // 2) % 2, "predicted": keys % 2,
+            "count": count}
+
+
+def replicate_metrics(groups: Dict[str, np.ndarray], counts: np.ndarray) -> np.ndarray:
+    """ Metrics of the test sets made of `counts` copies of every group
+
+    Args:
+        groups (`dict`): groups returned by `group_rows`
+        counts (:obj:`numpy.ndarray`): number of copies of every group in every replicate,
+            shape (n_replicates, n_groups)
+
+    Returns:
+        metrics (:obj:`numpy.ndarray`): AUC, accuracy, precision and recall of every
+            replicate, shape (n_replicates, 4), NaN where a metric is undefined
+    """
+    counts = counts.astype(np.float64)
+    positive = groups["actual"] == 1
+    predicted_positive = groups["predicted"] == 1
+
+    # groups are sorted by score, so the groups of a score are contiguous
+    starts = np.flatnonzero(np.diff(groups["score"], prepend=-1))
+    negatives = np.add.reduceat(counts * ~positive, starts, axis=1)
+    positives = np.add.reduceat(counts * positive, starts, axis=1)
+    negatives_below = np.cumsum(negatives, axis=1) - negatives
+    n_pairs = positives.sum(axis=1) * negatives.sum(axis=1)
+
+    true_positive = counts[:, positive & predicted_positive].sum(axis=1)
+    correct = counts[:, positive == predicted_positive].sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        auc = ((positives * negatives_below).sum(axis=1)
+               + 0.5 * (positives * negatives).sum(axis=1)) / n_pairs
+        precision = true_positive / counts[:, predicted_positive].sum(axis=1)
+        recall = true_positive / counts[:, positive].sum(axis=1)
+    return np.stack([auc, correct / counts.sum(axis=1), precision, recall], axis=1)
+
+
+def _replicate_batch(groups: Dict[str, np.ndarray], n_replicates: int, method: str,
+                     seed: np.random.SeedSequence) -> np.ndarray:
+    """ Metrics of `n_replicates` bootstrap replicates drawn from `seed` """
+    rng = np.random.default_rng(seed)
+    if method == "poisson":
+        counts = rng.poisson(groups["count"], size=(n_replicates, len(groups["count"])))
+    else:
+        total = groups["count"].sum()
+        counts = rng.multinomial(total, groups["count"] / total, size=n_replicates)
+    return replicate_metrics(groups, counts)
+
+
+def bootstrap_intervals(y_test: Any, ypred_proba_test: Any, ypred_bin_test: Any,
+                        n_replicates: int = 1000, confidence: float = 0.95,
+                        method: str = "multinomial", batch_size: int = 250,
+                        n_workers: Optional[int] = None, random_state: int = 42,
+                        max_groups: int = DEFAULT_MAX_GROUPS
+                        ) -> Dict[str, Tuple[float, float, float]]:
+    """ Point estimates and percentile bootstrap confidence intervals of the test metrics
+
+    With the "multinomial" method, every replicate has as many rows as the test set. With
+    the "poisson" method, every distinct row is copied a Poisson number of times instead,
+    which is faster to draw and gives practically the same intervals on large test sets.
+
+    Args:
+        y_test (array-like): actual test target, 0 or 1
+        ypred_proba_test (array-like): predicted probability of the positive class
+        ypred_bin_test (array-like): predicted class, 0 or 1
+        n_replicates (`int`): number of bootstrap replicates
+        confidence (`float`): confidence level of the intervals, in (0, 1)
+        method (`str`): "multinomial" or "poisson" resampling
+        batch_size (`int`): number of replicates drawn at a time by a worker, fewer if
+            they would draw more than `MAX_BATCH_CELLS` counts
+        n_workers (`int`, optional): number of worker processes, all CPUs if None
+        random_state (`int`): seed of the replicates
+        max_groups (`int`): largest number of distinct rows resampled; beyond it, the
+            probabilities are rounded to `max_groups // 4` bins, for the point estimates as
+            well as for the replicates
+
+    Returns:
+        intervals (`dict`): (estimate, lower bound, upper bound) of every metric of `METRICS`
+    """
+    if n_replicates <= 0 or batch_size <= 0:
+        logger.error("n_replicates and batch_size have to be greater than 0")
+        raise ValueError("n_replicates and batch_size have to be greater than 0")
+    if method not in METHODS:
+        logger.error("Unknown bootstrap method %s", method)
+        raise ValueError(f"Unknown bootstrap method {method!r}, expected one of {METHODS}")
+    if not 0 < confidence < 1:
+        logger.error("confidence has to be between 0 and 1")
+        raise ValueError("confidence has to be between 0 and 1")
+
+    groups = group_rows(y_test, ypred_proba_test, ypred_bin_test)
+    if len(groups["count"]) > max_groups:
+        logger.info("%d distinct rows, rounding the probabilities to %d bins",
+                    len(groups["count"]), max_groups // 4)
+        groups = group_rows(y_test, ypred_proba_test, ypred_bin_test, n_bins=max_groups // 4)
+    # estimated from the same groups as the replicates, so rounding cannot shift the
+    # intervals away from their estimate
+    estimates = replicate_metrics(groups, groups["count"][np.newaxis])[0]
+    batch_size = max(1, min(batch_size, MAX_BATCH_CELLS // len(groups["count"])))
+    sizes = [min(batch_size, n_replicates - start)
+             for start in range(0, n_replicates, batch_size)]
+    seeds = np.random.SeedSequence(random_state).spawn(len(sizes))
+    logger.info("Drawing %d bootstrap replicates of %d distinct rows in %d batches",
+                n_replicates, len(groups["count"]), len(sizes))
+
+    if n_workers == 1 or len(sizes) == 1:
+        batches = [_replicate_batch(groups, size, method, seed)
+                   for size, seed in zip(sizes, seeds)]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(n_workers or os.cpu_count(), len(sizes))) as pool:
+            batches = list(pool.map(_replicate_batch, [groups] * len(sizes), sizes,
+                                    [method] * len(sizes), seeds))
+    replicates = np.concatenate(batches)
+
+    tails = 100 * np.array([(1 - confidence) / 2, (1 + confidence) / 2])
+    bounds = np.nanpercentile(replicates, tails, axis=0)
+    return {metric: (float(estimates[i]), float(bounds[0, i]), float(bounds[1, i]))
+            for i, metric in enumerate(METRICS)}
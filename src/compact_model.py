@@ -0,0 +1,408 @@
+"""
+This module is to compact a fitted random forest after training, into a smaller and faster
+model in the compact format of `src.model_format`.
+
+Three steps shrink the flattened trees:
+
+    merging     an internal node whose two leaves predict the same probabilities is replaced
+                by one leaf, which changes no prediction
+    pruning     internal nodes whose two children are leaves are replaced by one leaf with the
+                probabilities of both, weighted by their training samples, cheapest first,
+                as long as the predicted probabilities of no validation sample move by more
+                than `tolerance` in total
+    precision   thresholds are rounded down to float32, which changes no prediction since
+                samples are compared as float32, leaf probabilities are stored in float16 (or
+                float32) and features and children in the narrowest integer type that fits
+
+The compacted model is saved as a .forest directory and scored with the flat engine, and a
+report compares its size, scoring latency and test AUC with the fitted model.
+"""
+import heapq
+import logging.config
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from src import artifact_io, dtype_schema, index_split, model_format
+
+logger = logging.getLogger(__name__)
+
+VALUE_DTYPES = ["float16", "float32", "float64"]
+
+
+def _index_dtype(n_values: int) -> type:
+    """ Narrowest signed integer type holding the values -n_values to n_values """
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_values <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def round_down_float32(threshold: np.ndarray) -> np.ndarray:
+    """ Largest float32 at most every threshold
+
+    A float32 sample is at most a threshold if and only if it is at most the rounded
+    threshold, so rounding down changes no split.
+
+    Args:
+        threshold (:obj:`numpy.ndarray`): float64 thresholds
+
+    Returns:
+        threshold (:obj:`numpy.ndarray`): float32 thresholds
+    """
+    rounded = threshold.astype(np.float32)
+    above = rounded.astype(np.float64) > threshold
+    rounded[above] = np.nextafter(rounded[above], np.float32(-np.inf))
+    return rounded
+
+
+def narrow_arrays(arrays: Dict[str, np.ndarray], n_features: int,
+                  value_dtype: str = "float16") -> Dict[str, np.ndarray]:
+    """ Store node arrays with reduced precision
+
+    Args:
+        arrays (`dict`): node arrays keyed by the names in `model_format.ARRAYS`
+        n_features (`int`): number of features of the model
+        value_dtype (`str`): dtype of the leaf probabilities, one of `VALUE_DTYPES`
+
+    Returns:
+        arrays (`dict`): node arrays with float32 thresholds, `value_dtype` probabilities and
+            the narrowest integer features and children
+    """
+    if value_dtype not in VALUE_DTYPES:
+        logger.error("Unknown dtype %s of the leaf probabilities", value_dtype)
+        raise ValueError(f"Unknown dtype {value_dtype!r} of the leaf probabilities, "
+                         f"expected one of {VALUE_DTYPES}")
+    child_dtype = _index_dtype(max(len(arrays["left"]), len(arrays["value"])))
+    return {"feature": arrays["feature"].astype(_index_dtype(n_features)),
+            "threshold": round_down_float32(arrays["threshold"]),
+            "left": arrays["left"].astype(child_dtype),
+            "right": arrays["right"].astype(child_dtype),
+            "value": arrays["value"].astype(value_dtype),
+            "roots": arrays["roots"].astype(child_dtype)}
+
+
+def _samples_by_leaf(forest: model_format.CompactForest,
+                     x_validation: Optional[pd.DataFrame]) -> Dict[int, np.ndarray]:
+    """ Validation samples reaching every leaf reached by at least one of them """
+    if x_validation is None or len(x_validation) == 0:
+        return {}
+    leaves = forest.apply(x_validation).ravel()
+    samples = np.tile(np.arange(len(x_validation)), len(forest.roots))
+    order = np.argsort(leaves, kind="stable")
+    reached, starts = np.unique(leaves[order], return_index=True)
+    return dict(zip(reached.tolist(), np.split(samples[order], starts[1:])))
+
+
+def prune_arrays(arrays: Dict[str, np.ndarray], weight: np.ndarray,
+                 samples: Dict[int, np.ndarray], n_samples: int, tolerance: float = 0.0,
+                 value_dtype: str = "float64") -> Tuple[Dict[str, np.ndarray], Dict[str, int]]:
+    """ Merge sibling leaves with the same probabilities and prune nodes within a tolerance
+
+    Args:
+        arrays (`dict`): node arrays keyed by the names in `model_format.ARRAYS`
+        weight (:obj:`numpy.ndarray`): weighted number of training samples of every leaf
+        samples (`dict`): validation samples reaching every leaf, keyed by leaf index
+        n_samples (`int`): number of validation samples
+        tolerance (`float`): largest total change of the predicted probabilities of a
+            validation sample, 0 to only merge leaves with the same probabilities
+        value_dtype (`str`): dtype the probabilities are stored in, leaves with the same
+            probabilities in that dtype are merged
+
+    Returns:
+        arrays (`dict`): node arrays of the pruned forest
+        counts (`dict`): number of "merged" and "pruned" nodes
+    """
+    left, right = arrays["left"].astype(np.int64), arrays["right"].astype(np.int64)
+    roots = arrays["roots"].astype(np.int64)
+    value, weight = arrays["value"].astype(np.float64), weight.astype(np.float64)
+    stored = value.astype(value_dtype)
+    n_trees, n_internal = len(roots), len(left)
+    samples = dict(samples)
+    empty = np.empty(0, dtype=np.int64)
+
+    # parent of every internal node, -1 for roots, and tree of every root
+    parent = np.full(n_internal, -1, dtype=np.int64)
+    parent[left[left >= 0]] = np.flatnonzero(left >= 0)
+    parent[right[right >= 0]] = np.flatnonzero(right >= 0)
+    tree_of_root = {int(root): tree for tree, root in enumerate(roots) if root >= 0}
+
+    # total change of the predicted probabilities of every validation sample
+    drift = np.zeros((n_samples, value.shape[1]))
+    reached = np.zeros(len(value), dtype=bool)
+    reached[list(samples)] = True
+
+    def merge(first: np.ndarray, second: np.ndarray) -> np.ndarray:
+        """ Probabilities of the leaf replacing two leaves, weighted by their samples """
+        total = (weight[first] + weight[second])[..., np.newaxis]
+        return (value[first] * weight[first][..., np.newaxis]
+                + value[second] * weight[second][..., np.newaxis]) / total
+
+    def candidates(nodes: np.ndarray) -> List[Tuple[float, int]]:
+        """ Cost of replacing nodes whose two children are leaves by a leaf """
+        nodes = nodes[(left[nodes] < 0) & (right[nodes] < 0)]
+        first, second = -left[nodes] - 1, -right[nodes] - 1
+        same = (stored[first] == stored[second]).all(axis=1)
+        merged = merge(first, second)
+        cost = np.maximum(np.abs(merged - value[first]),
+                          np.abs(merged - value[second])).max(axis=1) / n_trees
+        # leaves no validation sample reaches are only merged without any change
+        prunable = ~same & reached[first] & reached[second] & (tolerance > 0.0)
+        return list(zip(np.where(same, 0.0, cost)[same | prunable].tolist(),
+                        nodes[same | prunable].tolist()))
+
+    heap = candidates(np.arange(n_internal))
+    heapq.heapify(heap)
+    removed_internal = np.zeros(n_internal, dtype=bool)
+    removed_leaf = np.zeros(len(value), dtype=bool)
+    counts = {"merged": 0, "pruned": 0}
+    while heap:
+        cost, node = heapq.heappop(heap)
+        first, second = -left[node] - 1, -right[node] - 1
+        if cost == 0.0:
+            merged = value[first]
+            counts["merged"] += 1
+        else:
+            merged = merge(first, second)
+            # a sample reaches only one of the two leaves of a tree
+            updated = [drift[samples[leaf]] + (merged - value[leaf]) / n_trees
+                       for leaf in (first, second)]
+            if max(np.abs(change).max() for change in updated) > tolerance:
+                continue
+            drift[samples[first]], drift[samples[second]] = updated
+            counts["pruned"] += 1
+
+        # the node becomes its first leaf, holding the samples and weight of both
+        value[first], stored[first] = merged, merged.astype(value_dtype)
+        weight[first] += weight[second]
+        if reached[second]:
+            samples[first] = np.concatenate([samples.get(first, empty), samples.pop(second)])
+            reached[first] = True
+        removed_internal[node], removed_leaf[second] = True, True
+        reference = -(first + 1)
+        above = parent[node]
+        if above < 0:
+            roots[tree_of_root[node]] = reference
+            continue
+        if left[above] == node:
+            left[above] = reference
+        else:
+            right[above] = reference
+        for item in candidates(np.array([above])):
+            heapq.heappush(heap, item)
+
+    # renumber the remaining nodes and leaves, keeping their order
+    new_internal = np.cumsum(~removed_internal) - 1
+    new_leaf = np.cumsum(~removed_leaf) - 1
+
+    def renumber(reference: np.ndarray) -> np.ndarray:
+        """ References to the renumbered nodes and leaves """
+        return np.where(reference >= 0, new_internal[np.maximum(reference, 0)],
+                        -new_leaf[np.maximum(-reference - 1, 0)] - 1)
+
+    kept = ~removed_internal
+    return ({"feature": arrays["feature"][kept], "threshold": arrays["threshold"][kept],
+             "left": renumber(left[kept]), "right": renumber(right[kept]),
+             "value": value[~removed_leaf], "roots": renumber(roots)}, counts)
+
+
+def compact_forest(model: Any, x_validation: Optional[pd.DataFrame] = None,
+                   tolerance: float = 0.0, value_dtype: str = "float16"
+                   ) -> model_format.CompactForest:
+    """ Compact a fitted random forest classifier
+
+    Args:
+        model (:obj:`sklearn.ensemble.RandomForestClassifier`): fitted classifier
+        x_validation (:obj:`pandas.DataFrame`, optional): validation samples with the
+            features of the model, bounding the change of their predictions
+        tolerance (`float`): largest total change of the predicted probabilities of a
+            validation sample, 0 to only merge leaves with the same probabilities
+        value_dtype (`str`): dtype of the leaf probabilities, one of `VALUE_DTYPES`
+
+    Returns:
+        model (:obj:`model_format.CompactForest`): compacted model, with the number of
+            "merged" and "pruned" nodes under "compaction" in its meta
+    """
+    if value_dtype not in VALUE_DTYPES:
+        logger.error("Unknown dtype %s of the leaf probabilities", value_dtype)
+        raise ValueError(f"Unknown dtype {value_dtype!r} of the leaf probabilities, "
+                         f"expected one of {VALUE_DTYPES}")
+    if tolerance < 0:
+        logger.error("The tolerance has to be at least 0")
+        raise ValueError("The tolerance has to be at least 0")
+    arrays, meta = model_format.to_arrays(model)
+    forest = model_format.CompactForest(arrays, meta)
+
+    # training samples of every leaf, in the order of `model_format.to_arrays`
+    weight = np.concatenate([estimator.tree_.weighted_n_node_samples[
+        estimator.tree_.children_left == -1] for estimator in model.estimators_])
+    samples = _samples_by_leaf(forest, x_validation)
+    pruned, counts = prune_arrays(arrays, weight, samples,
+                                  len(x_validation) if x_validation is not None else 0,
+                                  tolerance, value_dtype)
+
+    meta = dict(meta, n_internal_nodes=len(pruned["left"]), n_leaves=len(pruned["value"]),
+                compaction=dict(counts, tolerance=tolerance, value_dtype=value_dtype))
+    logger.info("Merged %d and pruned %d of %d nodes", counts["merged"], counts["pruned"],
+                len(arrays["left"]))
+    return model_format.CompactForest(narrow_arrays(pruned, meta["n_features"], value_dtype),
+                                      meta)
+
+
+def _latency(model: Any, x_test: pd.DataFrame, repeat: int = 3) -> float:
+    """ Best wall time in seconds of predicting the test samples """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        model.predict_proba(x_test)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def compaction_report(models: Dict[str, Any], sizes: Dict[str, int], x_test: pd.DataFrame,
+                      y_test: np.ndarray) -> List[Dict[str, Any]]:
+    """ Size, scoring latency and test AUC of models
+
+    Args:
+        models (`dict`): models keyed by name, the first one being the reference
+        sizes (`dict`): size in bytes of every model, keyed by name
+        x_test (:obj:`pandas.DataFrame`): test data for features
+        y_test (:obj:`numpy.ndarray`): test target
+
+    Returns:
+        rows (:obj:`list` of `dict`): "model", "size", "latency", "auc" and the largest change
+            "max_change" of the predicted probability of a test sample from the reference
+    """
+    # imported here, so loading this module does not import scikit-learn metrics
+    from sklearn.metrics import roc_auc_score
+
+    rows, reference = [], None
+    for name, model in models.items():
+        proba = model.predict_proba(x_test)[:, 1].astype(np.float64)
+        reference = proba if reference is None else reference
+        rows.append({"model": name, "size": sizes[name], "latency": _latency(model, x_test),
+                     "auc": roc_auc_score(y_test, proba),
+                     "max_change": float(np.abs(proba - reference).max())})
+    return rows
+
+
+def format_report(rows: List[Dict[str, Any]], meta: Dict[str, Any], n_test: int) -> str:
+    """ Report of `compaction_report` as text
+
+    Args:
+        rows (:obj:`list` of `dict`): rows returned by `compaction_report`
+        meta (`dict`): meta of the compacted model
+        n_test (`int`): number of test samples
+
+    Returns:
+        report (`str`): one line per model and the number of merged and pruned nodes
+    """
+    compaction = meta["compaction"]
+    lines = [f"Merged {compaction['merged']} and pruned {compaction['pruned']} nodes "
+             f"(tolerance {compaction['tolerance']}, {compaction['value_dtype']} leaves), "
+             f"{meta['n_internal_nodes']} nodes and {meta['n_leaves']} leaves left",
+             f"{'model':>10} {'size (KB)':>10} {'latency (ms)':>13} {'AUC':>7} "
+             f"{'max change':>11}   on {n_test} test rows"]
+    lines.extend(f"{row['model']:>10} {row['size'] / 1024:10.1f} {row['latency'] * 1000:13.2f} "
+                 f"{row['auc']:7.4f} {row['max_change']:11.2e}" for row in rows)
+    return "\n".join(lines)
+
+
+def compact(input_path: str, validation_path: str, x_test_path: str, y_test_path: str,
+            initial_features: List[str], output_path: str, report_path: str,
+            tolerance: float = 0.0, value_dtype: str = "float16",
+            dtypes: Optional[Dict[str, str]] = None, split_path: Optional[str] = None,
+            fold: Optional[int] = None) -> None:
+    """ Compact a fitted random forest and report its size, latency and AUC before and after
+
+    Args:
+        input_path (`str`): path to the fitted classifier (joblib)
+        validation_path (`str`): path to features bounding the change of the predictions,
+            like the training data (csv, parquet, feather or npcols)
+        x_test_path (`str`): path to test data for features (csv, parquet, feather or npcols)
+        y_test_path (`str`): path to test data for target (csv, parquet, feather or npcols)
+        initial_features (:obj:`list` of `str`): list of column names
+        output_path (`str`): path to save the compacted model (.forest)
+        report_path (`str`): path to save the report (txt)
+        tolerance (`float`): largest total change of the predicted probabilities of a
+            validation sample, 0 to only merge leaves with the same probabilities
+        value_dtype (`str`): dtype of the leaf probabilities, one of `VALUE_DTYPES`
+        dtypes (`dict`, optional): dtype schema the data are downcast to while they are read
+            (see `src.dtype_schema`), dtypes of the files if None
+        split_path (`str`, optional): path to an index split (npz) to read the training rows
+            as validation samples and the test rows from, instead of `validation_path`,
+            `x_test_path` and `y_test_path` (see `src.index_split`)
+        fold (`int`, optional): fold of the test rows, for splits with folds
+
+    Returns:
+        None
+    """
+    try:
+        model = joblib.load(input_path)
+    except FileNotFoundError:
+        logger.error("Cannot find the given model file")
+        sys.exit(1)
+
+    logger.info("Loading validation and test data for compacting the model")
+    schema = dtype_schema.resolve(dtypes)
+    read_dtypes = dtype_schema.read_dtypes(schema)
+    try:
+        if split_path is None:
+            x_validation = artifact_io.read_table(validation_path, columns=initial_features,
+                                                  dtype=read_dtypes)
+            x_test = artifact_io.read_table(x_test_path, columns=initial_features,
+                                            dtype=read_dtypes)
+            y_test = artifact_io.read_table(y_test_path)
+        else:
+            x_validation = index_split.read_rows(split_path, "train", "feature",
+                                                 columns=initial_features, dtype=read_dtypes,
+                                                 fold=fold)
+            x_test = index_split.read_rows(split_path, "test", "feature",
+                                           columns=initial_features, dtype=read_dtypes,
+                                           fold=fold)
+            y_test = index_split.read_rows(split_path, "test", "target", fold=fold)
+    except FileNotFoundError as error:
+        logger.error("No such file or directory to load %s. Please try again.", error.filename)
+        sys.exit(1)
+    except KeyError:
+        logger.error("Provided `Initial_features` are not all in provided data")
+        sys.exit(1)
+    except ValueError as error:
+        logger.error("Cannot read the rows of the split: %s", error)
+        sys.exit(1)
+
+    x_validation = dtype_schema.feature_frame(x_validation, initial_features)
+    x_test = dtype_schema.feature_frame(x_test, initial_features)
+    try:
+        compacted = compact_forest(model, x_validation, tolerance, value_dtype)
+    except TypeError:
+        logger.error("Only fitted random forest classifiers can be compacted")
+        sys.exit(1)
+    try:
+        model_format.save_arrays({name: getattr(compacted, name)
+                                  for name in model_format.ARRAYS}, compacted.meta, output_path)
+    except FileNotFoundError:
+        logger.error("No such file or directory to save the compacted model. Please try again.")
+        sys.exit(1)
+
+    flat = model_format.to_compact(model)
+    models = {"fitted": model, "flat": flat,
+              "compacted": model_format.load_compact_model(output_path)}
+    # the fitted model as pickled, the flattened models as node arrays
+    sizes = {"fitted": os.path.getsize(input_path),
+             "flat": sum(getattr(flat, name).nbytes for name in model_format.ARRAYS),
+             "compacted": sum(getattr(compacted, name).nbytes for name in model_format.ARRAYS)}
+    report = format_report(compaction_report(models, sizes, x_test, y_test.to_numpy().ravel()),
+                           compacted.meta, len(x_test))
+    logger.info("Compaction report:\n%s", report)
+    try:
+        with open(report_path, "w", encoding="ASCII") as report_file:
+            report_file.write(report + "\n")
+    except FileNotFoundError:
+        logger.error("No such file or directory to save the report. Please try again.")
+        sys.exit(1)
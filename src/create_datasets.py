@@ -1,106 +1,340 @@
 """ This module is to acquire raw data and construct dataset for clouds """
+from __future__ import annotations
+
 import logging.config
-from typing import List
+from typing import TYPE_CHECKING, Any, BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
 import sys
 
 import requests
-import pandas as pd
-import numpy as np
+
+from src import download, instrumentation
+
+if TYPE_CHECKING:
+    # numpy, pandas and the parser are only imported when clouds are built, so acquiring raw
+    # data starts faster
+    import numpy as np
+    import pandas as pd
+
+    from src import parse_raw_data
 
 logger = logging.getLogger(__name__)
 
 
-def acquire_raw_data(input_path: str, output_path: str) -> None:
+def acquire_raw_data(input_path: Union[str, List[str]], output_path: Union[str, List[str]],
+                     cache_dir: str = download.DEFAULT_CACHE_DIR,
+                     sha256: Optional[Union[str, List[str]]] = None,
+                     chunk_size: int = download.DEFAULT_CHUNK_SIZE, max_retries: int = 3,
+                     backoff: float = 1.0, timeout: float = 30.0,
+                     n_workers: Optional[int] = None) -> None:
     """ Acquire raw data from input path and save it to given output path
 
+    Downloads are streamed, resumed after an interruption, checked and kept in a local cache,
+    so an unchanged source is not downloaded again (see `src.download`).
+
         Args:
-            input_path (`str`): path to acquire data
-            output_path (`str`): path to save acquired data
+            input_path (`str` or :obj:`list` of `str`): path to acquire data, or several paths
+                downloaded concurrently
+            output_path (`str` or :obj:`list` of `str`): path to save acquired data, one per
+                input path
+            cache_dir (`str`): directory of the download cache
+            sha256 (`str` or :obj:`list` of `str`, optional): expected SHA-256 of the data,
+                one per input path, not checked if None
+            chunk_size (`int`): number of bytes written at a time
+            max_retries (`int`): number of times an interrupted download is resumed
+            backoff (`float`): seconds to wait before the first retry, doubled at every retry
+            timeout (`float`): seconds to wait for the server to send data
+            n_workers (`int`, optional): number of concurrent downloads, one per path if None
 
         Returns:
             None
     """
     logger.info("Acquiring raw data")
+    input_paths = [input_path] if isinstance(input_path, str) else list(input_path)
+    output_paths = [output_path] if isinstance(output_path, str) else list(output_path)
 
-    # acquire raw data
+    # acquire raw data and save it to given output path
     try:
-        raw_data = requests.get(input_path)
-    except requests.ConnectionError:
-        logger.error("There is a connection error.")
-        sys.exit(1)
+        entries = download.fetch_all(input_paths, output_paths, n_workers=n_workers,
+                                     cache_dir=cache_dir, sha256=sha256, chunk_size=chunk_size,
+                                     max_retries=max_retries, backoff=backoff, timeout=timeout)
     except (requests.exceptions.MissingSchema, requests.exceptions.InvalidURL):
         logger.error("Either the request schema http/https is missing or the URL is malformed.")
         sys.exit(1)
+    except (requests.ConnectionError, requests.Timeout,
+            requests.exceptions.ChunkedEncodingError):
+        logger.error("There is a connection error.")
+        sys.exit(1)
+    except requests.HTTPError as error:
+        logger.error("The raw data cannot be acquired: %s", error)
+        sys.exit(1)
+    except download.IntegrityError as error:
+        logger.error("The acquired raw data is corrupted: %s", error)
+        sys.exit(1)
+    except FileNotFoundError:
+        logger.error("No such file or directory to save raw data. Please try again.")
+        sys.exit(1)
+    except ValueError:
+        logger.error("Provided input_path and output_path should have the same length.")
+        sys.exit(1)
 
-    logger.info("Raw data is successfully acquired")
+    logger.info("Raw data is successfully saved in given output path (%d of %d from the cache).",
+                sum(entry["cached"] for entry in entries), len(entries))
+
+
+def _segments(first_cloud: Optional[List[int]], second_cloud: Optional[List[int]],
+              segments: Optional[List[Dict[str, Any]]]) -> Tuple[List[Any], List[Any]]:
+    """ Line ranges and class labels of the segments to extract from raw data """
+    if segments is None:
+        # first cloud is labeled as 0 and second cloud is labeled as 1
+        return [first_cloud, second_cloud], [0, 1]
 
-    # save data to given output path
     try:
-        with open(output_path, "wb") as output_file:
-            output_file.write(raw_data.content)
-    except FileNotFoundError:
-        logger.error("No such file or directory to save raw data. Please try again.")
+        return ([segment["lines"] for segment in segments],
+                [segment.get("label", position) for position, segment in enumerate(segments)])
+    except (TypeError, KeyError, AttributeError):
+        logger.error("Provided segments should be a list like "
+                     "[{'lines': [first_index, second_index], 'label': 0}, ...]")
         sys.exit(1)
 
-    logger.info("Raw data is successfully saved in given output path.")
 
+def _label_blocks(blocks: Iterator[Tuple[int, np.ndarray]], columns: List[str],
+                  labels: List[Any], dtypes: Optional[Dict[str, str]]) -> Iterator[pd.DataFrame]:
+    """ Turn the parsed blocks of the segments into dataframes with their `class` label """
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+    import pandas as pd
+    from src import dtype_schema
+
+    schema = dtype_schema.resolve(dtypes) or dtype_schema.DtypeSchema(np.dtype(np.float64),
+                                                                       np.dtype(np.float64))
+    try:
+        for position, block in blocks:
+            cloud = pd.DataFrame(block.astype(schema.features, copy=False), columns=columns)
+            cloud["class"] = np.full(len(cloud), labels[position], dtype=schema.target)
+            yield cloud
+    except TypeError:
+        logger.error("Provided first_cloud and second_cloud (or segment lines) should be lists "
+                     "of two integers. Please try again.")
+        sys.exit(1)
+    except ValueError as error:
+        logger.error("Cannot parse clouds from raw data: %s", error)
+        sys.exit(1)
+
+
+def iter_clouds(input_file: BinaryIO, columns: List[str], first_cloud: Optional[List[int]],
+                second_cloud: Optional[List[int]],
+                chunk_size: Optional[int] = None,
+                dtypes: Optional[Dict[str, str]] = None,
+                segments: Optional[List[Dict[str, Any]]] = None) -> Iterator[pd.DataFrame]:
+    """ Stream labeled chunks of the two clouds out of an open raw data file
+
+    Args:
+        input_file (:obj:`BinaryIO`): raw data file opened in binary mode
+        columns (:obj:`list` of `str`): list of column names in clouds
+        first_cloud(`list` of `int`): list like [first_index, second_index] to slice first cloud
+        second_cloud(`list` of `int`): list like [first_index, second_index] to slice second cloud
+        chunk_size (`int`, optional): number of bytes to read from the raw file at a time,
+            `parse_raw_data.DEFAULT_CHUNK_SIZE` if None
+        dtypes (`dict`, optional): dtype schema of the clouds (see `src.dtype_schema`),
+            float64 if None
+        segments (:obj:`list` of `dict`, optional): segments to extract instead of the two
+            clouds, like [{"lines": [first_index, second_index], "label": 0}, ...] in
+            ascending order, labeled by their position if "label" is missing
+
+    Yields:
+        cloud (:obj:`pandas.DataFrame`): chunk of rows of one cloud with its `class` label
+    """
+    # pylint: disable=import-outside-toplevel
+    from src import parse_raw_data
+
+    bounds, labels = _segments(first_cloud, second_cloud, segments)
+    yield from _label_blocks(parse_raw_data.iter_segment_blocks(
+        input_file, bounds, len(columns), chunk_size or parse_raw_data.DEFAULT_CHUNK_SIZE),
+        columns, labels, dtypes)
 
-def get_clouds(input_path: str, columns: List[str], first_cloud: List[int], second_cloud: List[int],
-               output_path: str) -> None:
-    """ Obtain cloud from raw data
+
+def iter_indexed_clouds(input_path: str, columns: List[str], first_cloud: Optional[List[int]],
+                        second_cloud: Optional[List[int]], line_index: parse_raw_data.LineIndex,
+                        chunk_size: Optional[int] = None,
+                        dtypes: Optional[Dict[str, str]] = None,
+                        segments: Optional[List[Dict[str, Any]]] = None,
+                        n_workers: Optional[int] = None) -> Iterator[pd.DataFrame]:
+    """ Read labeled chunks of the clouds directly at their byte offsets in a raw data file
+
+    Only the bytes of the clouds are read, and they are parsed by a pool of processes (see
+    `parse_raw_data.iter_indexed_blocks`), so segments can also be in any order.
 
     Args:
         input_path (`str`): path to acquire clouds
         columns (:obj:`list` of `str`): list of column names in clouds
         first_cloud(`list` of `int`): list like [first_index, second_index] to slice first cloud
         second_cloud(`list` of `int`): list like [first_index, second_index] to slice second cloud
-        output_path (`str`): path to save acquired data (csv)
+        line_index (:obj:`parse_raw_data.LineIndex`): line index of the raw file
+        chunk_size (`int`, optional): number of bytes parsed at a time by a worker,
+            `parse_raw_data.DEFAULT_CHUNK_SIZE` if None
+        dtypes (`dict`, optional): dtype schema of the clouds (see `src.dtype_schema`),
+            float64 if None
+        segments (:obj:`list` of `dict`, optional): segments to extract instead of the two
+            clouds, see `iter_clouds`
+        n_workers (`int`, optional): number of worker processes, all CPUs if None
 
-    Returns:
-       None
+    Yields:
+        cloud (:obj:`pandas.DataFrame`): chunk of rows of one cloud with its `class` label
     """
-    # read raw data
+    # pylint: disable=import-outside-toplevel
+    from src import parse_raw_data
+
+    bounds, labels = _segments(first_cloud, second_cloud, segments)
+    yield from _label_blocks(parse_raw_data.iter_indexed_blocks(
+        input_path, bounds, len(columns), line_index,
+        chunk_size or parse_raw_data.DEFAULT_CHUNK_SIZE, n_workers), columns, labels, dtypes)
+
+
+def _open_raw_data(input_path: str, index: Optional[Dict[str, Any]]
+                   ) -> Tuple[BinaryIO, Optional[parse_raw_data.LineIndex]]:
+    """ Open a raw data file and load its line index if `index` configures one """
+    # pylint: disable=import-outside-toplevel
+    from src import parse_raw_data
+
     logger.info("Loading raw data")
     try:
-        with open(input_path, mode="r", encoding="ASCII") as input_file:
-            data = [[s for s in line.split(" ") if s != ""] for line in input_file.readlines()]
+        input_file = open(input_path, mode="rb")
+        line_index = None if index is None else parse_raw_data.load_index(input_path, **index)
     except FileNotFoundError:
         logger.error("No such file or directory to load raw data. Please try again.")
         sys.exit(1)
 
-    # get first cloud
-    logger.info("Getting first cloud")
-    try:
-        first_cloud = data[first_cloud[0]:first_cloud[1]]
-    except TypeError:
-        logger.error("Provided first_cloud should be a list of two integers. Please try again.")
-        sys.exit(1)
+    return input_file, line_index
+
+
+def load_clouds(input_path: str, columns: List[str], first_cloud: Optional[List[int]],
+                second_cloud: Optional[List[int]],
+                chunk_size: Optional[int] = None,
+                dtypes: Optional[Dict[str, str]] = None,
+                segments: Optional[List[Dict[str, Any]]] = None,
+                index: Optional[Dict[str, Any]] = None,
+                n_workers: Optional[int] = None) -> pd.DataFrame:
+    """ Obtain cloud from raw data as an in-memory dataframe
+
+    Args:
+        input_path (`str`): path to acquire clouds
+        columns (:obj:`list` of `str`): list of column names in clouds
+        first_cloud(`list` of `int`): list like [first_index, second_index] to slice first cloud
+        second_cloud(`list` of `int`): list like [first_index, second_index] to slice second cloud
+        chunk_size (`int`, optional): number of bytes to read from the raw file at a time,
+            `parse_raw_data.DEFAULT_CHUNK_SIZE` if None
+        dtypes (`dict`, optional): dtype schema of the clouds (see `src.dtype_schema`),
+            float64 if None
+        segments (:obj:`list` of `dict`, optional): segments to extract instead of the two
+            clouds, see `iter_clouds`
+        index (`dict`, optional): arguments of `parse_raw_data.load_index`, like
+            {"stride": 1024}, to read the segments directly with a sidecar line index;
+            the raw file is streamed from its start if None
+        n_workers (`int`, optional): number of worker processes parsing the segments with
+            the line index, all CPUs if None
+
+    Returns:
+        clouds_df (:obj:`pandas.DataFrame`): the concatenated clouds with their `class` label
+    """
+    # pylint: disable=import-outside-toplevel
+    import pandas as pd
+    from src import dtype_schema
+
+    input_file, line_index = _open_raw_data(input_path, index)
+
+    logger.info("Getting the labeled segments of raw data")
+    with input_file, instrumentation.span("parse_clouds") as timing:
+        if line_index is None:
+            clouds = list(iter_clouds(input_file, columns, first_cloud, second_cloud, chunk_size,
+                                      dtypes, segments))
+        else:
+            clouds = list(iter_indexed_clouds(input_path, columns, first_cloud, second_cloud,
+                                              line_index, chunk_size, dtypes, segments,
+                                              n_workers))
+        timing.rows = sum(len(cloud) for cloud in clouds)
 
-    first_cloud = [[float(s.replace("/n", "")) for s in cloud] for cloud in first_cloud]
-    first_cloud = pd.DataFrame(first_cloud, columns=columns)
-    first_cloud["class"] = np.zeros(len(first_cloud))  # first cloud is labeled as 0
+    if not clouds:
+        return dtype_schema.cast_frame(pd.DataFrame(columns=columns + ["class"], dtype=float),
+                                       dtype_schema.resolve(dtypes))
+
+    logger.info("Clouds are successfully concatenated.")
+    return pd.concat(clouds, ignore_index=True)
+
+
+def get_clouds(input_path: str, columns: List[str], first_cloud: Optional[List[int]],
+               second_cloud: Optional[List[int]], output_path: str,
+               chunk_size: Optional[int] = None,
+               dtypes: Optional[Dict[str, str]] = None,
+               segments: Optional[List[Dict[str, Any]]] = None,
+               index: Optional[Dict[str, Any]] = None, n_workers: Optional[int] = None) -> None:
+    """ Obtain cloud from raw data
+
+    The raw file is read in chunks of `chunk_size` bytes and the rows of each
+    cloud are appended to a CSV output as soon as they are parsed, so memory use
+    does not grow with the size of the raw file. Other formats are written whole
+    once the clouds are concatenated. With a line index, only the bytes of the
+    clouds are read.
+
+    Args:
+        input_path (`str`): path to acquire clouds
+        columns (:obj:`list` of `str`): list of column names in clouds
+        first_cloud(`list` of `int`): list like [first_index, second_index] to slice first cloud
+        second_cloud(`list` of `int`): list like [first_index, second_index] to slice second cloud
+        output_path (`str`): path to save acquired data (csv, parquet, feather or npcols)
+        chunk_size (`int`, optional): number of bytes to read from the raw file at a time,
+            `parse_raw_data.DEFAULT_CHUNK_SIZE` if None
+        dtypes (`dict`, optional): dtype schema of the clouds (see `src.dtype_schema`),
+            float64 if None
+        segments (:obj:`list` of `dict`, optional): segments to extract instead of the two
+            clouds, see `iter_clouds`
+        index (`dict`, optional): arguments of `parse_raw_data.load_index` to read the
+            segments with a sidecar line index, see `load_clouds`
+        n_workers (`int`, optional): number of worker processes parsing the segments with
+            the line index, all CPUs if None
+
+    Returns:
+       None
+    """
+    # pylint: disable=import-outside-toplevel
+    from src import artifact_io
 
-    # get second cloud
-    logger.info("Getting second cloud")
     try:
-        second_cloud = data[second_cloud[0]:second_cloud[1]]
-    except TypeError:
-        logger.error("Provided second_cloud should be a list of two integers. Please try again.")
+        fmt = artifact_io.get_format(output_path)
+    except ValueError as error:
+        logger.error("Cannot save cleaned clouds: %s", error)
         sys.exit(1)
+    if fmt != "csv":
+        clouds = load_clouds(input_path, columns, first_cloud, second_cloud, chunk_size, dtypes,
+                             segments, index, n_workers)
+        try:
+            artifact_io.write_table(clouds, output_path)
+        except FileNotFoundError:
+            logger.error("No such file or directory to save cleaned clouds. Please try again.")
+            sys.exit(1)
+        logger.info("Clouds are successfully saved in given output path.")
+        return
 
-    second_cloud = [[float(s.replace("/n", "")) for s in cloud]
-                    for cloud in second_cloud]
-    second_cloud = pd.DataFrame(second_cloud, columns=columns)
-    second_cloud["class"] = np.ones(len(second_cloud))  # second cloud is labeled as 1
-
-    # concatenate the two clouds
-    clouds_df = pd.concat([first_cloud, second_cloud])
+    # read raw data
+    input_file, line_index = _open_raw_data(input_path, index)
 
-    # save to output path
     try:
-        clouds_df.to_csv(output_path, index=False)
+        output_file = open(output_path, mode="w", encoding="ASCII")
     except FileNotFoundError:
+        input_file.close()
         logger.error("No such file or directory to save cleaned clouds. Please try again.")
         sys.exit(1)
 
-    logger.info("Two clouds are successfully concatenated and saved in given output path.")
+    logger.info("Getting the labeled segments of raw data")
+    with input_file, output_file, instrumentation.span("parse_clouds", rows=0) as timing:
+        if line_index is None:
+            clouds = iter_clouds(input_file, columns, first_cloud, second_cloud, chunk_size,
+                                 dtypes, segments)
+        else:
+            clouds = iter_indexed_clouds(input_path, columns, first_cloud, second_cloud,
+                                         line_index, chunk_size, dtypes, segments, n_workers)
+        output_file.write(",".join(columns + ["class"]) + "\n")
+        for cloud in clouds:
+            cloud.to_csv(output_file, index=False, header=False)
+            timing.rows += len(cloud)
+
+    logger.info("Clouds are successfully concatenated and saved in given output path.")
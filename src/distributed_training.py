@@ -0,0 +1,348 @@
+"""
+This module is to train the trees of a random forest classifier in shards on several
+worker processes or machines, and to merge them into one classifier.
+
+The coordinator splits the trees into `n_shards` shards, each with its own seed derived from
+the random state of the forest, so the merged forest only depends on the random state and the
+number of shards, not on the transport or the number of workers. The training data is saved
+once as .npy files that every worker memory-maps. The shards are sent to the workers by a
+transport:
+
+    local    a pool of worker processes on this machine (default)
+    socket   the coordinator listens on `address` and workers connect to it, started
+             with `run.py train_worker` on any machine that sees `shared_dir` at the same
+             path, or locally with `n_local_workers`
+"""
+import concurrent.futures
+import logging.config
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import secrets
+import sys
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+
+from src import shared_data
+
+logger = logging.getLogger(__name__)
+
+TRANSPORTS = ["local", "socket"]
+
+DEFAULT_ADDRESS = "127.0.0.1:6000"
+
+# environment variable holding the key workers authenticate to the coordinator with
+AUTHKEY_VARIABLE = "FOREST_AUTHKEY"
+
+# training data of one shard: paths of the shared arrays, number of trees, seed, parameters
+Shard = Tuple[Dict[str, str], int, int, Dict[str, Any]]
+
+
+def plan_shards(n_estimators: int, n_shards: int, random_state: int) -> List[Tuple[int, int]]:
+    """ Split the trees of a forest into shards with their own seeds
+
+    Args:
+        n_estimators (`int`): the number of trees in the forest
+        n_shards (`int`): the number of shards, at most `n_estimators`
+        random_state (`int`): seed of the forest
+
+    Returns:
+        shards (:obj:`list` of `tuple`): number of trees and seed of every shard
+    """
+    n_shards = min(n_shards, n_estimators)
+    sizes = [len(part) for part in np.array_split(np.arange(n_estimators), n_shards)]
+    seeds = [int(seed.generate_state(1)[0])
+             for seed in np.random.SeedSequence(random_state).spawn(n_shards)]
+    return list(zip(sizes, seeds))
+
+
+def train_shard(paths: Dict[str, str], n_trees: int, seed: int,
+                params: Dict[str, Any]) -> RandomForestClassifier:
+    """ Fit the trees of one shard on the memory-mapped training data
+
+    Args:
+        paths (`dict`): paths of the shared "x" and "y" arrays, see `shared_data.share_arrays`
+        n_trees (`int`): the number of trees of the shard
+        seed (`int`): seed of the shard
+        params (`dict`): other parameters of the `RandomForestClassifier`
+
+    Returns:
+        forest (:obj:`sklearn.ensemble.RandomForestClassifier`): forest with the trees of
+            the shard
+    """
+    data = shared_data.load_shared(paths)
+    forest = RandomForestClassifier(n_estimators=n_trees, random_state=seed, n_jobs=1, **params)
+    return forest.fit(data["x"], data["y"])
+
+
+def merge_forests(forests: List[RandomForestClassifier],
+                  feature_names: Optional[List[str]] = None) -> RandomForestClassifier:
+    """ Merge forests fitted on the same data into one forest holding all their trees
+
+    Args:
+        forests (:obj:`list` of :obj:`sklearn.ensemble.RandomForestClassifier`): forests with
+            the same classes and features, their trees are kept in this order
+        feature_names (:obj:`list` of `str`, optional): names of the features the trees were
+            fitted on, checked by scikit-learn when the merged forest predicts a dataframe
+
+    Returns:
+        forest (:obj:`sklearn.ensemble.RandomForestClassifier`): the merged forest, which
+            replaces the trees of the first forest
+    """
+    if not forests:
+        logger.error("No forest to merge")
+        raise ValueError("No forest to merge")
+    merged = forests[0]
+    for forest in forests[1:]:
+        if (not np.array_equal(forest.classes_, merged.classes_)
+                or forest.n_features_in_ != merged.n_features_in_):
+            logger.error("Forests fitted on different classes or features cannot be merged")
+            raise ValueError("Forests fitted on different classes or features cannot be merged")
+
+    merged.estimators_ = [tree for forest in forests for tree in forest.estimators_]
+    merged.set_params(n_estimators=len(merged.estimators_), n_jobs=None)
+    if feature_names is not None:
+        merged.feature_names_in_ = np.asarray(feature_names, dtype=object)
+    return merged
+
+
+def _parse_address(address: str) -> Tuple[str, int]:
+    """ Host and port of an address like "host:port" """
+    host, _, port = address.rpartition(":")
+    try:
+        return host or "127.0.0.1", int(port)
+    except ValueError:
+        logger.error("Provided address %s should be like host:port", address)
+        raise
+
+
+def _authkey(authkey: Optional[str]) -> bytes:
+    """ Key of the socket transport, from the argument or the environment """
+    authkey = authkey or os.environ.get(AUTHKEY_VARIABLE)
+    if authkey is None:
+        logger.error("Set %s to the key shared by the coordinator and its workers",
+                     AUTHKEY_VARIABLE)
+        raise ValueError(f"No authentication key, set {AUTHKEY_VARIABLE}")
+    return authkey.encode("utf-8")
+
+
+def run_worker(address: str = DEFAULT_ADDRESS, authkey: Optional[str] = None) -> int:
+    """ Connect to a coordinator and train the shards it sends until it has no more
+
+    Args:
+        address (`str`): address of the coordinator, like "host:port"
+        authkey (`str`, optional): key shared with the coordinator, the `FOREST_AUTHKEY`
+            environment variable if None
+
+    Returns:
+        n_shards (`int`): the number of shards trained
+    """
+    n_shards = 0
+    with multiprocessing.connection.Client(_parse_address(address),
+                                           authkey=_authkey(authkey)) as connection:
+        logger.info("Connected to the coordinator at %s", address)
+        while True:
+            try:
+                shard = connection.recv()
+            except EOFError:
+                logger.warning("The coordinator closed the connection")
+                break
+            if shard is None:
+                break
+            try:
+                connection.send((True, train_shard(*shard)))
+            except Exception as error:  # pylint: disable=broad-except
+                connection.send((False, repr(error)))
+            n_shards += 1
+
+    logger.info("Trained %d shards", n_shards)
+    return n_shards
+
+
+def _run_local(shards: List[Shard], n_workers: Optional[int]) -> List[RandomForestClassifier]:
+    """ Train the shards in a pool of local processes """
+    n_workers = min(n_workers or os.cpu_count() or 1, len(shards))
+    if n_workers <= 1:
+        return [train_shard(*shard) for shard in shards]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as pool:
+        return list(pool.map(train_shard, *zip(*shards)))
+
+
+def _serve(connection: multiprocessing.connection.Connection, pending: "queue.Queue[int]",
+           shards: List[Shard], results: Dict[int, Any], done: threading.Condition) -> None:
+    """ Send shards to one connected worker until there are none left """
+    with connection:
+        while True:
+            try:
+                position = pending.get(timeout=0.1)
+            except queue.Empty:
+                # stay connected while a shard may still come back from a lost worker
+                if len(results) == len(shards):
+                    connection.send(None)
+                    return
+                continue
+            try:
+                connection.send(shards[position])
+                result = connection.recv()
+            except (EOFError, OSError):
+                # the worker is gone, so another worker trains its shard
+                logger.warning("Lost a worker while it was training shard %d", position)
+                pending.put(position)
+                return
+            with done:
+                results[position] = result
+                done.notify_all()
+
+
+def _run_socket(shards: List[Shard], address: str, authkey: Optional[str],
+                n_local_workers: Optional[int],
+                timeout: Optional[float]) -> List[RandomForestClassifier]:
+    """ Train the shards on the workers that connect to `address` """
+    if authkey is None and os.environ.get(AUTHKEY_VARIABLE) is None and n_local_workers:
+        # only the local workers need to know a key generated here
+        authkey = secrets.token_hex(16)
+    key = _authkey(authkey)
+
+    pending: "queue.Queue[int]" = queue.Queue()
+    for position in range(len(shards)):
+        pending.put(position)
+    results: Dict[int, Any] = {}
+    done = threading.Condition()
+    serving: List[threading.Thread] = []
+
+    with multiprocessing.connection.Listener(_parse_address(address), authkey=key) as listener:
+        host, port = listener.address
+        logger.info("Waiting for workers at %s:%d", host, port)
+
+        def accept() -> None:
+            while True:
+                try:
+                    connection = listener.accept()
+                except multiprocessing.AuthenticationError:
+                    logger.warning("Rejected a worker with a wrong authentication key")
+                    continue
+                except OSError:
+                    # the listener is closed
+                    return
+                serving.append(threading.Thread(
+                    target=_serve, args=(connection, pending, shards, results, done), daemon=True))
+                serving[-1].start()
+
+        workers = [multiprocessing.Process(target=run_worker,
+                                           args=(f"{host}:{port}", key.decode("utf-8")))
+                   for _ in range(min(n_local_workers or 0, len(shards)))]
+        for worker in workers:
+            worker.start()
+        threading.Thread(target=accept, daemon=True).start()
+
+        with done:
+            finished = done.wait_for(lambda: len(results) == len(shards), timeout)
+        # let the connected workers know that there are no more shards
+        for thread in list(serving):
+            thread.join(timeout=1.0)
+        for worker in workers:
+            if not finished:
+                worker.terminate()
+            worker.join()
+
+    if not finished:
+        logger.error("Workers trained %d of %d shards in %s seconds", len(results),
+                     len(shards), timeout)
+        raise TimeoutError(f"Workers trained {len(results)} of {len(shards)} shards")
+
+    failed = [message for success, message in results.values() if not success]
+    if failed:
+        logger.error("Workers failed to train shards: %s", failed[0])
+        raise RuntimeError(f"Workers failed to train shards: {failed[0]}")
+    return [results[position][1] for position in range(len(shards))]
+
+
+def train_distributed(x_train: pd.DataFrame, y_train: pd.DataFrame, initial_features: List[str],
+                      n_estimators: int, max_depth: int, random_state: int, n_shards: int = 4,
+                      transport: str = "local", n_workers: Optional[int] = None,
+                      address: str = DEFAULT_ADDRESS, authkey: Optional[str] = None,
+                      n_local_workers: Optional[int] = None, timeout: Optional[float] = None,
+                      shared_dir: Optional[str] = None) -> RandomForestClassifier:
+    """ Train a random forest in shards on worker processes and merge them
+
+    Args:
+        x_train (:obj:`pandas.DataFrame`): training data for features
+        y_train (:obj:`pandas.DataFrame`): training data for target
+        initial_features (:obj:`list` of `str`): list of column names
+        n_estimators (`int`): the number of trees in the forest
+        max_depth (`int`): the maximum depth of the tree
+        random_state (`int`): seed the seeds of the shards are derived from
+        n_shards (`int`): the number of shards the trees are split into
+        transport (`str`): "local" for a pool of local processes, or "socket" for workers
+            connecting to `address`
+        n_workers (`int`, optional): number of local worker processes, all CPUs if None
+        address (`str`): address the socket coordinator listens on, like "host:port"
+        authkey (`str`, optional): key workers authenticate with, the `FOREST_AUTHKEY`
+            environment variable if None (generated when only local workers connect)
+        n_local_workers (`int`, optional): number of workers the socket coordinator starts
+            on this machine, next to the workers started with `run.py train_worker`
+        timeout (`float`, optional): seconds the socket coordinator waits for the shards,
+            forever if None
+        shared_dir (`str`, optional): directory to save the memory-mapped training data in,
+            visible at the same path to every worker, a temporary directory if None
+
+    Returns:
+        rf_model (:obj:`sklearn.ensemble.RandomForestClassifier`): fitted classifier
+
+    Raises:
+        ValueError: if the transport is unknown
+        TimeoutError: if the workers did not train every shard within `timeout`
+        RuntimeError: if a worker failed to train its shard
+    """
+    if transport not in TRANSPORTS:
+        logger.error("Unknown transport %s", transport)
+        raise ValueError(f"Unknown transport {transport!r}, expected one of {TRANSPORTS}")
+    if not isinstance(n_shards, int) or n_shards <= 0:
+        logger.error("n_shards has to be an integer greater than 0")
+        raise ValueError("n_shards has to be an integer greater than 0")
+
+    params = {"max_depth": max_depth}
+    plan = plan_shards(n_estimators, n_shards, random_state)
+    logger.info("Training %d trees in %d shards with the %s transport", n_estimators, len(plan),
+                transport)
+
+    with tempfile.TemporaryDirectory(dir=shared_dir) as data_dir:
+        # scikit-learn fits trees on float32, so the workers memory-map it without a copy
+        paths = shared_data.share_arrays(
+            {"x": x_train[initial_features].to_numpy(dtype=np.float32),
+             "y": y_train.to_numpy().ravel()}, data_dir)
+        shards = [(paths, n_trees, seed, params) for n_trees, seed in plan]
+        if transport == "local":
+            forests = _run_local(shards, n_workers)
+        else:
+            forests = _run_socket(shards, address, authkey, n_local_workers, timeout)
+
+    return merge_forests(forests, initial_features)
+
+
+def serve_worker(address: str = DEFAULT_ADDRESS, authkey: Optional[str] = None) -> None:
+    """ Run a worker of the socket transport, see `run_worker`
+
+    Args:
+        address (`str`): address of the coordinator, like "host:port"
+        authkey (`str`, optional): key shared with the coordinator, the `FOREST_AUTHKEY`
+            environment variable if None
+
+    Returns:
+        None
+    """
+    try:
+        run_worker(address, authkey)
+    except (ConnectionError, ValueError) as error:
+        logger.error("Cannot connect to the coordinator at %s: %s", address, error)
+        sys.exit(1)
+    except multiprocessing.AuthenticationError:
+        logger.error("The coordinator at %s rejected the authentication key", address)
+        sys.exit(1)
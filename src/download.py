@@ -0,0 +1,257 @@
+"""
+This module is to download source files with streaming, resuming, integrity checks and a
+local cache.
+
+Downloads are streamed to a partial file in the cache directory. An interrupted download is
+resumed with an HTTP Range request (guarded by If-Range, so a changed source is fetched again
+from the start) when it is retried or when the download is run again. Complete downloads are
+stored in the cache under their SHA-256, and a manifest records the digest, ETag and
+Last-Modified of every URL, so a source that did not change since the last download is only
+validated with a conditional request instead of being fetched again. Output files are copied
+from the cache and renamed into place atomically.
+
+Cache layout:
+    <cache_dir>/manifest.json            URL -> sha256, size, etag, last_modified, fetched_at
+    <cache_dir>/objects/<sha256>         downloaded contents
+    <cache_dir>/partial/<key>.part       interrupted downloads, with <key>.part.json validators
+"""
+import concurrent.futures
+import datetime
+import hashlib
+import json
+import logging.config
+import os
+import shutil
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = ".cache/downloads"
+MANIFEST_FILE = "manifest.json"
+DEFAULT_CHUNK_SIZE = 1 << 20
+HASH_BLOCK_SIZE = 1 << 20
+
+# errors after which a download is retried, resuming from the bytes already received
+RETRIED_ERRORS = (requests.ConnectionError, requests.Timeout,
+                  requests.exceptions.ChunkedEncodingError)
+
+_MANIFEST_LOCK = threading.Lock()
+
+
+class IntegrityError(ValueError):
+    """ Downloaded contents do not match their expected size or checksum """
+
+
+def hash_file(path: str) -> str:
+    """ SHA-256 of a file, read in blocks """
+    digest = hashlib.sha256()
+    with open(path, "rb") as input_file:
+        for block in iter(lambda: input_file.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_json(data: Dict[str, Any], path: str) -> None:
+    """ Replace a JSON file atomically """
+    temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as output_file:
+        json.dump(data, output_file, indent=2, sort_keys=True)
+    os.replace(temporary_path, path)
+
+
+def _read_json(path: str) -> Dict[str, Any]:
+    """ Content of a JSON file, empty if it does not exist or is corrupted """
+    try:
+        with open(path, "r", encoding="utf-8") as input_file:
+            return json.load(input_file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def read_manifest(cache_dir: str) -> Dict[str, Dict[str, Any]]:
+    """ Manifest of the downloads cached in `cache_dir`, keyed by URL """
+    return _read_json(os.path.join(cache_dir, MANIFEST_FILE))
+
+
+def _update_manifest(cache_dir: str, url: str, entry: Dict[str, Any]) -> None:
+    """ Record the cached download of a URL """
+    with _MANIFEST_LOCK:
+        manifest = read_manifest(cache_dir)
+        manifest[url] = entry
+        _write_json(manifest, os.path.join(cache_dir, MANIFEST_FILE))
+
+
+def _copy_atomic(source_path: str, output_path: str) -> None:
+    """ Copy a file and rename the copy into place, so readers never see a partial file """
+    temporary_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        shutil.copyfile(source_path, temporary_path)
+        os.replace(temporary_path, output_path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+
+def _validators(response: requests.Response) -> Dict[str, Optional[str]]:
+    """ ETag and Last-Modified of a response """
+    return {"etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified")}
+
+
+def _download(url: str, part_path: str, chunk_size: int, timeout: float,
+              headers: Dict[str, str]) -> Optional[Dict[str, Optional[str]]]:
+    """ Download a URL into a partial file, resuming it if it holds the start of the same
+    version of the source
+
+    Returns:
+        validators (`dict`): ETag and Last-Modified of the downloaded version, or None if the
+            server answered 304 Not Modified to the conditional `headers`
+    """
+    state_path = f"{part_path}.json"
+    state = _read_json(state_path)
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = dict(headers)
+    # ranges apply to the encoded bytes, so ask for the identity encoding
+    headers["Accept-Encoding"] = "identity"
+    validator = state.get("etag") or state.get("last_modified")
+    if offset and validator:
+        headers.update({"Range": f"bytes={offset}-", "If-Range": validator})
+
+    with requests.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code == 304:
+            return None
+        if response.status_code == 416 and offset:
+            # the partial file is already complete or longer than the source: start again
+            os.remove(part_path)
+            return _download(url, part_path, chunk_size, timeout,
+                             {key: value for key, value in headers.items()
+                              if key not in ("Range", "If-Range")})
+        response.raise_for_status()
+
+        validators = _validators(response)
+        resumed = response.status_code == 206
+        if not resumed:
+            offset = 0
+        _write_json({**validators, "url": url}, state_path)
+        logger.info("%s %s", "Resuming download of" if resumed else "Downloading", url)
+
+        expected_size = response.headers.get("Content-Length")
+        received = 0
+        with open(part_path, "ab" if resumed else "wb") as part_file:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                part_file.write(chunk)
+                received += len(chunk)
+
+    if expected_size is not None and received != int(expected_size):
+        raise requests.exceptions.ChunkedEncodingError(
+            f"Received {received} of {expected_size} bytes of {url}")
+    return validators
+
+
+def fetch(url: str, output_path: str, cache_dir: str = DEFAULT_CACHE_DIR,
+          sha256: Optional[str] = None, chunk_size: int = DEFAULT_CHUNK_SIZE,
+          max_retries: int = 3, backoff: float = 1.0, timeout: float = 30.0) -> Dict[str, Any]:
+    """ Download a URL to a file through the cache
+
+    Args:
+        url (`str`): URL of the source
+        output_path (`str`): path to save the source to
+        cache_dir (`str`): directory of the cache
+        sha256 (`str`, optional): expected SHA-256 of the source, not checked if None
+        chunk_size (`int`): number of bytes written at a time
+        max_retries (`int`): number of times an interrupted download is resumed
+        backoff (`float`): seconds to wait before the first retry, doubled at every retry
+        timeout (`float`): seconds to wait for the server to send data
+
+    Returns:
+        entry (`dict`): manifest entry of the source, with "cached" True if it was not
+            downloaded again
+
+    Raises:
+        requests.RequestException: if the source cannot be downloaded
+        IntegrityError: if the download does not match `sha256`
+        FileNotFoundError: if the directory to save the source does not exist
+    """
+    output_dir = os.path.dirname(output_path)
+    if output_dir and not os.path.isdir(output_dir):
+        raise FileNotFoundError(f"No such directory: {output_dir!r}")
+    for directory in ("objects", "partial"):
+        os.makedirs(os.path.join(cache_dir, directory), exist_ok=True)
+
+    entry = read_manifest(cache_dir).get(url)
+    headers = {}
+    if entry and os.path.exists(os.path.join(cache_dir, "objects", entry["sha256"])) \
+            and (sha256 is None or entry["sha256"] == sha256):
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    part_path = os.path.join(cache_dir, "partial",
+                             hashlib.sha256(url.encode("utf-8")).hexdigest() + ".part")
+    for attempt in range(max_retries + 1):
+        try:
+            validators = _download(url, part_path, chunk_size, timeout, headers)
+            break
+        except RETRIED_ERRORS as error:
+            if attempt == max_retries:
+                raise
+            logger.warning("Download of %s interrupted (%s), retrying in %.1fs",
+                           url, error, backoff * 2 ** attempt)
+            time.sleep(backoff * 2 ** attempt)
+
+    if validators is None:
+        logger.info("%s is unchanged, using the cached copy", url)
+        object_path = os.path.join(cache_dir, "objects", entry["sha256"])
+        if hash_file(object_path) != entry["sha256"]:
+            # the cached copy is corrupted: download the source again
+            os.remove(object_path)
+            return fetch(url, output_path, cache_dir, sha256, chunk_size, max_retries,
+                         backoff, timeout)
+        _copy_atomic(object_path, output_path)
+        return {**entry, "cached": True}
+
+    digest = hash_file(part_path)
+    if sha256 is not None and digest != sha256:
+        os.remove(part_path)
+        raise IntegrityError(f"SHA-256 of {url} is {digest}, expected {sha256}")
+
+    entry = {"sha256": digest, "size": os.path.getsize(part_path), **validators,
+             "fetched_at": datetime.datetime.now(datetime.timezone.utc).isoformat()}
+    os.replace(part_path, os.path.join(cache_dir, "objects", digest))
+    os.remove(f"{part_path}.json")
+    _update_manifest(cache_dir, url, entry)
+    _copy_atomic(os.path.join(cache_dir, "objects", digest), output_path)
+    logger.info("Downloaded %d bytes of %s with SHA-256 %s", entry["size"], url, digest)
+    return {**entry, "cached": False}
+
+
+def fetch_all(urls: List[str], output_paths: List[str], n_workers: Optional[int] = None,
+              **kwargs: Any) -> List[Dict[str, Any]]:
+    """ Download several URLs concurrently, see `fetch`
+
+    Args:
+        urls (:obj:`list` of `str`): URLs of the sources
+        output_paths (:obj:`list` of `str`): path to save every source to
+        n_workers (`int`, optional): number of concurrent downloads, one per URL if None
+        **kwargs: other arguments of `fetch`, the same for every URL; "sha256" can be a list
+            with one digest per URL
+
+    Returns:
+        entries (:obj:`list` of `dict`): manifest entry of every source, in order
+    """
+    if len(urls) != len(output_paths):
+        logger.error("The same number of URLs and output paths should be given")
+        raise ValueError("The same number of URLs and output paths should be given")
+    digests = kwargs.pop("sha256", None)
+    if not isinstance(digests, list):
+        digests = [digests] * len(urls)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers or len(urls) or 1) as pool:
+        futures = [pool.submit(fetch, url, output_path, sha256=digest, **kwargs)
+                   for url, output_path, digest in zip(urls, output_paths, digests)]
+        return [future.result() for future in futures]
@@ -0,0 +1,138 @@
+"""
+This module is to apply the dtype schema of the pipeline data.
+
+The schema (`dtype_schema` in model_config.yaml) gives one dtype for the feature columns and
+one for the target column. Float32 features take half the memory of pandas' default float64
+and change nothing for the random forest, which casts its inputs to float32 before comparing
+them with its thresholds. A uint8 target takes an eighth.
+"""
+import collections
+import logging.config
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TARGET_COLUMN = "class"
+
+
+class DtypeSchema(NamedTuple):
+    """ Dtypes of the feature columns and of the target column """
+    features: np.dtype
+    target: np.dtype
+    target_column: str = DEFAULT_TARGET_COLUMN
+
+
+def resolve(dtypes: Optional[Dict[str, str]]) -> Optional[DtypeSchema]:
+    """ Check a dtype schema from the configuration
+
+    Args:
+        dtypes (`dict`, optional): like {"features": "float32", "target": "uint8",
+            "target_column": "class"}, where target_column is optional
+
+    Returns:
+        schema (:obj:`DtypeSchema`): resolved schema, None if `dtypes` is None
+    """
+    if dtypes is None:
+        return None
+    unknown = set(dtypes) - set(DtypeSchema._fields)
+    if unknown or not {"features", "target"} <= set(dtypes):
+        logger.error("The dtype schema should give features, target and optionally "
+                     "target_column")
+        raise ValueError(f"The dtype schema should have the keys {DtypeSchema._fields}, "
+                         f"got {sorted(dtypes)}")
+
+    features, target = np.dtype(dtypes["features"]), np.dtype(dtypes["target"])
+    if features.kind != "f":
+        logger.error("Features should have a floating point dtype, not %s", features)
+        raise ValueError(f"Features should have a floating point dtype, not {features}")
+    if target.kind not in "iuf":
+        logger.error("The target should have a numeric dtype, not %s", target)
+        raise ValueError(f"The target should have a numeric dtype, not {target}")
+
+    return DtypeSchema(features, target,
+                       dtypes.get("target_column", DEFAULT_TARGET_COLUMN))
+
+
+def read_dtypes(schema: Optional[DtypeSchema]) -> Optional[Dict[str, np.dtype]]:
+    """ Dtypes to parse the columns of an artifact with, see `artifact_io.read_table`
+
+    Every column, the target included, is parsed with the feature dtype, which is exact for
+    class labels; `cast_frame` then casts the target to its own dtype.
+    """
+    if schema is None:
+        return None
+    return collections.defaultdict(lambda: schema.features)
+
+
+def cast_frame(data: pd.DataFrame, schema: Optional[DtypeSchema]) -> pd.DataFrame:
+    """ Cast the target column of a dataframe to the target dtype and the others to the
+    feature dtype, leaving the columns that already have their dtype uncopied
+
+    Args:
+        data (:obj:`pandas.DataFrame`): data to cast
+        schema (:obj:`DtypeSchema`, optional): schema to apply, `data` is returned as is if None
+
+    Returns:
+        data (:obj:`pandas.DataFrame`): cast data
+
+    Raises:
+        ValueError: if the target does not fit in the target dtype
+    """
+    if schema is None:
+        return data
+
+    dtypes = {column: schema.target if column == schema.target_column else schema.features
+              for column in data.columns}
+    if schema.target_column in data.columns and schema.target.kind in "iu":
+        target = data[schema.target_column].to_numpy()
+        if not np.array_equal(target, target.astype(schema.target)):
+            raise ValueError(f"Values of {schema.target_column} do not fit in {schema.target}")
+    if all(data[column].dtype == dtype for column, dtype in dtypes.items()):
+        return data
+
+    return data.astype(dtypes)
+
+
+def feature_frame(data: pd.DataFrame, columns: List[str],
+                  dtype: Optional[np.dtype] = None) -> pd.DataFrame:
+    """ Assemble columns of a dataframe into one contiguous matrix
+
+    The matrix is column-major, so every feature is contiguous, and the returned dataframe
+    is a view of it: `to_numpy()` gives the matrix without a copy, which scikit-learn uses
+    as is when it already has the dtype it needs. Data that already is such a matrix is
+    returned without a copy.
+
+    Args:
+        data (:obj:`pandas.DataFrame`): data that include `columns`
+        columns (:obj:`list` of `str`): columns to assemble, in order
+        dtype (`numpy.dtype`, optional): dtype of the matrix, the common dtype of the
+            columns if None
+
+    Returns:
+        features (:obj:`pandas.DataFrame`): dataframe with the index of `data` backed by a
+            single (n_rows, n_columns) matrix
+
+    Raises:
+        KeyError: if one of `columns` is not in `data`
+    """
+    missing = [column for column in columns if column not in data.columns]
+    if missing:
+        raise KeyError(f"Columns {missing} are not in the data")
+    if dtype is None:
+        dtype = np.result_type(*[data[column].dtype for column in columns])
+
+    if list(data.columns) == list(columns) and all(data.dtypes == dtype):
+        # a view of the single block of `data`, or else one copy interleaving its blocks
+        values = data.to_numpy()
+        if values.flags.f_contiguous:
+            return data
+        return pd.DataFrame(values, index=data.index, columns=list(columns), copy=False)
+
+    matrix = np.empty((len(columns), len(data)), dtype=dtype)
+    for row, column in zip(matrix, columns):
+        row[:] = data[column].to_numpy()
+
+    return pd.DataFrame(matrix.T, index=data.index, columns=list(columns), copy=False)
@@ -1,30 +1,36 @@
 """ Compute test metrics to evaluate model performance """
+import concurrent.futures
+import functools
+import itertools
 import logging.config
+import os
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 import sys
 
-import sklearn
+import numpy as np
 import pandas as pd
 
+from src import artifact_io, bootstrap, index_split, instrumentation, streaming_metrics
+
 logger = logging.getLogger(__name__)
 
 
-def evaluate(proba_input_path: str, bin_input_path: str,
-             y_test_path: str, output_path: str) -> None:
-    """ Calculate accuracy metrics and save it to output path
+def load_predictions(proba_input_path: str,
+                     bin_input_path: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """ Load predicted probability and class saved by `score_model`
 
     Args:
         proba_input_path (`str`): path to saved predicted probability for test data (npy)
         bin_input_path (`str`): path to saved predicted class for test data (npy)
-        y_test_path (`str`): path to saved test data for target (csv)
-        output_path (`str`): path to save calculated metrics (txt)
 
     Returns:
-        None
+        ypred_proba_test, ypred_bin_test (:obj:`pandas.DataFrame`): predicted probability and class
     """
-    # load necessary data for evaluation
     logger.info("Loading predicted values for evaluation")
     try:
-        ypred_proba_test = pd.read_csv(proba_input_path, index_col=False, header=None)
+        with instrumentation.span("read_predictions") as timing:
+            ypred_proba_test = pd.read_csv(proba_input_path, index_col=False, header=None)
+            timing.rows = len(ypred_proba_test)
     except FileNotFoundError:
         logger.error("No such file or directory to load predicted probability. Please try again.")
         sys.exit(1)
@@ -35,24 +41,40 @@ def evaluate(proba_input_path: str, bin_input_path: str,
         logger.error("No such file or directory to load predicted class. Please try again.")
         sys.exit(1)
 
-    logger.info("Loading actual test target for evaluation")
-    try:
-        y_test = pd.read_csv(y_test_path, index_col=False)
-    except FileNotFoundError:
-        logger.error("No such file or directory to load actual test target. Please try again.")
-        sys.exit(1)
+    return ypred_proba_test, ypred_bin_test
+
+
+def compute_metrics(y_test: Any, ypred_proba_test: Any, ypred_bin_test: Any) -> Dict[str, Any]:
+    """ Calculate accuracy metrics from in-memory predictions
+
+    Args:
+        y_test (array-like): actual test target
+        ypred_proba_test (array-like): predicted probability for test data
+        ypred_bin_test (array-like): predicted class for test data
+
+    Returns:
+        metrics (`dict`): auc, accuracy, confusion matrix (:obj:`pandas.DataFrame`)
+            and classification report (`str`)
+    """
+    # sklearn.metrics imports scipy, which the streaming evaluation does not need
+    import sklearn.metrics  # pylint: disable=import-outside-toplevel
 
     # compute test metrics
     logger.info("Calculating test metrics")
 
+    # classes are compared as floats, so the report reads the same whatever the target dtype
+    y_test = np.asarray(y_test, dtype=np.float64).ravel()
+    ypred_bin_test = np.asarray(ypred_bin_test, dtype=np.float64).ravel()
+
     # check if only two class are present in test data
-    if y_test.nunique().values != 2:
+    if pd.DataFrame(y_test).nunique().values != 2:
         logger.error("Exactly two classes should be present in y_test")
         raise ValueError("Exactly two classes should be present in y_test")
 
     try:
         # compute test metrics with predicted probability
-        auc = sklearn.metrics.roc_auc_score(y_test, ypred_proba_test)
+        with instrumentation.span("auc", rows=len(y_test)):
+            auc = sklearn.metrics.roc_auc_score(y_test, ypred_proba_test)
 
     except ValueError:
         logger.error("Samples should be of same length (>1) and all numerical")
@@ -60,31 +82,216 @@ def evaluate(proba_input_path: str, bin_input_path: str,
 
     try:
         # compute test metrics with predicted class
-        confusion = sklearn.metrics.confusion_matrix(y_test, ypred_bin_test)
-        accuracy = sklearn.metrics.accuracy_score(y_test, ypred_bin_test)
-        classification_report = sklearn.metrics.classification_report(y_test, ypred_bin_test)
+        with instrumentation.span("class_metrics", rows=len(y_test)):
+            confusion = sklearn.metrics.confusion_matrix(y_test, ypred_bin_test)
+            accuracy = sklearn.metrics.accuracy_score(y_test, ypred_bin_test)
+            classification_report = sklearn.metrics.classification_report(y_test,
+                                                                          ypred_bin_test)
     except ValueError:
         logger.error("Samples should be of same length (>1) and all binary")
         sys.exit(1)
 
     confusion_df = pd.DataFrame(confusion, index=["Actual negative", "Actual positive"],
                                 columns=["Predicted negative", "Predicted positive"])
+
+    return {"auc": auc, "accuracy": accuracy, "confusion": confusion_df,
+            "classification_report": classification_report}
+
+
+def add_intervals(metrics: Dict[str, Any], y_test: Any, ypred_proba_test: Any,
+                  ypred_bin_test: Any, bootstrap_config: Dict[str, Any]) -> Dict[str, Any]:
+    """ Add bootstrap confidence intervals of the AUC, accuracy, precision and recall to metrics
+
+    Args:
+        metrics (`dict`): metrics returned by `compute_metrics`
+        y_test (array-like): actual test target
+        ypred_proba_test (array-like): predicted probability for test data
+        ypred_bin_test (array-like): predicted class for test data
+        bootstrap_config (`dict`): arguments of `bootstrap.bootstrap_intervals`, like
+            {"n_replicates": 1000, "confidence": 0.95}
+
+    Returns:
+        metrics (`dict`): metrics with the intervals under "intervals" and their confidence
+            level under "confidence"
+    """
+    logger.info("Computing bootstrap confidence intervals")
+    with instrumentation.span("bootstrap", rows=len(y_test)):
+        metrics["intervals"] = bootstrap.bootstrap_intervals(
+            np.asarray(y_test), np.asarray(ypred_proba_test), np.asarray(ypred_bin_test),
+            **bootstrap_config)
+    metrics["confidence"] = bootstrap_config.get("confidence", 0.95)
+    return metrics
+
+
+def write_metrics(metrics: Dict[str, Any], output_path: str) -> None:
+    """ Save metrics computed by `compute_metrics` to output path
+
+    Args:
+        metrics (`dict`): metrics returned by `compute_metrics`
+        output_path (`str`): path to save calculated metrics (txt)
+
+    Returns:
+        None
+    """
     # transform confusion df to string for writing the output later
-    confusion_df_string = confusion_df.to_string(header=True, index=True)
+    confusion_df_string = metrics["confusion"].to_string(header=True, index=True)
 
     # save output to given path
     logger.info("Saving test metrics to given output path")
 
     try:
         with open(output_path, "w", encoding="ASCII") as output_file:
-            output_file.write(f"AUC on test: {auc:.3f}\n")
-            output_file.write(f"Accuracy on test: {accuracy:.3f}\n")
+            output_file.write(f"AUC on test: {metrics['auc']:.3f}\n")
+            if "auc_error" in metrics:
+                output_file.write(f"AUC error bound: {metrics['auc_error']:.2e}\n")
+            output_file.write(f"Accuracy on test: {metrics['accuracy']:.3f}\n")
+            if "intervals" in metrics:
+                output_file.write(f"{metrics['confidence']:.0%} bootstrap confidence "
+                                  f"intervals:\n")
+                for metric, (estimate, lower, upper) in metrics["intervals"].items():
+                    output_file.write(f"  {metric}: {estimate:.3f} [{lower:.3f}, {upper:.3f}]\n")
             output_file.write(confusion_df_string)
             output_file.write("\n")
-            output_file.writelines(classification_report)
-        output_file.close()
+            output_file.writelines(metrics["classification_report"])
     except FileNotFoundError:
         logger.error("No such file or directory to save test metrics. Please try again.")
         sys.exit(1)
 
     logger.info("Test metrics are successfully saved to given output path")
+
+
+def evaluate(proba_input_path: str, bin_input_path: str,
+             y_test_path: str, output_path: str,
+             bootstrap_config: Optional[Dict[str, Any]] = None,
+             split_path: Optional[str] = None, fold: Optional[int] = None) -> None:
+    """ Calculate accuracy metrics and save it to output path
+
+    Args:
+        proba_input_path (`str`): path to saved predicted probability for test data (npy)
+        bin_input_path (`str`): path to saved predicted class for test data (npy)
+        y_test_path (`str`): path to saved test data for target (csv, parquet, feather or npcols)
+        output_path (`str`): path to save calculated metrics (txt)
+        bootstrap_config (`dict`, optional): arguments of `bootstrap.bootstrap_intervals` to
+            also save confidence intervals of the metrics, no intervals if None
+        split_path (`str`, optional): path to an index split (npz) to read the test rows from
+            the target it indexes, instead of `y_test_path` (see `src.index_split`)
+        fold (`int`, optional): fold used as the test rows, for splits with folds
+
+    Returns:
+        None
+    """
+    # load necessary data for evaluation
+    ypred_proba_test, ypred_bin_test = load_predictions(proba_input_path, bin_input_path)
+
+    logger.info("Loading actual test target for evaluation")
+    try:
+        if split_path is None:
+            y_test = artifact_io.read_table(y_test_path)
+        else:
+            y_test = index_split.read_rows(split_path, "test", "target", fold=fold)
+    except FileNotFoundError:
+        logger.error("No such file or directory to load actual test target. Please try again.")
+        sys.exit(1)
+    except ValueError as error:
+        logger.error("Cannot read the test rows of the split: %s", error)
+        sys.exit(1)
+
+    metrics = compute_metrics(y_test, ypred_proba_test, ypred_bin_test)
+    if bootstrap_config is not None:
+        add_intervals(metrics, y_test, ypred_proba_test, ypred_bin_test, bootstrap_config)
+    write_metrics(metrics, output_path)
+
+
+def _iter_chunks(proba_input_path: str, bin_input_path: str, y_test_path: str,
+                 chunk_size: int) -> Iterator[Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]]:
+    """ Aligned chunks of the predicted probability, predicted class and actual target """
+    readers = [pd.read_csv(proba_input_path, index_col=False, header=None, chunksize=chunk_size),
+               pd.read_csv(bin_input_path, index_col=False, header=None, chunksize=chunk_size),
+               artifact_io.iter_table(y_test_path, chunk_size=chunk_size)]
+    for chunks in itertools.zip_longest(*readers):
+        if any(chunk is None for chunk in chunks) or len({len(chunk) for chunk in chunks}) > 1:
+            raise ValueError("Predictions and target do not have the same number of rows")
+        yield chunks
+
+
+def evaluate_shard(proba_input_path: str, bin_input_path: str, y_test_path: str,
+                   chunk_size: int = 1000000,
+                   n_bins: int = streaming_metrics.DEFAULT_N_BINS
+                   ) -> streaming_metrics.MetricsAccumulator:
+    """ Accumulate the metrics of saved predictions `chunk_size` rows at a time
+
+    Args:
+        proba_input_path (`str`): path to saved predicted probability for test data (csv)
+        bin_input_path (`str`): path to saved predicted class for test data (csv)
+        y_test_path (`str`): path to saved test data for target (csv, parquet, feather or npcols)
+        chunk_size (`int`): number of rows read at a time
+        n_bins (`int`): number of bins of the predicted probabilities used to estimate the AUC
+
+    Returns:
+        accumulator (:obj:`streaming_metrics.MetricsAccumulator`): metrics of the predictions
+    """
+    accumulator = streaming_metrics.MetricsAccumulator(n_bins)
+    with instrumentation.span("accumulate", rows=0) as timing:
+        for proba, predicted, actual in _iter_chunks(proba_input_path, bin_input_path,
+                                                     y_test_path, chunk_size):
+            accumulator.update(actual.to_numpy(), proba.to_numpy(), predicted.to_numpy())
+            timing.rows += len(proba)
+    return accumulator
+
+
+def evaluate_stream(proba_input_path: Union[str, List[str]],
+                    bin_input_path: Union[str, List[str]],
+                    y_test_path: Union[str, List[str]], output_path: str,
+                    chunk_size: int = 1000000, n_bins: int = streaming_metrics.DEFAULT_N_BINS,
+                    n_workers: Optional[int] = None) -> Dict[str, Any]:
+    """ Calculate accuracy metrics of predictions of any size and save them to output path
+
+    Inputs are read in chunks, so memory use does not depend on the number of rows. The
+    confusion matrix, accuracy and classification report are exact; the AUC is estimated from
+    histograms of the predicted probabilities, and the bound of its error is saved with it.
+    Predictions saved in several shards (lists of paths, one per shard) are evaluated in
+    parallel by `n_workers` processes and the metrics of the shards are merged.
+
+    Args:
+        proba_input_path (`str` or :obj:`list` of `str`): path(s) to saved predicted
+            probability for test data (csv)
+        bin_input_path (`str` or :obj:`list` of `str`): path(s) to saved predicted class
+            for test data (csv)
+        y_test_path (`str` or :obj:`list` of `str`): path(s) to saved test data for target
+        output_path (`str`): path to save calculated metrics (txt)
+        chunk_size (`int`): number of rows read at a time
+        n_bins (`int`): number of bins of the predicted probabilities used to estimate the AUC
+        n_workers (`int`, optional): number of worker processes for shards, all CPUs if None
+
+    Returns:
+        metrics (`dict`): metrics like `compute_metrics`, with the AUC error bound as `auc_error`
+    """
+    shards = [[path] if isinstance(path, str) else list(path)
+              for path in (proba_input_path, bin_input_path, y_test_path)]
+    if len({len(paths) for paths in shards}) > 1:
+        logger.error("The same number of shards should be given for every input")
+        raise ValueError("The same number of shards should be given for every input")
+    shards = list(zip(*shards))
+
+    logger.info("Accumulating test metrics over %d shard(s)", len(shards))
+    try:
+        if len(shards) == 1 or n_workers == 1:
+            accumulators = [evaluate_shard(*paths, chunk_size, n_bins) for paths in shards]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=min(n_workers or os.cpu_count(), len(shards))) as pool:
+                accumulators = list(pool.map(evaluate_shard, *zip(*shards),
+                                             [chunk_size] * len(shards), [n_bins] * len(shards)))
+    except FileNotFoundError as error:
+        logger.error("No such file or directory to load %s. Please try again.", error.filename)
+        sys.exit(1)
+    except ValueError as error:
+        logger.error("Cannot evaluate predictions: %s", error)
+        sys.exit(1)
+
+    accumulator = functools.reduce(streaming_metrics.MetricsAccumulator.merge, accumulators)
+    metrics = accumulator.metrics()
+    logger.info("AUC %.4f (error at most %.2e) and accuracy %.4f on %d rows",
+                metrics["auc"], metrics["auc_error"], metrics["accuracy"], accumulator.n_rows)
+    write_metrics(metrics, output_path)
+    return metrics
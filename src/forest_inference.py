@@ -0,0 +1,85 @@
+"""
+This module is to evaluate a flattened random forest over a batch of samples.
+
+All trees are traversed together, level by level: every step moves each (tree, sample) pair
+that has not reached a leaf yet one level down, with a handful of vectorized gathers and
+comparisons over contiguous node arrays. The flattened forest is any object with the node
+arrays of :obj:`src.model_format.CompactForest` (feature, threshold, left, right, value and
+roots) of internal nodes, where a negative reference -(i + 1) to a child or a root is leaf i.
+
+Probabilities are accumulated tree by tree in the order of the forest and divided by the
+number of trees, on float32 samples compared with float64 thresholds, so they are identical
+to the ones of :obj:`sklearn.ensemble.RandomForestClassifier`.
+"""
+import logging.config
+from typing import Any, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# number of (tree, sample) pairs traversed at a time, bounding the memory of the traversal
+BLOCK_PAIRS = 1 << 18
+
+
+def apply(forest: Any, x: np.ndarray) -> np.ndarray:
+    """ Leaf reached by every sample in every tree
+
+    Args:
+        forest: flattened forest
+        x (:obj:`numpy.ndarray`): float32 matrix of samples with the features in model order
+
+    Returns:
+        leaves (:obj:`numpy.ndarray`): leaf indices, one row per tree and one column per sample
+    """
+    n_trees, n_rows = len(forest.roots), len(x)
+    flat_x = np.ascontiguousarray(x).ravel()
+    index_dtype = np.int32 if flat_x.size < np.iinfo(np.int32).max else np.int64
+
+    # node reached by every (tree, sample) pair, in tree-major order
+    node = np.repeat(np.asarray(forest.roots), n_rows)
+    offsets = np.tile(np.arange(n_rows, dtype=index_dtype) * x.shape[1], n_trees)
+
+    # pairs still at an internal node, with their node and the offset of their sample in flat_x
+    active = np.flatnonzero(node >= 0).astype(index_dtype)
+    current = node.take(active)
+    offsets = offsets.take(active)
+    while active.size:
+        go_left = flat_x.take(offsets + forest.feature.take(current)) \
+            <= forest.threshold.take(current)
+        current = np.where(go_left, forest.left.take(current), forest.right.take(current))
+
+        internal = current >= 0
+        if not internal.all():
+            reached = ~internal
+            node[active[reached]] = current[reached]
+            active, current, offsets = active[internal], current[internal], offsets[internal]
+
+    return (-node - 1).reshape(n_trees, n_rows)
+
+
+def predict_proba(forest: Any, x: np.ndarray, block_rows: Optional[int] = None) -> np.ndarray:
+    """ Class probabilities averaged over the trees of a flattened forest
+
+    Args:
+        forest: flattened forest
+        x (:obj:`numpy.ndarray`): float32 matrix of samples with the features in model order
+        block_rows (`int`, optional): number of samples traversed at a time, by default
+            so that about `BLOCK_PAIRS` (tree, sample) pairs are traversed at a time
+
+    Returns:
+        proba (:obj:`numpy.ndarray`): probability of every class, one row per sample
+    """
+    n_trees, n_rows = len(forest.roots), len(x)
+    block_rows = block_rows or max(BLOCK_PAIRS // max(n_trees, 1), 1)
+    proba = np.zeros((n_rows, forest.value.shape[1]), dtype=np.float64)
+
+    for start in range(0, n_rows, block_rows):
+        stop = min(start + block_rows, n_rows)
+        leaves = apply(forest, x[start:stop])
+        block = proba[start:stop]
+        for tree in range(n_trees):
+            block += forest.value.take(leaves[tree], axis=0)
+
+    proba /= n_trees
+    return proba
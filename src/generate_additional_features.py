@@ -1,39 +1,108 @@
 """ This module is to generate additional features """
 import logging.config
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
 
 import pandas as pd
 import numpy as np
 
+from src import instrumentation
+
 logger = logging.getLogger(__name__)
 
 
-def log_transform(features: pd.DataFrame, log_col: str, additional_feature: str) -> pd.DataFrame:
-    """ Take log of selected features
+def _log(log_col: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """ Natural log of a column """
+    return np.log(log_col, out=out)
 
-        Args:
-            features (:obj:`pandas.DataFrame`): data that include columns to transform
-            log_col (`str`): column name for the feature to take log transform
-            additional_feature (`str`): column name for the additional feature
 
-        Returns:
-           features (:obj:`pandas.DataFrame`): dataframe with transformed feature
+def _multiply(col1: np.ndarray, col2: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """ Product of two columns """
+    return np.multiply(col2, col1, out=out)
+
+
+def _col_range(min_col: np.ndarray, max_col: np.ndarray,
+               out: Optional[np.ndarray] = None) -> np.ndarray:
+    """ Difference between a max and a min column """
+    return np.subtract(max_col, min_col, out=out)
+
+
+def _norm_range(min_col: np.ndarray, max_col: np.ndarray, mean_col: np.ndarray,
+                out: Optional[np.ndarray] = None) -> np.ndarray:
+    """ Difference between a max and a min column divided by a mean column """
+    out = np.subtract(max_col, min_col, out=out)
+    return np.divide(out, mean_col, out=out)
+
+
+# operations that generate an additional feature: name -> (names of the input column
+# arguments, vectorized kernel, numexpr expression over the same arguments, log message)
+OPERATIONS: Dict[str, Tuple[List[str], Callable[..., np.ndarray], str, str]] = {
+    "log_transform": (["log_col"], _log, "log(log_col)",
+                      "Log transformed feature is successfully generated"),
+    "multiply": (["col1", "col2"], _multiply, "col2 * col1",
+                 "Multiplied feature is successfully generated"),
+    "col_range": (["min_col", "max_col"], _col_range, "max_col - min_col",
+                  "Range feature is successfully generated"),
+    "norm_range": (["min_col", "max_col", "mean_col"], _norm_range,
+                   "(max_col - min_col) / mean_col",
+                   "Normalized range feature is successfully generated"),
+}
+
+
+class FeaturePlan(NamedTuple):
+    """ Compiled plan of additional features
+
+    Attributes:
+        input_columns (:obj:`list` of `str`): columns read from the features
+        output_columns (:obj:`list` of `str`): input columns followed by the additional features
+        steps (:obj:`list` of :obj:`tuple`): (operation, positions of its input columns in
+            `output_columns`, position of its output column in `output_columns`) in order
     """
+    input_columns: List[str]
+    output_columns: List[str]
+    steps: List[Tuple[str, List[int], int]]
+
+
+def _validate(features: pd.DataFrame, columns: List[str]) -> None:
+    """ Raise if `features` is not a dataframe or does not contain all of `columns` """
     # raise TypeError if provided data is not a pandas dataframe
     if not isinstance(features, pd.DataFrame):
         logger.error("Provided argument `features` is not a Pandas DataFrame object")
         raise TypeError("Provided argument `features` is not a Pandas DataFrame object")
 
     # raise AttributeError if provided data does not contain the column to be transformed
-    if log_col not in features.columns:
-        logger.error("%s not in provided data", log_col)
-        raise AttributeError(f"{log_col} not in provided data")
+    for column in columns:
+        if column not in features.columns:
+            logger.error("%s not in provided data", column)
+            raise AttributeError(f"{column} not in provided data")
+
 
-    features[additional_feature] = features[log_col].apply(np.log)
-    logger.info("Log transformed feature is successfully generated")
+def _add_feature(features: pd.DataFrame, operation: str, additional_feature: str,
+                 **columns: str) -> pd.DataFrame:
+    """ Validate `features` and insert the feature generated by one operation """
+    arguments, kernel, _, message = OPERATIONS[operation]
+    _validate(features, [columns[argument] for argument in arguments])
+
+    values = kernel(*[features[columns[argument]].to_numpy() for argument in arguments])
+    features[additional_feature] = pd.Series(values, index=features.index, copy=False)
+    logger.info(message)
 
     return features
 
 
+def log_transform(features: pd.DataFrame, log_col: str, additional_feature: str) -> pd.DataFrame:
+    """ Take log of selected features
+
+        Args:
+            features (:obj:`pandas.DataFrame`): data that include columns to transform
+            log_col (`str`): column name for the feature to take log transform
+            additional_feature (`str`): column name for the additional feature
+
+        Returns:
+           features (:obj:`pandas.DataFrame`): dataframe with transformed feature
+    """
+    return _add_feature(features, "log_transform", additional_feature, log_col=log_col)
+
+
 def multiply(features: pd.DataFrame, col1: str, col2: str, additional_feature: str) -> pd.DataFrame:
     """Get feature equal to the product of two given features
 
@@ -45,24 +114,7 @@ def multiply(features: pd.DataFrame, col1: str, col2: str, additional_feature: s
     Returns:
         features (:obj:`pandas.DataFrame`): dataframe with transformed features
     """
-    # raise TypeError if provided data is not a pandas dataframe
-    if not isinstance(features, pd.DataFrame):
-        logger.error("Provided argument `features` is not a Pandas DataFrame object")
-        raise TypeError("Provided argument `features` is not a Pandas DataFrame object")
-
-    # raise AttributeError if provided data does not contain the column to be transformed
-    if col1 not in features.columns:
-        logger.error("%s not in provided data", col1)
-        raise AttributeError(f"{col1} not in provided data")
-    if col2 not in features.columns:
-        logger.error("%s not in provided data", col2)
-        raise AttributeError(f"{col2} not in provided data")
-
-    # features multiplication
-    features[additional_feature] = features[col2].multiply(features[col1])
-    logger.info("Multiplied feature is successfully generated")
-
-    return features
+    return _add_feature(features, "multiply", additional_feature, col1=col1, col2=col2)
 
 
 def col_range(features: pd.DataFrame, min_col: str, max_col: str,
@@ -77,24 +129,8 @@ def col_range(features: pd.DataFrame, min_col: str, max_col: str,
     Returns:
         features (:obj:`pandas.DataFrame`): dataframe with transformed features
     """
-    # raise TypeError if provided data is not a pandas dataframe
-    if not isinstance(features, pd.DataFrame):
-        logger.error("Provided argument `features` is not a Pandas DataFrame object")
-        raise TypeError("Provided argument `features` is not a Pandas DataFrame object")
-
-    # raise AttributeError if provided data does not contain the column to be transformed
-    if min_col not in features.columns:
-        logger.error("%s not in provided data", min_col)
-        raise AttributeError(f"{min_col} not in provided data")
-    if max_col not in features.columns:
-        logger.error("%s not in provided data", max_col)
-        raise AttributeError(f"{max_col} not in provided data")
-
-    # range
-    features[additional_feature] = features[max_col] - features[min_col]
-    logger.info("Range feature is successfully generated")
-
-    return features
+    return _add_feature(features, "col_range", additional_feature,
+                        min_col=min_col, max_col=max_col)
 
 
 def norm_range(features: pd.DataFrame, min_col: str, max_col: str,
@@ -110,25 +146,111 @@ def norm_range(features: pd.DataFrame, min_col: str, max_col: str,
     Returns:
         features (:obj:`pandas.DataFrame`): dataframe with transformed features
     """
-    # raise TypeError if provided data is not a pandas dataframe
-    if not isinstance(features, pd.DataFrame):
-        logger.error("Provided argument `features` is not a Pandas DataFrame object")
-        raise TypeError("Provided argument `features` is not a Pandas DataFrame object")
+    return _add_feature(features, "norm_range", additional_feature,
+                        min_col=min_col, max_col=max_col, mean_col=mean_col)
 
-    # raise AttributeError if provided data does not contain the column to be transformed
-    if min_col not in features.columns:
-        logger.error("%s not in provided data", min_col)
-        raise AttributeError(f"{min_col} not in provided data")
-    if max_col not in features.columns:
-        logger.error("%s not in provided data", max_col)
-        raise AttributeError(f"{max_col} not in provided data")
-    if mean_col not in features.columns:
-        logger.error("%s not in provided data", mean_col)
-        raise AttributeError(f"{mean_col} not in provided data")
-
-    # Normalized range
-    features[additional_feature] = (features[max_col] - features[min_col])\
-        .divide(features[mean_col])
-    logger.info("Normalized range feature is successfully generated")
 
-    return features
+def compile_feature_plan(config: Dict[str, Dict[str, Any]],
+                         input_columns: List[str]) -> FeaturePlan:
+    """ Compile the `generate_additional_features` configuration into a feature plan
+
+    Every entry of `config` generates one additional feature. The key of the entry is the
+    operation (one of `OPERATIONS`) unless the entry names it under `operation`, so the same
+    operation can be listed several times. Additional features can use the ones listed before.
+
+    Args:
+        config (`dict`): like {"log_transform": {"log_col": ..., "additional_feature": ...}, ...}
+        input_columns (:obj:`list` of `str`): columns of the features the plan is applied to
+
+    Returns:
+        plan (:obj:`FeaturePlan`): compiled plan
+    """
+    output_columns = list(input_columns)
+    positions = {column: position for position, column in enumerate(output_columns)}
+    steps = []
+    for name, arguments in config.items():
+        arguments = dict(arguments)
+        operation = arguments.pop("operation", name)
+        if operation not in OPERATIONS:
+            logger.error("Unknown feature operation %s", operation)
+            raise ValueError(f"Unknown feature operation {operation!r}, "
+                             f"expected one of {sorted(OPERATIONS)}")
+
+        inputs = []
+        for argument in OPERATIONS[operation][0]:
+            if arguments.get(argument) not in positions:
+                logger.error("%s not in provided data", arguments.get(argument))
+                raise AttributeError(f"{arguments.get(argument)} not in provided data")
+            inputs.append(positions[arguments[argument]])
+
+        additional_feature = arguments["additional_feature"]
+        if additional_feature in input_columns:
+            logger.error("%s is already in provided data", additional_feature)
+            raise ValueError(f"{additional_feature} is already in provided data")
+        if additional_feature not in positions:
+            positions[additional_feature] = len(output_columns)
+            output_columns.append(additional_feature)
+        steps.append((operation, inputs, positions[additional_feature]))
+
+    return FeaturePlan(list(input_columns), output_columns, steps)
+
+
+def apply_feature_plan(features: pd.DataFrame, plan: FeaturePlan,
+                       chunk_size: Optional[int] = None, engine: str = "numpy") -> pd.DataFrame:
+    """ Generate all additional features of a plan in one pass
+
+    The input columns and the additional features are assembled into one preallocated
+    matrix, of the dtype of the inputs (at least float32), and the additional features are
+    evaluated directly into it without inserting columns one at a time. Rows are evaluated
+    `chunk_size` at a time so that chained operations work on data that is still in cache.
+
+    Args:
+        features (:obj:`pandas.DataFrame`): data that include the input columns of the plan
+        plan (:obj:`FeaturePlan`): plan compiled by `compile_feature_plan`
+        chunk_size (`int`, optional): number of rows evaluated at a time, all rows if None
+        engine (`str`): "numpy", or "numexpr" to evaluate the operations with numexpr
+
+    Returns:
+        features (:obj:`pandas.DataFrame`): dataframe with the input columns followed by
+            the additional features, with the index of `features`, backed by a single
+            contiguous matrix
+    """
+    _validate(features, plan.input_columns)
+    if engine not in ("numpy", "numexpr"):
+        logger.error("Unknown feature engine %s", engine)
+        raise ValueError(f"Unknown feature engine {engine!r}, expected 'numpy' or 'numexpr'")
+    if engine == "numexpr":
+        try:
+            import numexpr  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            logger.error("The numexpr engine requires numexpr to be installed")
+            raise
+
+    n_rows = len(features)
+    chunk_size = chunk_size or max(n_rows, 1)
+    dtype = np.result_type(np.float32, *[features[column].dtype
+                                         for column in plan.input_columns])
+
+    # one contiguous row of the matrix per column, so every slice is contiguous
+    matrix = np.empty((len(plan.output_columns), n_rows), dtype=dtype)
+    for row, column in zip(matrix, plan.input_columns):
+        row[:] = features[column].to_numpy()
+    sources = list(matrix)
+
+    with instrumentation.span("feature_transform", rows=n_rows):
+        for start in range(0, n_rows, chunk_size):
+            stop = min(start + chunk_size, n_rows)
+            for operation, inputs, output in plan.steps:
+                arguments, kernel, expression, _ = OPERATIONS[operation]
+                columns = [sources[position][start:stop] for position in inputs]
+                if engine == "numexpr":
+                    numexpr.evaluate(expression, local_dict=dict(zip(arguments, columns)),
+                                     out=sources[output][start:stop])
+                else:
+                    kernel(*columns, out=sources[output][start:stop])
+
+    logger.info("%d additional features are successfully generated", len(plan.steps))
+
+    # the transposed view keeps the matrix as a single block of the dataframe
+    return pd.DataFrame(matrix.T, index=features.index, columns=plan.output_columns,
+                        copy=False)
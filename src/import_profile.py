@@ -0,0 +1,113 @@
+"""
+This module is to profile the imports of run.py actions.
+
+The modules of an action are imported in a fresh interpreter started with `-X importtime`,
+after the modules run.py always imports, and the self and cumulative import time of every
+module is read from its report. Only the standard library is imported here, so profiling
+does not load the modules it measures into the running process.
+"""
+import logging.config
+import subprocess
+import sys
+from typing import Dict, List, NamedTuple, Tuple
+
+logger = logging.getLogger(__name__)
+
+# written to stderr between the imports of run.py and the imports of the action
+MARKER = "-- action imports --"
+
+
+class ImportTime(NamedTuple):
+    """ Import time of one module, as reported by `python -X importtime` """
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def parse_importtime(report: str) -> List[ImportTime]:
+    """ Parse the report of `python -X importtime`
+
+    Args:
+        report (`str`): lines like "import time:  self [us] | cumulative | imported package"
+
+    Returns:
+        times (:obj:`list` of :obj:`ImportTime`): import time of every module, in the order
+            of the report, the depth of a module being the number of imports it is nested in
+    """
+    times = []
+    for line in report.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        module = name.lstrip()
+        times.append(ImportTime(module, int(fields[0]), int(fields[1]),
+                                (len(name) - len(module) - 1) // 2))
+    return times
+
+
+def profile_imports(base_modules: List[str], action_modules: List[str]
+                    ) -> Tuple[List[ImportTime], List[ImportTime]]:
+    """ Import time of the modules of an action in a fresh interpreter
+
+    Args:
+        base_modules (:obj:`list` of `str`): modules imported before the action, like the
+            modules run.py always imports
+        action_modules (:obj:`list` of `str`): modules imported by the action
+
+    Returns:
+        base, action (:obj:`list` of :obj:`ImportTime`): import time of every module
+            imported by `base_modules`, and of every module imported on top of them by
+            `action_modules`
+    """
+    code = "; ".join([f"import {name}" for name in base_modules]
+                     + [f"import sys; sys.stderr.write({MARKER!r} + '\\n')"]
+                     + [f"import {name}" for name in action_modules])
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            capture_output=True, text=True, check=False)
+    if result.returncode != 0 or MARKER not in result.stderr:
+        logger.error("Cannot import the modules of the action: %s", result.stderr[-2000:])
+        raise ImportError(f"Cannot import {action_modules}")
+
+    base, action = result.stderr.split(MARKER, 1)
+    startup = {entry.module for entry in parse_importtime(
+        subprocess.run([sys.executable, "-X", "importtime", "-c", "pass"],
+                       capture_output=True, text=True, check=False).stderr)}
+    # drop the modules every interpreter imports at startup
+    return ([entry for entry in parse_importtime(base) if entry.module not in startup],
+            parse_importtime(action))
+
+
+def format_report(action: str, base: List[ImportTime], times: List[ImportTime],
+                  top: int = 15) -> str:
+    """ Report of the import time of an action
+
+    Args:
+        action (`str`): name of the action
+        base (:obj:`list` of :obj:`ImportTime`): import time of the modules run.py always
+            imports
+        times (:obj:`list` of :obj:`ImportTime`): import time of the modules of the action
+        top (`int`): number of the slowest packages to list
+
+    Returns:
+        report (`str`): total import time of the action and the time spent importing the
+            modules of its slowest packages
+    """
+    base_ms = sum(entry.self_us for entry in base) / 1000
+    action_ms = sum(entry.self_us for entry in times) / 1000
+    packages: Dict[str, List[int]] = {}
+    for entry in times:
+        package = packages.setdefault(entry.module.split(".")[0], [0, 0])
+        package[0] += entry.self_us
+        package[1] += 1
+
+    lines = [f"{action}: {action_ms:.1f} ms importing {len(times)} modules, "
+             f"after {base_ms:.1f} ms for run.py",
+             f"{'ms':>9} {'modules':>8}  package"]
+    slowest = sorted(packages.items(), key=lambda item: item[1][0], reverse=True)[:top]
+    lines.extend(f"{self_us / 1000:9.1f} {n_modules:8d}  {package}"
+                 for package, (self_us, n_modules) in slowest)
+    return "\n".join(lines)
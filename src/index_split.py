@@ -0,0 +1,229 @@
+"""
+This module is to split data into train and test sets by row index, without copying them.
+
+A split is saved as a small .npz file holding the row numbers of the train and test sets
+(or the fold of every row for cross-validation folds), together with the paths of the
+features and target files it indexes, their number of rows and the settings it was drawn
+with. Stages read their rows straight from those files, so several splits or folds share one
+copy of the data, and columnar artifacts (.npcols) only page in the rows they use.
+
+    random       shuffled rows, the same rows and order as `train_test_split`
+    stratified   shuffled rows, with the class proportions of the target in every set
+    grouped      shuffled groups of rows sharing a value of `group_column`
+    hash         rows, or groups of rows, assigned by a hash of their row number (or group)
+                 and the seed, so a row keeps its set when rows are added
+"""
+import json
+import logging.config
+from typing import Any, Dict, Mapping, NamedTuple, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from src import artifact_io
+
+logger = logging.getLogger(__name__)
+
+METHODS = ["random", "stratified", "grouped", "hash"]
+
+PARTS = ["train", "test"]
+
+# key of the pandas hash of the rows, any fixed 16 characters
+HASH_KEY = "cloud_classifier"
+
+
+class IndexSplit(NamedTuple):
+    """ Row numbers of a train and test split, or of cross-validation folds """
+    arrays: Dict[str, np.ndarray]
+    meta: Dict[str, Any]
+
+    def rows(self, part: str, fold: Optional[int] = None) -> np.ndarray:
+        """ Row numbers of the train or test set
+
+        Args:
+            part (`str`): "train" or "test"
+            fold (`int`, optional): fold used as the test set, only for splits with folds
+
+        Returns:
+            rows (:obj:`numpy.ndarray`): row numbers of the set, in the order of the split
+        """
+        if part not in PARTS:
+            logger.error("Unknown part %s", part)
+            raise ValueError(f"Unknown part {part!r}, expected one of {PARTS}")
+        n_folds = self.meta.get("n_folds")
+        if n_folds is None:
+            if fold is not None:
+                logger.error("The split has no folds")
+                raise ValueError("The split has no folds")
+            return self.arrays[part]
+        if fold is None or not 0 <= fold < n_folds:
+            logger.error("Choose a fold between 0 and %d", n_folds - 1)
+            raise ValueError(f"Choose a fold between 0 and {n_folds - 1}")
+        folds = self.arrays["fold"]
+        return np.flatnonzero(folds == fold if part == "test" else folds != fold)
+
+
+def hash_unit(keys: np.ndarray, random_state: int) -> np.ndarray:
+    """ Deterministic pseudo-random numbers in [0, 1) from keys and a seed
+
+    Args:
+        keys (:obj:`numpy.ndarray`): key of every row, rows with the same key get the
+            same number
+        random_state (`int`): seed
+
+    Returns:
+        units (:obj:`numpy.ndarray`): float64 number of every row
+    """
+    seed = pd.util.hash_array(np.array([random_state]), hash_key=HASH_KEY)
+    hashes = pd.util.hash_array(pd.util.hash_array(np.asarray(keys), hash_key=HASH_KEY) ^ seed,
+                                hash_key=HASH_KEY)
+    return (hashes >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+
+
+def make_split(n_rows: int, test_size: float, random_state: int, method: str = "random",
+               target: Optional[np.ndarray] = None, groups: Optional[np.ndarray] = None,
+               n_folds: Optional[int] = None) -> Dict[str, np.ndarray]:
+    """ Draw the row numbers of a train and test split, or the fold of every row
+
+    Args:
+        n_rows (`int`): number of rows of the data
+        test_size (`float`): proportion of test set, unused with folds
+        random_state (`int`): seed of the split
+        method (`str`): one of `METHODS`
+        target (:obj:`numpy.ndarray`, optional): target of every row, for "stratified"
+        groups (:obj:`numpy.ndarray`, optional): group of every row, for "grouped", and for
+            "hash" to hash groups instead of row numbers
+        n_folds (`int`, optional): number of cross-validation folds, a single split if None
+
+    Returns:
+        arrays (`dict`): row numbers under "train" and "test", or with folds the fold of every
+            row under "fold"
+    """
+    if method not in METHODS:
+        logger.error("Unknown split method %s", method)
+        raise ValueError(f"Unknown split method {method!r}, expected one of {METHODS}")
+    if method == "stratified" and target is None or method == "grouped" and groups is None:
+        logger.error("The %s split needs the %s of every row", method,
+                     "target" if method == "stratified" else "group")
+        raise ValueError(f"The {method} split needs the "
+                         f"{'target' if method == 'stratified' else 'group'} of every row")
+    # imported here, so reading the rows of a split does not import scikit-learn
+    from sklearn.model_selection import (GroupKFold, GroupShuffleSplit, KFold, StratifiedKFold,
+                                         train_test_split)
+
+    rows = np.arange(n_rows)
+    row_dtype = np.int32 if n_rows < 2 ** 31 else np.int64
+
+    if n_folds is None:
+        if method == "hash":
+            units = hash_unit(rows if groups is None else groups, random_state)
+            train, test = np.flatnonzero(units >= test_size), np.flatnonzero(units < test_size)
+        elif method == "grouped":
+            splitter = GroupShuffleSplit(n_splits=1, test_size=test_size,
+                                         random_state=random_state)
+            train, test = next(splitter.split(rows, groups=groups))
+        else:
+            train, test = train_test_split(rows, test_size=test_size, random_state=random_state,
+                                           stratify=target if method == "stratified" else None)
+        return {"train": train.astype(row_dtype), "test": test.astype(row_dtype)}
+
+    if method == "hash":
+        units = hash_unit(rows if groups is None else groups, random_state)
+        return {"fold": np.minimum(units * n_folds, n_folds - 1).astype(np.int16)}
+    if method == "grouped":
+        splits = GroupKFold(n_splits=n_folds).split(rows, groups=groups)
+    elif method == "stratified":
+        splits = StratifiedKFold(n_splits=n_folds, shuffle=True,
+                                 random_state=random_state).split(rows, target)
+    else:
+        splits = KFold(n_splits=n_folds, shuffle=True, random_state=random_state).split(rows)
+    folds = np.empty(n_rows, dtype=np.int16)
+    for fold, (_, test) in enumerate(splits):
+        folds[test] = fold
+    return {"fold": folds}
+
+
+def save_split(arrays: Mapping[str, np.ndarray], meta: Mapping[str, Any], path: str) -> None:
+    """ Save a split and its settings to a .npz file
+
+    Args:
+        arrays (`dict`): arrays returned by `make_split`
+        meta (`dict`): paths of the indexed files under "feature_path" and "target_path",
+            their number of rows under "n_rows", and the settings of the split
+
+    Returns:
+        None
+
+    Raises:
+        FileNotFoundError: if the directory to save the split does not exist
+    """
+    with open(path, mode="wb") as split_file:
+        np.savez(split_file, meta=np.frombuffer(json.dumps(dict(meta)).encode("utf-8"),
+                                                dtype=np.uint8), **arrays)
+
+
+def load_split(path: str) -> IndexSplit:
+    """ Load a split saved by `save_split`
+
+    Args:
+        path (`str`): path to the split (npz)
+
+    Returns:
+        split (:obj:`IndexSplit`): row numbers and settings of the split
+
+    Raises:
+        FileNotFoundError: if the split does not exist
+    """
+    with np.load(path) as stored:
+        arrays = {name: stored[name] for name in stored.files if name != "meta"}
+        meta = json.loads(stored["meta"].tobytes().decode("utf-8"))
+    return IndexSplit(arrays, meta)
+
+
+def take_rows(data: pd.DataFrame, split: IndexSplit, part: str,
+              fold: Optional[int] = None) -> pd.DataFrame:
+    """ Rows of the train or test set of a split
+
+    Args:
+        data (:obj:`pandas.DataFrame`): every row of the features or target indexed by the split
+        split (:obj:`IndexSplit`): split of the rows
+        part (`str`): "train" or "test"
+        fold (`int`, optional): fold used as the test set, only for splits with folds
+
+    Returns:
+        rows (:obj:`pandas.DataFrame`): rows of the set, in the order of the split
+    """
+    if len(data) != split.meta["n_rows"]:
+        logger.error("The split indexes %d rows but the data have %d rows",
+                     split.meta["n_rows"], len(data))
+        raise ValueError(f"The split indexes {split.meta['n_rows']} rows but the data have "
+                         f"{len(data)} rows, split the data again")
+    return data.iloc[split.rows(part, fold)]
+
+
+def read_rows(split_path: str, part: str, source: str = "feature",
+              columns: Optional[Sequence[str]] = None, dtype: Optional[Mapping[str, Any]] = None,
+              fold: Optional[int] = None) -> pd.DataFrame:
+    """ Read the rows of the train or test set of a split from the file it indexes
+
+    Args:
+        split_path (`str`): path to the split (npz)
+        part (`str`): "train" or "test"
+        source (`str`): "feature" to read the features, or "target" to read the target
+        columns (:obj:`list` of `str`, optional): columns to load, all columns if None
+        dtype (`dict`, optional): dtype of the columns, see `artifact_io.read_table`
+        fold (`int`, optional): fold used as the test set, only for splits with folds
+
+    Returns:
+        rows (:obj:`pandas.DataFrame`): rows of the set, in the order of the split
+
+    Raises:
+        FileNotFoundError: if the split or the file it indexes does not exist
+        KeyError: if one of `columns` is not in the file
+        ValueError: if the file does not have the rows indexed by the split
+    """
+    split = load_split(split_path)
+    data = artifact_io.read_table(split.meta[source + "_path"],
+                                  columns=list(columns) if columns is not None else None,
+                                  dtype=dtype)
+    return take_rows(data, split, part, fold)
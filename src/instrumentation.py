@@ -0,0 +1,247 @@
+"""
+This module is to record runtime metrics of the pipeline actions and their steps.
+
+Code to measure is wrapped in `span`:
+
+    with instrumentation.span("fit", rows=len(x_train)):
+        ...
+
+Every span records its wall time, CPU time, the peak resident memory of the whole process so
+far (not of the span, see `_process_peak_rss`), the number of rows processed and the bytes
+read and written by the process while it ran. Spans nest: a span opened inside another one is
+named "<outer>/<inner>". Finished spans are appended to a JSON-lines metrics file and,
+optionally, to a Prometheus textfile written when recording stops.
+
+Recording is off until `start` is called. Until then, spans are no-ops that cost about a
+microsecond, so instrumented code does not need to check whether metrics are wanted.
+"""
+import json
+import logging.config
+import os
+import resource
+import threading
+import time
+from typing import Any, Dict, List, Optional, TextIO
+
+logger = logging.getLogger(__name__)
+
+PROC_IO = "/proc/self/io"
+METRIC_PREFIX = "cloud_classifier_span"
+
+# Prometheus gauges written for every span name: metric suffix -> (record field, help text)
+PROMETHEUS_METRICS = {
+    "wall_seconds": ("wall_s", "Wall time of the span in seconds"),
+    "cpu_seconds": ("cpu_s", "CPU time of the process during the span in seconds"),
+    "process_peak_rss_bytes": ("process_peak_rss_bytes",
+                               "Peak resident memory of the process since it started in bytes"),
+    "rows": ("rows", "Rows processed by the span"),
+    "rows_per_second": ("rows_per_s", "Rows processed per second of wall time"),
+    "read_bytes": ("read_bytes", "Bytes read by the process during the span"),
+    "write_bytes": ("write_bytes", "Bytes written by the process during the span"),
+}
+
+_NOT_LABELS = {field for field, _ in PROMETHEUS_METRICS.values()} | {"timestamp", "failed"}
+
+
+def _io_counters() -> Optional[Dict[str, int]]:
+    """ Bytes read and written by the process so far, None where /proc/self/io is missing """
+    try:
+        with open(PROC_IO, "r", encoding="ASCII") as io_file:
+            counters = dict(line.split(": ") for line in io_file.read().splitlines())
+    except OSError:
+        return None
+    # rchar and wchar count all reads and writes, including the ones served by the page cache
+    return {"read_bytes": int(counters["rchar"]), "write_bytes": int(counters["wchar"])}
+
+
+def _process_peak_rss() -> int:
+    """ Peak resident memory of the process since it started in bytes
+
+    This is the process-wide high-water mark (`ru_maxrss`): it never decreases, so a span
+    reports the largest memory used by any code run before or during it, not its own usage.
+    """
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Span:
+    """ Measurement of one run of a block of code
+
+    Attributes:
+        name (`str`): name of the span, prefixed with the names of the enclosing spans
+        rows (`int`, optional): number of rows processed, can be set while the span runs
+    """
+
+    def __init__(self, recorder: "Recorder", name: str, rows: Optional[int]):
+        self.recorder = recorder
+        self.name = name
+        self.rows = rows
+        self._start: Dict[str, Any] = {}
+
+    def __enter__(self) -> "Span":
+        stack = self.recorder.stack()
+        if stack:
+            self.name = f"{stack[-1].name}/{self.name}"
+        stack.append(self)
+        self._start = {"io": _io_counters(), "cpu": time.process_time(),
+                       "timestamp": time.time(), "wall": time.perf_counter()}
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        wall = time.perf_counter() - self._start["wall"]
+        cpu = time.process_time() - self._start["cpu"]
+        record = {"name": self.name, "timestamp": self._start["timestamp"], "wall_s": wall,
+                  "cpu_s": cpu, "process_peak_rss_bytes": _process_peak_rss(),
+                  "rows": self.rows,
+                  "rows_per_s": self.rows / wall if self.rows is not None and wall else None,
+                  "read_bytes": None, "write_bytes": None, "failed": exc_type is not None}
+        io_counters = _io_counters()
+        if io_counters is not None and self._start["io"] is not None:
+            for key, value in io_counters.items():
+                record[key] = value - self._start["io"][key]
+        self.recorder.stack().pop()
+        self.recorder.emit(record)
+
+
+class _NullSpan:
+    """ Span used while recording is off """
+    name = None
+    rows = 0
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        return None
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        # rows set on a span while recording is off are dropped
+        return None
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Recorder:
+    """ Writes finished spans to a JSON-lines file and keeps the last record of every span
+    for the Prometheus textfile
+
+    Args:
+        metrics_path (`str`, optional): JSON-lines file the spans are appended to
+        prometheus_path (`str`, optional): Prometheus textfile written by `close`
+        labels (`dict`, optional): labels added to every record, e.g. {"action": "train_model"}
+    """
+
+    def __init__(self, metrics_path: Optional[str] = None, prometheus_path: Optional[str] = None,
+                 labels: Optional[Dict[str, str]] = None):
+        self.prometheus_path = prometheus_path
+        self.labels = dict(labels or {})
+        self.latest: Dict[str, Dict[str, Any]] = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._file: Optional[TextIO] = None
+        if metrics_path is not None:
+            self._file = open(metrics_path, "a", encoding="utf-8")
+
+    def stack(self) -> List[Span]:
+        """ Spans open in the current thread, innermost last """
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def emit(self, record: Dict[str, Any]) -> None:
+        """ Write a finished span """
+        record = {**self.labels, **record}
+        with self._lock:
+            self.latest[record["name"]] = record
+            if self._file is not None:
+                self._file.write(json.dumps(record) + "\n")
+                self._file.flush()
+
+    def close(self) -> None:
+        """ Close the metrics file and write the Prometheus textfile """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self.prometheus_path is not None:
+                write_prometheus(list(self.latest.values()), self.prometheus_path)
+
+
+_RECORDER: Optional[Recorder] = None
+
+
+def start(metrics_path: Optional[str] = None, prometheus_path: Optional[str] = None,
+          labels: Optional[Dict[str, str]] = None) -> Recorder:
+    """ Start recording spans, stopping the current recording if any
+
+    Args:
+        metrics_path (`str`, optional): JSON-lines file the spans are appended to; its
+            directory is created if needed
+        prometheus_path (`str`, optional): Prometheus textfile written by `stop`
+        labels (`dict`, optional): labels added to every record
+
+    Returns:
+        recorder (:obj:`Recorder`): recorder of the spans
+    """
+    global _RECORDER  # pylint: disable=global-statement
+    stop()
+    for path in (metrics_path, prometheus_path):
+        if path is not None and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+    _RECORDER = Recorder(metrics_path, prometheus_path, labels)
+    return _RECORDER
+
+
+def stop() -> None:
+    """ Stop recording spans and write the outputs of the recording """
+    global _RECORDER  # pylint: disable=global-statement
+    if _RECORDER is not None:
+        _RECORDER.close()
+        _RECORDER = None
+
+
+def span(name: str, rows: Optional[int] = None) -> Any:
+    """ Context manager measuring the block of code it wraps
+
+    Args:
+        name (`str`): name of the span
+        rows (`int`, optional): number of rows processed, can also be set on the span later
+
+    Returns:
+        span (:obj:`Span`): span to use in a `with` statement, a no-op if recording is off
+    """
+    if _RECORDER is None:
+        return NULL_SPAN
+    return Span(_RECORDER, name, rows)
+
+
+def write_prometheus(records: List[Dict[str, Any]], output_path: str) -> None:
+    """ Write span records as gauges in the Prometheus text format
+
+    The file is replaced atomically, as expected by the textfile collector of the node exporter.
+
+    Args:
+        records (:obj:`list` of `dict`): span records, one per span name
+        output_path (`str`): path of the textfile (.prom)
+    """
+    lines = []
+    for suffix, (field, help_text) in PROMETHEUS_METRICS.items():
+        metric = f"{METRIC_PREFIX}_{suffix}"
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+        for record in records:
+            if record.get(field) is None:
+                continue
+            labels = {key: value for key, value in record.items() if key not in _NOT_LABELS}
+            label_text = ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+            lines.append(f"{metric}{{{label_text}}} {record[field]}")
+
+    temporary_path = f"{output_path}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as output_file:
+        output_file.write("\n".join(lines) + "\n")
+    os.replace(temporary_path, output_path)
+
+
+def _escape(value: Any) -> str:
+    """ Escape a label value for the Prometheus text format """
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
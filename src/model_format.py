@@ -0,0 +1,247 @@
+"""
+This module is to save fitted random forests in a compact, versioned format that loads
+without unpickling.
+
+A compact model is a directory (`.forest`) holding the nodes of all trees as flat,
+uncompressed .npy arrays and a `meta.json` file. Loading memory-maps the arrays, so it takes
+near-zero time, only the pages touched by predictions are read, and processes loading the
+same model share those pages through the page cache.
+
+    meta.json       format name and version, classes, feature names, number of trees
+    feature.npy     feature tested by every internal node (int32)
+    threshold.npy   threshold of every internal node (float64), a sample goes left
+                    if value <= threshold
+    left.npy        left child of every internal node (int32/int64): the index of an
+                    internal node, or -(leaf index + 1) for a leaf
+    right.npy       right child of every internal node, encoded like `left`
+    value.npy       class probabilities of every leaf (float64, n_leaves x n_classes)
+    roots.npy       root of every tree, encoded like `left`
+
+Models compacted by `src.compact_model` store the same arrays with narrower dtypes
+(float32 thresholds, float16 or float32 probabilities, int8/int16 features and children).
+"""
+import json
+import logging.config
+import os
+from typing import Any, Dict, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from src import forest_inference
+
+logger = logging.getLogger(__name__)
+
+EXTENSION = ".forest"
+FORMAT_NAME = "cloud-classifier-forest"
+FORMAT_VERSION = 2
+META_FILE = "meta.json"
+ARRAYS = ["feature", "threshold", "left", "right", "value", "roots"]
+
+
+class CompactForest:
+    """ Random forest classifier read from flat node arrays
+
+    It predicts like the :obj:`sklearn.ensemble.RandomForestClassifier` it was converted
+    from, so it can be used in place of the fitted classifier for scoring.
+
+    Args:
+        arrays (`dict`): node arrays keyed by the names in `ARRAYS`
+        meta (`dict`): content of `meta.json`
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]) -> None:
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.left = arrays["left"]
+        self.right = arrays["right"]
+        self.value = arrays["value"]
+        self.roots = arrays["roots"]
+        self.meta = meta
+        self.classes_ = np.array(meta["classes"])
+        self.feature_names_in_ = (np.array(meta["feature_names"], dtype=object)
+                                  if meta["feature_names"] is not None else None)
+        self.n_features_in_ = meta["n_features"]
+        self.n_estimators = len(self.roots)
+
+    def _validate_x(self, x: Union[pd.DataFrame, np.ndarray]) -> np.ndarray:
+        """ Features as a float32 matrix with the columns in training order, like sklearn """
+        if isinstance(x, pd.DataFrame) and self.feature_names_in_ is not None:
+            x = x[list(self.feature_names_in_)]
+        x = np.asarray(x, dtype=np.float32)
+        if x.ndim != 2 or x.shape[1] != self.n_features_in_:
+            raise ValueError(f"X has {x.shape[-1]} features, but the model is expecting "
+                             f"{self.n_features_in_} features")
+        if not np.isfinite(x).all():
+            raise ValueError("Input X contains NaN or infinity")
+        return x
+
+    def apply(self, x: Union[pd.DataFrame, np.ndarray]) -> np.ndarray:
+        """ Leaf index reached by every sample in every tree (one row per tree) """
+        return forest_inference.apply(self, self._validate_x(x))
+
+    def predict_proba(self, x: Union[pd.DataFrame, np.ndarray]) -> np.ndarray:
+        """ Class probabilities averaged over the trees """
+        return forest_inference.predict_proba(self, self._validate_x(x))
+
+    def predict(self, x: Union[pd.DataFrame, np.ndarray]) -> np.ndarray:
+        """ Class with the highest averaged probability """
+        return self.classes_.take(np.argmax(self.predict_proba(x), axis=1))
+
+
+def to_arrays(model: Any) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """ Flatten the trees of a fitted random forest classifier into node arrays
+
+    Args:
+        model (:obj:`sklearn.ensemble.RandomForestClassifier`): fitted classifier
+            with a single output
+
+    Returns:
+        arrays (`dict`): node arrays keyed by the names in `ARRAYS`
+        meta (`dict`): content of `meta.json`
+    """
+    if getattr(model, "n_outputs_", None) != 1 or not hasattr(model, "estimators_"):
+        logger.error("Only fitted single-output random forest classifiers can be converted")
+        raise TypeError("Only fitted single-output random forest classifiers can be converted")
+
+    trees = [estimator.tree_ for estimator in model.estimators_]
+    n_nodes = sum(tree.node_count for tree in trees)
+    index_dtype = np.int32 if n_nodes < np.iinfo(np.int32).max else np.int64
+
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    n_internal, n_leaves = 0, 0
+    for tree in trees:
+        is_leaf = tree.children_left == -1
+        internal = np.flatnonzero(~is_leaf)
+
+        # reference of every node of the tree: internal nodes and leaves are numbered
+        # in node order across all trees, leaves are encoded as -(leaf index + 1)
+        reference = np.where(is_leaf, -(n_leaves + np.cumsum(is_leaf)),
+                             n_internal + np.cumsum(~is_leaf) - 1)
+
+        # per-node normalization, as done by the predict_proba of a decision tree
+        value = tree.value[is_leaf, 0, :]
+        normalizer = value.sum(axis=1)[:, np.newaxis]
+        normalizer[normalizer == 0.0] = 1.0
+
+        features.append(tree.feature[internal])
+        thresholds.append(tree.threshold[internal])
+        lefts.append(reference[tree.children_left[internal]])
+        rights.append(reference[tree.children_right[internal]])
+        values.append(value / normalizer)
+        roots.append(reference[0])
+        n_internal += len(internal)
+        n_leaves += len(is_leaf) - len(internal)
+
+    arrays = {
+        "feature": np.concatenate(features).astype(np.int32),
+        "threshold": np.concatenate(thresholds).astype(np.float64),
+        "left": np.concatenate(lefts).astype(index_dtype),
+        "right": np.concatenate(rights).astype(index_dtype),
+        "value": np.concatenate(values).astype(np.float64),
+        "roots": np.array(roots, dtype=index_dtype),
+    }
+    feature_names = getattr(model, "feature_names_in_", None)
+    meta = {
+        "format": FORMAT_NAME,
+        "version": FORMAT_VERSION,
+        "classes": model.classes_.tolist(),
+        "feature_names": [str(name) for name in feature_names]
+                         if feature_names is not None else None,
+        "n_features": int(model.n_features_in_),
+        "n_trees": len(trees),
+        "n_internal_nodes": n_internal,
+        "n_leaves": n_leaves,
+    }
+    return arrays, meta
+
+
+def to_compact(model: Any) -> CompactForest:
+    """ Flatten a fitted random forest classifier into an in-memory compact model
+
+    Args:
+        model (:obj:`sklearn.ensemble.RandomForestClassifier` or :obj:`CompactForest`):
+            fitted classifier, returned as is if it is already a compact model
+
+    Returns:
+        model (:obj:`CompactForest`): compact model
+    """
+    if isinstance(model, CompactForest):
+        return model
+    return CompactForest(*to_arrays(model))
+
+
+def save_compact_model(model: Any, output_path: str) -> None:
+    """ Save a fitted random forest classifier in the compact format
+
+    Args:
+        model (:obj:`sklearn.ensemble.RandomForestClassifier`): fitted classifier
+        output_path (`str`): path of the model directory (.forest)
+
+    Returns:
+        None
+
+    Raises:
+        FileNotFoundError: if the parent directory of `output_path` does not exist
+    """
+    save_arrays(*to_arrays(model), output_path)
+
+
+def save_arrays(arrays: Dict[str, np.ndarray], meta: Dict[str, Any], output_path: str) -> None:
+    """ Save the node arrays of a flattened forest in the compact format
+
+    Args:
+        arrays (`dict`): node arrays keyed by the names in `ARRAYS`
+        meta (`dict`): content of `meta.json`
+        output_path (`str`): path of the model directory (.forest)
+
+    Returns:
+        None
+
+    Raises:
+        FileNotFoundError: if the parent directory of `output_path` does not exist
+    """
+    parent = os.path.dirname(output_path)
+    if parent and not os.path.isdir(parent):
+        raise FileNotFoundError(f"No such directory: {parent!r}")
+
+    os.makedirs(output_path, exist_ok=True)
+    meta_path = os.path.join(output_path, META_FILE)
+    # remove the metadata first so a partially rewritten model is never loaded
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    for name in ARRAYS:
+        np.save(os.path.join(output_path, name + ".npy"), arrays[name])
+    with open(meta_path, "w", encoding="utf-8") as meta_file:
+        json.dump(meta, meta_file, indent=2)
+
+
+def load_compact_model(input_path: str, mmap_mode: Optional[str] = "r") -> CompactForest:
+    """ Load a compact model, memory-mapping its node arrays
+
+    Args:
+        input_path (`str`): path of the model directory (.forest)
+        mmap_mode (`str`, optional): passed to :obj:`numpy.load`, None to read the arrays
+
+    Returns:
+        model (:obj:`CompactForest`): loaded model
+
+    Raises:
+        FileNotFoundError: if the model does not exist
+        ValueError: if the model was written in another format or version
+    """
+    with open(os.path.join(input_path, META_FILE), "r", encoding="utf-8") as meta_file:
+        meta = json.load(meta_file)
+    if meta.get("format") != FORMAT_NAME or meta.get("version") != FORMAT_VERSION:
+        logger.error("%s is not a version %d compact model", input_path, FORMAT_VERSION)
+        raise ValueError(f"{input_path} is not a version {FORMAT_VERSION} compact model")
+
+    arrays = {name: np.load(os.path.join(input_path, name + ".npy"), mmap_mode=mmap_mode)
+              for name in ARRAYS}
+    return CompactForest(arrays, meta)
+
+
+def is_compact_model(path: str) -> bool:
+    """ Whether a model path refers to the compact format """
+    return os.path.splitext(path.rstrip("/\\"))[1].lower() == EXTENSION
+
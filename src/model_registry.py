@@ -0,0 +1,307 @@
+"""
+This module is to keep every trained model under its version, and to keep the most recently
+used models in memory for scoring.
+
+A registry is a directory holding one directory per version:
+
+    <version>/model.joblib      the fitted classifier
+    <version>/model.forest      the compact model, if one was saved (see `src.model_format`)
+    <version>/metrics.txt       the test metrics, if they were computed
+    <version>/metadata.json     version, registration time, features, hyperparameters,
+                                SHA-256 of the training data and test metrics
+
+Loaded models are kept in a :obj:`ModelCache` bounded in bytes and in number of models, which
+evicts the least recently used models first, so switching between versions only pays the cost
+of loading a model the first time it is used.
+"""
+import collections
+import json
+import logging.config
+import os
+import shutil
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src import stage_cache
+
+logger = logging.getLogger(__name__)
+
+METADATA_FILE = "metadata.json"
+MODEL_FILE = "model.joblib"
+COMPACT_MODEL_FILE = "model.forest"
+METRICS_FILE = "metrics.txt"
+
+# default bound of the memory of the models kept by `MODEL_CACHE`
+DEFAULT_CACHE_BYTES = 1 << 30
+DEFAULT_CACHE_MODELS = 8
+
+
+def _path_size(path: str) -> int:
+    """ Size in bytes of a file, or of the files in a directory """
+    if os.path.isdir(path):
+        return sum(_path_size(os.path.join(path, name)) for name in os.listdir(path))
+    return os.path.getsize(path)
+
+
+def _path_stamp(path: str) -> Tuple[Any, ...]:
+    """ Size and modification time of a file, or of every file in a directory
+
+    The stat of a directory itself does not change when a file in it is rewritten in place,
+    so a directory model (.forest) is stamped by its metadata and array files.
+    """
+    if os.path.isdir(path):
+        return tuple((name, _path_stamp(os.path.join(path, name)))
+                     for name in sorted(os.listdir(path)))
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class ModelCache:
+    """ Loaded models kept in memory, least recently used first out
+
+    A model is keyed by its path and the size and modification time of its files, so a model
+    overwritten on disk is loaded again. Its memory is estimated by its size on disk.
+
+    Args:
+        max_bytes (`int`): largest total size of the cached models
+        max_models (`int`, optional): largest number of cached models, no limit if None
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES,
+                 max_models: Optional[int] = DEFAULT_CACHE_MODELS) -> None:
+        self.max_bytes = max_bytes
+        self.max_models = max_models
+        self.hits = 0
+        self.misses = 0
+        self._models: "collections.OrderedDict[str, Tuple[Tuple[Any, ...], int, Any]]" = \
+            collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def size_bytes(self) -> int:
+        """ Total size of the cached models """
+        with self._lock:
+            return sum(size for _, size, _ in self._models.values())
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._models)
+
+    def __contains__(self, path: object) -> bool:
+        with self._lock:
+            return isinstance(path, str) and os.path.abspath(path) in self._models
+
+    def get(self, path: str, loader: Callable[[str], Any]) -> Any:
+        """ Model at a path, loaded with `loader` unless it is cached
+
+        Args:
+            path (`str`): path to the model
+            loader (`callable`): function loading the model at a path
+
+        Returns:
+            model: loaded model
+
+        Raises:
+            FileNotFoundError: if the model does not exist
+        """
+        key = os.path.abspath(path)
+        stamp = _path_stamp(path)
+        with self._lock:
+            cached = self._models.get(key)
+            if cached is not None and cached[0] == stamp:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return cached[2]
+        self.misses += 1
+
+        model = loader(path)
+        size = _path_size(path)
+        with self._lock:
+            self._models.pop(key, None)
+            if size <= self.max_bytes:
+                self._models[key] = (stamp, size, model)
+            self._evict_over_bounds()
+        return model
+
+    def _evict_over_bounds(self) -> None:
+        """ Evict the least recently used models until the cache is within its bounds """
+        total = sum(size for _, size, _ in self._models.values())
+        while self._models and (total > self.max_bytes or self.max_models is not None
+                                and len(self._models) > self.max_models):
+            key, (_, size, _) = self._models.popitem(last=False)
+            total -= size
+            logger.debug("Evicted %s from the model cache", key)
+
+    def evict(self, path: str) -> bool:
+        """ Remove a model from the cache, return whether it was cached """
+        with self._lock:
+            return self._models.pop(os.path.abspath(path), None) is not None
+
+    def clear(self) -> None:
+        """ Remove every model from the cache """
+        with self._lock:
+            self._models.clear()
+
+
+# cache of the models loaded by `score_model.load_model`
+MODEL_CACHE = ModelCache()
+
+
+def parse_metrics(path: str) -> Dict[str, float]:
+    """ Numeric metrics of a metrics file written by `evaluate_performance.write_metrics`
+
+    Args:
+        path (`str`): path to the metrics (txt)
+
+    Returns:
+        metrics (`dict`): value of every line like "AUC on test: 0.987", keyed by its label
+    """
+    metrics = {}
+    with open(path, "r", encoding="ASCII") as metrics_file:
+        for line in metrics_file:
+            label, _, value = line.strip().partition(": ")
+            try:
+                metrics[label] = float(value)
+            except ValueError:
+                continue
+    return metrics
+
+
+def register_model(registry_dir: str, version: Any, model_path: str,
+                   training_paths: List[str], compact_model_path: Optional[str] = None,
+                   metrics_path: Optional[str] = None, overwrite: bool = False
+                   ) -> Dict[str, Any]:
+    """ Store a fitted model under its version with its metadata
+
+    Args:
+        registry_dir (`str`): directory of the registry
+        version: version of the model, like the `model.version` of the configuration
+        model_path (`str`): path to the fitted classifier (joblib)
+        training_paths (:obj:`list` of `str`): paths to the data the model was trained on,
+            whose SHA-256 are saved with it
+        compact_model_path (`str`, optional): path to the compact model (.forest)
+        metrics_path (`str`, optional): path to the test metrics (txt)
+        overwrite (`bool`): replace the model if the version is already registered
+
+    Returns:
+        metadata (`dict`): content of the metadata of the version
+
+    Raises:
+        FileExistsError: if the version is registered and `overwrite` is False
+        FileNotFoundError: if the model, the compact model, the metrics or the training data
+            does not exist
+    """
+    version = str(version)
+    version_dir = os.path.join(registry_dir, version)
+    if os.path.exists(version_dir) and not overwrite:
+        logger.error("Version %s is already registered", version)
+        raise FileExistsError(f"Version {version} is already registered in {registry_dir}")
+
+    # joblib is only needed to register a model, not to resolve a version
+    import joblib  # pylint: disable=import-outside-toplevel
+
+    model = joblib.load(model_path)
+    params = {name: value for name, value in model.get_params().items()
+              if value is None or isinstance(value, (bool, int, float, str))}
+    feature_names = getattr(model, "feature_names_in_", None)
+    metadata = {
+        "version": version,
+        "registered": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "registered_ns": time.time_ns(),
+        "model_class": type(model).__name__,
+        "features": [str(name) for name in feature_names] if feature_names is not None else None,
+        "classes": model.classes_.tolist(),
+        "hyperparameters": params,
+        "training_data": {path: stage_cache.hash_path(path) for path in training_paths},
+        "metrics": parse_metrics(metrics_path) if metrics_path is not None else None,
+    }
+
+    # copy into a new directory first, so a failed registration leaves the old version intact
+    staging_dir = version_dir + ".partial"
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    os.makedirs(staging_dir)
+    shutil.copyfile(model_path, os.path.join(staging_dir, MODEL_FILE))
+    if compact_model_path is not None:
+        shutil.copytree(compact_model_path, os.path.join(staging_dir, COMPACT_MODEL_FILE))
+    if metrics_path is not None:
+        shutil.copyfile(metrics_path, os.path.join(staging_dir, METRICS_FILE))
+    with open(os.path.join(staging_dir, METADATA_FILE), "w", encoding="utf-8") as meta_file:
+        json.dump(metadata, meta_file, indent=2)
+    shutil.rmtree(version_dir, ignore_errors=True)
+    os.replace(staging_dir, version_dir)
+    return metadata
+
+
+def list_versions(registry_dir: str) -> List[Dict[str, Any]]:
+    """ Metadata of every registered version, oldest registration first
+
+    Args:
+        registry_dir (`str`): directory of the registry
+
+    Returns:
+        versions (:obj:`list` of `dict`): metadata of every version
+    """
+    versions = []
+    if not os.path.isdir(registry_dir):
+        return versions
+    for name in os.listdir(registry_dir):
+        meta_path = os.path.join(registry_dir, name, METADATA_FILE)
+        if os.path.isfile(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as meta_file:
+                versions.append(json.load(meta_file))
+    return sorted(versions, key=lambda metadata: metadata["registered_ns"])
+
+
+def resolve_model(registry_dir: str, version: Any = "latest", compact: bool = True) -> str:
+    """ Path to the model of a registered version
+
+    Args:
+        registry_dir (`str`): directory of the registry
+        version: registered version, or "latest" for the last registered version
+        compact (`bool`): prefer the compact model (.forest) when the version has one
+
+    Returns:
+        path (`str`): path to the model
+
+    Raises:
+        FileNotFoundError: if the version is not registered
+    """
+    version = str(version)
+    if version == "latest":
+        versions = list_versions(registry_dir)
+        if not versions:
+            raise FileNotFoundError(f"No model is registered in {registry_dir}")
+        version = versions[-1]["version"]
+    version_dir = os.path.join(registry_dir, version)
+    if not os.path.isfile(os.path.join(version_dir, METADATA_FILE)):
+        raise FileNotFoundError(f"Version {version} is not registered in {registry_dir}")
+    compact_path = os.path.join(version_dir, COMPACT_MODEL_FILE)
+    if compact and os.path.isdir(compact_path):
+        return compact_path
+    return os.path.join(version_dir, MODEL_FILE)
+
+
+def register(registry_dir: str, version: Any, model_path: str, training_paths: List[str],
+             compact_model_path: Optional[str] = None, metrics_path: Optional[str] = None,
+             overwrite: bool = False) -> None:
+    """ Register a fitted model, see `register_model`
+
+    Returns:
+        None
+    """
+    try:
+        metadata = register_model(registry_dir, version, model_path, training_paths,
+                                  compact_model_path, metrics_path, overwrite)
+    except FileExistsError:
+        logger.error("Version %s is already registered, change `model.version` or set "
+                     "`overwrite` to replace it", version)
+        sys.exit(1)
+    except FileNotFoundError as error:
+        logger.error("No such file or directory to register %s. Please try again.",
+                     error.filename)
+        sys.exit(1)
+
+    logger.info("Model is successfully registered as version %s in %s", metadata["version"],
+                registry_dir)
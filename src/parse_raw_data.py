@@ -0,0 +1,320 @@
+"""
+This module is to stream labeled segments of whitespace-delimited numeric rows
+out of raw data files without holding the whole file in memory.
+
+Segments are either streamed from the start of the file, or read directly with a line
+index: a sidecar file holding the byte offset of every `stride`-th line, built once by
+scanning the file. With the index, only the bytes of the segments are read and parsed, and
+the segments are parsed in parallel.
+"""
+import collections
+import concurrent.futures
+import logging.config
+import os
+from typing import BinaryIO, Deque, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# number of bytes read from the raw file per chunk
+DEFAULT_CHUNK_SIZE = 1 << 22
+
+# number of lines between two byte offsets of the line index
+DEFAULT_INDEX_STRIDE = 1024
+
+# fewest bytes of segments parsed by a pool of processes, smaller reads are parsed serially
+# because starting the pool would take longer than parsing them
+MIN_PARALLEL_BYTES = 1 << 25
+
+# suffix of the sidecar line index of a raw file
+INDEX_SUFFIX = ".lineindex.npz"
+
+NEWLINE = ord("\n")
+
+
+class LineIndex(NamedTuple):
+    """ Byte offsets of every `stride`-th line of a file, with the size and modification time
+    of the file it was built from """
+    offsets: np.ndarray
+    stride: int
+    n_lines: int
+    size: int
+    mtime_ns: int
+
+
+def validate_segments(segments: Sequence[Sequence[int]]) -> List[Tuple[int, int]]:
+    """ Check that segments are ascending, non-overlapping [start, stop) line ranges
+
+    Args:
+        segments (:obj:`list` of :obj:`list` of `int`): list like [[start, stop], ...]
+            of zero-based line ranges (stop excluded)
+
+    Returns:
+        bounds (:obj:`list` of :obj:`tuple`): validated (start, stop) pairs
+    """
+    bounds = []
+    for segment in segments:
+        try:
+            start, stop = segment
+        except (TypeError, ValueError) as error:
+            raise TypeError("Each segment should be a list of two integers") from error
+        if not all(isinstance(item, int) for item in (start, stop)):
+            raise TypeError("Each segment should be a list of two integers")
+        if start < 0 or stop < start:
+            raise ValueError("Each segment should satisfy 0 <= start <= stop")
+        if bounds and start < bounds[-1][1]:
+            raise ValueError("Segments should be in ascending order and should not overlap")
+        bounds.append((start, stop))
+
+    return bounds
+
+
+def parse_block(block: bytes, n_rows: int, n_columns: int) -> np.ndarray:
+    """ Parse whitespace-separated numeric lines into a float matrix
+
+    Args:
+        block (`bytes`): complete lines of whitespace-separated numbers
+        n_rows (`int`): number of lines in `block`
+        n_columns (`int`): number of values on every line
+
+    Returns:
+        values (:obj:`numpy.ndarray`): float64 array of shape (n_rows, n_columns)
+    """
+    values = np.fromstring(block, dtype=np.float64, sep=" ")
+    if values.size != n_rows * n_columns:
+        raise ValueError(f"Expected {n_rows * n_columns} values in {n_rows} lines "
+                         f"but parsed {values.size}")
+
+    return values.reshape(n_rows, n_columns)
+
+
+def iter_segment_blocks(input_file: BinaryIO, segments: Sequence[Sequence[int]], n_columns: int,
+                        chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Tuple[int, np.ndarray]]:
+    """ Stream the rows of each segment out of a raw file in fixed-size chunks
+
+    Only one chunk (plus one partial line) is held in memory at a time, so the
+    memory used does not depend on the size of the raw file. Segments running
+    past the end of the file are truncated like a list slice would be.
+
+    Args:
+        input_file (:obj:`BinaryIO`): raw data file opened in binary mode
+        segments (:obj:`list` of :obj:`list` of `int`): list like [[start, stop], ...]
+            of zero-based line ranges (stop excluded)
+        n_columns (`int`): number of values on every line of a segment
+        chunk_size (`int`): number of bytes to read per chunk
+
+    Yields:
+        (`int`, :obj:`numpy.ndarray`): position of the segment in `segments` and
+            a float64 block of its rows with shape (rows, n_columns)
+    """
+    bounds = validate_segments(segments)
+    if chunk_size <= 0:
+        raise ValueError("chunk_size has to be greater than 0")
+
+    current = 0
+    line_number = 0
+    remainder = b""
+    while current < len(bounds):
+        chunk = input_file.read(chunk_size)
+        if chunk:
+            buffer = remainder + chunk
+            last_newline = buffer.rfind(b"\n")
+            if last_newline < 0:
+                remainder = buffer
+                continue
+            remainder = buffer[last_newline + 1:]
+            buffer = buffer[:last_newline + 1]
+        elif remainder:
+            # last line of the file has no trailing newline
+            buffer, remainder = remainder + b"\n", b""
+        else:
+            break
+
+        newlines = np.flatnonzero(np.frombuffer(buffer, dtype=np.uint8) == NEWLINE)
+        chunk_end = line_number + newlines.size
+
+        while current < len(bounds) and bounds[current][0] < chunk_end:
+            start, stop = bounds[current]
+            first = max(start, line_number) - line_number
+            last = min(stop, chunk_end) - line_number
+            if last > first:
+                begin = newlines[first - 1] + 1 if first > 0 else 0
+                end = newlines[last - 1] + 1
+                yield current, parse_block(buffer[begin:end], last - first, n_columns)
+            if stop > chunk_end:
+                break
+            current += 1
+
+        line_number = chunk_end
+
+
+def build_index(input_path: str, stride: int = DEFAULT_INDEX_STRIDE,
+                chunk_size: int = DEFAULT_CHUNK_SIZE) -> LineIndex:
+    """ Scan a file once for the byte offsets of its lines
+
+    Args:
+        input_path (`str`): path to the raw file
+        stride (`int`): number of lines between two offsets, 1 to record every line
+        chunk_size (`int`): number of bytes to read from the raw file at a time
+
+    Returns:
+        index (:obj:`LineIndex`): offset of lines 0, stride, 2 * stride, ...
+
+    Raises:
+        FileNotFoundError: if the raw file does not exist
+    """
+    if stride <= 0 or chunk_size <= 0:
+        raise ValueError("stride and chunk_size have to be greater than 0")
+
+    status = os.stat(input_path)
+    offsets = [np.zeros(1, dtype=np.int64)]
+    n_newlines = 0
+    position = 0
+    last_byte = NEWLINE
+    with open(input_path, mode="rb") as input_file:
+        for chunk in iter(lambda: input_file.read(chunk_size), b""):
+            newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == NEWLINE)
+            # line k starts after the newline ending line k - 1
+            first = -(n_newlines + 1) % stride
+            offsets.append(position + newlines[first::stride].astype(np.int64) + 1)
+            n_newlines += newlines.size
+            position += len(chunk)
+            last_byte = chunk[-1]
+
+    n_lines = n_newlines + (last_byte != NEWLINE)
+    offsets = np.concatenate(offsets)
+    # drop the offset of the empty line after a trailing newline
+    offsets = offsets[:(n_lines - 1) // stride + 1] if n_lines else offsets[:1]
+    return LineIndex(offsets, stride, n_lines, status.st_size, status.st_mtime_ns)
+
+
+def save_index(index: LineIndex, index_path: str) -> None:
+    """ Save a line index to a sidecar file (.npz) """
+    with open(index_path, mode="wb") as index_file:
+        np.savez(index_file, offsets=index.offsets,
+                 meta=np.array([index.stride, index.n_lines, index.size, index.mtime_ns],
+                               dtype=np.int64))
+
+
+def load_index(input_path: str, index_path: Optional[str] = None,
+               stride: int = DEFAULT_INDEX_STRIDE) -> LineIndex:
+    """ Load the sidecar line index of a file, building and saving it first if it is missing,
+    was built with another stride, or is older than the file
+
+    Args:
+        input_path (`str`): path to the raw file
+        index_path (`str`, optional): path to the sidecar index, `input_path` followed by
+            `INDEX_SUFFIX` if None
+        stride (`int`): number of lines between two offsets
+
+    Returns:
+        index (:obj:`LineIndex`): index matching the current content of the file
+
+    Raises:
+        FileNotFoundError: if the raw file does not exist
+    """
+    index_path = index_path or input_path + INDEX_SUFFIX
+    status = os.stat(input_path)
+    try:
+        with np.load(index_path) as stored:
+            index = LineIndex(stored["offsets"], *(int(value) for value in stored["meta"]))
+        if (index.stride, index.size, index.mtime_ns) == (stride, status.st_size,
+                                                          status.st_mtime_ns):
+            return index
+    except (FileNotFoundError, KeyError, ValueError, TypeError):
+        pass
+
+    logger.info("Indexing the lines of %s", input_path)
+    index = build_index(input_path, stride)
+    try:
+        save_index(index, index_path)
+    except OSError as error:
+        logger.warning("Cannot save the line index to %s: %s", index_path, error)
+    return index
+
+
+def _line_bytes(index: LineIndex, start: int, stop: int) -> Tuple[int, int, int]:
+    """ Byte range holding lines [start, stop) and the number of lines before `start` in it """
+    first = start // index.stride
+    last = -(-stop // index.stride)
+    end = index.offsets[last] if last < len(index.offsets) else index.size
+    return int(index.offsets[first]), int(end), start - first * index.stride
+
+
+def parse_lines(input_path: str, begin: int, end: int, skip: int, n_rows: int,
+                n_columns: int) -> np.ndarray:
+    """ Parse `n_rows` lines after the first `skip` lines of the bytes [begin, end) of a file
+
+    Returns:
+        values (:obj:`numpy.ndarray`): float64 array of shape (n_rows, n_columns)
+    """
+    with open(input_path, mode="rb") as input_file:
+        input_file.seek(begin)
+        buffer = input_file.read(end - begin)
+
+    newlines = np.flatnonzero(np.frombuffer(buffer, dtype=np.uint8) == NEWLINE)
+    first = newlines[skip - 1] + 1 if skip > 0 else 0
+    last = newlines[skip + n_rows - 1] + 1 if skip + n_rows - 1 < newlines.size else len(buffer)
+    return parse_block(buffer[first:last], n_rows, n_columns)
+
+
+def iter_indexed_blocks(input_path: str, segments: Sequence[Sequence[int]], n_columns: int,
+                        index: LineIndex, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                        n_workers: Optional[int] = None) -> Iterator[Tuple[int, np.ndarray]]:
+    """ Read the rows of each segment directly at their byte offsets
+
+    Segments are split into blocks of about `chunk_size` bytes that are parsed by a pool of
+    processes, at most two blocks per process ahead of the one being yielded, so memory use
+    does not depend on the size of the segments. Segments of less than `MIN_PARALLEL_BYTES`
+    bytes in total, or a single worker, are parsed serially in this process. Segments can be
+    in any order and overlap, and segments running past the end of the file are truncated
+    like a list slice would be.
+
+    Args:
+        input_path (`str`): path to the raw file
+        segments (:obj:`list` of :obj:`list` of `int`): list like [[start, stop], ...]
+            of zero-based line ranges (stop excluded)
+        n_columns (`int`): number of values on every line of a segment
+        index (:obj:`LineIndex`): line index of the file, see `load_index`
+        chunk_size (`int`): number of bytes parsed at a time by a worker
+        n_workers (`int`, optional): number of worker processes, all CPUs if None
+
+    Yields:
+        (`int`, :obj:`numpy.ndarray`): position of the segment in `segments` and
+            a float64 block of its rows with shape (rows, n_columns), in order
+    """
+    bounds = [validate_segments([segment])[0] for segment in segments]
+    if chunk_size <= 0:
+        raise ValueError("chunk_size has to be greater than 0")
+    status = os.stat(input_path)
+    if (status.st_size, status.st_mtime_ns) != (index.size, index.mtime_ns):
+        raise ValueError(f"The line index is out of date for {input_path}")
+
+    rows_per_block = max(1, chunk_size * index.n_lines // max(index.size, 1))
+    tasks, n_bytes = [], 0
+    for position, (start, stop) in enumerate(bounds):
+        stop = min(stop, index.n_lines)
+        for block_start in range(start, stop, rows_per_block):
+            block_stop = min(block_start + rows_per_block, stop)
+            begin, end, skip = _line_bytes(index, block_start, block_stop)
+            n_bytes += end - begin
+            tasks.append((position, (input_path, begin, end, skip, block_stop - block_start,
+                                     n_columns)))
+
+    n_workers = min(n_workers or os.cpu_count() or 1, len(tasks))
+    if n_workers <= 1 or n_bytes < MIN_PARALLEL_BYTES:
+        for position, arguments in tasks:
+            yield position, parse_lines(*arguments)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as pool:
+        pending: Deque[Tuple[int, concurrent.futures.Future]] = collections.deque()
+        for position, arguments in tasks:
+            pending.append((position, pool.submit(parse_lines, *arguments)))
+            if len(pending) > 2 * n_workers:
+                position, future = pending.popleft()
+                yield position, future.result()
+        while pending:
+            position, future = pending.popleft()
+            yield position, future.result()
@@ -0,0 +1,269 @@
+"""
+This module is to run the model pipeline stages in a single process, passing dataframes
+and the fitted model directly from one stage to the next instead of through files.
+"""
+import logging.config
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import sys
+
+import pandas as pd
+
+from src import artifact_io, create_datasets, dtype_schema, index_split, process_data
+from src import generate_additional_features
+from src import train_model, score_model, evaluate_performance, instrumentation
+
+logger = logging.getLogger(__name__)
+
+STAGES = ["get_clouds", "generate_features", "split_data", "fit_model", "predict", "evaluate"]
+
+
+def generate_features(data: pd.DataFrame,
+                      config: Dict[str, Any]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """ Get features, with the additional features, and target from cleaned clouds data
+
+    Args:
+        data (:obj:`pandas.DataFrame`): cleaned clouds data
+        config (`dict`): model pipeline configuration
+
+    Returns:
+        features (:obj:`pandas.DataFrame`): features including the additional features
+        target (:obj:`pandas.DataFrame`): single-column dataframe with the target
+    """
+    features = process_data.get_features(data, **config["process_data"]["get_features"])
+    target = process_data.get_target(data, config["process_data"]["get_target"]["column"])
+
+    plan = generate_additional_features.compile_feature_plan(
+        config["generate_additional_features"], list(features.columns))
+    features = generate_additional_features.apply_feature_plan(
+        features, plan, **config.get("feature_plan", {}))
+
+    return features, target
+
+
+def _read(path: str, columns: Optional[List[str]] = None,
+          dtypes: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+    """ Read an intermediate artifact written by an earlier run, cast to the dtype schema """
+    schema = dtype_schema.resolve(dtypes)
+    try:
+        return dtype_schema.cast_frame(
+            artifact_io.read_table(path, columns=columns, dtype=dtype_schema.read_dtypes(schema)),
+            schema)
+    except FileNotFoundError:
+        logger.error("Cannot find %s, run the stage that writes it first", path)
+        sys.exit(1)
+    except KeyError:
+        logger.error("Provided columns are not all in %s", path)
+        sys.exit(1)
+    except ValueError as error:
+        logger.error("%s does not fit the dtype schema: %s", path, error)
+        sys.exit(1)
+
+
+def _write(data: pd.DataFrame, path: str) -> None:
+    """ Persist an intermediate artifact """
+    try:
+        artifact_io.write_table(data, path)
+    except FileNotFoundError:
+        logger.error("No such file or directory to save %s. Please try again.", path)
+        sys.exit(1)
+    except ValueError as error:
+        logger.error("Cannot save %s: %s", path, error)
+        sys.exit(1)
+
+
+def _split_rows(state: Dict[str, Any], stage_config: Dict[str, Any], part: str, source: str,
+                columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """ Rows of the train or test set of an index split, from the data in memory or on disk """
+    if "split" not in state:
+        try:
+            state["split"] = index_split.load_split(stage_config["split_path"])
+        except FileNotFoundError:
+            logger.error("Cannot find %s, run the stage that writes it first",
+                         stage_config["split_path"])
+            sys.exit(1)
+    split = state["split"]
+    name = "features" if source == "feature" else "target"
+    data = (state[name] if name in state
+            else _read(split.meta[source + "_path"], columns, stage_config.get("dtypes")))
+    try:
+        return index_split.take_rows(data, split, part, stage_config.get("fold"))
+    except ValueError as error:
+        logger.error("Cannot read the %s rows of the split: %s", part, error)
+        sys.exit(1)
+
+
+def _get_clouds(config: Dict[str, Any], state: Dict[str, Any], persist: bool) -> None:
+    """ Parse the two clouds from the raw data """
+    stage_config = dict(config["create_datasets"]["get_clouds"])
+    output_path = stage_config.pop("output_path")
+
+    state["clouds"] = create_datasets.load_clouds(**stage_config)
+    if persist:
+        _write(state["clouds"], output_path)
+
+
+def _generate_features(config: Dict[str, Any], state: Dict[str, Any], persist: bool) -> None:
+    """ Get features, additional features and target from the clouds """
+    if "clouds" not in state:
+        state["clouds"] = process_data.load_data(**config["process_data"]["load_data"])
+
+    state["features"], state["target"] = generate_features(state["clouds"], config)
+    if persist:
+        process_data.save_features(state["features"],
+                                   **config["process_data"]["save_features"])
+        _write(state["target"], config["process_data"]["get_target"]["output_path"])
+
+
+def _split_data(config: Dict[str, Any], state: Dict[str, Any], persist: bool) -> None:
+    """ Split features and target into train and test set """
+    stage_config = config["train_model"]["split_data"]
+    if "features" not in state:
+        state["features"] = _read(stage_config["feature_path"],
+                                  dtypes=stage_config.get("dtypes"))
+        state["target"] = _read(stage_config["target_path"], dtypes=stage_config.get("dtypes"))
+
+    if stage_config.get("split_path") is not None:
+        # only the row numbers are kept, later stages take their rows from the data
+        group_column = stage_config.get("group_column")
+        meta = {"feature_path": stage_config["feature_path"],
+                "target_path": stage_config["target_path"], "n_rows": len(state["target"]),
+                "method": stage_config.get("method", "random"),
+                "test_size": stage_config["test_size"],
+                "random_state": stage_config["random_state"], "group_column": group_column,
+                "n_folds": stage_config.get("n_folds")}
+        try:
+            with instrumentation.span("split", rows=len(state["target"])):
+                arrays = index_split.make_split(
+                    meta["n_rows"], meta["test_size"], meta["random_state"], meta["method"],
+                    target=state["target"].to_numpy().ravel(),
+                    groups=(state["features"][group_column].to_numpy()
+                            if group_column is not None else None),
+                    n_folds=meta["n_folds"])
+        except (KeyError, ValueError) as error:
+            logger.error("Cannot split the rows: %s", error)
+            sys.exit(1)
+        state["split"] = index_split.IndexSplit(arrays, meta)
+        if persist:
+            try:
+                index_split.save_split(arrays, meta, stage_config["split_path"])
+            except FileNotFoundError:
+                logger.error("No such file or directory to save %s. Please try again.",
+                             stage_config["split_path"])
+                sys.exit(1)
+        return
+
+    splits = train_model.split_frames(state["features"], state["target"],
+                                      stage_config["test_size"], stage_config["random_state"])
+    for name, split in zip(["x_train", "x_test", "y_train", "y_test"], splits):
+        state[name] = split
+        if persist:
+            _write(split, stage_config[name + "_path"])
+
+
+def _fit_model(config: Dict[str, Any], state: Dict[str, Any], persist: bool) -> None:
+    """ Train the random forest classifier """
+    stage_config = config["train_model"]["fit_model"]
+    if "x_train" not in state and stage_config.get("split_path") is not None:
+        state["x_train"] = _split_rows(state, stage_config, "train", "feature",
+                                       stage_config["initial_features"])
+        state["y_train"] = _split_rows(state, stage_config, "train", "target")
+    elif "x_train" not in state:
+        state["x_train"] = _read(stage_config["x_train_path"], stage_config["initial_features"],
+                                 stage_config.get("dtypes"))
+        state["y_train"] = _read(stage_config["y_train_path"], dtypes=stage_config.get("dtypes"))
+
+    state["model"] = train_model.train_classifier(
+        state["x_train"], state["y_train"], stage_config["initial_features"],
+        stage_config["n_estimators"], stage_config["max_depth"], stage_config["random_state"],
+        stage_config.get("distributed"))
+    if persist:
+        train_model.save_model(state["model"], stage_config["output_path"],
+                               stage_config.get("compact_output_path"))
+
+
+def _predict(config: Dict[str, Any], state: Dict[str, Any], persist: bool) -> None:
+    """ Predict the test set with the fitted classifier """
+    stage_config = config["score_model"]["predict"]
+    if "model" not in state:
+        state["model"] = score_model.load_model(stage_config["input_path"])
+    if "x_test" not in state and stage_config.get("split_path") is not None:
+        state["x_test"] = _split_rows(state, stage_config, "test", "feature",
+                                      stage_config["initial_features"])
+    elif "x_test" not in state:
+        state["x_test"] = _read(stage_config["x_test_path"], stage_config["initial_features"],
+                                stage_config.get("dtypes"))
+
+    state["ypred_proba_test"], state["ypred_bin_test"] = score_model.predict_frame(
+        state["model"], state["x_test"], stage_config["initial_features"],
+        stage_config.get("engine", "sklearn"))
+    if persist:
+        score_model.save_predictions(state["ypred_proba_test"], state["ypred_bin_test"],
+                                     stage_config["proba_output_path"],
+                                     stage_config["bin_output_path"])
+
+
+def _evaluate(config: Dict[str, Any], state: Dict[str, Any], persist: bool) -> None:
+    """ Compute test metrics and save them """
+    # metrics are the only output of the last stage, so they are always saved
+    del persist
+    stage_config = config["evaluate_performance"]["evaluate"]
+    if "ypred_proba_test" not in state:
+        state["ypred_proba_test"], state["ypred_bin_test"] = evaluate_performance.load_predictions(
+            stage_config["proba_input_path"], stage_config["bin_input_path"])
+    if "y_test" not in state and stage_config.get("split_path") is not None:
+        state["y_test"] = _split_rows(state, stage_config, "test", "target")
+    elif "y_test" not in state:
+        state["y_test"] = _read(stage_config["y_test_path"])
+
+    state["metrics"] = evaluate_performance.compute_metrics(
+        state["y_test"], state["ypred_proba_test"], state["ypred_bin_test"])
+    if stage_config.get("bootstrap_config") is not None:
+        evaluate_performance.add_intervals(state["metrics"], state["y_test"],
+                                           state["ypred_proba_test"], state["ypred_bin_test"],
+                                           stage_config["bootstrap_config"])
+    evaluate_performance.write_metrics(state["metrics"], stage_config["output_path"])
+
+
+STAGE_FUNCTIONS: Dict[str, Callable[[Dict[str, Any], Dict[str, Any], bool], None]] = {
+    "get_clouds": _get_clouds,
+    "generate_features": _generate_features,
+    "split_data": _split_data,
+    "fit_model": _fit_model,
+    "predict": _predict,
+    "evaluate": _evaluate,
+}
+
+
+def run_pipeline(config: Dict[str, Any], start: str = STAGES[0], stop: str = STAGES[-1],
+                 persist: bool = False) -> Dict[str, Any]:
+    """ Run the pipeline stages from `start` to `stop` (both included) in this process
+
+    Stages pass their outputs to the next stage in memory. The first stage reads its
+    inputs from the paths in `config`, and the outputs of the last stage are always
+    saved to the paths in `config`; the outputs of the other stages only if `persist`.
+
+    Args:
+        config (`dict`): model pipeline configuration
+        start (`str`): first stage to run, one of `STAGES`
+        stop (`str`): last stage to run, one of `STAGES`
+        persist (`bool`): whether to save the outputs of every stage
+
+    Returns:
+        state (`dict`): dataframes, model, predictions and metrics produced by the stages
+    """
+    if start not in STAGES or stop not in STAGES:
+        logger.error("Stages should be among %s", STAGES)
+        raise ValueError(f"Stages should be among {STAGES}")
+    if STAGES.index(start) > STAGES.index(stop):
+        logger.error("Stage %s comes after stage %s", start, stop)
+        raise ValueError(f"Stage {start} comes after stage {stop}")
+
+    stages = STAGES[STAGES.index(start):STAGES.index(stop) + 1]
+    state: Dict[str, Any] = {}
+    for stage in stages:
+        logger.info("Running pipeline stage %s", stage)
+        with instrumentation.span(stage):
+            STAGE_FUNCTIONS[stage](config, state, persist or stage == stop)
+
+    logger.info("Pipeline stages %s to %s are successfully completed", start, stop)
+    return state
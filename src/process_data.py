@@ -1,52 +1,71 @@
 """
 This module is to load cleaned clouds data, acquire features and target from the data,
-and save features and target as separate csv files to given outuput path.
+and save features and target as separate files to given outuput path.
 """
 import logging.config
-from typing import List
+from typing import Dict, List, Optional
 import sys
 
 import pandas as pd
 
+from src import artifact_io, dtype_schema
+
 logger = logging.getLogger(__name__)
 
 
-def load_data(input_path: str) -> pd.DataFrame:
+def load_data(input_path: str, dtypes: Optional[Dict[str, str]] = None) -> pd.DataFrame:
     """ Load cleaned data
 
     Args:
-        input_path (`str`): path to cleaned data (csv)
+        input_path (`str`): path to cleaned data (csv, parquet, feather or npcols)
+        dtypes (`dict`, optional): dtype schema the data are downcast to while they are read
+            (see `src.dtype_schema`), dtypes of the file if None
     Returns:
         data (:obj:`pandas.DataFrame): pandas dataframe
     """
     # load clouds data
     logger.info("Loading clouds data")
+    schema = dtype_schema.resolve(dtypes)
 
     try:
-        data = pd.read_csv(input_path, index_col=False)
+        data = artifact_io.read_table(input_path, dtype=dtype_schema.read_dtypes(schema))
     except FileNotFoundError:
         logger.error("No such file or directory to load clouds data. Please try again.")
         sys.exit(1)
+    except ValueError as error:
+        logger.error("Cannot read clouds data: %s", error)
+        sys.exit(1)
+    try:
+        data = dtype_schema.cast_frame(data, schema)
+    except ValueError as error:
+        logger.error("Clouds data do not fit the dtype schema: %s", error)
+        sys.exit(1)
 
     logger.info("Clouds data is successfully loaded")
     return data
 
 
-def get_features(data: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+def get_features(data: pd.DataFrame, columns: List[str],
+                 dtypes: Optional[Dict[str, str]] = None) -> pd.DataFrame:
     """ Get features from data
 
     Args:
         data (:obj:`pandas.DataFrame`): data to get features from
         columns (:obj:`list` of `str`): list of column names
+        dtypes (`dict`, optional): dtype schema of the features (see `src.dtype_schema`),
+            common dtype of the columns if None
 
     Returns:
-       features (:obj:`pandas.DataFrame`): dataframe with selected features
+       features (:obj:`pandas.DataFrame`): dataframe with selected features, backed by a
+           single contiguous matrix
     """
     # get features from data
     logger.info("Getting features from clouds data")
+    schema = dtype_schema.resolve(dtypes)
 
     try:
-        features = data[columns]
+        features = dtype_schema.feature_frame(data, columns,
+                                              schema.features if schema is not None else None)
     except KeyError:
         logger.error("At least one of column in provided `columns` "
                      "are not included in provided `data`")
@@ -62,7 +81,7 @@ def save_features(features: pd.DataFrame, output_path: str) -> None:
 
     Args:
         features (:obj:`pandas.DataFrame`): pandas dataframe
-        output_path (`str`): path to save acquired data (csv)
+        output_path (`str`): path to save acquired data (csv, parquet, feather or npcols)
 
     Returns:
         None
@@ -71,34 +90,47 @@ def save_features(features: pd.DataFrame, output_path: str) -> None:
     logger.info("Saving features to given output path")
 
     try:
-        features.to_csv(output_path, index=False)
+        artifact_io.write_table(features, output_path)
     except FileNotFoundError:
         logger.error("No such file or directory to load features. Please try again.")
         sys.exit(1)
+    except ValueError as error:
+        logger.error("Cannot save features: %s", error)
+        sys.exit(1)
 
     logger.info("Features are successfully saved to given output path")
 
 
-def get_target(data: pd.DataFrame, column: str, output_path: str) -> None:
+def get_target(data: pd.DataFrame, column: str,
+               output_path: Optional[str] = None) -> pd.DataFrame:
     """ Get target from data
 
         Args:
             data (:obj:`pandas.DataFrame`): data to get features from
             column (`str`): column name for target
-            output_path (`str`): path to save acquired data (csv)
+            output_path (`str`, optional): path to save acquired data
+                (csv, parquet, feather or npcols), not saved if None
         Returns:
-            None
+            target (:obj:`pandas.DataFrame`): single-column dataframe with the target
     """
     # acquire target from given data
     try:
-        target = data[column]
+        target = data[[column]]
     except KeyError:
         logger.error("Provided `column` is not in provided `data`")
         sys.exit(1)
 
+    if output_path is None:
+        return target
+
     # save target to output path
     try:
-        target.to_csv(output_path, index=False)
+        artifact_io.write_table(target, output_path)
     except FileNotFoundError:
         logger.error("No such file or directory to load target. Please try again.")
         sys.exit(1)
+    except ValueError as error:
+        logger.error("Cannot save target: %s", error)
+        sys.exit(1)
+
+    return target
@@ -1,47 +1,90 @@
 """ Predict test data with pre-trained model """
+import itertools
 import logging.config
-from typing import List
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, TextIO, Tuple
 import sys
 
-import pandas as pd
 import numpy as np
-import joblib
+import pandas as pd
+
+from src import artifact_io, dtype_schema, generate_additional_features, instrumentation
+from src import index_split, model_format, model_registry
 
 logger = logging.getLogger(__name__)
 
+ENGINES = ["sklearn", "flat"]
+
+# marks the end of the chunks passed between the threads of `predict_stream`
+_END = object()
+
+
+def _read_model(input_path: str) -> Any:
+    """ Load a model from disk, memory-mapping compact models """
+    if model_format.is_compact_model(input_path):
+        return model_format.load_compact_model(input_path)
+    # joblib is only needed for models that are not compact
+    import joblib  # pylint: disable=import-outside-toplevel
+
+    return joblib.load(input_path)
+
+
+def load_model(input_path: str,
+               cache: Optional[model_registry.ModelCache] = model_registry.MODEL_CACHE) -> Any:
+    """ Load pretrained model
 
-def predict(input_path: str, x_test_path: str, initial_features: List[str],
-            proba_output_path: str, bin_output_path: str) -> None:
-    """ predict test data with given model
     Args:
-        input_path (str): input path to pretrained model (joblib)
-        x_test_path (`str`): path to test data for features (csv)
-        initial_features (:obj:`list` of `str`): list of column names
-        proba_output_path (`str`): output path to save predicted probability (csv)
-        bin_output_path (`str`): output path to save predicted class (csv)
+        input_path (str): input path to pretrained model (joblib, or a compact .forest model
+            which is memory-mapped instead of unpickled)
+        cache (:obj:`model_registry.ModelCache`, optional): cache of the recently used
+            models, returning the model without loading it again while it is unchanged on
+            disk; loaded every time if None
     Returns:
-        None
+        model: pretrained model, shared with the other users of the cache
     """
-    # load model
     logger.info("Loading model for prediction")
     try:
-        model = joblib.load(input_path)
+        if cache is None:
+            model = _read_model(input_path)
+        else:
+            model = cache.get(input_path, _read_model)
     except FileNotFoundError:
         logger.error("Cannot find the given model file")
         sys.exit(1)
-    # load test data
-    logger.info("Loading test data for prediction")
-    try:
-        x_test = pd.read_csv(x_test_path, index_col=False)
-    except FileNotFoundError:
-        logger.error("Cannot find the given test data file")
-        sys.exit(1)
 
-    # predict
+    return model
+
+
+def predict_frame(model: Any, x_test: pd.DataFrame, initial_features: List[str],
+                  engine: str = "sklearn") -> Tuple[np.ndarray, np.ndarray]:
+    """ predict in-memory test data with given model
+
+    The class is the argmax of the predicted probabilities, so the trees are only
+    traversed once.
+
+    Args:
+        model: pretrained model
+        x_test (:obj:`pandas.DataFrame`): test data for features
+        initial_features (:obj:`list` of `str`): list of column names
+        engine (`str`): "sklearn" to predict with the model itself, or "flat" to predict
+            with the vectorized engine of `src.forest_inference` (random forests only)
+    Returns:
+        ypred_proba_test (:obj:`numpy.ndarray`): predicted probability of the positive class
+        ypred_bin_test (:obj:`numpy.ndarray`): predicted class
+    """
+    if engine not in ENGINES:
+        logger.error("Unknown inference engine %s", engine)
+        raise ValueError(f"Unknown inference engine {engine!r}, expected one of {ENGINES}")
+    if engine == "flat":
+        model = model_format.to_compact(model)
+
     logger.info("Predicting with given model")
     try:
-        ypred_proba_test = model.predict_proba(x_test[initial_features])[:, 1]
-        ypred_bin_test = model.predict(x_test[initial_features])
+        x_test = dtype_schema.feature_frame(x_test, initial_features)
+        with instrumentation.span("predict", rows=len(x_test)):
+            ypred_proba = model.predict_proba(x_test)
+        ypred_proba_test = ypred_proba[:, 1]
     except KeyError:
         logger.error("Provided `Initial_features` are not all in provided test data or model")
         sys.exit(1)
@@ -51,18 +94,281 @@ def predict(input_path: str, x_test_path: str, initial_features: List[str],
     except IndexError:
         logger.error("Index 1 is out of bounds for axis 1 with size 1")
         sys.exit(1)
+    ypred_bin_test = model.classes_.take(np.argmax(ypred_proba, axis=1))
 
-    # save prediction to given output path
+    return ypred_proba_test, ypred_bin_test
+
+
+def save_predictions(ypred_proba_test: np.ndarray, ypred_bin_test: np.ndarray,
+                     proba_output_path: str, bin_output_path: str) -> None:
+    """ save predictions to given output paths
+    Args:
+        ypred_proba_test (:obj:`numpy.ndarray`): predicted probability of the positive class
+        ypred_bin_test (:obj:`numpy.ndarray`): predicted class
+        proba_output_path (`str`): output path to save predicted probability (csv)
+        bin_output_path (`str`): output path to save predicted class (csv)
+    Returns:
+        None
+    """
     logger.info("Saving predictions to given output paths")
+    with instrumentation.span("write_predictions", rows=len(ypred_proba_test)):
+        try:
+            np.savetxt(proba_output_path, ypred_proba_test, delimiter=",")
+        except FileNotFoundError:
+            logger.error("No such file or directory to save predicted probability. "
+                         "Please try again.")
+            sys.exit(1)
+        try:
+            np.savetxt(bin_output_path, ypred_bin_test, delimiter=",")
+        except FileNotFoundError:
+            logger.error("No such file or directory to save predicted class. Please try again.")
+            sys.exit(1)
+
+    logger.info("Predicted values are successfully saved to given output path")
+
+
+def predict(input_path: str, x_test_path: str, initial_features: List[str],
+            proba_output_path: str, bin_output_path: str, engine: str = "sklearn",
+            dtypes: Optional[Dict[str, str]] = None, split_path: Optional[str] = None,
+            fold: Optional[int] = None, registry_dir: Optional[str] = None,
+            version: Optional[Any] = None) -> None:
+    """ predict test data with given model
+    Args:
+        input_path (str): input path to pretrained model (joblib or .forest), unused if
+            `version` is set
+        x_test_path (`str`): path to test data for features (csv, parquet, feather or npcols)
+        initial_features (:obj:`list` of `str`): list of column names
+        proba_output_path (`str`): output path to save predicted probability (csv)
+        bin_output_path (`str`): output path to save predicted class (csv)
+        engine (`str`): "sklearn" or "flat", see `predict_frame`
+        dtypes (`dict`, optional): dtype schema the test data are downcast to while they are
+            read (see `src.dtype_schema`), dtypes of the file if None
+        split_path (`str`, optional): path to an index split (npz) to read the test rows from
+            the features it indexes, instead of `x_test_path` (see `src.index_split`)
+        fold (`int`, optional): fold used as the test rows, for splits with folds
+        registry_dir (`str`, optional): directory of the model registry
+            (see `src.model_registry`)
+        version (optional): registered version to predict with, or "latest", instead of the
+            model at `input_path`
+    Returns:
+        None
+    """
+    if version is not None:
+        try:
+            input_path = model_registry.resolve_model(registry_dir, version)
+        except (FileNotFoundError, TypeError) as error:
+            logger.error("Cannot find version %s in the model registry: %s", version, error)
+            sys.exit(1)
+
+    # load model
+    model = load_model(input_path)
+
+    # load test data
+    logger.info("Loading test data for prediction")
+    schema = dtype_schema.resolve(dtypes)
     try:
-        np.savetxt(proba_output_path, ypred_proba_test, delimiter=",")
+        if split_path is None:
+            x_test = artifact_io.read_table(x_test_path, columns=initial_features,
+                                            dtype=dtype_schema.read_dtypes(schema))
+        else:
+            x_test = index_split.read_rows(split_path, "test", "feature",
+                                           columns=initial_features,
+                                           dtype=dtype_schema.read_dtypes(schema), fold=fold)
     except FileNotFoundError:
-        logger.error("No such file or directory to save predicted probability. Please try again.")
+        logger.error("Cannot find the given test data file")
+        sys.exit(1)
+    except KeyError:
+        logger.error("Provided `Initial_features` are not all in provided test data or model")
+        sys.exit(1)
+    except ValueError as error:
+        logger.error("Cannot read the test rows of the split: %s", error)
         sys.exit(1)
+
+    # predict
+    ypred_proba_test, ypred_bin_test = predict_frame(model, x_test, initial_features,
+                                                     engine)
+
+    # save prediction to given output path
+    save_predictions(ypred_proba_test, ypred_bin_test, proba_output_path, bin_output_path)
+
+
+def _put(items: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    """ Put an item in a bounded queue unless `stop` is set first, return whether it was put """
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(items: queue.Queue, stop: threading.Event) -> Any:
+    """ Get an item from a queue, or `_END` if `stop` is set first """
+    while not stop.is_set():
+        try:
+            return items.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _END
+
+
+def _run_threads(chunks: Iterable[pd.DataFrame],
+                 predict_chunk: Callable[[pd.DataFrame], Tuple[np.ndarray, np.ndarray]],
+                 write_chunk: Callable[[Tuple[np.ndarray, np.ndarray]], None],
+                 queue_size: int) -> None:
+    """ Read, predict and write chunks in three threads linked by bounded queues
+
+    At most `queue_size` chunks wait between two threads, so memory use is bounded by the
+    chunk size. The first error raised by any thread stops the others and is raised again.
+    """
+    to_predict: queue.Queue = queue.Queue(maxsize=queue_size)
+    to_write: queue.Queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors: List[BaseException] = []
+
+    def read() -> None:
+        try:
+            for chunk in chunks:
+                if not _put(to_predict, chunk, stop):
+                    return
+        except BaseException as error:  # pylint: disable=broad-except
+            errors.append(error)
+            stop.set()
+        finally:
+            _put(to_predict, _END, stop)
+
+    def predict() -> None:
+        try:
+            while True:
+                chunk = _get(to_predict, stop)
+                if chunk is _END or not _put(to_write, predict_chunk(chunk), stop):
+                    return
+        except BaseException as error:  # pylint: disable=broad-except
+            errors.append(error)
+            stop.set()
+        finally:
+            _put(to_write, _END, stop)
+
+    threads = [threading.Thread(target=read, name="score-reader", daemon=True),
+               threading.Thread(target=predict, name="score-predictor", daemon=True)]
+    for thread in threads:
+        thread.start()
     try:
-        np.savetxt(bin_output_path, ypred_bin_test, delimiter=",")
+        # the calling thread writes
+        while True:
+            predictions = _get(to_write, stop)
+            if predictions is _END:
+                break
+            write_chunk(predictions)
+    except BaseException as error:  # pylint: disable=broad-except
+        errors.append(error)
+        stop.set()
+    finally:
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+
+
+def predict_stream(input_path: str, x_test_path: str, initial_features: List[str],
+                   proba_output_path: str, bin_output_path: str, chunk_size: int = 100000,
+                   threaded: bool = True, queue_size: int = 2, engine: str = "sklearn",
+                   derive_features: bool = False,
+                   feature_config: Optional[Dict[str, Dict[str, Any]]] = None) -> int:
+    """ predict test data chunk by chunk, appending the predictions to the outputs
+
+    Only `chunk_size` rows (times the chunks queued between threads) are in memory at a time,
+    so memory use does not depend on the size of the test data. The outputs are the same as
+    the ones of `predict`.
+
+    Args:
+        input_path (str): input path to pretrained model (joblib or .forest)
+        x_test_path (`str`): path to test data for features (csv, parquet, feather or npcols)
+        initial_features (:obj:`list` of `str`): list of column names
+        proba_output_path (`str`): output path to save predicted probability (csv)
+        bin_output_path (`str`): output path to save predicted class (csv)
+        chunk_size (`int`): number of rows read, predicted and written at a time
+        threaded (`bool`): whether to read, predict and write in three threads so that
+            reading and writing overlap with predicting
+        queue_size (`int`): maximum number of chunks waiting between two threads
+        engine (`str`): "sklearn" or "flat", see `predict_frame`
+        derive_features (`bool`): whether the test data holds the raw features, from which
+            the additional features of `feature_config` are generated for every chunk
+        feature_config (`dict`, optional): `generate_additional_features` configuration
+    Returns:
+        n_rows (`int`): number of predicted rows
+    """
+    if chunk_size < 1 or queue_size < 1:
+        logger.error("`chunk_size` and `queue_size` should be positive")
+        raise ValueError("`chunk_size` and `queue_size` should be positive")
+
+    model = load_model(input_path)
+    if engine == "flat":
+        # flatten the forest once instead of for every chunk
+        model = model_format.to_compact(model)
+
+    chunks = artifact_io.iter_table(x_test_path, columns=None if derive_features
+                                    else initial_features, chunk_size=chunk_size)
+    try:
+        # read the first chunk now, so that a missing file or column is reported here
+        first_chunk = next(chunks, None)
     except FileNotFoundError:
-        logger.error("No such file or directory to save predicted class. Please try again.")
+        logger.error("Cannot find the given test data file")
+        sys.exit(1)
+    except KeyError:
+        logger.error("Provided `Initial_features` are not all in provided test data or model")
         sys.exit(1)
+    except ValueError as error:
+        logger.error("Cannot read the test data: %s", error)
+        sys.exit(1)
+    chunks = itertools.chain([first_chunk] if first_chunk is not None else [], chunks)
+    if derive_features:
+        chunks = _derive_features(chunks, feature_config or {})
 
-    logger.info("Predicted values are successfully saved to given output path")
+    logger.info("Predicting test data in chunks of %d rows", chunk_size)
+    n_rows = 0
+    try:
+        with open(proba_output_path, "w", encoding="utf-8") as proba_file, \
+                open(bin_output_path, "w", encoding="utf-8") as bin_file:
+
+            def predict_chunk(chunk: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+                return predict_frame(model, chunk, initial_features, engine)
+
+            def write_chunk(predictions: Tuple[np.ndarray, np.ndarray]) -> None:
+                nonlocal n_rows
+                _append_predictions(predictions, proba_file, bin_file)
+                n_rows += len(predictions[0])
+
+            if threaded:
+                _run_threads(chunks, predict_chunk, write_chunk, queue_size)
+            else:
+                for chunk in chunks:
+                    write_chunk(predict_chunk(chunk))
+    except FileNotFoundError:
+        logger.error("No such file or directory to save predictions. Please try again.")
+        sys.exit(1)
+
+    logger.info("Predictions of %d rows are successfully saved to given output paths", n_rows)
+    return n_rows
+
+
+def _derive_features(chunks: Iterable[pd.DataFrame],
+                     feature_config: Dict[str, Dict[str, Any]]) -> Iterable[pd.DataFrame]:
+    """ Generate the additional features of every chunk, compiling the plan once """
+    plan = None
+    for chunk in chunks:
+        if plan is None:
+            plan = generate_additional_features.compile_feature_plan(feature_config,
+                                                                     list(chunk.columns))
+        yield generate_additional_features.apply_feature_plan(chunk, plan)
+
+
+def _append_predictions(predictions: Tuple[np.ndarray, np.ndarray], proba_file: TextIO,
+                        bin_file: TextIO) -> None:
+    """ Append predicted probabilities and classes in the format of `save_predictions` """
+    with instrumentation.span("write_predictions", rows=len(predictions[0])):
+        for values, output_file in zip(predictions, [proba_file, bin_file]):
+            # one formatting operation per chunk, the same text as np.savetxt writes row by row
+            output_file.write(("%.18e\n" * len(values)) % tuple(values.tolist()))
@@ -0,0 +1,344 @@
+"""
+This module is to serve predictions of a pretrained model over HTTP.
+
+The model is loaded once. Every request is featurized with the same feature plan as
+`generate_additional_features`, and concurrent requests are coalesced into micro-batches
+that are scored together, waiting at most `max_latency_ms` for a batch to fill up.
+
+Endpoints:
+    POST /predict   body {"instances": [{"visible_mean": ..., ...}, ...]}
+                    returns {"proba": [...], "class": [...]}
+    GET  /metrics   latency percentiles, throughput and batching counters
+    GET  /health    returns {"status": "ok"}
+"""
+import collections
+import json
+import logging.config
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src import dtype_schema, generate_additional_features, model_format, score_model
+
+logger = logging.getLogger(__name__)
+
+# number of most recent request latencies kept for the percentiles
+LATENCY_WINDOW = 10000
+
+
+class ServerStats:
+    """ Thread-safe request counters and a window of recent request latencies """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._latencies: collections.deque = collections.deque(maxlen=LATENCY_WINDOW)
+        self._started = time.monotonic()
+        self.requests = 0
+        self.rows = 0
+        self.errors = 0
+        self.batches = 0
+        self.batch_rows = 0
+
+    def record_request(self, latency: float, n_rows: int) -> None:
+        """ Record a successful request of `n_rows` rows that took `latency` seconds """
+        with self._lock:
+            self._latencies.append(latency)
+            self.requests += 1
+            self.rows += n_rows
+
+    def record_error(self) -> None:
+        """ Record a failed request """
+        with self._lock:
+            self.errors += 1
+
+    def record_batch(self, n_rows: int) -> None:
+        """ Record a scored micro-batch of `n_rows` rows """
+        with self._lock:
+            self.batches += 1
+            self.batch_rows += n_rows
+
+    def snapshot(self) -> Dict[str, Any]:
+        """ Current counters, latency percentiles in milliseconds and throughput """
+        with self._lock:
+            latencies = np.array(self._latencies) * 1000.0
+            elapsed = time.monotonic() - self._started
+            p50, p99 = np.percentile(latencies, [50, 99]) if latencies.size else (0.0, 0.0)
+            return {
+                "uptime_s": elapsed,
+                "requests": self.requests,
+                "rows": self.rows,
+                "errors": self.errors,
+                "batches": self.batches,
+                "mean_batch_rows": self.batch_rows / self.batches if self.batches else 0.0,
+                "latency_p50_ms": float(p50),
+                "latency_p99_ms": float(p99),
+                "requests_per_s": self.requests / elapsed,
+                "rows_per_s": self.rows / elapsed,
+            }
+
+
+class MicroBatcher:
+    """ Coalesce concurrent prediction requests into batches scored by one thread
+
+    Args:
+        predict_fn (`callable`): maps a feature matrix to (probability, class) arrays
+        max_batch_size (`int`): maximum number of rows in a batch
+        max_latency_ms (`float`): longest time the first request of a batch waits for others
+        stats (:obj:`ServerStats`, optional): counters updated for every batch
+    """
+
+    def __init__(self, predict_fn: Callable[[np.ndarray], Tuple[np.ndarray, np.ndarray]],
+                 max_batch_size: int, max_latency_ms: float,
+                 stats: Optional[ServerStats] = None) -> None:
+        self._predict_fn = predict_fn
+        self._max_batch_size = max_batch_size
+        self._max_latency = max_latency_ms / 1000.0
+        self._stats = stats
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def predict(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """ Score `rows` as part of the next micro-batch, blocking until it is scored """
+        pending = {"rows": rows, "arrived": time.monotonic(), "done": threading.Event()}
+        self._queue.put(pending)
+        pending["done"].wait()
+        if "error" in pending:
+            raise pending["error"]
+        return pending["result"]
+
+    def close(self) -> None:
+        """ Stop the batching thread after the queued requests are scored """
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        """ Collect and score batches until `close` is called """
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch, n_rows = [first], len(first["rows"])
+            deadline = first["arrived"] + self._max_latency
+            while n_rows < self._max_batch_size:
+                try:
+                    pending = self._queue.get(timeout=max(deadline - time.monotonic(), 0.0))
+                except queue.Empty:
+                    break
+                if pending is None:
+                    stopping = True
+                    break
+                batch.append(pending)
+                n_rows += len(pending["rows"])
+            self._score(batch, n_rows)
+
+    def _score(self, batch: List[Dict[str, Any]], n_rows: int) -> None:
+        """ Score a batch and hand every request its slice of the results
+
+        If the batch fails, its requests are scored one at a time, so a request that cannot
+        be scored only fails itself.
+        """
+        try:
+            proba, classes = self._predict_fn(np.concatenate([item["rows"] for item in batch]))
+        except Exception as error:  # pylint: disable=broad-except
+            if len(batch) > 1:
+                logger.warning("Scoring a batch of %d rows failed, scoring its %d requests "
+                               "one at a time: %s", n_rows, len(batch), error)
+                for item in batch:
+                    self._score([item], len(item["rows"]))
+                return
+            logger.error("Scoring a batch of %d rows failed: %s", n_rows, error)
+            for item in batch:
+                item["error"] = error
+                item["done"].set()
+            return
+
+        if self._stats is not None:
+            self._stats.record_batch(n_rows)
+        start = 0
+        for item in batch:
+            stop = start + len(item["rows"])
+            item["result"] = (proba[start:stop], classes[start:stop])
+            item["done"].set()
+            start = stop
+
+
+class ScoringService:
+    """ Featurize request rows and score them through a micro-batcher
+
+    Args:
+        model: pretrained classifier with `predict_proba` and `classes_`
+        columns (:obj:`list` of `str`): raw feature columns expected in every instance
+        initial_features (:obj:`list` of `str`): columns used by the model
+        feature_config (`dict`): `generate_additional_features` configuration
+        max_batch_size (`int`): maximum number of rows in a micro-batch
+        max_latency_ms (`float`): longest time a request waits for its batch to fill up
+        engine (`str`): "sklearn", or "flat" to score with the vectorized engine of
+            `src.forest_inference`
+        dtypes (`dict`, optional): dtype schema the features are built in (see
+            `src.dtype_schema`), float64 if None
+    """
+
+    def __init__(self, model: Any, columns: List[str], initial_features: List[str],
+                 feature_config: Dict[str, Dict[str, Any]], max_batch_size: int,
+                 max_latency_ms: float, engine: str = "sklearn",
+                 dtypes: Optional[Dict[str, str]] = None) -> None:
+        self.model = model_format.to_compact(model) if engine == "flat" else model
+        schema = dtype_schema.resolve(dtypes)
+        self.dtype = np.dtype(np.float64) if schema is None else schema.features
+        self.columns = list(columns)
+        self.initial_features = list(initial_features)
+        self.plan = generate_additional_features.compile_feature_plan(feature_config,
+                                                                      self.columns)
+        self.stats = ServerStats()
+        self.batcher = MicroBatcher(self._predict, max_batch_size, max_latency_ms, self.stats)
+
+    def _predict(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """ Probability of the positive class and class of a feature matrix in one pass """
+        proba = self.model.predict_proba(pd.DataFrame(rows, columns=self.initial_features))
+        return proba[:, 1], self.model.classes_.take(np.argmax(proba, axis=1))
+
+    def featurize(self, instances: List[Dict[str, float]]) -> np.ndarray:
+        """ Feature matrix of the model from a list of raw instances
+
+        Raises:
+            ValueError: if the instances are not a non-empty list of objects
+                with numeric values for all raw feature columns, or if some of their
+                features are not finite
+        """
+        if not isinstance(instances, list) or not instances:
+            raise ValueError("`instances` should be a non-empty list of objects")
+        try:
+            raw = pd.DataFrame(np.array([[float(instance[column]) for column in self.columns]
+                                         for instance in instances], dtype=self.dtype),
+                               columns=self.columns)
+        except KeyError as error:
+            raise ValueError(f"Every instance should contain {error}") from error
+        except (TypeError, ValueError) as error:
+            raise ValueError("Every instance should be an object with numeric values") \
+                from error
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            features = generate_additional_features.apply_feature_plan(raw, self.plan)
+        rows = dtype_schema.feature_frame(features, self.initial_features,
+                                          self.dtype).to_numpy()
+        # rejected here, so a bad request never reaches the batch of other requests
+        invalid = np.flatnonzero(~np.isfinite(rows).all(axis=1))
+        if invalid.size:
+            raise ValueError(f"Instances {invalid.tolist()} have features that are not finite")
+        return rows
+
+    def predict(self, instances: List[Dict[str, float]]) -> Dict[str, List[float]]:
+        """ Predicted probability and class of raw instances """
+        proba, classes = self.batcher.predict(self.featurize(instances))
+        return {"proba": proba.tolist(), "class": classes.tolist()}
+
+
+class ScoringRequestHandler(BaseHTTPRequestHandler):
+    """ HTTP handler of the scoring server, using the service attached to the server """
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """ Serve /metrics and /health """
+        if self.path == "/metrics":
+            self._reply(200, self.server.service.stats.snapshot())
+        elif self.path == "/health":
+            self._reply(200, {"status": "ok"})
+        else:
+            self._reply(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self) -> None:  # pylint: disable=invalid-name
+        """ Serve /predict """
+        if self.path != "/predict":
+            self._reply(404, {"error": f"Unknown path {self.path}"})
+            return
+
+        started = time.monotonic()
+        service = self.server.service
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            instances = body["instances"] if isinstance(body, dict) else None
+            result = service.predict(instances)
+        except (ValueError, KeyError) as error:
+            service.stats.record_error()
+            self._reply(400, {"error": str(error)})
+            return
+        except Exception as error:  # pylint: disable=broad-except
+            service.stats.record_error()
+            self._reply(500, {"error": str(error)})
+            return
+
+        service.stats.record_request(time.monotonic() - started, len(instances))
+        self._reply(200, result)
+
+    def _reply(self, status: int, payload: Dict[str, Any]) -> None:
+        """ Send a JSON response """
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:  # pylint: disable=redefined-builtin
+        """ Route access logs to the module logger """
+        logger.debug(format, *args)
+
+
+def create_server(service: ScoringService, host: str, port: int) -> ThreadingHTTPServer:
+    """ HTTP server answering requests with `service`, one thread per connection
+
+    Args:
+        service (:obj:`ScoringService`): scoring service
+        host (`str`): address to bind
+        port (`int`): port to bind, 0 for any free port
+
+    Returns:
+        server (:obj:`http.server.ThreadingHTTPServer`): server, not started yet
+    """
+    server = ThreadingHTTPServer((host, port), ScoringRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def serve(model_path: str, columns: List[str], initial_features: List[str],
+          feature_config: Dict[str, Dict[str, Any]], host: str = "127.0.0.1", port: int = 8080,
+          max_batch_size: int = 1024, max_latency_ms: float = 5.0,
+          engine: str = "sklearn", dtypes: Optional[Dict[str, str]] = None) -> None:
+    """ Load the model once and serve predictions until interrupted
+
+    Args:
+        model_path (`str`): input path to pretrained model (joblib)
+        columns (:obj:`list` of `str`): raw feature columns expected in every instance
+        initial_features (:obj:`list` of `str`): columns used by the model
+        feature_config (`dict`): `generate_additional_features` configuration
+        host (`str`): address to bind
+        port (`int`): port to bind
+        max_batch_size (`int`): maximum number of rows in a micro-batch
+        max_latency_ms (`float`): longest time a request waits for its batch to fill up
+        engine (`str`): "sklearn" or "flat", see :obj:`ScoringService`
+        dtypes (`dict`, optional): dtype schema the features are built in, see
+            :obj:`ScoringService`
+
+    Returns:
+        None
+    """
+    model = score_model.load_model(model_path)
+    service = ScoringService(model, columns, initial_features, feature_config,
+                             max_batch_size, max_latency_ms, engine, dtypes)
+    server = create_server(service, host, port)
+
+    logger.info("Serving predictions on http://%s:%d", *server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down the scoring server")
+    finally:
+        server.server_close()
+        service.batcher.close()
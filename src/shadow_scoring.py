@@ -0,0 +1,213 @@
+"""
+This module is to score the same test data with several models at once, like a candidate
+model in the shadow of the production model.
+
+The test data are read and assembled into one feature matrix once. The models then score that
+matrix concurrently: in threads sharing it in memory, or in worker processes memory-mapping
+one copy of it saved with `src.shared_data`. The probabilities of all models are written
+column-wise into one file, together with pairwise statistics of how much the models disagree.
+"""
+import concurrent.futures
+import itertools
+import logging.config
+import os
+import sys
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src import (artifact_io, dtype_schema, index_split, instrumentation, model_registry,
+                 score_model, shared_data)
+
+logger = logging.getLogger(__name__)
+
+EXECUTORS = ["thread", "process"]
+
+# feature matrix memory-mapped by every worker process, set by `_init_worker`
+_WORKER_DATA: Dict[str, Any] = {}
+
+
+def _score(model_path: str, x_test: pd.DataFrame, initial_features: List[str],
+           engine: str) -> Tuple[np.ndarray, np.ndarray]:
+    """ Probability of the positive class and class predicted by one model """
+    model = score_model.load_model(model_path)
+    return score_model.predict_frame(model, x_test, initial_features, engine)
+
+
+def _init_worker(paths: Dict[str, str], initial_features: List[str]) -> None:
+    """ Memory-map the shared feature matrix in a worker process """
+    matrix = shared_data.load_shared(paths)["x"]
+    _WORKER_DATA["x"] = pd.DataFrame(matrix, columns=initial_features, copy=False)
+
+
+def _score_in_worker(model_path: str, initial_features: List[str],
+                     engine: str) -> Tuple[np.ndarray, np.ndarray]:
+    """ Score the shared feature matrix with one model in a worker process """
+    return _score(model_path, _WORKER_DATA["x"], initial_features, engine)
+
+
+def score_models(model_paths: Dict[str, str], x_test: pd.DataFrame, initial_features: List[str],
+                 engine: str = "sklearn", executor: str = "thread",
+                 n_workers: Optional[int] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """ Score the same test data with several models concurrently
+
+    Args:
+        model_paths (`dict`): path to every model (joblib or .forest), keyed by model name
+        x_test (:obj:`pandas.DataFrame`): test data for features
+        initial_features (:obj:`list` of `str`): list of column names
+        engine (`str`): "sklearn" or "flat", see `score_model.predict_frame`
+        executor (`str`): "thread" to score in threads sharing the features in memory, or
+            "process" to score in worker processes memory-mapping one copy of them
+        n_workers (`int`, optional): number of threads or processes, one per model if None
+            for threads and all CPUs if None for processes
+
+    Returns:
+        probabilities (:obj:`pandas.DataFrame`): probability of the positive class predicted
+            by every model, one column per model
+        classes (:obj:`pandas.DataFrame`): class predicted by every model
+    """
+    if executor not in EXECUTORS:
+        logger.error("Unknown executor %s", executor)
+        raise ValueError(f"Unknown executor {executor!r}, expected one of {EXECUTORS}")
+    names = list(model_paths)
+    # one matrix assembled once and scored by every model without another copy
+    x_test = dtype_schema.feature_frame(x_test, initial_features)
+
+    logger.info("Scoring %d rows with %d models", len(x_test), len(names))
+    with instrumentation.span("shadow_score", rows=len(x_test)):
+        if len(names) == 1 or n_workers == 1:
+            results = [_score(model_paths[name], x_test, initial_features, engine)
+                       for name in names]
+        elif executor == "thread":
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=min(n_workers or len(names), len(names))) as pool:
+                results = list(pool.map(_score, [model_paths[name] for name in names],
+                                        itertools.repeat(x_test),
+                                        itertools.repeat(initial_features),
+                                        itertools.repeat(engine)))
+        else:
+            with tempfile.TemporaryDirectory() as shared_dir:
+                paths = shared_data.share_arrays({"x": x_test.to_numpy()}, shared_dir)
+                with concurrent.futures.ProcessPoolExecutor(
+                        max_workers=min(n_workers or os.cpu_count(), len(names)),
+                        initializer=_init_worker, initargs=(paths, initial_features)) as pool:
+                    results = list(pool.map(_score_in_worker,
+                                            [model_paths[name] for name in names],
+                                            itertools.repeat(initial_features),
+                                            itertools.repeat(engine)))
+
+    probabilities = pd.DataFrame({name: proba for name, (proba, _) in zip(names, results)})
+    classes = pd.DataFrame({name: predicted for name, (_, predicted) in zip(names, results)})
+    return probabilities, classes
+
+
+def disagreement(probabilities: pd.DataFrame, classes: pd.DataFrame) -> pd.DataFrame:
+    """ Pairwise statistics of the disagreement between models
+
+    Args:
+        probabilities (:obj:`pandas.DataFrame`): probabilities returned by `score_models`
+        classes (:obj:`pandas.DataFrame`): classes returned by `score_models`
+
+    Returns:
+        statistics (:obj:`pandas.DataFrame`): one row per pair of models, with the fraction of
+            rows they predict different classes for ("class_disagreement"), the mean and the
+            largest absolute difference of their probabilities, and the correlation of their
+            probabilities
+    """
+    rows = []
+    for first, second in itertools.combinations(probabilities.columns, 2):
+        difference = np.abs(probabilities[first].to_numpy() - probabilities[second].to_numpy())
+        rows.append({"model": first, "other_model": second,
+                     "class_disagreement": float(np.mean(classes[first].to_numpy()
+                                                         != classes[second].to_numpy())),
+                     "mean_abs_difference": float(difference.mean()),
+                     "max_abs_difference": float(difference.max()),
+                     "correlation": float(probabilities[first].corr(probabilities[second]))})
+    return pd.DataFrame(rows, columns=["model", "other_model", "class_disagreement",
+                                       "mean_abs_difference", "max_abs_difference",
+                                       "correlation"])
+
+
+def shadow_score(x_test_path: str, initial_features: List[str], output_path: str,
+                 disagreement_path: str, models: Optional[Dict[str, str]] = None,
+                 versions: Optional[Dict[str, Any]] = None, registry_dir: Optional[str] = None,
+                 engine: str = "sklearn", executor: str = "thread",
+                 n_workers: Optional[int] = None, dtypes: Optional[Dict[str, str]] = None,
+                 split_path: Optional[str] = None, fold: Optional[int] = None) -> None:
+    """ Score test data once with several models and save their probabilities side by side
+
+    Args:
+        x_test_path (`str`): path to test data for features (csv, parquet, feather or npcols)
+        initial_features (:obj:`list` of `str`): list of column names
+        output_path (`str`): path to save the probability of every model, one column per
+            model (csv)
+        disagreement_path (`str`): path to save the disagreement of every pair of models (csv)
+        models (`dict`, optional): path to a model (joblib or .forest), keyed by model name
+        versions (`dict`, optional): registered version, or "latest", keyed by model name
+        registry_dir (`str`, optional): directory of the model registry, for `versions`
+        engine (`str`): "sklearn" or "flat", see `score_model.predict_frame`
+        executor (`str`): "thread" or "process", see `score_models`
+        n_workers (`int`, optional): number of threads or processes, see `score_models`
+        dtypes (`dict`, optional): dtype schema the test data are downcast to while they are
+            read (see `src.dtype_schema`), dtypes of the file if None
+        split_path (`str`, optional): path to an index split (npz) to read the test rows from,
+            instead of `x_test_path` (see `src.index_split`)
+        fold (`int`, optional): fold used as the test rows, for splits with folds
+
+    Returns:
+        None
+    """
+    model_paths = dict(models or {})
+    try:
+        for name, version in (versions or {}).items():
+            model_paths[name] = model_registry.resolve_model(registry_dir, version)
+    except (FileNotFoundError, TypeError) as error:
+        logger.error("Cannot find a version in the model registry: %s", error)
+        sys.exit(1)
+    if len(model_paths) < 2:
+        logger.error("At least two models are needed for shadow scoring")
+        raise ValueError("At least two models are needed for shadow scoring")
+
+    logger.info("Loading test data for shadow scoring")
+    schema = dtype_schema.resolve(dtypes)
+    try:
+        if split_path is None:
+            x_test = artifact_io.read_table(x_test_path, columns=initial_features,
+                                            dtype=dtype_schema.read_dtypes(schema))
+        else:
+            x_test = index_split.read_rows(split_path, "test", "feature",
+                                           columns=initial_features,
+                                           dtype=dtype_schema.read_dtypes(schema), fold=fold)
+    except FileNotFoundError:
+        logger.error("Cannot find the given test data file")
+        sys.exit(1)
+    except KeyError:
+        logger.error("Provided `Initial_features` are not all in provided test data")
+        sys.exit(1)
+    except ValueError as error:
+        logger.error("Cannot read the test rows of the split: %s", error)
+        sys.exit(1)
+
+    probabilities, classes = score_models(model_paths, x_test, initial_features, engine,
+                                          executor, n_workers)
+    statistics = disagreement(probabilities, classes)
+    for row in statistics.itertuples():
+        logger.info("%s and %s disagree on %.2f%% of the rows, probabilities differ by %.4f "
+                    "on average", row.model, row.other_model, row.class_disagreement * 100,
+                    row.mean_abs_difference)
+
+    try:
+        probabilities.to_csv(output_path, index=False)
+    except FileNotFoundError:
+        logger.error("No such file or directory to save the probabilities. Please try again.")
+        sys.exit(1)
+    try:
+        statistics.to_csv(disagreement_path, index=False)
+    except FileNotFoundError:
+        logger.error("No such file or directory to save the disagreement. Please try again.")
+        sys.exit(1)
+
+    logger.info("Probabilities of %d models are successfully saved to %s", len(model_paths),
+                output_path)
@@ -0,0 +1,42 @@
+"""
+This module is to share read-only arrays with worker processes without pickling them.
+
+The arrays are saved once as uncompressed .npy files and every worker memory-maps them, so
+the workers read the same pages of the page cache instead of receiving a copy of the data.
+"""
+import logging.config
+import os
+from typing import Dict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def share_arrays(arrays: Dict[str, np.ndarray], directory: str) -> Dict[str, str]:
+    """ Save arrays to be memory-mapped by worker processes
+
+    Args:
+        arrays (`dict`): arrays keyed by name
+        directory (`str`): existing directory to save the arrays in, usually a temporary one
+
+    Returns:
+        paths (`dict`): path of every saved array, keyed by name
+    """
+    paths = {}
+    for name, array in arrays.items():
+        paths[name] = os.path.join(directory, f"{name}.npy")
+        np.save(paths[name], np.ascontiguousarray(array))
+    return paths
+
+
+def load_shared(paths: Dict[str, str]) -> Dict[str, np.ndarray]:
+    """ Memory-map arrays saved by `share_arrays`, read-only
+
+    Args:
+        paths (`dict`): path of every array, keyed by name
+
+    Returns:
+        arrays (`dict`): memory-mapped arrays keyed by name
+    """
+    return {name: np.load(path, mmap_mode="r") for name, path in paths.items()}
@@ -0,0 +1,323 @@
+"""
+This module is to skip pipeline actions whose inputs have not changed since they last ran.
+
+Each action is fingerprinted from the content hashes of its input files, its sections of
+the configuration and the source code of run.py and of every module of `src`, so a change to
+any code an action may run, directly or through an engine picked by the configuration, reruns
+it. The
+fingerprint is recorded in a manifest next to the outputs of the action, and the outputs
+are copied into a content-addressed cache directory so that a previous result can be
+restored when the inputs change back to an earlier state.
+"""
+import hashlib
+import json
+import logging.config
+import os
+import shutil
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = ".cache/stages"
+
+# number of bytes hashed at a time
+HASH_BLOCK_SIZE = 1 << 20
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# run.py wires the configuration sections to the functions of `src`, so it is fingerprinted too
+RUN_PATH = os.path.join(os.path.dirname(SRC_DIR), "run.py")
+
+
+def describe_action(action: str, config: Dict[str, Any]) -> Dict[str, List[str]]:
+    """ List the input files, output files and configuration sections of an action
+
+    Args:
+        action (`str`): action of run.py
+        config (`dict`): model pipeline configuration
+
+    Returns:
+        description (`dict`): lists under "inputs", "outputs" and "sections"
+    """
+    if action == "get_clouds":
+        stage = config["create_datasets"]["get_clouds"]
+        return {"inputs": [stage["input_path"]], "outputs": [stage["output_path"]],
+                "sections": ["create_datasets.get_clouds"]}
+    if action == "generate_features":
+        stage = config["process_data"]
+        return {"inputs": [stage["load_data"]["input_path"]],
+                "outputs": [stage["save_features"]["output_path"],
+                            stage["get_target"]["output_path"]],
+                "sections": ["process_data", "generate_additional_features", "feature_plan"]}
+    if action == "train_model":
+        split, fit = config["train_model"]["split_data"], config["train_model"]["fit_model"]
+        if split.get("split_path"):
+            outputs = [split["split_path"], fit["output_path"]]
+        else:
+            outputs = [split["x_train_path"], split["x_test_path"], split["y_train_path"],
+                       split["y_test_path"], fit["output_path"]]
+        if fit.get("compact_output_path"):
+            outputs.append(fit["compact_output_path"])
+        return {"inputs": [split["feature_path"], split["target_path"]], "outputs": outputs,
+                "sections": ["train_model"]}
+    if action == "score_model":
+        stage = config["score_model"]["predict"]
+        # an index split reads its rows from the features it indexes
+        split = config["train_model"]["split_data"]
+        test_inputs = ([stage["split_path"], split["feature_path"]] if stage.get("split_path")
+                       else [stage["x_test_path"]])
+        # a registered version is resolved from the registry when the action runs
+        model_input = (stage["registry_dir"] if stage.get("version") is not None
+                       else stage["input_path"])
+        return {"inputs": [model_input] + test_inputs,
+                "outputs": [stage["proba_output_path"], stage["bin_output_path"]],
+                "sections": ["score_model"]}
+    if action == "evaluate":
+        stage = config["evaluate_performance"]["evaluate"]
+        split = config["train_model"]["split_data"]
+        test_inputs = ([stage["split_path"], split["target_path"]] if stage.get("split_path")
+                       else [stage["y_test_path"]])
+        return {"inputs": [stage["proba_input_path"], stage["bin_input_path"]] + test_inputs,
+                "outputs": [stage["output_path"]],
+                "sections": ["evaluate_performance"]}
+
+    logger.error("Action %s cannot be cached", action)
+    raise ValueError(f"Action {action} cannot be cached")
+
+
+def hash_path(path: str, hash_index: Optional[Dict[str, Any]] = None) -> str:
+    """ SHA-256 of a file, or of the names and contents of the files in a directory
+
+    Args:
+        path (`str`): path to a file or a directory
+        hash_index (`dict`, optional): hashes of previously seen files keyed by path, reused
+            while the size and modification time of a file are unchanged and updated in place
+
+    Returns:
+        digest (`str`): hexadecimal SHA-256 digest
+    """
+    if os.path.isdir(path):
+        digest = hashlib.sha256()
+        for name in sorted(os.listdir(path)):
+            digest.update(name.encode("utf-8"))
+            digest.update(hash_path(os.path.join(path, name), hash_index).encode("ascii"))
+        return digest.hexdigest()
+
+    stat = os.stat(path)
+    key = os.path.abspath(path)
+    if hash_index is not None:
+        known = hash_index.get(key)
+        if known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+            return known["sha256"]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as input_file:
+        for block in iter(lambda: input_file.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+
+    if hash_index is not None:
+        hash_index[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                           "sha256": digest.hexdigest()}
+    return digest.hexdigest()
+
+
+def hash_code(hash_index: Optional[Dict[str, Any]] = None) -> Dict[str, str]:
+    """ SHA-256 of the source of run.py and of every module of `src`, keyed by file name
+
+    The logging configuration is left out, since it does not change the outputs of an action.
+
+    Args:
+        hash_index (`dict`, optional): hashes of previously seen files, see `hash_path`
+
+    Returns:
+        digests (`dict`): hexadecimal SHA-256 digest of run.py and of every .py file of `src`
+    """
+    digests = {name: hash_path(os.path.join(SRC_DIR, name), hash_index)
+               for name in sorted(os.listdir(SRC_DIR)) if name.endswith(".py")}
+    if os.path.exists(RUN_PATH):
+        digests["../run.py"] = hash_path(RUN_PATH, hash_index)
+    return digests
+
+
+def fingerprint(action: str, config: Dict[str, Any], description: Dict[str, List[str]],
+                hash_index: Optional[Dict[str, Any]] = None) -> str:
+    """ Fingerprint an action from its inputs, configuration sections and code
+
+    Args:
+        action (`str`): action of run.py
+        config (`dict`): model pipeline configuration
+        description (`dict`): description of the action returned by `describe_action`
+        hash_index (`dict`, optional): hashes of previously seen files, see `hash_path`
+
+    Returns:
+        digest (`str`): hexadecimal SHA-256 digest
+    """
+    sections = {}
+    for section in description["sections"]:
+        value = config
+        for key in section.split("."):
+            value = value.get(key) if isinstance(value, dict) else None
+        sections[section] = value
+
+    key = {
+        "action": action,
+        "inputs": {path: hash_path(path, hash_index) for path in description["inputs"]},
+        "config": sections,
+        "code": hash_code(hash_index),
+        "outputs": description["outputs"],
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def manifest_path(action: str, outputs: List[str]) -> str:
+    """ Path of the manifest recording the last run of an action, next to its first output """
+    return os.path.join(os.path.dirname(outputs[0]), f".{action}.manifest.json")
+
+
+def _is_up_to_date(manifest: Dict[str, Any], digest: str,
+                   hash_index: Dict[str, Any]) -> bool:
+    """ Whether the manifest matches the fingerprint and the outputs are unchanged """
+    if manifest.get("fingerprint") != digest:
+        return False
+    for path, recorded in manifest["outputs"].items():
+        if not os.path.exists(path) or hash_path(path, hash_index) != recorded:
+            return False
+    return True
+
+
+def _copy(source: str, destination: str) -> None:
+    """ Copy a file or a directory, replacing the destination """
+    if os.path.isdir(destination):
+        shutil.rmtree(destination)
+    if os.path.isdir(source):
+        shutil.copytree(source, destination)
+    else:
+        shutil.copyfile(source, destination)
+
+
+def _load_json(path: str, default: Any) -> Any:
+    """ Load a JSON file, or return `default` if it does not exist or is corrupt """
+    try:
+        with open(path, "r", encoding="utf-8") as input_file:
+            return json.load(input_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return default
+
+
+def _dump_json(data: Any, path: str) -> None:
+    """ Atomically write a JSON file """
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "w", encoding="utf-8") as output_file:
+        json.dump(data, output_file, indent=2, sort_keys=True)
+    os.replace(temporary_path, path)
+
+
+def run_cached(action: str, config: Dict[str, Any], func: Callable[[], None],
+               cache_dir: str = DEFAULT_CACHE_DIR, force: bool = False) -> bool:
+    """ Run an action unless its outputs are up to date or can be restored from the cache
+
+    Every time the action runs, a copy of all its outputs is written to a new entry of
+    `cache_dir`, which takes as much disk space and time as the outputs themselves. Entries
+    are only removed by `collect_garbage` (the clean_cache action of run.py).
+
+    Args:
+        action (`str`): action of run.py
+        config (`dict`): model pipeline configuration
+        func (`callable`): runs the action and writes its outputs
+        cache_dir (`str`): directory of the content-addressed cache
+        force (`bool`): run the action even if its outputs are up to date
+
+    Returns:
+        ran (`bool`): whether `func` was run
+    """
+    description = describe_action(action, config)
+    outputs = description["outputs"]
+    os.makedirs(cache_dir, exist_ok=True)
+    index_path = os.path.join(cache_dir, "hashes.json")
+    hash_index = _load_json(index_path, {})
+
+    try:
+        digest = fingerprint(action, config, description, hash_index)
+    except FileNotFoundError:
+        # a missing input is reported by the action itself
+        logger.warning("Inputs of %s are missing, running it without the cache", action)
+        func()
+        return True
+
+    manifest_file = manifest_path(action, outputs)
+    entry_dir = os.path.join(cache_dir, digest)
+    entry_file = os.path.join(entry_dir, "entry.json")
+
+    if not force and _is_up_to_date(_load_json(manifest_file, {}), digest, hash_index):
+        logger.info("Outputs of %s are up to date, skipping it (use --force to rerun)", action)
+        if os.path.exists(entry_file):
+            os.utime(entry_file)
+        _dump_json(hash_index, index_path)
+        return False
+
+    if not force and os.path.exists(entry_file):
+        logger.info("Restoring outputs of %s from cache entry %s", action, digest[:12])
+        for position, path in enumerate(outputs):
+            _copy(os.path.join(entry_dir, str(position)), path)
+        os.utime(entry_file)
+        ran = False
+    else:
+        func()
+        ran = True
+
+        # store a copy of the outputs in the cache
+        if os.path.isdir(entry_dir):
+            shutil.rmtree(entry_dir)
+        os.makedirs(entry_dir)
+        for position, path in enumerate(outputs):
+            _copy(path, os.path.join(entry_dir, str(position)))
+        _dump_json({"action": action, "outputs": outputs, "created": time.time()}, entry_file)
+
+    _dump_json({"action": action, "fingerprint": digest,
+                "outputs": {path: hash_path(path, hash_index) for path in outputs}},
+               manifest_file)
+    _dump_json(hash_index, index_path)
+    return ran
+
+
+def _entry_size(entry_dir: str) -> int:
+    """ Size in bytes of all files of a cache entry """
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(entry_dir) for name in names)
+
+
+def collect_garbage(cache_dir: str = DEFAULT_CACHE_DIR,
+                    max_size: int = 1 << 30) -> Tuple[int, int]:
+    """ Remove the least recently used cache entries until the cache fits in `max_size`
+
+    Args:
+        cache_dir (`str`): directory of the content-addressed cache
+        max_size (`int`): maximum total size in bytes of the kept entries
+
+    Returns:
+        (`int`, `int`): number of removed entries and number of bytes freed
+    """
+    if not os.path.isdir(cache_dir):
+        return 0, 0
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry_file = os.path.join(cache_dir, name, "entry.json")
+        if os.path.exists(entry_file):
+            entries.append((os.path.getmtime(entry_file), os.path.join(cache_dir, name)))
+
+    # most recently used entries first
+    entries.sort(reverse=True)
+    kept_size, removed, freed = 0, 0, 0
+    for _, entry_dir in entries:
+        size = _entry_size(entry_dir)
+        if kept_size + size <= max_size:
+            kept_size += size
+            continue
+        shutil.rmtree(entry_dir)
+        removed += 1
+        freed += size
+
+    logger.info("Removed %d cache entries (%d bytes), %d bytes kept", removed, freed, kept_size)
+    return removed, freed
@@ -0,0 +1,161 @@
+"""
+This module is to accumulate test metrics over chunks of predictions of any size.
+
+`MetricsAccumulator` keeps exact confusion counts and a fixed-resolution histogram of the
+predicted probabilities of each class, so its memory does not depend on the number of rows.
+The AUC is estimated from the histograms, with an upper bound of its error. Accumulators of
+different shards of the same predictions can be merged.
+"""
+import logging.config
+from typing import Any, Dict, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# number of histogram bins of the predicted probabilities
+DEFAULT_N_BINS = 1 << 16
+
+
+class MetricsAccumulator:
+    """ Confusion counts and probability histograms of binary predictions
+
+    Args:
+        n_bins (`int`): number of equal-width bins of the predicted probabilities in [0, 1]
+        labels (:obj:`tuple`): negative and positive class labels
+
+    Attributes:
+        confusion (:obj:`numpy.ndarray`): counts of (actual, predicted) classes, shape (2, 2)
+        histograms (:obj:`numpy.ndarray`): counts of predicted probabilities per bin of
+            actual negatives (row 0) and actual positives (row 1), shape (2, n_bins)
+    """
+
+    def __init__(self, n_bins: int = DEFAULT_N_BINS, labels: Sequence[Any] = (0.0, 1.0)):
+        if n_bins <= 0:
+            logger.error("n_bins has to be greater than 0")
+            raise ValueError("n_bins has to be greater than 0")
+        self.n_bins = n_bins
+        self.labels = tuple(labels)
+        self.confusion = np.zeros((2, 2), dtype=np.int64)
+        self.histograms = np.zeros((2, n_bins), dtype=np.int64)
+
+    @property
+    def n_rows(self) -> int:
+        """ Number of predictions accumulated """
+        return int(self.confusion.sum())
+
+    def _encode(self, values: Any, name: str) -> np.ndarray:
+        """ 0 for the negative and 1 for the positive label """
+        values = np.asarray(values).ravel()
+        positive = values == self.labels[1]
+        if not np.all(positive | (values == self.labels[0])):
+            logger.error("%s should only hold the labels %s", name, self.labels)
+            raise ValueError(f"{name} should only hold the labels {self.labels}")
+        return positive.astype(np.int64)
+
+    def update(self, y_test: Any, ypred_proba_test: Any, ypred_bin_test: Any) -> None:
+        """ Add a chunk of predictions
+
+        Args:
+            y_test (array-like): actual test target
+            ypred_proba_test (array-like): predicted probability of the positive class
+            ypred_bin_test (array-like): predicted class
+        """
+        actual = self._encode(y_test, "y_test")
+        predicted = self._encode(ypred_bin_test, "ypred_bin_test")
+        proba = np.asarray(ypred_proba_test, dtype=np.float64).ravel()
+        if not len(actual) == len(predicted) == len(proba):
+            logger.error("Chunks of target and predictions should have the same length")
+            raise ValueError("Chunks of target and predictions should have the same length")
+
+        self.confusion += np.bincount(2 * actual + predicted, minlength=4).reshape(2, 2)
+        bins = np.clip(proba * self.n_bins, 0, self.n_bins - 1).astype(np.int64)
+        self.histograms += np.bincount(actual * self.n_bins + bins,
+                                       minlength=2 * self.n_bins).reshape(2, self.n_bins)
+
+    def merge(self, other: "MetricsAccumulator") -> "MetricsAccumulator":
+        """ Add the counts of another accumulator of the same resolution and labels
+
+        Returns:
+            self (:obj:`MetricsAccumulator`): this accumulator
+        """
+        if other.n_bins != self.n_bins or other.labels != self.labels:
+            logger.error("Only accumulators with the same n_bins and labels can be merged")
+            raise ValueError("Only accumulators with the same n_bins and labels can be merged")
+        self.confusion += other.confusion
+        self.histograms += other.histograms
+        return self
+
+    def auc(self) -> Tuple[float, float]:
+        """ AUC estimated from the histograms and an upper bound of its error
+
+        Pairs of a positive and a negative in different bins are ordered exactly. Pairs in the
+        same bin are counted as ties, half correctly ordered, so the estimate is off by at
+        most half of the share of pairs that fall in the same bin.
+
+        Returns:
+            (auc, max_error) (`float`): estimated AUC and bound of its absolute error
+        """
+        negatives, positives = self.histograms.astype(np.float64)
+        n_pairs = negatives.sum() * positives.sum()
+        if n_pairs == 0:
+            logger.error("Both classes should be present in y_test")
+            raise ValueError("Both classes should be present in y_test")
+        negatives_below = np.cumsum(negatives) - negatives
+        same_bin = np.dot(positives, negatives)
+        auc = (np.dot(positives, negatives_below) + 0.5 * same_bin) / n_pairs
+        return float(auc), float(0.5 * same_bin / n_pairs)
+
+    def metrics(self) -> Dict[str, Any]:
+        """ Metrics in the format of `evaluate_performance.compute_metrics`, with the
+        AUC error bound as `auc_error` """
+        auc, auc_error = self.auc()
+        confusion_df = pd.DataFrame(self.confusion,
+                                    index=["Actual negative", "Actual positive"],
+                                    columns=["Predicted negative", "Predicted positive"])
+        return {"auc": auc, "auc_error": auc_error,
+                "accuracy": np.trace(self.confusion) / self.n_rows,
+                "confusion": confusion_df,
+                "classification_report": classification_report(self.confusion, self.labels)}
+
+
+def classification_report(confusion: np.ndarray, labels: Sequence[Any], digits: int = 2) -> str:
+    """ Text report of the precision, recall and F1 score of each class from confusion counts,
+    laid out like `sklearn.metrics.classification_report`
+
+    Args:
+        confusion (:obj:`numpy.ndarray`): counts of (actual, predicted) classes
+        labels (:obj:`list`): class labels, in the order of the confusion counts
+        digits (`int`): number of digits of the scores
+
+    Returns:
+        report (`str`): classification report
+    """
+    confusion = np.asarray(confusion, dtype=np.float64)
+    support = confusion.sum(axis=1)
+    correct = np.diag(confusion)
+    # undefined scores are reported as 0, like scikit-learn does
+    precision = np.divide(correct, confusion.sum(axis=0), out=np.zeros(len(labels)),
+                          where=confusion.sum(axis=0) > 0)
+    recall = np.divide(correct, support, out=np.zeros(len(labels)), where=support > 0)
+    f1_score = np.divide(2 * precision * recall, precision + recall, out=np.zeros(len(labels)),
+                         where=precision + recall > 0)
+    scores = np.stack([precision, recall, f1_score], axis=1)
+    total = support.sum()
+
+    names = [f"{label}" for label in labels]
+    width = max(max(len(name) for name in names), len("weighted avg"), digits)
+    row_format = "{:>{width}s} " + " {:>9.{digits}f}" * 3 + " {:>9}\n"
+    report = ("{:>{width}s} " + " {:>9}" * 4).format(
+        "", "precision", "recall", "f1-score", "support", width=width) + "\n\n"
+    for name, row, count in zip(names, scores, support):
+        report += row_format.format(name, *row, int(count), width=width, digits=digits)
+    report += "\n"
+    report += ("{:>{width}s} " + " {:>9.{digits}}" * 2 + " {:>9.{digits}f}" + " {:>9}\n").format(
+        "accuracy", "", "", correct.sum() / total, int(total), width=width, digits=digits)
+    report += row_format.format("macro avg", *scores.mean(axis=0), int(total), width=width,
+                                digits=digits)
+    report += row_format.format("weighted avg", *np.average(scores, axis=0, weights=support),
+                                int(total), width=width, digits=digits)
+    return report
@@ -0,0 +1,217 @@
+"""
+This module is to generate large synthetic raw data files with the layout of the clouds data.
+
+Every cloud is drawn from a multivariate normal distribution fitted to the same cloud of the
+real data, clipped to the range of the real cloud. Values are written as fixed-width "%10.4f"
+fields, so every line has the same length and the byte offset of every row is known in
+advance: the file is generated in blocks of rows by a pool of processes, each writing its
+blocks in place with `os.pwrite`.
+"""
+import concurrent.futures
+import functools
+import logging.config
+import os
+import sys
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from src import create_datasets
+
+logger = logging.getLogger(__name__)
+
+# every value is written as "%10.4f"
+WIDTH = 10
+DECIMALS = 4
+
+HEADER = [b";;; SYNTHETIC CLOUD COVER DATA", b";;;;", b";;; CLOUD COVER DB #1", b";;;;", b""]
+SEPARATOR = [b"", b";;;;", b";;; CLOUD COVER DB #2", b";;;;", b""]
+FOOTER = [b";;; END OF DBS", b";;;;"]
+
+
+class CloudDistribution(NamedTuple):
+    """ Distribution of the rows of one cloud
+
+    Attributes:
+        mean (:obj:`numpy.ndarray`): mean of every column
+        factor (:obj:`numpy.ndarray`): matrix such that `mean + z @ factor.T` has the covariance
+            of the cloud for standard normal `z`
+        low (:obj:`numpy.ndarray`): smallest value of every column
+        high (:obj:`numpy.ndarray`): largest value of every column
+    """
+    mean: np.ndarray
+    factor: np.ndarray
+    low: np.ndarray
+    high: np.ndarray
+
+
+def fit_distribution(cloud: np.ndarray) -> CloudDistribution:
+    """ Fit a clipped multivariate normal distribution to the rows of a cloud
+
+    Args:
+        cloud (:obj:`numpy.ndarray`): rows of the cloud, shape (n_rows, n_columns)
+
+    Returns:
+        distribution (:obj:`CloudDistribution`): fitted distribution
+    """
+    if len(cloud) < 2:
+        raise ValueError("Cannot fit a distribution to less than two rows")
+    low, high = cloud.min(axis=0), cloud.max(axis=0)
+    # keep one unit of margin for the rounding to DECIMALS decimals
+    if np.any(high >= 10 ** (WIDTH - DECIMALS - 1) - 1) or \
+            np.any(low <= 1 - 10 ** (WIDTH - DECIMALS - 2)):
+        raise ValueError(f"Values do not fit in {WIDTH} characters with {DECIMALS} decimals")
+
+    # eigendecomposition instead of Cholesky, in case the covariance is only semi-definite
+    eigenvalues, eigenvectors = np.linalg.eigh(np.cov(cloud, rowvar=False))
+    factor = eigenvectors * np.sqrt(np.clip(eigenvalues, 0, None))
+    return CloudDistribution(cloud.mean(axis=0), factor, low, high)
+
+
+def _characters(strings: List[bytes]) -> np.ndarray:
+    """ Characters of strings of the same length, shape (len(strings), length) """
+    return np.frombuffer(b"".join(strings), dtype=np.uint8).reshape(len(strings), -1)
+
+
+_INTEGER_WIDTH = WIDTH - DECIMALS - 1
+
+
+@functools.lru_cache(maxsize=None)
+def _tables() -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Characters of every possible positive and negative integer part and decimal part """
+    return (_characters([b"%*d" % (_INTEGER_WIDTH, i) for i in range(10 ** _INTEGER_WIDTH)]),
+            _characters([b"%*s" % (_INTEGER_WIDTH, b"-%d" % i)
+                         for i in range(10 ** (_INTEGER_WIDTH - 1))]),
+            _characters([b"%0*d" % (DECIMALS, i) for i in range(10 ** DECIMALS)]))
+
+
+def format_rows(values: np.ndarray) -> bytes:
+    """ Format rows of values as lines of fixed-width "%10.4f" fields
+
+    The characters of the integer and decimal parts are looked up in precomputed tables for
+    whole arrays at once, several times faster than formatting every value with Python.
+
+    Args:
+        values (:obj:`numpy.ndarray`): rows to format, shape (n_rows, n_columns), with values
+            above -10000 and below 100000
+
+    Returns:
+        lines (`bytes`): one newline-terminated line of n_columns * 10 characters per row
+    """
+    n_rows, n_columns = values.shape
+    positive_table, negative_table, decimal_table = _tables()
+    scaled = np.rint(values * 10 ** DECIMALS).astype(np.int64)
+    integers, decimals = np.divmod(np.abs(scaled), 10 ** DECIMALS)
+
+    lines = np.empty((n_rows, n_columns, WIDTH), dtype=np.uint8)
+    negative = scaled < 0
+    lines[..., :_INTEGER_WIDTH] = positive_table.take(integers, axis=0)
+    lines[negative, :_INTEGER_WIDTH] = negative_table.take(integers[negative], axis=0)
+    lines[..., _INTEGER_WIDTH] = ord(".")
+    lines[..., _INTEGER_WIDTH + 1:] = decimal_table.take(decimals, axis=0)
+
+    lines = np.concatenate([lines.reshape(n_rows, -1),
+                            np.full((n_rows, 1), ord("\n"), dtype=np.uint8)], axis=1)
+    return lines.tobytes()
+
+
+def _write_block(output_path: str, offset: int, n_rows: int, distribution: CloudDistribution,
+                 seed: np.random.SeedSequence) -> None:
+    """ Draw `n_rows` rows of a cloud and write them at byte `offset` of the output file """
+    rng = np.random.default_rng(seed)
+    rows = distribution.mean + rng.standard_normal((n_rows, len(distribution.mean))) \
+        @ distribution.factor.T
+    np.clip(rows, distribution.low, distribution.high, out=rows)
+
+    file_descriptor = os.open(output_path, os.O_WRONLY)
+    try:
+        data = memoryview(format_rows(rows))
+        while data:
+            written = os.pwrite(file_descriptor, data, offset)
+            data, offset = data[written:], offset + written
+    finally:
+        os.close(file_descriptor)
+
+
+def generate(input_path: str, columns: List[str], first_cloud: List[int],
+             second_cloud: List[int], output_path: str, n_rows: int,
+             block_rows: int = 1 << 18, n_workers: Optional[int] = None,
+             random_state: int = 42) -> Tuple[List[int], List[int]]:
+    """ Generate a synthetic raw data file with the layout of the clouds data
+
+    The rows are split between the two clouds in the proportions of the real data. The
+    generated file only depends on `random_state` and `block_rows`, not on `n_workers`.
+
+    Args:
+        input_path (`str`): path of the real raw data the distributions are fitted to
+        columns (:obj:`list` of `str`): list of column names in clouds
+        first_cloud(`list` of `int`): list like [first_index, second_index] to slice first cloud
+        second_cloud(`list` of `int`): list like [first_index, second_index] to slice second cloud
+        output_path (`str`): path to save the synthetic raw data
+        n_rows (`int`): number of rows of the two synthetic clouds together
+        block_rows (`int`): number of rows generated by a worker at a time
+        n_workers (`int`, optional): number of worker processes, all CPUs if None
+
+    Returns:
+        (first_cloud, second_cloud): line ranges of the two clouds in the synthetic file, to
+            set in the `get_clouds` configuration
+    """
+    if n_rows < 0 or block_rows <= 0:
+        logger.error("n_rows should not be negative and block_rows should be positive")
+        raise ValueError("n_rows should not be negative and block_rows should be positive")
+
+    clouds = create_datasets.load_clouds(input_path, columns, first_cloud, second_cloud)
+    distributions = []
+    sizes = []
+    for label in (0.0, 1.0):
+        cloud = clouds.loc[clouds["class"] == label, columns].to_numpy()
+        distributions.append(fit_distribution(cloud))
+        sizes.append(len(cloud))
+    first_rows = n_rows * sizes[0] // sum(sizes)
+    cloud_rows = [first_rows, n_rows - first_rows]
+    logger.info("Fitted distributions of %d and %d real rows", *sizes)
+
+    # layout: header, first cloud, separator, second cloud, footer
+    line_size = len(columns) * WIDTH + 1
+    first_start = len(HEADER)
+    second_start = first_start + cloud_rows[0] + len(SEPARATOR)
+    offsets = [sum(len(line) + 1 for line in HEADER)]
+    offsets.append(offsets[0] + cloud_rows[0] * line_size + sum(len(line) + 1
+                                                                 for line in SEPARATOR))
+    footer_offset = offsets[1] + cloud_rows[1] * line_size
+
+    try:
+        with open(output_path, "wb") as output_file:
+            output_file.write(b"\n".join(HEADER) + b"\n")
+            output_file.seek(offsets[1] - sum(len(line) + 1 for line in SEPARATOR))
+            output_file.write(b"\n".join(SEPARATOR) + b"\n")
+            output_file.seek(footer_offset)
+            output_file.write(b"\n".join(FOOTER) + b"\n")
+    except FileNotFoundError:
+        logger.error("No such file or directory to save synthetic raw data. Please try again.")
+        sys.exit(1)
+
+    blocks = []
+    for label in (0, 1):
+        for start in range(0, cloud_rows[label], block_rows):
+            blocks.append((offsets[label] + start * line_size,
+                           min(block_rows, cloud_rows[label] - start), distributions[label]))
+    seeds = np.random.SeedSequence(random_state).spawn(len(blocks))
+
+    logger.info("Generating %d rows in %d blocks", n_rows, len(blocks))
+    if n_workers == 1:
+        for (offset, size, distribution), seed in zip(blocks, seeds):
+            _write_block(output_path, offset, size, distribution, seed)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers or os.cpu_count()) \
+                as pool:
+            futures = [pool.submit(_write_block, output_path, offset, size, distribution, seed)
+                       for (offset, size, distribution), seed in zip(blocks, seeds)]
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+
+    first = [first_start, first_start + cloud_rows[0]]
+    second = [second_start, second_start + cloud_rows[1]]
+    logger.info("Synthetic raw data saved to %s with first_cloud %s and second_cloud %s",
+                output_path, first, second)
+    return first, second
@@ -1,120 +1,263 @@
-""" This module is to train a random forest classifier to cloud data """
+"""
+This module is to train a random forest classifier to cloud data, and to grow a fitted
+forest with trees trained only on newly labeled data.
+"""
 import logging.config
-from typing import List
+from typing import Any, Dict, List, Optional, Tuple
 import sys
 
-import pandas as pd
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 import joblib
+import numpy as np
+import pandas as pd
+
+from src import (artifact_io, distributed_training, dtype_schema, index_split, instrumentation,
+                 model_format)
 
 logger = logging.getLogger(__name__)
 
 
+def read_target(path: str, schema: Optional[dtype_schema.DtypeSchema] = None) -> pd.DataFrame:
+    """ Read a target artifact and cast it to the target dtype of `schema`
+
+    Raises:
+        FileNotFoundError: if the artifact does not exist
+    """
+    try:
+        target = artifact_io.read_table(path, dtype=dtype_schema.read_dtypes(schema))
+    except ValueError as error:
+        logger.error("Cannot read the target: %s", error)
+        sys.exit(1)
+    try:
+        return dtype_schema.cast_frame(target, schema)
+    except ValueError as error:
+        logger.error("Target does not fit the dtype schema: %s", error)
+        sys.exit(1)
+
+
+def split_frames(features: pd.DataFrame, target: pd.DataFrame, test_size: float, random_state: int
+                 ) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """ Split in-memory features and target into train and test set
+
+    Args:
+        features (:obj:`pandas.DataFrame`): features
+        target (:obj:`pandas.DataFrame`): target
+        test_size (`float`): proportion of test set
+        random_state (`int`):  pass an int for reproducible output
+    Returns:
+        x_train, x_test, y_train, y_test (:obj:`pandas.DataFrame`): train and test sets
+    """
+    # handle exceptions for not enough samples
+    try:
+        # split train and test
+        logger.info("Splitting train and test sets")
+        with instrumentation.span("split", rows=len(features)):
+            x_train, x_test, y_train, y_test = train_test_split(
+                features, target, test_size=test_size, random_state=random_state)
+    except ValueError:
+        logger.error("Sample size in provided data is not enough. Please add more samples.")
+        sys.exit(1)
+
+    return x_train, x_test, y_train, y_test
+
+
 def split_data(feature_path: str, target_path: str, test_size: float, random_state: int,
-               x_train_path: str, x_test_path: str, y_train_path: str, y_test_path: str) -> None:
+               x_train_path: str, x_test_path: str, y_train_path: str, y_test_path: str,
+               dtypes: Optional[Dict[str, str]] = None, split_path: Optional[str] = None,
+               method: str = "random", group_column: Optional[str] = None,
+               n_folds: Optional[int] = None) -> None:
     """ Split features and target into train and test set
 
     Args:
-        feature_path (`str`):  path to features (csv)
-        target_path (`str`): path to target (csv)
+        feature_path (`str`):  path to features (csv, parquet, feather or npcols)
+        target_path (`str`): path to target (csv, parquet, feather or npcols)
         test_size (`float`): proportion of test set
         random_state (`int`):  pass an int for reproducible output
-        x_train_path (`str`): path to training data for features (csv)
-        x_test_path (`str`): path to test data for features (csv)
-        y_train_path (`str`): path to training data for target (csv)
-        y_test_path (`str`): path to training data for target (csv)
+        x_train_path (`str`): path to training data for features (csv, parquet, feather or npcols)
+        x_test_path (`str`): path to test data for features (csv, parquet, feather or npcols)
+        y_train_path (`str`): path to training data for target (csv, parquet, feather or npcols)
+        y_test_path (`str`): path to training data for target (csv, parquet, feather or npcols)
+        dtypes (`dict`, optional): dtype schema features and target are downcast to while
+            they are read (see `src.dtype_schema`), dtypes of the files if None
+        split_path (`str`, optional): path to save only the row numbers of the train and test
+            sets (npz) instead of the four sets, see `index_split_data`
+        method (`str`): split method of `src.index_split`, only with `split_path`
+        group_column (`str`, optional): feature column grouping the rows, only with
+            `split_path`
+        n_folds (`int`, optional): number of cross-validation folds, only with `split_path`
     Returns:
          None
     """
+    if split_path is not None:
+        index_split_data(feature_path, target_path, test_size, random_state, split_path,
+                         method, group_column, n_folds)
+        return
+    if method != "random" or group_column is not None or n_folds is not None:
+        logger.error("Only index splits (`split_path`) support other methods, groups or folds")
+        raise ValueError("Only index splits (`split_path`) support other methods, groups or folds")
+
     logger.info("Loading features and target for splitting train and test set")
+    schema = dtype_schema.resolve(dtypes)
 
     # handle exception for file not found
     try:
         # load features
-        features = pd.read_csv(feature_path, index_col=False)
+        features = artifact_io.read_table(feature_path, dtype=dtype_schema.read_dtypes(schema))
     except FileNotFoundError:
         logger.error("Cannot find provided feature file")
         sys.exit(1)
+    except ValueError as error:
+        logger.error("Cannot read the features: %s", error)
+        sys.exit(1)
     try:
         # load target
-        target = pd.read_csv(target_path, index_col=False)
+        target = read_target(target_path, schema)
     except FileNotFoundError:
         logger.error("Cannot find provided target file")
         sys.exit(1)
 
-    # handle exceptions for not enough samples
-    try:
-        # split train and test
-        logger.info("Splitting train and test sets")
-        x_train, x_test, y_train, y_test = train_test_split(features, target, test_size=test_size,
-                                                            random_state=random_state)
-    except ValueError:
-        logger.error("Sample size in provided data is not enough. Please add more samples.")
-        sys.exit(1)
+    x_train, x_test, y_train, y_test = split_frames(features, target, test_size, random_state)
 
     # handle exceptions for file not found
     try:
         # save x train
-        x_train.to_csv(x_train_path, index=False)
+        artifact_io.write_table(x_train, x_train_path)
     except FileNotFoundError:
         logger.error("No such file or directory to load x train. Please try again.")
         sys.exit(1)
+    except ValueError as error:
+        logger.error("Cannot save x train: %s", error)
+        sys.exit(1)
     try:
         # save x test
-        x_test.to_csv(x_test_path, index=False)
+        artifact_io.write_table(x_test, x_test_path)
     except FileNotFoundError:
         logger.error("No such file or directory to load x test. Please try again.")
         sys.exit(1)
+    except ValueError as error:
+        logger.error("Cannot save x test: %s", error)
+        sys.exit(1)
     try:
         # save y train
-        y_train.to_csv(y_train_path, index=False)
+        artifact_io.write_table(y_train, y_train_path)
     except FileNotFoundError:
         logger.error("No such file or directory to load y train. Please try again.")
         sys.exit(1)
+    except ValueError as error:
+        logger.error("Cannot save y train: %s", error)
+        sys.exit(1)
     try:
         # save y test
-        y_test.to_csv(y_test_path, index=False)
+        artifact_io.write_table(y_test, y_test_path)
     except FileNotFoundError:
         logger.error("No such file or directory to load y test. Please try again.")
         sys.exit(1)
+    except ValueError as error:
+        logger.error("Cannot save y test: %s", error)
+        sys.exit(1)
 
     logger.info("Train and test sets are successfully split and saved to given output paths")
 
 
-def fit_model(x_train_path: str, y_train_path: str, initial_features: List[str],
-              n_estimators: int, max_depth: int, random_state: int, output_path: str) -> None:
-    """ Train a random forest model
+def index_split_data(feature_path: str, target_path: str, test_size: float, random_state: int,
+                     split_path: str, method: str = "random", group_column: Optional[str] = None,
+                     n_folds: Optional[int] = None) -> None:
+    """ Split features and target into train and test set, saving only the row numbers
+
+    Only the target, and the group column of the features, are read. Later stages read their
+    rows from `feature_path` and `target_path` (see `src.index_split`).
 
     Args:
-        x_train_path (`str`): path to training data for features (csv)
-        y_train_path (`str`): path to training data for target (csv)
-        initial_features (:obj:`list` of `str`): list of column names
-        n_estimators (`int`): the number of trees in the forest
-        max_depth (`int`): the maximum depth of the tree
-`       random_state (`int`):  pass an int for reproducible output
-        output_path (`str`): path to save acquired data (joblib)
+        feature_path (`str`):  path to features (csv, parquet, feather or npcols)
+        target_path (`str`): path to target (csv, parquet, feather or npcols)
+        test_size (`float`): proportion of test set, unused with folds
+        random_state (`int`):  pass an int for reproducible output
+        split_path (`str`): path to save the split (npz)
+        method (`str`): one of `index_split.METHODS`
+        group_column (`str`, optional): feature column grouping the rows, required by the
+            "grouped" method, and hashed instead of the row numbers by the "hash" method
+        n_folds (`int`, optional): number of cross-validation folds, a single split if None
 
     Returns:
         None
     """
-    # load training set for fit model
-    logger.info("Loading training set for model fitting")
+    if method not in index_split.METHODS:
+        logger.error("Unknown split method %s", method)
+        raise ValueError(f"Unknown split method {method!r}, "
+                         f"expected one of {index_split.METHODS}")
+    if method == "grouped" and group_column is None:
+        logger.error("The grouped split needs a `group_column`")
+        raise ValueError("The grouped split needs a `group_column`")
 
-    # handle exceptions for training data for features
+    logger.info("Loading target for splitting train and test set by row index")
     try:
-        x_train = pd.read_csv(x_train_path, index_col=False)
+        target = artifact_io.read_table(target_path)
     except FileNotFoundError:
-        logger.error("Cannot find provided training data for features. Please try again.")
+        logger.error("Cannot find provided target file")
+        sys.exit(1)
+    except ValueError as error:
+        logger.error("Cannot read the target: %s", error)
         sys.exit(1)
+    groups = None
+    if group_column is not None:
+        try:
+            groups = artifact_io.read_table(feature_path, columns=[group_column])
+        except FileNotFoundError:
+            logger.error("Cannot find provided feature file")
+            sys.exit(1)
+        except KeyError:
+            logger.error("Group column %s is not in provided features", group_column)
+            sys.exit(1)
+        except ValueError as error:
+            logger.error("Cannot read the features: %s", error)
+            sys.exit(1)
+        if len(groups) != len(target):
+            logger.error("Provided features and target do not have the same number of rows")
+            sys.exit(1)
+        groups = groups[group_column].to_numpy()
 
-    # handle exceptions for training data for target
     try:
-        y_train = pd.read_csv(y_train_path, index_col=False)
+        with instrumentation.span("split", rows=len(target)):
+            arrays = index_split.make_split(len(target), test_size, random_state, method,
+                                            target=target.to_numpy().ravel(), groups=groups,
+                                            n_folds=n_folds)
+    except ValueError:
+        logger.error("Sample size in provided data is not enough. Please add more samples.")
+        sys.exit(1)
+
+    meta = {"feature_path": feature_path, "target_path": target_path, "n_rows": len(target),
+            "method": method, "test_size": test_size, "random_state": random_state,
+            "group_column": group_column, "n_folds": n_folds}
+    try:
+        index_split.save_split(arrays, meta, split_path)
     except FileNotFoundError:
-        logger.error("Cannot find provided training data for target. Please try again.")
+        logger.error("No such file or directory to save the split. Please try again.")
         sys.exit(1)
 
+    logger.info("Rows of the train and test sets are successfully split and saved to %s",
+                split_path)
+
+
+def train_classifier(x_train: pd.DataFrame, y_train: pd.DataFrame, initial_features: List[str],
+                     n_estimators: int, max_depth: int, random_state: int,
+                     distributed: Optional[Dict[str, Any]] = None) -> RandomForestClassifier:
+    """ Train a random forest model on in-memory training data
+
+    Args:
+        x_train (:obj:`pandas.DataFrame`): training data for features
+        y_train (:obj:`pandas.DataFrame`): training data for target
+        initial_features (:obj:`list` of `str`): list of column names
+        n_estimators (`int`): the number of trees in the forest
+        max_depth (`int`): the maximum depth of the tree
+        random_state (`int`):  pass an int for reproducible output
+        distributed (`dict`, optional): arguments of `distributed_training.train_distributed`,
+            like {"n_shards": 4, "transport": "local"}, to train the trees in shards on worker
+            processes; trained in this process if None
+
+    Returns:
+        rf_model (:obj:`sklearn.ensemble.RandomForestClassifier`): fitted classifier
+    """
     # fit random forest classifier
     logger.info("Fitting random forest classifier")
 
@@ -132,7 +275,18 @@ def fit_model(x_train_path: str, y_train_path: str, initial_features: List[str],
                                       random_state=random_state)
 
     try:
-        rf_model.fit(x_train[initial_features], y_train.values.ravel())
+        # one contiguous matrix, used by scikit-learn without a copy when it is float32
+        x_train = dtype_schema.feature_frame(x_train, initial_features)
+        with instrumentation.span("fit", rows=len(x_train)):
+            if distributed is None:
+                rf_model.fit(x_train, y_train.values.ravel())
+            else:
+                rf_model = distributed_training.train_distributed(
+                    x_train, y_train, initial_features, n_estimators, max_depth, random_state,
+                    **distributed)
+    except (TimeoutError, RuntimeError):
+        logger.error("Trees could not be trained by the workers")
+        sys.exit(1)
     except KeyError:
         logger.error("Provided `Initial_features` are not all in provided `x_train`")
         sys.exit(1)
@@ -142,12 +296,241 @@ def fit_model(x_train_path: str, y_train_path: str, initial_features: List[str],
 
     logger.info("Classifier is successfully fitted")
 
-    # save model fit to given output path
+    return rf_model
+
+
+def save_model(rf_model: RandomForestClassifier, output_path: str,
+               compact_output_path: Optional[str] = None) -> None:
+    """ Save a fitted model to given output path
+
+    Args:
+        rf_model (:obj:`sklearn.ensemble.RandomForestClassifier`): fitted classifier
+        output_path (`str`): path to save acquired data (joblib)
+        compact_output_path (`str`, optional): path to also save the model in the compact
+            memory-mappable format (.forest)
+
+    Returns:
+        None
+    """
     try:
         logger.info("Saving the fitted classifier to given output path")
-        joblib.dump(rf_model, output_path)
+        with instrumentation.span("save_model"):
+            joblib.dump(rf_model, output_path)
     except FileNotFoundError:
         logger.error("No such file or directory to save model. Please try again.")
         sys.exit(1)
 
+    if compact_output_path is not None:
+        try:
+            model_format.save_compact_model(rf_model, compact_output_path)
+        except FileNotFoundError:
+            logger.error("No such file or directory to save compact model. Please try again.")
+            sys.exit(1)
+
     logger.info("Fitted classifier is successfully saved to given output path")
+
+
+def fit_model(x_train_path: str, y_train_path: str, initial_features: List[str],
+              n_estimators: int, max_depth: int, random_state: int, output_path: str,
+              compact_output_path: Optional[str] = None,
+              dtypes: Optional[Dict[str, str]] = None,
+              distributed: Optional[Dict[str, Any]] = None, split_path: Optional[str] = None,
+              fold: Optional[int] = None) -> None:
+    """ Train a random forest model
+
+    Args:
+        x_train_path (`str`): path to training data for features (csv, parquet, feather or npcols)
+        y_train_path (`str`): path to training data for target (csv, parquet, feather or npcols)
+        initial_features (:obj:`list` of `str`): list of column names
+        n_estimators (`int`): the number of trees in the forest
+        max_depth (`int`): the maximum depth of the tree
+`       random_state (`int`):  pass an int for reproducible output
+        output_path (`str`): path to save acquired data (joblib)
+        compact_output_path (`str`, optional): path to also save the model in the compact
+            memory-mappable format (.forest)
+        dtypes (`dict`, optional): dtype schema the training data are downcast to while they
+            are read (see `src.dtype_schema`), dtypes of the files if None
+        distributed (`dict`, optional): arguments of `distributed_training.train_distributed`
+            to train the trees in shards on worker processes, see `train_classifier`
+        split_path (`str`, optional): path to an index split (npz) to read the training rows
+            from the features and target it indexes, instead of `x_train_path` and
+            `y_train_path` (see `src.index_split`)
+        fold (`int`, optional): fold left out of the training rows, for splits with folds
+
+    Returns:
+        None
+    """
+    # load training set for fit model
+    logger.info("Loading training set for model fitting")
+    schema = dtype_schema.resolve(dtypes)
+
+    # handle exceptions for training data for features, only loading the features used
+    try:
+        if split_path is None:
+            x_train = artifact_io.read_table(x_train_path, columns=initial_features,
+                                             dtype=dtype_schema.read_dtypes(schema))
+        else:
+            x_train = index_split.read_rows(split_path, "train", "feature",
+                                            columns=initial_features,
+                                            dtype=dtype_schema.read_dtypes(schema), fold=fold)
+    except FileNotFoundError:
+        logger.error("Cannot find provided training data for features. Please try again.")
+        sys.exit(1)
+    except KeyError:
+        logger.error("Provided `Initial_features` are not all in provided `x_train`")
+        sys.exit(1)
+    except ValueError as error:
+        logger.error("Cannot read the training rows of the split: %s", error)
+        sys.exit(1)
+
+    # handle exceptions for training data for target
+    try:
+        if split_path is None:
+            y_train = read_target(y_train_path, schema)
+        else:
+            y_train = dtype_schema.cast_frame(
+                index_split.read_rows(split_path, "train", "target",
+                                      dtype=dtype_schema.read_dtypes(schema), fold=fold), schema)
+    except FileNotFoundError:
+        logger.error("Cannot find provided training data for target. Please try again.")
+        sys.exit(1)
+    except ValueError as error:
+        logger.error("Cannot read the training rows of the split: %s", error)
+        sys.exit(1)
+
+    rf_model = train_classifier(x_train, y_train, initial_features, n_estimators, max_depth,
+                                random_state, distributed)
+
+    # save model fit to given output path
+    save_model(rf_model, output_path, compact_output_path)
+
+
+def grow_forest(rf_model: RandomForestClassifier, x_new: pd.DataFrame, y_new: pd.DataFrame,
+                initial_features: List[str], n_new_estimators: int,
+                max_estimators: Optional[int] = None) -> RandomForestClassifier:
+    """ Add trees trained on new data to a fitted random forest, in place
+
+    The existing trees are kept as they are and only the new trees are fitted (with
+    scikit-learn's warm start), so the cost depends on the size of the new data and
+    `n_new_estimators`, not on the data the forest was trained on before. The new trees
+    are seeded from the seeds of the existing ones, so growing the same forest twice on
+    the same data gives the same trees while every update draws different bootstraps.
+
+    Args:
+        rf_model (:obj:`sklearn.ensemble.RandomForestClassifier`): fitted classifier
+        x_new (:obj:`pandas.DataFrame`): new data for features
+        y_new (:obj:`pandas.DataFrame`): new data for target, with every class of the model
+        initial_features (:obj:`list` of `str`): list of column names the model was fitted on
+        n_new_estimators (`int`): the number of trees to add
+        max_estimators (`int`, optional): the number of trees kept, the oldest trees are
+            retired once the forest grows beyond it; no tree is retired if None
+
+    Returns:
+        rf_model (:obj:`sklearn.ensemble.RandomForestClassifier`): the grown classifier
+    """
+    logger.info("Growing random forest classifier with %s new trees", n_new_estimators)
+
+    limits = [n_new_estimators] + ([max_estimators] if max_estimators is not None else [])
+    if not all(isinstance(item, int) and item > 0 for item in limits):
+        logger.error("n_new_estimators and max_estimators have to be integers greater than 0")
+        raise ValueError("n_new_estimators and max_estimators have to be integers greater than 0")
+
+    feature_names = list(getattr(rf_model, "feature_names_in_", initial_features))
+    if feature_names != list(initial_features):
+        logger.error("The model was fitted on the features %s, not on `initial_features`",
+                     feature_names)
+        raise ValueError(f"The model was fitted on the features {feature_names}")
+
+    try:
+        x_new = dtype_schema.feature_frame(x_new, initial_features)
+    except KeyError:
+        logger.error("Provided `Initial_features` are not all in provided new data")
+        sys.exit(1)
+    y_new = y_new.values.ravel()
+
+    # a tree fitted without some class would not line up with the class probabilities
+    # of the existing trees
+    if not np.array_equal(np.unique(y_new).astype(float), rf_model.classes_.astype(float)):
+        logger.error("New data have the classes %s but the model has the classes %s",
+                     np.unique(y_new), rf_model.classes_)
+        sys.exit(1)
+
+    seeds = [tree.random_state for tree in rf_model.estimators_]
+    rf_model.set_params(warm_start=True,
+                        n_estimators=len(rf_model.estimators_) + n_new_estimators,
+                        random_state=int(np.random.SeedSequence(seeds).generate_state(1)[0]))
+    try:
+        with instrumentation.span("grow", rows=len(x_new)):
+            rf_model.fit(x_new, y_new)
+    except ValueError:
+        logger.error("Sample sizes in provided new data are not enough or inconsistent")
+        sys.exit(1)
+
+    if max_estimators is not None and len(rf_model.estimators_) > max_estimators:
+        logger.info("Retiring the %d oldest trees",
+                    len(rf_model.estimators_) - max_estimators)
+        rf_model.estimators_ = rf_model.estimators_[-max_estimators:]
+    rf_model.set_params(warm_start=False, n_estimators=len(rf_model.estimators_))
+
+    logger.info("Classifier is successfully grown to %d trees", len(rf_model.estimators_))
+
+    return rf_model
+
+
+def update_model(input_path: str, x_new_path: str, y_new_path: str, initial_features: List[str],
+                 n_new_estimators: int, output_path: str, max_estimators: Optional[int] = None,
+                 compact_output_path: Optional[str] = None,
+                 dtypes: Optional[Dict[str, str]] = None) -> None:
+    """ Grow a saved random forest model with trees trained on new labeled data
+
+    Args:
+        input_path (`str`): path to the fitted model (joblib)
+        x_new_path (`str`): path to new data for features (csv, parquet, feather or npcols)
+        y_new_path (`str`): path to new data for target (csv, parquet, feather or npcols)
+        initial_features (:obj:`list` of `str`): list of column names
+        n_new_estimators (`int`): the number of trees to add
+        output_path (`str`): path to save the grown model (joblib), can be `input_path`
+        max_estimators (`int`, optional): the number of trees kept, the oldest trees are
+            retired once the forest grows beyond it; no tree is retired if None
+        compact_output_path (`str`, optional): path to also save the model in the compact
+            memory-mappable format (.forest)
+        dtypes (`dict`, optional): dtype schema the new data are downcast to while they
+            are read (see `src.dtype_schema`), dtypes of the files if None
+
+    Returns:
+        None
+    """
+    logger.info("Loading the fitted classifier and new data for updating the model")
+    schema = dtype_schema.resolve(dtypes)
+
+    try:
+        rf_model = joblib.load(input_path)
+    except FileNotFoundError:
+        logger.error("Cannot find provided model. Please try again.")
+        sys.exit(1)
+    if not isinstance(rf_model, RandomForestClassifier):
+        logger.error("Provided model is not a random forest classifier")
+        sys.exit(1)
+
+    try:
+        x_new = artifact_io.read_table(x_new_path, columns=initial_features,
+                                       dtype=dtype_schema.read_dtypes(schema))
+    except FileNotFoundError:
+        logger.error("Cannot find provided new data for features. Please try again.")
+        sys.exit(1)
+    except KeyError:
+        logger.error("Provided `Initial_features` are not all in provided new data")
+        sys.exit(1)
+    except ValueError as error:
+        logger.error("Cannot read the new data: %s", error)
+        sys.exit(1)
+    try:
+        y_new = read_target(y_new_path, schema)
+    except FileNotFoundError:
+        logger.error("Cannot find provided new data for target. Please try again.")
+        sys.exit(1)
+
+    rf_model = grow_forest(rf_model, x_new, y_new, initial_features, n_new_estimators,
+                           max_estimators)
+
+    save_model(rf_model, output_path, compact_output_path)
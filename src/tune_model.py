@@ -0,0 +1,316 @@
+"""
+This module is to tune the hyperparameters of the random forest classifier.
+
+Candidates come from a parameter grid or are drawn from parameter ranges, and are scored
+by cross-validated ROC AUC in a pool of worker processes. The training data is loaded once
+and memory-mapped by the workers. With successive halving, all candidates are first scored
+on a small stratified subsample of the training rows, and only the best 1 / `halving_factor`
+of them are scored again on `halving_factor` times more rows, until one candidate is left or
+all rows are used. The best candidate is refitted on all training rows and saved together
+with a leaderboard of every scored candidate.
+"""
+import concurrent.futures
+import itertools
+import json
+import logging.config
+import math
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import StratifiedKFold
+
+from src import artifact_io, shared_data, train_model
+
+logger = logging.getLogger(__name__)
+
+SEARCHES = ["grid", "random"]
+
+# training data memory-mapped by every worker process, set by `_init_worker`
+_WORKER_DATA: Dict[str, np.ndarray] = {}
+
+
+def grid_candidates(param_grid: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """ Every combination of the values of a parameter grid
+
+    Args:
+        param_grid (`dict`): list of values of every parameter
+
+    Returns:
+        candidates (:obj:`list` of `dict`): parameters of every candidate
+    """
+    names = sorted(param_grid)
+    return [dict(zip(names, values))
+            for values in itertools.product(*[param_grid[name] for name in names])]
+
+
+def random_candidates(param_distributions: Dict[str, Any], n_candidates: int,
+                      random_state: int) -> List[Dict[str, Any]]:
+    """ Candidates drawn from parameter ranges
+
+    Args:
+        param_distributions (`dict`): for every parameter, a list of values drawn uniformly,
+            or a range {"low": ..., "high": ..., "log": false} drawn uniformly (integers if
+            both bounds are integers, both bounds included) or log-uniformly if "log" is true
+        n_candidates (`int`): number of candidates to draw
+        random_state (`int`): seed of the draws
+
+    Returns:
+        candidates (:obj:`list` of `dict`): parameters of every candidate, without duplicates
+    """
+    rng = np.random.default_rng(random_state)
+    candidates: List[Dict[str, Any]] = []
+    # stop drawing if the space has fewer distinct candidates than requested
+    for _ in range(n_candidates * 10):
+        if len(candidates) == n_candidates:
+            break
+        candidate = {name: _draw(distribution, rng)
+                     for name, distribution in sorted(param_distributions.items())}
+        if candidate not in candidates:
+            candidates.append(candidate)
+    return candidates
+
+
+def _draw(distribution: Any, rng: np.random.Generator) -> Any:
+    """ Draw one value of a parameter, see `random_candidates` """
+    if isinstance(distribution, list):
+        return distribution[rng.integers(len(distribution))]
+    if not isinstance(distribution, dict) or not {"low", "high"} <= set(distribution):
+        logger.error("Parameter ranges should be lists or dictionaries with low and high")
+        raise ValueError("Parameter ranges should be lists or dictionaries with low and high")
+
+    low, high = distribution["low"], distribution["high"]
+    if distribution.get("log", False):
+        value = math.exp(rng.uniform(math.log(low), math.log(high)))
+    else:
+        value = rng.uniform(low, high + 1 if isinstance(low, int) and isinstance(high, int)
+                            else high)
+    return int(value) if isinstance(low, int) and isinstance(high, int) else float(value)
+
+
+def stratified_order(y: np.ndarray, random_state: int) -> np.ndarray:
+    """ Random order of the rows in which every prefix keeps the class proportions of `y`
+
+    Args:
+        y (:obj:`numpy.ndarray`): class of every row
+        random_state (`int`): seed of the order
+
+    Returns:
+        order (:obj:`numpy.ndarray`): permutation of the row indices
+    """
+    rng = np.random.default_rng(random_state)
+    keys = np.empty(len(y), dtype=np.float64)
+    for label in np.unique(y):
+        rows = np.flatnonzero(y == label)
+        # spread the rows of every class evenly over [0, 1) in a random order
+        keys[rows] = (rng.permutation(len(rows)) + rng.uniform(size=len(rows))) / len(rows)
+    return np.argsort(keys, kind="stable")
+
+
+def _init_worker(paths: Dict[str, str]) -> None:
+    """ Memory-map the shared training data in a worker process """
+    _WORKER_DATA.update(shared_data.load_shared(paths))
+
+
+def _score_candidate(params: Dict[str, Any], fold: int, n_resources: int,
+                     random_state: int) -> Tuple[float, float]:
+    """ Fit a candidate on the first `n_resources` training rows of a fold in the
+    stratified order, and score it on the validation rows of the fold
+
+    Returns:
+        (`float`, `float`): ROC AUC on the validation rows and fit time in seconds
+    """
+    x, y = _WORKER_DATA["x"], _WORKER_DATA["y"]
+    folds, order = _WORKER_DATA["folds"], _WORKER_DATA["order"]
+
+    train_rows = order[folds[order] != fold][:n_resources]
+    validation_rows = np.flatnonzero(folds == fold)
+
+    start = time.perf_counter()
+    model = RandomForestClassifier(random_state=random_state, n_jobs=1, **params)
+    model.fit(x[train_rows], y[train_rows])
+    fit_time = time.perf_counter() - start
+
+    proba = model.predict_proba(x[validation_rows])
+    positive = np.flatnonzero(model.classes_ == y.max())
+    score = roc_auc_score(y[validation_rows] == y.max(),
+                          proba[:, positive[0]] if positive.size else np.zeros(len(proba)))
+    return float(score), fit_time
+
+
+def successive_halving(pool: concurrent.futures.Executor, candidates: List[Dict[str, Any]],
+                       cv: int, max_resources: int, halving_factor: Optional[int],
+                       min_resources: Optional[int], random_state: int) -> pd.DataFrame:
+    """ Score candidates in rounds of increasing resources, keeping the best ones
+
+    Args:
+        pool (:obj:`concurrent.futures.Executor`): worker pool with the shared data
+        candidates (:obj:`list` of `dict`): parameters of every candidate
+        cv (`int`): number of cross-validation folds
+        max_resources (`int`): number of training rows of the smallest fold
+        halving_factor (`int`, optional): proportion of candidates dropped and multiplier of
+            the resources after each round, all candidates are scored on all rows if None
+        min_resources (`int`, optional): training rows of the first round, by default
+            so that the last round uses all rows
+        random_state (`int`): seed of the forests
+
+    Returns:
+        leaderboard (:obj:`pandas.DataFrame`): one row per candidate and round, from the
+            best candidate to the worst
+    """
+    if halving_factor is None:
+        n_rounds, halving_factor = 1, 1
+    elif halving_factor < 2:
+        logger.error("`halving_factor` should be at least 2")
+        raise ValueError("`halving_factor` should be at least 2")
+    else:
+        # rounds until the number of kept candidates drops to one
+        n_rounds = 1
+        while halving_factor ** n_rounds < len(candidates):
+            n_rounds += 1
+    if min_resources is None:
+        min_resources = max_resources // halving_factor ** (n_rounds - 1)
+    min_resources = max(min(min_resources, max_resources), 2 * cv)
+
+    records = []
+    remaining = list(range(len(candidates)))
+    for round_ in range(n_rounds):
+        n_resources = min(min_resources * halving_factor ** round_, max_resources)
+        logger.info("Round %d: scoring %d candidates on %d training rows",
+                    round_, len(remaining), n_resources)
+        futures = {(candidate, fold): pool.submit(_score_candidate, candidates[candidate], fold,
+                                                  n_resources, random_state)
+                   for candidate in remaining for fold in range(cv)}
+
+        for candidate in remaining:
+            results = [futures[candidate, fold].result() for fold in range(cv)]
+            scores = [score for score, _ in results]
+            records.append({"candidate": candidate, "round": round_,
+                            "n_resources": n_resources,
+                            "params": json.dumps(candidates[candidate], sort_keys=True),
+                            "mean_score": float(np.mean(scores)),
+                            "std_score": float(np.std(scores)),
+                            "fit_time": float(sum(fit_time for _, fit_time in results))})
+
+        ranked = sorted(records[-len(remaining):],
+                        key=lambda record: (-record["mean_score"], record["candidate"]))
+        remaining = [record["candidate"]
+                     for record in ranked[:max(math.ceil(len(remaining) / halving_factor), 1)]]
+        if len(remaining) == 1 or n_resources == max_resources:
+            break
+
+    leaderboard = pd.DataFrame(records)
+    # candidates ranked by their last round, then by their score in it
+    last = leaderboard.groupby("candidate")["round"].transform("max") == leaderboard["round"]
+    final = leaderboard[last].sort_values(["round", "mean_score", "candidate"],
+                                          ascending=[False, False, True])
+    leaderboard["rank"] = leaderboard["candidate"].map(
+        {candidate: rank for rank, candidate in enumerate(final["candidate"], start=1)})
+    # the first row of every candidate is its last round
+    return leaderboard.sort_values(["rank", "round"],
+                                   ascending=[True, False]).reset_index(drop=True)
+
+
+def tune(x_train_path: str, y_train_path: str, initial_features: List[str], output_path: str,
+         leaderboard_path: str, search: str = "grid",
+         param_grid: Optional[Dict[str, List[Any]]] = None,
+         param_distributions: Optional[Dict[str, Any]] = None, n_candidates: int = 10,
+         cv: int = 3, halving_factor: Optional[int] = 3, min_resources: Optional[int] = None,
+         n_workers: Optional[int] = None, random_state: int = 42,
+         compact_output_path: Optional[str] = None) -> Dict[str, Any]:
+    """ Search the hyperparameters of the random forest classifier
+
+    Args:
+        x_train_path (`str`): path to training data for features (csv, parquet, feather or npcols)
+        y_train_path (`str`): path to training data for target (csv, parquet, feather or npcols)
+        initial_features (:obj:`list` of `str`): list of column names
+        output_path (`str`): path to save the best model refitted on all rows (joblib)
+        leaderboard_path (`str`): path to save the leaderboard (csv, parquet, feather or npcols)
+        search (`str`): "grid" to score every candidate of `param_grid`, or "random" to score
+            `n_candidates` candidates drawn from `param_distributions`
+        param_grid (`dict`, optional): list of values of every parameter
+        param_distributions (`dict`, optional): range of every parameter,
+            see `random_candidates`
+        n_candidates (`int`): number of random candidates
+        cv (`int`): number of stratified cross-validation folds
+        halving_factor (`int`, optional): successive halving factor, None to score every
+            candidate on all rows
+        min_resources (`int`, optional): training rows of the first halving round
+        n_workers (`int`, optional): number of worker processes, all CPUs if None
+        random_state (`int`): seed of the folds, the random candidates and the forests
+        compact_output_path (`str`, optional): path to also save the best model in the compact
+            format (.forest)
+
+    Returns:
+        best_params (`dict`): parameters of the best candidate
+    """
+    if search not in SEARCHES:
+        logger.error("Unknown search %s", search)
+        raise ValueError(f"Unknown search {search!r}, expected one of {SEARCHES}")
+    if search == "grid":
+        candidates = grid_candidates(param_grid or {})
+    else:
+        candidates = random_candidates(param_distributions or {}, n_candidates, random_state)
+    if not candidates or candidates == [{}]:
+        logger.error("No candidate to tune, check `param_grid` or `param_distributions`")
+        raise ValueError("No candidate to tune, check `param_grid` or `param_distributions`")
+
+    logger.info("Loading training set for tuning")
+    try:
+        x_train = artifact_io.read_table(x_train_path, columns=initial_features)
+        y_train = artifact_io.read_table(y_train_path)
+    except FileNotFoundError:
+        logger.error("Cannot find provided training data. Please try again.")
+        sys.exit(1)
+    except KeyError:
+        logger.error("Provided `Initial_features` are not all in provided `x_train`")
+        sys.exit(1)
+    except ValueError as error:
+        logger.error("Cannot read the training data: %s", error)
+        sys.exit(1)
+
+    x = x_train.to_numpy(dtype=np.float32)
+    y = y_train.to_numpy().ravel()
+    folds = np.empty(len(y), dtype=np.int8)
+    splitter = StratifiedKFold(n_splits=cv, shuffle=True, random_state=random_state)
+    for fold, (_, validation_rows) in enumerate(splitter.split(x, y)):
+        folds[validation_rows] = fold
+    max_resources = len(y) - int(np.bincount(folds).max())
+
+    logger.info("Tuning %d candidates with %d-fold cross-validation", len(candidates), cv)
+    with tempfile.TemporaryDirectory() as shared_dir:
+        paths = shared_data.share_arrays(
+            {"x": x, "y": y, "folds": folds, "order": stratified_order(y, random_state)},
+            shared_dir)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers or os.cpu_count(),
+                                                    initializer=_init_worker,
+                                                    initargs=(paths,)) as pool:
+            leaderboard = successive_halving(pool, candidates, cv, max_resources,
+                                             halving_factor, min_resources, random_state)
+
+    best_params = candidates[int(leaderboard.loc[0, "candidate"])]
+    logger.info("Best parameters %s with ROC AUC %.4f", best_params,
+                leaderboard.loc[0, "mean_score"])
+
+    try:
+        artifact_io.write_table(leaderboard, leaderboard_path)
+    except FileNotFoundError:
+        logger.error("No such file or directory to save the leaderboard. Please try again.")
+        sys.exit(1)
+    except ValueError as error:
+        logger.error("Cannot save the leaderboard: %s", error)
+        sys.exit(1)
+
+    # refit the best candidate on all training rows
+    rf_model = RandomForestClassifier(random_state=random_state, n_jobs=n_workers or -1,
+                                      **best_params)
+    rf_model.fit(x_train, y)
+    train_model.save_model(rf_model, output_path, compact_output_path)
+
+    return best_params
@@ -0,0 +1,57 @@
+"""
+This module is to test reading and writing pipeline artifacts.
+It includes round trips for the csv and npcols formats, column projection
+and reading in chunks.
+"""
+import pandas as pd
+import pytest
+
+from src import artifact_io
+
+data = pd.DataFrame({"IR_min": [230.6953, 230.6445, 231.6563],
+                     "IR_max": [238.0, 234.0, 237.0],
+                     "class": [0.0, 1.0, 0.0]}, index=[25, 53, 58])
+
+
+@pytest.mark.parametrize("extension", [".csv", ".npcols"])
+def test_round_trip(tmp_path, extension):
+    """Test that written artifacts are read back without their index"""
+    path = str(tmp_path / ("features" + extension))
+    artifact_io.write_table(data, path)
+    pd.testing.assert_frame_equal(artifact_io.read_table(path), data.reset_index(drop=True))
+
+
+@pytest.mark.parametrize("extension", [".csv", ".npcols"])
+def test_read_projection(tmp_path, extension):
+    """Test that only the requested columns are read, in the requested order"""
+    path = str(tmp_path / ("features" + extension))
+    artifact_io.write_table(data, path)
+    df_results = artifact_io.read_table(path, columns=["class", "IR_min"])
+    pd.testing.assert_frame_equal(df_results,
+                                  data[["class", "IR_min"]].reset_index(drop=True))
+
+
+@pytest.mark.parametrize("extension", [".csv", ".npcols"])
+def test_read_missing_column(tmp_path, extension):
+    """Test for reading a column that is not in the artifact"""
+    path = str(tmp_path / ("features" + extension))
+    artifact_io.write_table(data, path)
+    with pytest.raises(KeyError):
+        artifact_io.read_table(path, columns=["IR_mean"])
+
+
+@pytest.mark.parametrize("extension", [".csv", ".npcols"])
+def test_iter_table(tmp_path, extension):
+    """Test that chunks hold consecutive rows of the requested columns"""
+    path = str(tmp_path / ("features" + extension))
+    artifact_io.write_table(data, path)
+    chunks = list(artifact_io.iter_table(path, columns=["class", "IR_min"], chunk_size=2))
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    pd.testing.assert_frame_equal(pd.concat(chunks),
+                                  data[["class", "IR_min"]].reset_index(drop=True))
+
+
+def test_unsupported_extension():
+    """Test for an artifact path with an unknown extension"""
+    with pytest.raises(ValueError):
+        artifact_io.read_table("data/interim/features.txt")
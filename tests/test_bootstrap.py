@@ -0,0 +1,81 @@
+"""
+This module is to test the bootstrap confidence intervals of the test metrics.
+It includes tests for the point estimates against scikit-learn, the
+reproducibility of the intervals, the rounding of probabilities and the
+intervals written to the metrics file only when they are configured.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+import sklearn.metrics
+
+from src import bootstrap, evaluate_performance
+
+rng = np.random.default_rng(0)
+y_test = rng.integers(0, 2, 20000).astype(float)
+proba = np.clip(0.3 * y_test + rng.normal(0.35, 0.2, len(y_test)), 0, 1)
+predicted = (proba > 0.5).astype(float)
+expected = {"auc": sklearn.metrics.roc_auc_score(y_test, proba),
+            "accuracy": sklearn.metrics.accuracy_score(y_test, predicted),
+            "precision": sklearn.metrics.precision_score(y_test, predicted),
+            "recall": sklearn.metrics.recall_score(y_test, predicted)}
+
+
+@pytest.mark.parametrize("method", bootstrap.METHODS)
+@pytest.mark.parametrize("scores", [proba.round(2), proba])
+def test_bootstrap_intervals(method, scores):
+    """Test that estimates are exact and intervals contain them, with or without rounding"""
+    intervals = bootstrap.bootstrap_intervals(y_test, scores, predicted, n_replicates=200,
+                                              method=method, n_workers=1)
+    expected_auc = sklearn.metrics.roc_auc_score(y_test, scores)
+    for metric, (estimate, lower, upper) in intervals.items():
+        assert estimate == pytest.approx(expected_auc if metric == "auc" else expected[metric])
+        assert lower < estimate < upper and upper - lower < 0.05
+
+
+def test_bootstrap_reproducible():
+    """Test that intervals only depend on the seed, not on the number of workers"""
+    arguments = dict(n_replicates=300, batch_size=100, random_state=1)
+    intervals = bootstrap.bootstrap_intervals(y_test, proba, predicted, n_workers=1, **arguments)
+    assert intervals == bootstrap.bootstrap_intervals(y_test, proba, predicted, n_workers=2,
+                                                      **arguments)
+    assert intervals != bootstrap.bootstrap_intervals(y_test, proba, predicted, n_workers=1,
+                                                      **dict(arguments, random_state=2))
+
+
+def test_bootstrap_invalid():
+    """Test that invalid classes and confidence levels are rejected"""
+    with pytest.raises(ValueError):
+        bootstrap.bootstrap_intervals([0, 2], [0.1, 0.9], [0, 1])
+    with pytest.raises(ValueError):
+        bootstrap.bootstrap_intervals(y_test, proba, predicted, confidence=95)
+
+
+def test_bootstrap_rounded_estimates():
+    """Test that rounded probabilities give the point estimates of the replicates"""
+    intervals = bootstrap.bootstrap_intervals(y_test, proba, predicted, n_replicates=200,
+                                              n_workers=1, max_groups=64)
+    rounded_auc = sklearn.metrics.roc_auc_score(y_test, np.floor(proba * 16))
+
+    estimate, lower, upper = intervals["auc"]
+    assert estimate == pytest.approx(rounded_auc) and lower < estimate < upper
+
+
+def test_evaluate_intervals_opt_in(tmp_path):
+    """Test that the metrics file keeps its layout unless intervals are configured"""
+    rows = slice(0, 2000)
+    np.savetxt(tmp_path / "proba.csv", proba[rows], delimiter=",")
+    np.savetxt(tmp_path / "bin.csv", predicted[rows], delimiter=",")
+    pd.DataFrame({"class": y_test[rows]}).to_csv(tmp_path / "y_test.csv", index=False)
+    paths = [str(tmp_path / name) for name in ["proba.csv", "bin.csv", "y_test.csv"]]
+
+    evaluate_performance.evaluate(*paths, str(tmp_path / "metrics.txt"))
+    evaluate_performance.evaluate(*paths, str(tmp_path / "intervals.txt"),
+                                  bootstrap_config={"n_replicates": 50, "n_workers": 1})
+
+    lines = (tmp_path / "metrics.txt").read_text().splitlines()
+    assert lines[0].startswith("AUC on test: ") and lines[1].startswith("Accuracy on test: ")
+    assert "bootstrap" not in "".join(lines)
+    intervals = (tmp_path / "intervals.txt").read_text().splitlines()
+    assert intervals[2] == "95% bootstrap confidence intervals:"
+    assert intervals[:2] == lines[:2] and intervals[7:] == lines[2:]
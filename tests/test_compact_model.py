@@ -0,0 +1,88 @@
+"""
+This module is to test the compaction of fitted random forests.
+It includes tests for lossless float32 thresholds, leaf merging,
+pruning within a tolerance and saving compacted models.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from src import compact_model, model_format
+
+
+def make_model():
+    """Random forest fitted on noisy random features, with validation features"""
+    rng = np.random.default_rng(0)
+    x_train = pd.DataFrame(rng.normal(size=(2000, 3)).astype(np.float32),
+                           columns=["a", "b", "c"])
+    y_train = (x_train["a"] + x_train["b"] * x_train["c"] + rng.normal(size=2000) > 0)
+    model = RandomForestClassifier(n_estimators=20, max_depth=12, random_state=1)
+    model.fit(x_train, y_train.astype(int))
+    x_validation = pd.DataFrame(rng.normal(size=(1000, 3)).astype(np.float32),
+                                columns=["a", "b", "c"])
+    return model, x_validation
+
+
+def test_round_down_float32():
+    """Test that float32 samples go the same way at rounded thresholds"""
+    rng = np.random.default_rng(0)
+    threshold = rng.normal(size=1000)
+    x = np.concatenate([threshold.astype(np.float32),
+                        rng.normal(size=1000).astype(np.float32)])
+    rounded = compact_model.round_down_float32(threshold)
+
+    assert rounded.dtype == np.float32
+    assert np.array_equal(x[:, np.newaxis] <= threshold, x[:, np.newaxis] <= rounded)
+
+
+def test_compact_forest_lossless():
+    """Test that a compacted forest without pruning predicts exactly like the fitted one"""
+    model, x_validation = make_model()
+    compacted = compact_model.compact_forest(model, x_validation, 0.0, "float64")
+
+    assert np.array_equal(compacted.predict_proba(x_validation),
+                          model.predict_proba(x_validation))
+    assert compacted.threshold.dtype == np.float32 and compacted.feature.dtype == np.int8
+    assert compacted.left.dtype in (np.int16, np.int32)
+
+
+def test_compact_forest_tolerance():
+    """Test that pruning moves the probabilities of validation rows by at most the tolerance"""
+    model, x_validation = make_model()
+    compacted = compact_model.compact_forest(model, x_validation, 0.02, "float64")
+    change = np.abs(compacted.predict_proba(x_validation) - model.predict_proba(x_validation))
+
+    assert compacted.meta["compaction"]["pruned"] > 0
+    assert compacted.meta["n_internal_nodes"] < model_format.to_compact(model).meta[
+        "n_internal_nodes"]
+    assert change.max() <= 0.02 + 1e-12
+
+
+def test_prune_arrays_merges_leaves():
+    """Test that sibling leaves with the same probabilities are merged, and others kept"""
+    # root 0 -> (node 1, leaf 2), node 1 -> (leaf 0, leaf 1)
+    arrays = {"feature": np.array([0, 1]), "threshold": np.array([0.0, 0.5]),
+              "left": np.array([1, -1]), "right": np.array([-3, -2]),
+              "value": np.array([[1.0, 0.0], [1.0, 0.0], [0.0, 1.0]]), "roots": np.array([0])}
+    pruned, counts = compact_model.prune_arrays(arrays, np.array([5.0, 3.0, 4.0]), {}, 0)
+
+    assert counts == {"merged": 1, "pruned": 0}
+    assert pruned["left"].tolist() == [-1] and pruned["right"].tolist() == [-2]
+    assert pruned["value"].tolist() == [[1.0, 0.0], [0.0, 1.0]]
+
+
+def test_compacted_model_saved(tmp_path):
+    """Test that a compacted model with narrow dtypes is saved and memory-mapped"""
+    model, x_validation = make_model()
+    compacted = compact_model.compact_forest(model, x_validation, 0.01, "float16")
+    path = str(tmp_path / "model.forest")
+    model_format.save_arrays({name: getattr(compacted, name) for name in model_format.ARRAYS},
+                             compacted.meta, path)
+    loaded = model_format.load_compact_model(path)
+
+    assert loaded.value.dtype == np.float16
+    assert np.array_equal(loaded.predict_proba(x_validation),
+                          compacted.predict_proba(x_validation))
+    with pytest.raises(ValueError):
+        compact_model.compact_forest(model, x_validation, 0.01, "int8")
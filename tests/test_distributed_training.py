@@ -0,0 +1,64 @@
+"""
+This module is to test the training of random forests in shards on worker processes.
+It includes tests for planning the shards, merging forests, and training with the
+local and socket transports.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from src import distributed_training
+
+FEATURES = ["a", "b", "c"]
+
+rng = np.random.default_rng(0)
+x = pd.DataFrame(rng.normal(size=(600, 3)), columns=FEATURES)
+y = pd.DataFrame({"class": (x["a"] + rng.normal(0.0, 0.5, len(x)) > 0).astype(np.uint8)})
+
+
+def test_plan_shards():
+    """Test that trees are split evenly into shards with distinct seeds"""
+    shards = distributed_training.plan_shards(10, 4, 42)
+
+    assert [n_trees for n_trees, _ in shards] == [3, 3, 2, 2]
+    assert len({seed for _, seed in shards}) == 4
+    assert shards == distributed_training.plan_shards(10, 4, 42)
+    assert len(distributed_training.plan_shards(2, 4, 42)) == 2
+
+
+@pytest.mark.parametrize("kwargs", [{"transport": "local", "n_workers": 2},
+                                    {"transport": "socket", "address": "127.0.0.1:0",
+                                     "n_local_workers": 2, "timeout": 60}])
+def test_train_distributed_deterministic(kwargs):
+    """Test that the merged forest does not depend on the transport or the workers"""
+    expected = distributed_training.train_distributed(x, y, FEATURES, 7, 4, 42, n_shards=3,
+                                                      n_workers=1)
+    model = distributed_training.train_distributed(x, y, FEATURES, 7, 4, 42, n_shards=3,
+                                                   **kwargs)
+
+    assert isinstance(model, RandomForestClassifier) and len(model.estimators_) == 7
+    assert list(model.feature_names_in_) == FEATURES
+    np.testing.assert_array_equal(model.predict_proba(x), expected.predict_proba(x))
+
+
+def test_train_distributed_worker_failure():
+    """Test that a shard failing on a socket worker is reported"""
+    with pytest.raises(RuntimeError):
+        distributed_training.train_distributed(x, y, FEATURES, 4, -1, 42, n_shards=2,
+                                               transport="socket", address="127.0.0.1:0",
+                                               n_local_workers=1, timeout=60)
+
+
+def test_train_distributed_unknown_transport():
+    """Test for a transport that does not exist"""
+    with pytest.raises(ValueError):
+        distributed_training.train_distributed(x, y, FEATURES, 4, 3, 42, transport="mpi")
+
+
+def test_merge_forests_different_classes():
+    """Test that forests fitted on different classes are not merged"""
+    forests = [RandomForestClassifier(n_estimators=2, random_state=0).fit(x, labels)
+               for labels in [y["class"], y["class"] + 1]]
+    with pytest.raises(ValueError):
+        distributed_training.merge_forests(forests)
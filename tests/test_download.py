@@ -0,0 +1,106 @@
+"""
+This module is to test the download of source files.
+It includes tests for cached, conditional, resumed and concurrent downloads
+against a local HTTP server standing in for the source of the raw data.
+"""
+import hashlib
+import http.server
+import threading
+
+import pytest
+
+from src import create_datasets, download
+
+CONTENT = bytes(range(256)) * 4096
+ETAG = '"v1"'
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """ Serve CONTENT with an ETag and byte ranges, cutting the first `server.cut` responses """
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+        start = 0
+        if self.headers.get("Range") and self.headers.get("If-Range") == ETAG:
+            start = int(self.headers["Range"][len("bytes="):].rstrip("-"))
+        body = CONTENT[start:]
+        self.send_response(206 if start else 200)
+        self.send_header("ETag", ETAG)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.server.cut:
+            self.server.cut -= 1
+            body = body[:len(body) // 2]
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(name="server")
+def fixture_server():
+    """ Local HTTP server running in a thread """
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.requests, server.cut = [], 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def url(server, name="clouds.data"):
+    """ URL of a file on the local server """
+    return f"http://127.0.0.1:{server.server_address[1]}/{name}"
+
+
+def test_fetch_cached(server, tmp_path):
+    """Test that an unchanged source is validated with a conditional request, not downloaded"""
+    cache_dir = str(tmp_path / "cache")
+    first = download.fetch(url(server), str(tmp_path / "first.data"), cache_dir=cache_dir,
+                           sha256=hashlib.sha256(CONTENT).hexdigest())
+    second = download.fetch(url(server), str(tmp_path / "second.data"), cache_dir=cache_dir)
+
+    assert (tmp_path / "first.data").read_bytes() == (tmp_path / "second.data").read_bytes() \
+        == CONTENT
+    assert not first["cached"] and second["cached"]
+    assert server.requests[1]["If-None-Match"] == ETAG
+    assert download.read_manifest(cache_dir)[url(server)]["sha256"] \
+        == hashlib.sha256(CONTENT).hexdigest()
+
+
+def test_fetch_resumed(server, tmp_path):
+    """Test that an interrupted download is resumed from the bytes already received"""
+    server.cut = 1
+    download.fetch(url(server), str(tmp_path / "clouds.data"), cache_dir=str(tmp_path / "cache"),
+                   chunk_size=1 << 16, backoff=0)
+
+    assert (tmp_path / "clouds.data").read_bytes() == CONTENT
+    assert server.requests[1]["Range"] == f"bytes={len(CONTENT) // 2}-"
+    assert server.requests[1]["If-Range"] == ETAG
+    assert not list((tmp_path / "cache" / "partial").iterdir())
+
+
+def test_fetch_checksum(server, tmp_path):
+    """Test that a download not matching its checksum is rejected and not saved"""
+    with pytest.raises(download.IntegrityError):
+        download.fetch(url(server), str(tmp_path / "clouds.data"),
+                       cache_dir=str(tmp_path / "cache"), sha256="0" * 64)
+    assert not (tmp_path / "clouds.data").exists()
+
+
+def test_acquire_raw_data_concurrent(server, tmp_path):
+    """Test that several sources are saved to their own output paths"""
+    names = ["first.data", "second.data", "third.data"]
+    create_datasets.acquire_raw_data([url(server, name) for name in names],
+                                     [str(tmp_path / name) for name in names],
+                                     cache_dir=str(tmp_path / "cache"))
+
+    assert all((tmp_path / name).read_bytes() == CONTENT for name in names)
+    with pytest.raises(SystemExit):
+        create_datasets.acquire_raw_data(url(server), str(tmp_path / "missing" / "clouds.data"),
+                                         cache_dir=str(tmp_path / "cache"))
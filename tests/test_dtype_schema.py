@@ -0,0 +1,85 @@
+"""
+This module is to test the dtype schema of the pipeline data.
+It includes tests for resolving and applying the schema, assembling features
+into one contiguous matrix, and training on the compact dtypes.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import create_datasets, dtype_schema, process_data, score_model, train_model
+
+SCHEMA = {"features": "float32", "target": "uint8"}
+
+rng = np.random.default_rng(0)
+data = pd.DataFrame(rng.uniform(1.0, 300.0, size=(500, 3)).astype(np.float32).astype(np.float64),
+                    columns=["a", "b", "c"])
+data["class"] = (data["a"] + rng.normal(0.0, 50.0, len(data)) > 150).astype(np.float64)
+
+
+@pytest.mark.parametrize("dtypes", [{"features": "int32", "target": "uint8"},
+                                    {"features": "float32", "target": "str"},
+                                    {"features": "float32"},
+                                    {"features": "float32", "target": "uint8", "other": "x"}])
+def test_resolve_invalid(dtypes):
+    """Test that schemas without floating features, a numeric target or known keys are rejected"""
+    with pytest.raises((ValueError, TypeError)):
+        dtype_schema.resolve(dtypes)
+
+
+def test_cast_frame():
+    """Test that features and target are cast and that targets out of range are rejected"""
+    schema = dtype_schema.resolve(SCHEMA)
+    cast = dtype_schema.cast_frame(data, schema)
+
+    assert (cast.dtypes.drop("class") == np.float32).all() and cast["class"].dtype == np.uint8
+    assert dtype_schema.cast_frame(cast, schema) is cast
+    with pytest.raises(ValueError):
+        dtype_schema.cast_frame(data.assign(**{"class": 0.5}), schema)
+
+
+def test_feature_frame():
+    """Test that features are assembled into one column-major matrix viewed by the frame"""
+    features = dtype_schema.feature_frame(data, ["c", "a"], np.dtype(np.float32))
+    matrix = features.to_numpy()
+
+    assert matrix.dtype == np.float32 and matrix.flags.f_contiguous
+    assert np.shares_memory(matrix, features.to_numpy())
+    np.testing.assert_array_equal(matrix, data[["c", "a"]].to_numpy(dtype=np.float32))
+    assert dtype_schema.feature_frame(features, ["c", "a"]) is features
+    with pytest.raises(KeyError):
+        dtype_schema.feature_frame(data, ["d"])
+
+
+def test_load_data(tmp_path):
+    """Test that data are downcast while they are read"""
+    data.to_csv(tmp_path / "clouds.csv", index=False)
+    loaded = process_data.load_data(str(tmp_path / "clouds.csv"), SCHEMA)
+
+    assert list(loaded.dtypes) == [np.float32] * 3 + [np.uint8]
+    np.testing.assert_array_equal(loaded.to_numpy(dtype=np.float64), data.to_numpy())
+
+
+def test_load_clouds():
+    """Test that clouds parsed with the schema hold the float64 values cast to the schema"""
+    arguments = ["data/raw/clouds.data", ["c" + str(i) for i in range(10)], [53, 1077],
+                 [1082, 2105]]
+    clouds = create_datasets.load_clouds(*arguments, dtypes=SCHEMA)
+    expected = create_datasets.load_clouds(*arguments)
+
+    assert clouds["class"].dtype == np.uint8 and clouds["c0"].dtype == np.float32
+    pd.testing.assert_frame_equal(clouds, dtype_schema.cast_frame(
+        expected, dtype_schema.resolve(SCHEMA)))
+
+
+def test_same_model():
+    """Test that a model trained and scored on the schema predicts like one on float64"""
+    schema = dtype_schema.resolve(SCHEMA)
+    predictions = []
+    for frame in [data, dtype_schema.cast_frame(data, schema)]:
+        model = train_model.train_classifier(frame[["a", "b", "c"]], frame[["class"]],
+                                             ["a", "b", "c"], 5, 5, 42)
+        predictions.append(score_model.predict_frame(model, frame, ["a", "b", "c"]))
+
+    np.testing.assert_array_equal(predictions[0][0], predictions[1][0])
+    np.testing.assert_array_equal(predictions[0][1], predictions[1][1])
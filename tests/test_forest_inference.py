@@ -0,0 +1,58 @@
+"""
+This module is to test the vectorized inference engine of flattened forests.
+It includes tests for matching the predictions of sklearn exactly across
+batch sizes and for trees made of a single leaf.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from src import forest_inference, model_format, score_model
+
+FEATURES = ["log_entropy", "IR_norm_range", "entropy_x_contrast"]
+
+
+def make_data(n_rows, seed):
+    """Random features with a noisy target"""
+    rng = np.random.default_rng(seed)
+    features = pd.DataFrame(rng.normal(size=(n_rows, len(FEATURES))), columns=FEATURES)
+    target = (features.sum(axis=1) + rng.normal(size=n_rows) > 0).astype(float)
+    return features, target
+
+
+@pytest.mark.parametrize("n_rows", [1, 7, 1000])
+def test_flat_engine_matches_sklearn(n_rows):
+    """Test that the flat engine predicts exactly like sklearn"""
+    x_train, y_train = make_data(3000, 0)
+    x_test, _ = make_data(n_rows, 1)
+    model = RandomForestClassifier(n_estimators=15, random_state=3).fit(x_train, y_train)
+
+    proba, classes = score_model.predict_frame(model, x_test, FEATURES, engine="flat")
+    assert np.array_equal(proba, model.predict_proba(x_test)[:, 1])
+    assert np.array_equal(classes, model.predict(x_test))
+
+    # blocks of a few rows give the same probabilities
+    forest = model_format.to_compact(model)
+    x_values = x_test.to_numpy(dtype=np.float32)
+    assert np.array_equal(forest_inference.predict_proba(forest, x_values, block_rows=3),
+                          model.predict_proba(x_test))
+
+
+def test_single_leaf_trees():
+    """Test trees whose root is a leaf"""
+    x_train, y_train = make_data(200, 0)
+    model = RandomForestClassifier(n_estimators=3, min_samples_split=1000, random_state=3)
+    model.fit(x_train, y_train)
+
+    forest = model_format.to_compact(model)
+    assert (forest.roots < 0).all() and len(forest.feature) == 0
+    assert np.array_equal(forest.predict_proba(x_train), model.predict_proba(x_train))
+
+
+def test_unknown_engine():
+    """Test that an unknown engine is rejected"""
+    x_train, y_train = make_data(100, 0)
+    model = RandomForestClassifier(n_estimators=2, random_state=3).fit(x_train, y_train)
+    with pytest.raises(ValueError):
+        score_model.predict_frame(model, x_train, FEATURES, engine="gpu")
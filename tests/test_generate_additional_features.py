@@ -1,9 +1,10 @@
 """
 This module is to test functions to generate additional features.
 It includes tests for log transformation, multiplication of two features,
-and computation of normalized range.
+computation of normalized range and the compiled feature plan.
 """
 
+import numpy as np
 import pandas as pd
 import pytest
 
@@ -324,3 +325,60 @@ def test_norm_range_non_df():
     with pytest.raises(TypeError):
         generate_additional_features.norm_range(df_test, "IR_min", "IR_max", "IR_mean",
                                                 "IR_norm_range")
+
+
+plan_config = {
+    "log_transform": {"log_col": "visible_entropy", "additional_feature": "log_entropy"},
+    "multiply": {"col1": "visible_entropy", "col2": "visible_contrast",
+                 "additional_feature": "entropy_x_contrast"},
+    "col_range": {"min_col": "IR_min", "max_col": "IR_max", "additional_feature": "IR_range"},
+    "norm_range": {"min_col": "IR_min", "max_col": "IR_max", "mean_col": "IR_mean",
+                   "additional_feature": "IR_norm_range"},
+}
+
+
+@pytest.mark.parametrize("chunk_size", [None, 4])
+def test_apply_feature_plan(chunk_size):
+    """Test that the feature plan generates the same features as the single transforms"""
+    df_true = df_in.copy()
+    for operation, arguments in plan_config.items():
+        df_true = getattr(generate_additional_features, operation)(df_true, **arguments)
+
+    plan = generate_additional_features.compile_feature_plan(plan_config, df_in_columns)
+    df_results = generate_additional_features.apply_feature_plan(df_in.copy(), plan,
+                                                                 chunk_size=chunk_size)
+    pd.testing.assert_frame_equal(df_true, df_results)
+
+
+def test_compile_feature_plan_chained():
+    """Test for a feature generated from a previously generated feature"""
+    config = {"col_range": {"min_col": "IR_min", "max_col": "IR_max",
+                            "additional_feature": "IR_range"},
+              "log_range": {"operation": "log_transform", "log_col": "IR_range",
+                            "additional_feature": "log_IR_range"}}
+    plan = generate_additional_features.compile_feature_plan(config, df_in_columns)
+    df_results = generate_additional_features.apply_feature_plan(df_in.copy(), plan)
+    pd.testing.assert_series_equal(df_results["log_IR_range"],
+                                   (df_in["IR_max"] - df_in["IR_min"]).apply(np.log),
+                                   check_names=False)
+
+
+def test_compile_feature_plan_unknown_operation():
+    """Test for a feature plan with an operation that does not exist"""
+    with pytest.raises(ValueError):
+        generate_additional_features.compile_feature_plan(
+            {"square": {"col": "IR_min", "additional_feature": "IR_min_squared"}},
+            df_in_columns)
+
+
+def test_compile_feature_plan_no_col():
+    """Test for a feature plan using a column that is not in the features"""
+    with pytest.raises(AttributeError):
+        generate_additional_features.compile_feature_plan(plan_config, ["IR_min", "IR_max"])
+
+
+def test_apply_feature_plan_non_df():
+    """Test for applying a feature plan to a non dataframe"""
+    plan = generate_additional_features.compile_feature_plan(plan_config, df_in_columns)
+    with pytest.raises(TypeError):
+        generate_additional_features.apply_feature_plan("I am not a dataframe", plan)
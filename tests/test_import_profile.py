@@ -0,0 +1,48 @@
+"""
+This module is to test the import profiling of run.py actions.
+It includes tests for parsing the report of `python -X importtime`
+and for the modules the lightweight actions import.
+"""
+from src import import_profile
+
+report = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _json
+import time:       380 |        500 | json
+import time:      1000 |       3000 |     pandas.core
+import time:      2000 |       5000 |   pandas
+"""
+
+
+def test_parse_importtime():
+    """Test that modules, times and nesting depths are read from the report"""
+    times = import_profile.parse_importtime(report)
+
+    assert [time.module for time in times] == ["_json", "json", "pandas.core", "pandas"]
+    assert times[1] == import_profile.ImportTime("json", 380, 500, 0)
+    assert [time.depth for time in times] == [1, 0, 2, 1]
+
+
+def test_format_report():
+    """Test that the report sums the import time of every package"""
+    lines = import_profile.format_report("evaluate", [], import_profile.parse_importtime(report),
+                                         top=1).splitlines()
+
+    assert lines[0].startswith("evaluate: 3.5 ms importing 4 modules")
+    assert lines[2].split() == ["3.0", "2", "pandas"]
+
+
+def test_profile_imports():
+    """Test that acquiring raw data does not import numpy, pandas or scikit-learn"""
+    base, times = import_profile.profile_imports(["json"], ["src.create_datasets"])
+    modules = {time.module.split(".")[0] for time in times}
+
+    assert "json" in {time.module for time in base} and "src" in modules
+    assert not modules & {"numpy", "pandas", "sklearn", "scipy", "joblib"}
+
+
+def test_profile_imports_score_model():
+    """Test that scoring imports neither joblib nor scikit-learn until a joblib model is read"""
+    _, times = import_profile.profile_imports([], ["src.score_model", "src.model_registry"])
+    modules = {time.module.split(".")[0] for time in times}
+
+    assert "pandas" in modules and not modules & {"joblib", "sklearn", "scipy"}
@@ -0,0 +1,88 @@
+"""
+This module is to test splitting data into train and test sets by row index.
+It includes tests for the split methods, folds and reading the rows of a saved split.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.model_selection import train_test_split
+
+from src import index_split
+
+target = np.array([0] * 80 + [1] * 20)
+groups = np.repeat(np.arange(25), 4)
+
+
+def test_make_split_random():
+    """Test that the random split has the rows and order of `train_test_split`"""
+    arrays = index_split.make_split(100, 0.4, 42)
+    train, test = train_test_split(np.arange(100), test_size=0.4, random_state=42)
+
+    assert np.array_equal(arrays["train"], train) and np.array_equal(arrays["test"], test)
+
+
+def test_make_split_stratified_grouped():
+    """Test that stratified splits keep the class proportions and grouped splits the groups"""
+    stratified = index_split.make_split(100, 0.4, 42, "stratified", target=target)
+    grouped = index_split.make_split(100, 0.4, 42, "grouped", groups=groups)
+
+    assert target[stratified["test"]].sum() == 8
+    assert not set(groups[grouped["train"]]) & set(groups[grouped["test"]])
+    assert len(grouped["train"]) + len(grouped["test"]) == 100
+
+
+def test_make_split_hash():
+    """Test that hashed rows keep their set when rows are added, and groups stay together"""
+    small = index_split.make_split(100, 0.3, 42, "hash")
+    large = index_split.make_split(200, 0.3, 42, "hash")
+    hashed_groups = index_split.make_split(100, 0.3, 42, "hash", groups=groups)
+
+    assert np.array_equal(large["test"][large["test"] < 100], small["test"])
+    assert not set(groups[hashed_groups["train"]]) & set(groups[hashed_groups["test"]])
+
+
+def test_make_split_folds():
+    """Test that every row is in the test set of exactly one fold"""
+    split = index_split.IndexSplit(
+        index_split.make_split(100, 0.4, 42, "stratified", target=target, n_folds=5),
+        {"n_folds": 5, "n_rows": 100})
+    tests = np.concatenate([split.rows("test", fold) for fold in range(5)])
+
+    assert np.array_equal(np.sort(tests), np.arange(100))
+    assert all(target[split.rows("test", fold)].sum() == 4 for fold in range(5))
+    assert len(np.intersect1d(split.rows("train", 1), split.rows("test", 1))) == 0
+    with pytest.raises(ValueError):
+        split.rows("test")
+
+
+def test_make_split_unknown_method():
+    """Test that an unknown method, or a grouped split without groups, raises an error"""
+    with pytest.raises(ValueError):
+        index_split.make_split(100, 0.4, 42, "sorted")
+    with pytest.raises(ValueError):
+        index_split.make_split(100, 0.4, 42, "grouped")
+
+
+def test_read_rows(tmp_path):
+    """Test that the rows of a saved split are read from the features it indexes"""
+    features = pd.DataFrame({"a": np.arange(100.0), "b": np.arange(100.0) * 2})
+    feature_path, split_path = str(tmp_path / "features.csv"), str(tmp_path / "split.npz")
+    features.to_csv(feature_path, index=False)
+    arrays = index_split.make_split(100, 0.4, 42)
+    index_split.save_split(arrays, {"feature_path": feature_path, "n_rows": 100}, split_path)
+
+    x_test = index_split.read_rows(split_path, "test", columns=["b"])
+
+    assert list(x_test.columns) == ["b"]
+    assert np.array_equal(x_test["b"].to_numpy(), arrays["test"] * 2.0)
+
+
+def test_read_rows_stale(tmp_path):
+    """Test that a split of a different number of rows than the data raises an error"""
+    feature_path, split_path = str(tmp_path / "features.csv"), str(tmp_path / "split.npz")
+    pd.DataFrame({"a": np.arange(90.0)}).to_csv(feature_path, index=False)
+    index_split.save_split(index_split.make_split(100, 0.4, 42),
+                           {"feature_path": feature_path, "n_rows": 100}, split_path)
+
+    with pytest.raises(ValueError):
+        index_split.read_rows(split_path, "train")
@@ -0,0 +1,52 @@
+"""
+This module is to test the runtime instrumentation.
+It includes tests for nested spans written as JSON lines,
+the Prometheus textfile and recording being off by default.
+"""
+import json
+
+from src import instrumentation
+
+
+def test_spans(tmp_path):
+    """Test that nested spans are written with their metrics and labels"""
+    metrics_path = tmp_path / "metrics" / "metrics.jsonl"
+    prometheus_path = tmp_path / "metrics.prom"
+    instrumentation.start(str(metrics_path), str(prometheus_path), labels={"action": "test"})
+    try:
+        with instrumentation.span("stage"):
+            with instrumentation.span("read") as timing:
+                (tmp_path / "data.txt").write_text("x" * 1000)
+                timing.rows = 10
+    finally:
+        instrumentation.stop()
+
+    records = [json.loads(line) for line in metrics_path.read_text().splitlines()]
+    assert [record["name"] for record in records] == ["stage/read", "stage"]
+    assert all(record["action"] == "test" and not record["failed"] for record in records)
+    assert records[0]["rows"] == 10 and records[0]["rows_per_s"] > 0
+    assert records[0]["write_bytes"] >= 1000
+    assert records[1]["wall_s"] >= records[0]["wall_s"]
+    assert records[1]["process_peak_rss_bytes"] > 0
+
+    prometheus = prometheus_path.read_text()
+    assert "# TYPE cloud_classifier_span_wall_seconds gauge" in prometheus
+    assert 'cloud_classifier_span_rows{action="test",name="stage/read"} 10' in prometheus
+
+
+def test_spans_off(tmp_path):
+    """Test that spans are no-ops and failures are recorded once recording is on"""
+    with instrumentation.span("stage", rows=5) as timing:
+        timing.rows += 1
+    assert timing is instrumentation.NULL_SPAN
+
+    metrics_path = tmp_path / "metrics.jsonl"
+    instrumentation.start(str(metrics_path))
+    try:
+        with instrumentation.span("stage"):
+            raise ValueError
+    except ValueError:
+        pass
+    finally:
+        instrumentation.stop()
+    assert json.loads(metrics_path.read_text())["failed"]
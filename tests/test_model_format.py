@@ -0,0 +1,53 @@
+"""
+This module is to test the compact model format.
+It includes tests for predictions of a saved and memory-mapped model
+and for rejecting models of another format version.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from src import model_format, score_model
+
+
+def make_model():
+    """Random forest fitted on noisy random features, with test features"""
+    rng = np.random.default_rng(0)
+    x_train = pd.DataFrame(rng.normal(size=(2000, 3)), columns=["a", "b", "c"])
+    y_train = (x_train["a"] + x_train["b"] * x_train["c"] + rng.normal(size=2000) > 0)
+    model = RandomForestClassifier(n_estimators=20, max_depth=8, random_state=1)
+    model.fit(x_train, y_train.astype(float))
+    x_test = pd.DataFrame(rng.normal(size=(500, 3)), columns=["a", "b", "c"])
+    return model, x_test
+
+
+def test_compact_model_predictions(tmp_path):
+    """Test that a memory-mapped compact model predicts exactly like the fitted forest"""
+    model, x_test = make_model()
+    path = str(tmp_path / "model.forest")
+    model_format.save_compact_model(model, path)
+
+    compact = score_model.load_model(path)
+    assert isinstance(compact.threshold, np.memmap)
+    assert np.array_equal(compact.predict_proba(x_test), model.predict_proba(x_test))
+    assert np.array_equal(compact.predict(x_test), model.predict(x_test))
+
+    # columns are selected by name like the fitted forest
+    assert np.array_equal(compact.predict_proba(x_test[["c", "a", "b"]]),
+                          model.predict_proba(x_test))
+
+
+def test_compact_model_version(tmp_path):
+    """Test that a model written with another format version is rejected"""
+    model, _ = make_model()
+    path = tmp_path / "model.forest"
+    model_format.save_compact_model(model, str(path))
+    meta = json.loads((path / model_format.META_FILE).read_text())
+    meta["version"] = model_format.FORMAT_VERSION + 1
+    (path / model_format.META_FILE).write_text(json.dumps(meta))
+
+    with pytest.raises(ValueError):
+        model_format.load_compact_model(str(path))
@@ -0,0 +1,110 @@
+"""
+This module is to test the model registry and the cache of loaded models.
+It includes tests for least recently used eviction, reloading changed models
+and registering and resolving model versions.
+"""
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from src import model_registry
+
+
+def write_files(tmp_path, sizes):
+    """Files of the given sizes, named by their index"""
+    paths = []
+    for index, size in enumerate(sizes):
+        path = tmp_path / f"{index}.bin"
+        path.write_bytes(b"0" * size)
+        paths.append(str(path))
+    return paths
+
+
+def test_model_cache_hits():
+    """Test that a cached model is loaded once and returned while it is unchanged"""
+    loads = []
+    cache = model_registry.ModelCache()
+    path = model_registry.__file__
+
+    first = cache.get(path, lambda p: loads.append(p) or object())
+    second = cache.get(path, lambda p: loads.append(p) or object())
+
+    assert first is second and len(loads) == 1
+    assert (cache.hits, cache.misses) == (1, 1) and path in cache
+
+
+def test_model_cache_evicts_least_recently_used(tmp_path):
+    """Test that the least recently used models are evicted past the number and byte bounds"""
+    paths = write_files(tmp_path, [10, 10, 10, 35])
+    cache = model_registry.ModelCache(max_bytes=40, max_models=2)
+
+    cache.get(paths[0], str)
+    cache.get(paths[1], str)
+    cache.get(paths[0], str)
+    cache.get(paths[2], str)
+    assert paths[0] in cache and paths[1] not in cache and len(cache) == 2
+
+    cache.get(paths[3], str)
+    assert paths[3] in cache and len(cache) == 1 and cache.size_bytes == 35
+    assert cache.evict(paths[3]) and not cache.evict(paths[3])
+
+
+def test_model_cache_reloads_changed_model(tmp_path):
+    """Test that a model overwritten on disk is loaded again"""
+    path = write_files(tmp_path, [10])[0]
+    cache = model_registry.ModelCache()
+    first = cache.get(path, lambda p: object())
+    with open(path, "ab") as model_file:
+        model_file.write(b"1")
+
+    assert cache.get(path, lambda p: object()) is not first
+
+
+def test_model_cache_reloads_changed_directory(tmp_path):
+    """Test that a directory model is loaded again when a file in it is rewritten in place"""
+    model_dir = tmp_path / "model.forest"
+    model_dir.mkdir()
+    (model_dir / "meta.json").write_text('{"version": 1}')
+    (model_dir / "value.npy").write_bytes(b"0" * 10)
+    cache = model_registry.ModelCache()
+    first = cache.get(str(model_dir), lambda p: object())
+    assert cache.get(str(model_dir), lambda p: object()) is first
+
+    directory_stat = os.stat(model_dir)
+    stat = os.stat(model_dir / "value.npy")
+    (model_dir / "value.npy").write_bytes(b"1" * 10)
+    os.utime(model_dir / "value.npy", ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    assert os.stat(model_dir).st_mtime_ns == directory_stat.st_mtime_ns
+
+    assert cache.get(str(model_dir), lambda p: object()) is not first
+
+
+def test_register_and_resolve(tmp_path):
+    """Test that versions are registered with their metadata and resolved by version"""
+    x_train = pd.DataFrame(np.random.default_rng(0).normal(size=(100, 2)), columns=["a", "b"])
+    y_train = (x_train["a"] > 0).astype(int)
+    model_path, data_path = str(tmp_path / "model.joblib"), str(tmp_path / "x_train.csv")
+    x_train.to_csv(data_path, index=False)
+    registry_dir = str(tmp_path / "registry")
+    for n_estimators in [3, 5]:
+        model = RandomForestClassifier(n_estimators=n_estimators, random_state=0)
+        joblib.dump(model.fit(x_train, y_train), model_path)
+        model_registry.register_model(registry_dir, n_estimators / 10, model_path, [data_path])
+
+    versions = model_registry.list_versions(registry_dir)
+    latest = model_registry.resolve_model(registry_dir)
+
+    assert [metadata["version"] for metadata in versions] == ["0.3", "0.5"]
+    assert versions[0]["features"] == ["a", "b"]
+    assert versions[0]["hyperparameters"]["n_estimators"] == 3
+    assert len(versions[0]["training_data"][data_path]) == 64
+    assert latest == os.path.join(registry_dir, "0.5", model_registry.MODEL_FILE)
+    assert joblib.load(model_registry.resolve_model(registry_dir, 0.3)).n_estimators == 3
+    with pytest.raises(FileExistsError):
+        model_registry.register_model(registry_dir, 0.5, model_path, [data_path])
+    with pytest.raises(FileNotFoundError):
+        model_registry.resolve_model(registry_dir, "0.4")
@@ -0,0 +1,160 @@
+"""
+This module is to test the streaming parser for raw data files.
+It includes tests for parsing segments across chunk boundaries,
+for validation of segment line ranges, and for reading segments
+directly with a sidecar line index.
+"""
+import io
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import artifact_io, create_datasets, parse_raw_data
+
+raw_data = b"header line\n" \
+           b"   1.0000   2.0000\n" \
+           b"   3.0000   4.0000\n" \
+           b"\n" \
+           b";;; second segment\n" \
+           b"   5.0000   6.0000\n" \
+           b"   7.0000   8.0000"
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 1 << 20])
+def test_iter_segment_blocks(chunk_size):
+    """Test that segments are parsed identically whatever the chunk size"""
+    blocks = parse_raw_data.iter_segment_blocks(io.BytesIO(raw_data), [[1, 3], [5, 7]], 2,
+                                                chunk_size)
+    results = {0: [], 1: []}
+    for label, block in blocks:
+        results[label].append(block)
+
+    np.testing.assert_array_equal(np.concatenate(results[0]), [[1.0, 2.0], [3.0, 4.0]])
+    np.testing.assert_array_equal(np.concatenate(results[1]), [[5.0, 6.0], [7.0, 8.0]])
+
+
+def test_iter_segment_blocks_matches_legacy_parser():
+    """Test that the real raw data is parsed like the original readlines-based parser"""
+    with open("data/raw/clouds.data", mode="r", encoding="ASCII") as input_file:
+        lines = [[s for s in line.split(" ") if s != ""] for line in input_file.readlines()]
+
+    with open("data/raw/clouds.data", mode="rb") as input_file:
+        blocks = list(parse_raw_data.iter_segment_blocks(input_file, [[53, 1077], [1082, 2105]],
+                                                         10, 4096))
+
+    first = np.concatenate([block for label, block in blocks if label == 0])
+    second = np.concatenate([block for label, block in blocks if label == 1])
+    np.testing.assert_array_equal(first, np.array(lines[53:1077], dtype=float))
+    np.testing.assert_array_equal(second, np.array(lines[1082:2105], dtype=float))
+
+
+def test_iter_segment_blocks_wrong_columns():
+    """Test for parsing lines that do not have the given number of columns"""
+    with pytest.raises(ValueError):
+        list(parse_raw_data.iter_segment_blocks(io.BytesIO(raw_data), [[1, 3]], 3))
+
+
+def test_validate_segments_overlap():
+    """Test for overlapping segments"""
+    with pytest.raises(ValueError):
+        parse_raw_data.validate_segments([[1, 5], [4, 7]])
+
+
+def test_validate_segments_non_list():
+    """Test for segments that are not pairs of integers"""
+    with pytest.raises(TypeError):
+        parse_raw_data.validate_segments([53])
+
+
+@pytest.mark.parametrize("trailing", [b"", b"\n"])
+@pytest.mark.parametrize("stride", [1, 2, 3, 100])
+def test_build_index(tmp_path, stride, trailing):
+    """Test that the index holds the byte offset of every stride-th line"""
+    (tmp_path / "raw.data").write_bytes(raw_data + trailing)
+    index = parse_raw_data.build_index(str(tmp_path / "raw.data"), stride, chunk_size=5)
+
+    starts = [0] + [i + 1 for i, byte in enumerate(raw_data) if byte == ord("\n")]
+    assert index.n_lines == 7
+    np.testing.assert_array_equal(index.offsets, starts[::stride])
+
+
+@pytest.mark.parametrize("stride", [1, 3, 1024])
+@pytest.mark.parametrize("segments", [[[53, 1077], [1082, 2105]], [[1082, 2105], [60, 70]],
+                                      [[100, 200], [150, 160], [2000, 2105]]])
+def test_iter_indexed_blocks(stride, segments):
+    """Test that segments read at their offsets are parsed like the streamed file"""
+    index = parse_raw_data.build_index("data/raw/clouds.data", stride)
+    blocks = list(parse_raw_data.iter_indexed_blocks("data/raw/clouds.data", segments, 10,
+                                                     index, chunk_size=4096, n_workers=1))
+
+    for position, segment in enumerate(segments):
+        with open("data/raw/clouds.data", mode="rb") as input_file:
+            expected = np.concatenate([block for _, block in parse_raw_data.iter_segment_blocks(
+                input_file, [segment], 10)])
+        np.testing.assert_array_equal(
+            np.concatenate([block for label, block in blocks if label == position]), expected)
+
+
+def test_iter_indexed_blocks_serial(monkeypatch):
+    """Test that small segments are parsed without starting a pool of processes"""
+    def no_pool(*args, **kwargs):
+        raise AssertionError("a pool of processes was started")
+
+    monkeypatch.setattr(parse_raw_data.concurrent.futures, "ProcessPoolExecutor", no_pool)
+    index = parse_raw_data.build_index("data/raw/clouds.data", 16)
+    blocks = list(parse_raw_data.iter_indexed_blocks("data/raw/clouds.data", [[53, 1077]], 10,
+                                                     index, chunk_size=4096, n_workers=4))
+    assert sum(len(block) for _, block in blocks) == 1077 - 53
+
+
+def test_load_index_stale(tmp_path):
+    """Test that the sidecar index is saved once and rebuilt after the file changes"""
+    path = str(tmp_path / "raw.data")
+    (tmp_path / "raw.data").write_bytes(raw_data)
+    parse_raw_data.load_index(path, stride=2)
+    assert os.path.exists(path + parse_raw_data.INDEX_SUFFIX)
+
+    (tmp_path / "raw.data").write_bytes(b"new header\n" + raw_data)
+    index = parse_raw_data.load_index(path, stride=2)
+    assert index.n_lines == 8 and index.offsets[1] == len(b"new header\nheader line\n")
+
+    with open(path, mode="ab") as input_file:
+        input_file.write(b"\n")
+    with pytest.raises(ValueError):
+        list(parse_raw_data.iter_indexed_blocks(path, [[2, 3]], 2, index))
+
+
+def test_load_clouds_segments(tmp_path, monkeypatch):
+    """Test that labeled segments read in parallel with the index match the streamed clouds"""
+    monkeypatch.setattr(parse_raw_data, "MIN_PARALLEL_BYTES", 0)
+    columns = ["c" + str(i) for i in range(10)]
+    segments = [{"lines": [1082, 2105], "label": 1}, {"lines": [53, 1077], "label": 0}]
+    os.symlink(os.path.abspath("data/raw/clouds.data"), tmp_path / "clouds.data")
+
+    clouds = create_datasets.load_clouds(str(tmp_path / "clouds.data"), columns, None, None,
+                                         chunk_size=8192, segments=segments,
+                                         index={"stride": 16}, n_workers=2)
+    expected = create_datasets.load_clouds("data/raw/clouds.data", columns, [53, 1077],
+                                           [1082, 2105])
+
+    pd.testing.assert_frame_equal(
+        clouds.sort_values("class", kind="stable", ignore_index=True), expected)
+
+
+@pytest.mark.parametrize("extension", [".csv", ".npcols"])
+def test_get_clouds_output_format(tmp_path, extension):
+    """Test that clouds are saved in the format of the extension of the output path"""
+    columns = ["c" + str(i) for i in range(10)]
+    output_path = str(tmp_path / ("clouds" + extension))
+
+    create_datasets.get_clouds("data/raw/clouds.data", columns, [53, 1077], [1082, 2105],
+                               output_path)
+
+    expected = create_datasets.load_clouds("data/raw/clouds.data", columns, [53, 1077],
+                                           [1082, 2105])
+    pd.testing.assert_frame_equal(artifact_io.read_table(output_path), expected)
+    with pytest.raises(SystemExit):
+        create_datasets.get_clouds("data/raw/clouds.data", columns, [53, 1077], [1082, 2105],
+                                   str(tmp_path / "clouds.txt"))
@@ -0,0 +1,81 @@
+"""
+This module is to test running the model pipeline stages in a single process.
+It includes tests for chaining stages in memory between `start` and `stop`,
+persisting the intermediate artifacts and rejecting invalid stage bounds.
+"""
+import os
+
+import pytest
+import yaml
+
+from src import pipeline
+
+
+def make_config(tmp_path):
+    """Pipeline configuration writing its artifacts and models under tmp_path"""
+    with open("config/model_config.yaml", "r", encoding="ASCII") as config_file:
+        config = yaml.load(config_file, Loader=yaml.FullLoader)
+
+    def relocate(section):
+        for key, value in section.items():
+            if isinstance(value, dict):
+                relocate(value)
+            elif isinstance(value, str) and value.startswith(("data/interim/", "models/")):
+                section[key] = str(tmp_path / os.path.basename(value))
+
+    relocate(config)
+    config["create_datasets"]["get_clouds"]["index"] = None
+    config["evaluate_performance"]["evaluate"]["bootstrap_config"] = None
+    return config
+
+
+def intermediate_paths(config):
+    """Paths of the outputs of every stage but the last"""
+    split = config["train_model"]["split_data"]
+    return {"get_clouds": [config["create_datasets"]["get_clouds"]["output_path"]],
+            "generate_features": [config["process_data"]["save_features"]["output_path"],
+                                  config["process_data"]["get_target"]["output_path"]],
+            "split_data": [split[name + "_path"]
+                           for name in ["x_train", "x_test", "y_train", "y_test"]],
+            "fit_model": [config["train_model"]["fit_model"]["output_path"]],
+            "predict": [config["score_model"]["predict"]["proba_output_path"],
+                        config["score_model"]["predict"]["bin_output_path"]]}
+
+
+@pytest.mark.parametrize("persist", [False, True])
+def test_run_pipeline_persist(tmp_path, persist):
+    """Test that intermediate artifacts are only saved with persist and metrics always are"""
+    config = make_config(tmp_path)
+
+    state = pipeline.run_pipeline(config, persist=persist)
+
+    assert os.path.exists(config["evaluate_performance"]["evaluate"]["output_path"])
+    assert 0.5 < state["metrics"]["auc"] <= 1.0
+    for paths in intermediate_paths(config).values():
+        assert all(os.path.exists(path) == persist for path in paths)
+
+
+def test_run_pipeline_middle_stages(tmp_path):
+    """Test that stages between bounds are chained in memory and the last stage is saved"""
+    config = make_config(tmp_path)
+    paths = intermediate_paths(config)
+    pipeline.run_pipeline(config, stop="split_data")
+    assert all(os.path.exists(path) for path in paths["split_data"])
+    assert not any(os.path.exists(path) for path in paths["generate_features"])
+
+    state = pipeline.run_pipeline(config, start="fit_model", stop="predict")
+
+    # the model is handed to predict in memory, only the predictions are written
+    assert not os.path.exists(paths["fit_model"][0])
+    assert all(os.path.exists(path) for path in paths["predict"])
+    assert state["model"].n_estimators == config["train_model"]["fit_model"]["n_estimators"]
+    assert len(state["ypred_proba_test"]) == len(state["x_test"])
+    assert "features" not in state and "metrics" not in state
+
+
+@pytest.mark.parametrize("start, stop", [("predict", "fit_model"), ("load", "evaluate"),
+                                         ("get_clouds", "score")])
+def test_run_pipeline_invalid_stages(tmp_path, start, stop):
+    """Test that unknown stages and a start after the stop are rejected"""
+    with pytest.raises(ValueError):
+        pipeline.run_pipeline(make_config(tmp_path), start=start, stop=stop)
@@ -0,0 +1,91 @@
+"""
+This module is to test scoring with a pretrained model.
+It includes tests for streaming predictions chunk by chunk, with and
+without reader and writer threads, against predicting all rows at once.
+"""
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from src import score_model
+
+FEATURES = ["log_entropy", "IR_norm_range", "entropy_x_contrast"]
+
+
+@pytest.fixture(name="paths")
+def fixture_paths(tmp_path):
+    """Model, test data and output paths under tmp_path"""
+    rng = np.random.default_rng(0)
+    raw = pd.DataFrame({"visible_entropy": rng.uniform(1, 10, 1000),
+                        "visible_contrast": rng.uniform(1, 10, 1000),
+                        "IR_mean": rng.uniform(200, 250, 1000),
+                        "IR_max": rng.uniform(250, 260, 1000),
+                        "IR_min": rng.uniform(190, 200, 1000)})
+    x_test = pd.DataFrame({"log_entropy": np.log(raw["visible_entropy"]),
+                           "IR_norm_range": (raw["IR_max"] - raw["IR_min"]) / raw["IR_mean"],
+                           "entropy_x_contrast": raw["visible_contrast"]
+                           * raw["visible_entropy"]})
+    model = RandomForestClassifier(n_estimators=5, random_state=0)
+    model.fit(x_test, (x_test["log_entropy"] > 1.5).astype(float))
+
+    joblib.dump(model, tmp_path / "model.joblib")
+    raw.to_csv(tmp_path / "raw.csv", index=False)
+    x_test.to_csv(tmp_path / "x_test.csv", index=False)
+    return {name: str(tmp_path / name) for name in
+            ["model.joblib", "raw.csv", "x_test.csv", "proba.csv", "class.csv",
+             "stream_proba.csv", "stream_class.csv"]}
+
+
+@pytest.mark.parametrize("threaded", [False, True])
+def test_predict_stream(paths, threaded):
+    """Test that streamed predictions are the same as predicting all rows at once"""
+    score_model.predict(paths["model.joblib"], paths["x_test.csv"], FEATURES,
+                        paths["proba.csv"], paths["class.csv"])
+    n_rows = score_model.predict_stream(paths["model.joblib"], paths["x_test.csv"], FEATURES,
+                                        paths["stream_proba.csv"], paths["stream_class.csv"],
+                                        chunk_size=64, threaded=threaded, queue_size=1)
+
+    assert n_rows == 1000
+    for name in ["proba.csv", "class.csv"]:
+        with open(paths[name], encoding="utf-8") as expected, \
+                open(paths["stream_" + name], encoding="utf-8") as streamed:
+            assert streamed.read() == expected.read()
+
+
+def test_predict_stream_derive_features(paths):
+    """Test that additional features are generated from raw features for every chunk"""
+    feature_config = {
+        "log_transform": {"log_col": "visible_entropy", "additional_feature": "log_entropy"},
+        "multiply": {"col1": "visible_entropy", "col2": "visible_contrast",
+                     "additional_feature": "entropy_x_contrast"},
+        "norm_range": {"min_col": "IR_min", "max_col": "IR_max", "mean_col": "IR_mean",
+                       "additional_feature": "IR_norm_range"}}
+    score_model.predict(paths["model.joblib"], paths["x_test.csv"], FEATURES,
+                        paths["proba.csv"], paths["class.csv"])
+    score_model.predict_stream(paths["model.joblib"], paths["raw.csv"], FEATURES,
+                               paths["stream_proba.csv"], paths["stream_class.csv"],
+                               chunk_size=300, derive_features=True,
+                               feature_config=feature_config)
+
+    assert np.allclose(np.loadtxt(paths["stream_proba.csv"]), np.loadtxt(paths["proba.csv"]))
+
+
+def test_predict_stream_missing_column(paths):
+    """Test for test data without the initial features"""
+    with pytest.raises(SystemExit):
+        score_model.predict_stream(paths["model.joblib"], paths["raw.csv"], FEATURES,
+                                   paths["stream_proba.csv"], paths["stream_class.csv"])
+
+
+def test_predict_stream_error(paths, monkeypatch):
+    """Test that an error while predicting stops the reader and writer threads"""
+    def failing_predict(*_):
+        raise RuntimeError("prediction failed")
+
+    monkeypatch.setattr(score_model, "predict_frame", failing_predict)
+    with pytest.raises(RuntimeError):
+        score_model.predict_stream(paths["model.joblib"], paths["x_test.csv"], FEATURES,
+                                   paths["stream_proba.csv"], paths["stream_class.csv"],
+                                   chunk_size=10, queue_size=1)
@@ -0,0 +1,158 @@
+"""
+This module is to test the scoring server.
+It includes tests for micro-batching concurrent requests and for the
+predictions and errors returned over HTTP.
+"""
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from src import generate_additional_features, scoring_server
+
+COLUMNS = ["visible_entropy", "visible_contrast", "IR_mean", "IR_max", "IR_min"]
+INITIAL_FEATURES = ["log_entropy", "IR_norm_range", "entropy_x_contrast"]
+FEATURE_CONFIG = {
+    "log_transform": {"log_col": "visible_entropy", "additional_feature": "log_entropy"},
+    "multiply": {"col1": "visible_entropy", "col2": "visible_contrast",
+                 "additional_feature": "entropy_x_contrast"},
+    "norm_range": {"min_col": "IR_min", "max_col": "IR_max", "mean_col": "IR_mean",
+                   "additional_feature": "IR_norm_range"},
+}
+
+
+def make_service():
+    """Scoring service with a small forest trained on random instances"""
+    rng = np.random.default_rng(0)
+    raw = pd.DataFrame(rng.uniform(1.0, 100.0, (200, len(COLUMNS))), columns=COLUMNS)
+    plan = generate_additional_features.compile_feature_plan(FEATURE_CONFIG, COLUMNS)
+    x_train = generate_additional_features.apply_feature_plan(raw, plan)[INITIAL_FEATURES]
+    model = RandomForestClassifier(n_estimators=5, random_state=0)
+    model.fit(x_train, (raw["visible_entropy"] > 50).astype(float))
+    service = scoring_server.ScoringService(model, COLUMNS, INITIAL_FEATURES, FEATURE_CONFIG,
+                                            max_batch_size=64, max_latency_ms=20.0)
+    return service, raw, model.predict_proba(x_train)[:, 1]
+
+
+def test_micro_batcher():
+    """Test that concurrent requests are scored together and get their own rows back"""
+    batches = []
+
+    def predict_fn(rows):
+        batches.append(len(rows))
+        return rows[:, 0], rows[:, 0] > 0
+
+    batcher = scoring_server.MicroBatcher(predict_fn, max_batch_size=100, max_latency_ms=200.0)
+    results = {}
+
+    def request(value):
+        results[value] = batcher.predict(np.full((3, 2), float(value)))
+
+    threads = [threading.Thread(target=request, args=(value,)) for value in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batcher.close()
+
+    assert sum(batches) == 30 and len(batches) < 10
+    for value, (proba, _) in results.items():
+        assert proba.tolist() == [float(value)] * 3
+
+
+def test_micro_batcher_isolates_failures():
+    """Test that a request failing its batch does not fail the other requests of the batch"""
+
+    def predict_fn(rows):
+        if (rows < 0).any():
+            raise ValueError("negative rows")
+        return rows[:, 0], rows[:, 0] > 0
+
+    batcher = scoring_server.MicroBatcher(predict_fn, max_batch_size=100, max_latency_ms=200.0)
+    results = {}
+
+    def request(value):
+        try:
+            results[value] = batcher.predict(np.full((2, 2), float(value)))[0].tolist()
+        except ValueError as error:
+            results[value] = str(error)
+
+    threads = [threading.Thread(target=request, args=(value,)) for value in [-1, 1, 2]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batcher.close()
+
+    assert results == {-1: "negative rows", 1: [1.0, 1.0], 2: [2.0, 2.0]}
+
+
+def test_featurize_rejects_non_finite():
+    """Test that instances with features that are not finite are rejected before scoring"""
+    service, raw, _ = make_service()
+    instances = raw.iloc[:3].to_dict(orient="records")
+    instances[1]["visible_entropy"] = 0.0
+    try:
+        with pytest.raises(ValueError, match=r"Instances \[1\]"):
+            service.featurize(instances)
+        assert service.featurize(instances[:1]).shape == (1, len(INITIAL_FEATURES))
+    finally:
+        service.batcher.close()
+
+
+def test_featurize_dtype_schema():
+    """Test that features are built in the dtype of the configured schema"""
+    service, raw, _ = make_service()
+    instances = raw.iloc[:3].to_dict(orient="records")
+    schema_service = scoring_server.ScoringService(
+        service.model, COLUMNS, INITIAL_FEATURES, FEATURE_CONFIG, max_batch_size=64,
+        max_latency_ms=20.0, dtypes={"features": "float32", "target": "uint8"})
+    try:
+        assert service.featurize(instances).dtype == np.float64
+        rows = schema_service.featurize(instances)
+        assert rows.dtype == np.float32
+        assert np.allclose(rows, service.featurize(instances), rtol=1e-6)
+        assert schema_service.predict(instances)["proba"] == pytest.approx(
+            service.predict(instances)["proba"])
+    finally:
+        service.batcher.close()
+        schema_service.batcher.close()
+
+
+def test_server_predict():
+    """Test that the server returns the predictions of the model and reports metrics"""
+    service, raw, expected = make_service()
+    server = scoring_server.create_server(service, "127.0.0.1", 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:%d" % server.server_address[1]
+
+    def post(instances):
+        body = json.dumps({"instances": instances}).encode("utf-8")
+        with urllib.request.urlopen(urllib.request.Request(url + "/predict", data=body)) as rsp:
+            return json.loads(rsp.read())
+
+    try:
+        result = post(raw.iloc[:20].to_dict(orient="records"))
+        assert np.allclose(result["proba"], expected[:20])
+        assert len(result["class"]) == 20
+
+        # an instance missing a column is rejected without affecting the server
+        try:
+            post([{"visible_entropy": 1.0}])
+            assert False, "expected an HTTP error"
+        except urllib.error.HTTPError as error:
+            assert error.code == 400
+
+        with urllib.request.urlopen(url + "/metrics") as response:
+            metrics = json.loads(response.read())
+        assert metrics["requests"] == 1 and metrics["rows"] == 20 and metrics["errors"] == 1
+        assert metrics["latency_p99_ms"] >= metrics["latency_p50_ms"] > 0
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.batcher.close()
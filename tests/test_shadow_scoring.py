@@ -0,0 +1,84 @@
+"""
+This module is to test scoring the same test data with several models at once.
+It includes tests for scoring in threads and in processes, the disagreement
+statistics and the single read of the test data.
+"""
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from src import shadow_scoring
+
+FEATURES = ["a", "b"]
+
+
+@pytest.fixture(name="models")
+def fixture_models(tmp_path):
+    """Two fitted forests saved with joblib, and the test data they score"""
+    rng = np.random.default_rng(0)
+    x_data = pd.DataFrame(rng.normal(size=(200, 2)), columns=FEATURES)
+    y_data = (x_data["a"] + x_data["b"] > 0).astype(int)
+    paths = {}
+    for name, n_estimators in [("production", 5), ("candidate", 9)]:
+        model = RandomForestClassifier(n_estimators=n_estimators, random_state=0)
+        paths[name] = str(tmp_path / f"{name}.joblib")
+        joblib.dump(model.fit(x_data, y_data), paths[name])
+    return paths, x_data
+
+
+def test_score_models_threads_and_processes(models):
+    """Test that every model gets its column, the same in threads and in processes"""
+    paths, x_data = models
+    expected = joblib.load(paths["candidate"]).predict_proba(x_data)[:, 1]
+
+    threaded, classes = shadow_scoring.score_models(paths, x_data, FEATURES)
+    in_processes, _ = shadow_scoring.score_models(paths, x_data, FEATURES, executor="process",
+                                                  n_workers=2)
+
+    assert list(threaded.columns) == ["production", "candidate"] and len(classes) == 200
+    np.testing.assert_allclose(threaded["candidate"], expected)
+    pd.testing.assert_frame_equal(threaded, in_processes)
+    with pytest.raises(ValueError):
+        shadow_scoring.score_models(paths, x_data, FEATURES, executor="gpu")
+
+
+def test_disagreement():
+    """Test the pairwise disagreement statistics on known probabilities"""
+    probabilities = pd.DataFrame({"x": [0.1, 0.6, 0.9, 0.2], "y": [0.1, 0.4, 0.8, 0.2],
+                                  "z": [0.1, 0.6, 0.9, 0.2]})
+    classes = (probabilities > 0.5).astype(int)
+
+    statistics = shadow_scoring.disagreement(probabilities, classes).set_index(
+        ["model", "other_model"])
+
+    assert len(statistics) == 3
+    assert statistics.loc[("x", "y"), "class_disagreement"] == 0.25
+    assert statistics.loc[("x", "y"), "mean_abs_difference"] == pytest.approx(0.075)
+    assert statistics.loc[("x", "y"), "max_abs_difference"] == pytest.approx(0.2)
+    assert statistics.loc[("x", "z"), "correlation"] == pytest.approx(1.0)
+
+
+def test_shadow_score_reads_once(models, tmp_path, monkeypatch):
+    """Test that the test data are read once for all models and saved column-wise"""
+    paths, x_data = models
+    x_test_path = str(tmp_path / "x_test.csv")
+    x_data.to_csv(x_test_path, index=False)
+    reads = []
+    read_table = shadow_scoring.artifact_io.read_table
+    monkeypatch.setattr(shadow_scoring.artifact_io, "read_table",
+                        lambda *args, **kwargs: reads.append(args) or read_table(*args, **kwargs))
+    output_path, disagreement_path = str(tmp_path / "proba.csv"), str(tmp_path / "stats.csv")
+
+    shadow_scoring.shadow_score(x_test_path, FEATURES, output_path, disagreement_path,
+                                models=dict(paths, again=paths["production"]))
+
+    output = pd.read_csv(output_path)
+    assert len(reads) == 1
+    assert list(output.columns) == ["production", "candidate", "again"] and len(output) == 200
+    assert (output["production"] == output["again"]).all()
+    assert len(pd.read_csv(disagreement_path)) == 3
+    with pytest.raises(ValueError):
+        shadow_scoring.shadow_score(x_test_path, FEATURES, output_path, disagreement_path,
+                                    models={"production": paths["production"]})
@@ -0,0 +1,82 @@
+"""
+This module is to test the stage cache of run.py actions.
+It includes tests for skipping unchanged actions, restoring earlier
+outputs from the cache and garbage collection of cache entries.
+"""
+from src import stage_cache
+
+
+def make_config(tmp_path, first_cloud):
+    """Configuration of the get_clouds action reading and writing under tmp_path"""
+    return {"create_datasets": {"get_clouds": {
+        "input_path": str(tmp_path / "clouds.data"), "first_cloud": first_cloud,
+        "output_path": str(tmp_path / "clouds.csv")}}}
+
+
+def test_run_cached(tmp_path):
+    """Test that an action only runs when its inputs or configuration change"""
+    (tmp_path / "clouds.data").write_text("raw data")
+    cache_dir = str(tmp_path / "cache")
+    runs = []
+
+    def action(config):
+        runs.append(config["create_datasets"]["get_clouds"]["first_cloud"])
+        (tmp_path / "clouds.csv").write_text(str(runs[-1]))
+
+    for first_cloud in [[53, 1077], [53, 1077], [0, 10], [53, 1077]]:
+        config = make_config(tmp_path, first_cloud)
+        stage_cache.run_cached("get_clouds", config, lambda: action(config), cache_dir)
+
+    # the last configuration is restored from the cache instead of rerun
+    assert runs == [[53, 1077], [0, 10]]
+    assert (tmp_path / "clouds.csv").read_text() == "[53, 1077]"
+
+    # changing the input reruns the action, and force always reruns it
+    (tmp_path / "clouds.data").write_text("new raw data")
+    stage_cache.run_cached("get_clouds", config, lambda: action(config), cache_dir)
+    stage_cache.run_cached("get_clouds", config, lambda: action(config), cache_dir, force=True)
+    assert len(runs) == 4
+
+
+def test_collect_garbage(tmp_path):
+    """Test that garbage collection keeps the cache under the size cap"""
+    (tmp_path / "clouds.data").write_text("raw data")
+    cache_dir = str(tmp_path / "cache")
+    for first_cloud in [[0, 1], [0, 2], [0, 3]]:
+        config = make_config(tmp_path, first_cloud)
+        stage_cache.run_cached("get_clouds", config,
+                               lambda: (tmp_path / "clouds.csv").write_text("x" * 100), cache_dir)
+
+    removed, freed = stage_cache.collect_garbage(cache_dir, max_size=250)
+    assert removed == 2
+    assert freed > 200
+
+
+def test_fingerprint_covers_every_module(tmp_path, monkeypatch):
+    """Test that a change to any module of src changes the fingerprint of every action"""
+    (tmp_path / "clouds.data").write_text("raw data")
+    src_dir = tmp_path / "src"
+    src_dir.mkdir()
+    (src_dir / "forest_inference.py").write_text("# engine")
+    monkeypatch.setattr(stage_cache, "SRC_DIR", str(src_dir))
+    config = make_config(tmp_path, [53, 1077])
+    description = stage_cache.describe_action("get_clouds", config)
+
+    before = stage_cache.fingerprint("get_clouds", config, description)
+    (src_dir / "forest_inference.py").write_text("# new engine")
+
+    assert stage_cache.fingerprint("get_clouds", config, description) != before
+
+
+def test_fingerprint_covers_run_py(tmp_path, monkeypatch):
+    """Test that a change to run.py, which wires the actions, changes the fingerprint"""
+    (tmp_path / "clouds.data").write_text("raw data")
+    (tmp_path / "run.py").write_text("# wiring")
+    monkeypatch.setattr(stage_cache, "RUN_PATH", str(tmp_path / "run.py"))
+    config = make_config(tmp_path, [53, 1077])
+    description = stage_cache.describe_action("get_clouds", config)
+
+    before = stage_cache.fingerprint("get_clouds", config, description)
+    (tmp_path / "run.py").write_text("# new wiring")
+
+    assert stage_cache.fingerprint("get_clouds", config, description) != before
@@ -0,0 +1,78 @@
+"""
+This module is to test the streaming evaluation of predictions.
+It includes tests for the accumulated metrics against scikit-learn,
+merging accumulators and evaluating saved predictions in shards.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+import sklearn.metrics
+
+from src import evaluate_performance, streaming_metrics
+
+rng = np.random.default_rng(0)
+y_test = rng.integers(0, 2, 5000).astype(float)
+proba = np.clip(0.3 * y_test + rng.normal(0.35, 0.2, len(y_test)), 0, 1).round(3)
+predicted = (proba > 0.5).astype(float)
+
+
+@pytest.mark.parametrize("n_bins", [10, 1000, streaming_metrics.DEFAULT_N_BINS])
+def test_accumulator(n_bins):
+    """Test that counts are exact and the AUC is within its error bound, in any chunks"""
+    accumulator = streaming_metrics.MetricsAccumulator(n_bins)
+    for start in range(0, len(y_test), 1500):
+        other = streaming_metrics.MetricsAccumulator(n_bins)
+        other.update(y_test[start:start + 1500], proba[start:start + 1500],
+                     predicted[start:start + 1500])
+        accumulator.merge(other)
+
+    metrics = accumulator.metrics()
+    exact_auc = sklearn.metrics.roc_auc_score(y_test, proba)
+    assert abs(metrics["auc"] - exact_auc) <= metrics["auc_error"] + 1e-12
+    assert (metrics["confusion"].to_numpy()
+            == sklearn.metrics.confusion_matrix(y_test, predicted)).all()
+    assert metrics["accuracy"] == sklearn.metrics.accuracy_score(y_test, predicted)
+    assert metrics["classification_report"] == sklearn.metrics.classification_report(
+        y_test, predicted)
+
+
+def test_accumulator_labels():
+    """Test that labels other than the two classes are rejected"""
+    accumulator = streaming_metrics.MetricsAccumulator()
+    with pytest.raises(ValueError):
+        accumulator.update([0.0, 2.0], [0.1, 0.9], [0.0, 1.0])
+
+
+def test_evaluate_stream(tmp_path):
+    """Test that shards evaluated in parallel give the metrics of the whole predictions"""
+    paths = {"proba": [], "bin": [], "y_test": []}
+    for shard, rows in enumerate(np.array_split(np.arange(len(y_test)), 3)):
+        for name, values in [("proba", proba), ("bin", predicted)]:
+            paths[name].append(str(tmp_path / f"{name}_{shard}.csv"))
+            np.savetxt(paths[name][-1], values[rows], delimiter=",")
+        paths["y_test"].append(str(tmp_path / f"y_test_{shard}.csv"))
+        pd.DataFrame({"class": y_test[rows]}).to_csv(paths["y_test"][-1], index=False)
+
+    metrics = evaluate_performance.evaluate_stream(
+        paths["proba"], paths["bin"], paths["y_test"], str(tmp_path / "metrics.txt"),
+        chunk_size=700, n_bins=1000, n_workers=2)
+    first_shard = evaluate_performance.evaluate_stream(
+        paths["proba"][0], paths["bin"][0], paths["y_test"][0], str(tmp_path / "shard.txt"))
+
+    assert metrics["confusion"].to_numpy().sum() == len(y_test)
+    assert abs(metrics["auc"] - sklearn.metrics.roc_auc_score(y_test, proba)) \
+        <= metrics["auc_error"] + 1e-12
+    assert first_shard["confusion"].to_numpy().sum() == len(np.array_split(y_test, 3)[0])
+    assert "AUC error bound" in (tmp_path / "metrics.txt").read_text()
+
+
+def test_evaluate_stream_misaligned(tmp_path):
+    """Test that inputs of different lengths exit"""
+    np.savetxt(tmp_path / "proba.csv", proba[:10], delimiter=",")
+    np.savetxt(tmp_path / "bin.csv", predicted[:9], delimiter=",")
+    pd.DataFrame({"class": y_test[:10]}).to_csv(tmp_path / "y_test.csv", index=False)
+    with pytest.raises(SystemExit):
+        evaluate_performance.evaluate_stream(str(tmp_path / "proba.csv"),
+                                             str(tmp_path / "bin.csv"),
+                                             str(tmp_path / "y_test.csv"),
+                                             str(tmp_path / "metrics.txt"))
@@ -0,0 +1,45 @@
+"""
+This module is to test the synthetic raw data generator.
+It includes tests for fixed-width formatting and for generating
+a raw file that parses like the real clouds data.
+"""
+import numpy as np
+
+from src import create_datasets, synthetic_data
+
+columns = ["visible_mean", "visible_max", "visible_min", "visible_mean_distribution",
+           "visible_contrast", "visible_entropy", "visible_second_angular_momentum",
+           "IR_mean", "IR_max", "IR_min"]
+
+
+def test_format_rows():
+    """Test that rows are formatted exactly like "%10.4f" fields"""
+    rng = np.random.default_rng(0)
+    values = rng.uniform(-9990, 99990, size=(500, 3))
+    values[0] = [-0.5, 12.34567, -9998.0]
+    expected = "".join("%10.4f%10.4f%10.4f\n" % tuple(row) for row in values)
+    assert synthetic_data.format_rows(values) == expected.encode()
+
+
+def test_generate(tmp_path):
+    """Test that generated clouds parse with get_clouds and do not depend on the workers"""
+    paths = [str(tmp_path / "one.data"), str(tmp_path / "two.data")]
+    segments = [synthetic_data.generate("data/raw/clouds.data", columns, [53, 1077],
+                                        [1082, 2105], path, 5001, block_rows=1000,
+                                        n_workers=n_workers)
+                for path, n_workers in zip(paths, [1, 2])]
+
+    with open(paths[0], "rb") as one, open(paths[1], "rb") as two:
+        assert one.read() == two.read()
+    first_cloud, second_cloud = segments[0]
+    clouds = create_datasets.load_clouds(paths[0], columns, first_cloud, second_cloud)
+    assert len(clouds) == 5001
+    assert (clouds["class"] == 0).sum() == first_cloud[1] - first_cloud[0]
+
+    real = create_datasets.load_clouds("data/raw/clouds.data", columns, [53, 1077], [1082, 2105])
+    for label in [0, 1]:
+        synthetic_cloud = clouds.loc[clouds["class"] == label, columns]
+        real_cloud = real.loc[real["class"] == label, columns]
+        assert (synthetic_cloud.min() >= real_cloud.min()).all()
+        assert (synthetic_cloud.max() <= real_cloud.max()).all()
+        assert ((synthetic_cloud.mean() - real_cloud.mean()).abs() < 0.2 * real_cloud.std()).all()
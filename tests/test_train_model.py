@@ -0,0 +1,74 @@
+"""
+This module is to test the training of the random forest classifier.
+It includes tests for growing a fitted forest with trees trained on new data
+and for retiring its oldest trees.
+"""
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import train_model
+
+FEATURES = ["a", "b", "c"]
+
+rng = np.random.default_rng(0)
+x = pd.DataFrame(rng.normal(size=(1000, 3)), columns=FEATURES)
+y = pd.DataFrame({"class": (x["a"] + rng.normal(0.0, 0.5, len(x)) > 0).astype(np.uint8)})
+
+
+def test_grow_forest():
+    """Test that new trees are added after the existing ones and the oldest are retired"""
+    model = train_model.train_classifier(x[:800], y[:800], FEATURES, 6, 5, 42)
+    old_trees = list(model.estimators_)
+
+    model = train_model.grow_forest(model, x[800:], y[800:], FEATURES, 4, max_estimators=8)
+
+    assert len(model.estimators_) == model.n_estimators == 8 and not model.warm_start
+    assert model.estimators_[:4] == old_trees[2:]
+    assert len({tree.random_state for tree in model.estimators_}) == 8
+    assert model.predict_proba(x[FEATURES]).shape == (len(x), 2)
+
+
+def test_grow_forest_reproducible():
+    """Test that growing the same forest on the same data gives the same trees"""
+    models = [train_model.grow_forest(
+        train_model.train_classifier(x[:800], y[:800], FEATURES, 3, 5, 42),
+        x[800:], y[800:], FEATURES, 2) for _ in range(2)]
+
+    np.testing.assert_array_equal(models[0].predict_proba(x[FEATURES]),
+                                  models[1].predict_proba(x[FEATURES]))
+
+
+def test_grow_forest_missing_class():
+    """Test for new data that do not have every class of the model"""
+    model = train_model.train_classifier(x[:800], y[:800], FEATURES, 3, 5, 42)
+    ones = y["class"] == 1
+    with pytest.raises(SystemExit):
+        train_model.grow_forest(model, x[ones], y[ones], FEATURES, 2)
+
+
+@pytest.mark.parametrize("n_new_estimators, max_estimators", [(0, None), (2, 0), (2.5, None)])
+def test_grow_forest_invalid(n_new_estimators, max_estimators):
+    """Test for numbers of trees that are not positive integers"""
+    model = train_model.train_classifier(x[:800], y[:800], FEATURES, 3, 5, 42)
+    with pytest.raises(ValueError):
+        train_model.grow_forest(model, x[800:], y[800:], FEATURES, n_new_estimators,
+                                max_estimators)
+
+
+def test_update_model(tmp_path):
+    """Test that a saved model is grown from new data files and saved again"""
+    model = train_model.train_classifier(x[:800], y[:800], FEATURES, 3, 5, 42)
+    joblib.dump(model, tmp_path / "model.joblib")
+    x[800:].to_csv(tmp_path / "x_new.csv", index=False)
+    y[800:].to_csv(tmp_path / "y_new.csv", index=False)
+
+    train_model.update_model(str(tmp_path / "model.joblib"), str(tmp_path / "x_new.csv"),
+                             str(tmp_path / "y_new.csv"), FEATURES, 2,
+                             str(tmp_path / "model.joblib"), max_estimators=4,
+                             compact_output_path=str(tmp_path / "model.forest"))
+
+    updated = joblib.load(tmp_path / "model.joblib")
+    assert len(updated.estimators_) == 4
+    assert (tmp_path / "model.forest").is_dir()
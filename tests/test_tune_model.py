@@ -0,0 +1,56 @@
+"""
+This module is to test the hyperparameter search.
+It includes tests for generating candidates, stratified subsampling
+and successive halving in a process pool.
+"""
+import numpy as np
+import pandas as pd
+
+from src import tune_model
+
+
+def test_grid_candidates():
+    """Test that every combination of the grid is a candidate"""
+    candidates = tune_model.grid_candidates({"n_estimators": [10, 20], "max_depth": [3, 5, 7]})
+    assert len(candidates) == 6
+    assert {"n_estimators": 20, "max_depth": 7} in candidates
+
+
+def test_random_candidates():
+    """Test that random candidates are distinct, reproducible and within their ranges"""
+    distributions = {"n_estimators": {"low": 10, "high": 20}, "max_features": [1, 2]}
+    candidates = tune_model.random_candidates(distributions, 5, random_state=0)
+    assert candidates == tune_model.random_candidates(distributions, 5, random_state=0)
+    assert len(candidates) == 5 and len({str(candidate) for candidate in candidates}) == 5
+    assert all(10 <= candidate["n_estimators"] <= 20 for candidate in candidates)
+
+
+def test_stratified_order():
+    """Test that every prefix of the order keeps the class proportions"""
+    y = np.array([0] * 90 + [1] * 10)
+    order = tune_model.stratified_order(y, random_state=0)
+    assert sorted(order) == list(range(100))
+    for size in [10, 30, 50]:
+        assert abs(y[order[:size]].sum() - size / 10) <= 1
+
+
+def test_tune(tmp_path):
+    """Test that halving drops candidates and that the best model and leaderboard are saved"""
+    rng = np.random.default_rng(0)
+    x_train = pd.DataFrame(rng.normal(size=(300, 2)), columns=["a", "b"])
+    y_train = pd.DataFrame({"class": (x_train["a"] > 0).astype(float)})
+    x_train.to_csv(tmp_path / "x_train.csv", index=False)
+    y_train.to_csv(tmp_path / "y_train.csv", index=False)
+
+    best_params = tune_model.tune(
+        str(tmp_path / "x_train.csv"), str(tmp_path / "y_train.csv"), ["a", "b"],
+        str(tmp_path / "model.joblib"), str(tmp_path / "leaderboard.csv"),
+        param_grid={"n_estimators": [5], "max_depth": [1, 2, 3, 4]}, cv=2, halving_factor=2,
+        n_workers=2)
+
+    leaderboard = pd.read_csv(tmp_path / "leaderboard.csv")
+    assert (tmp_path / "model.joblib").exists()
+    assert sorted(leaderboard["round"].unique()) == [0, 1]
+    assert (leaderboard["round"] == 1).sum() == 2
+    assert leaderboard.loc[0, "rank"] == 1 and leaderboard.loc[0, "round"] == 1
+    assert best_params["max_depth"] in [1, 2, 3, 4]